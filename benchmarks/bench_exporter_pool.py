@@ -0,0 +1,74 @@
+"""Benchmark the per-process exporter reuse in publish tasks.
+
+Compares the time to render a notebook with a new `LsstHtmlReportExporter`
+for every task (the original behavior of ``create_html``) against reusing a
+warmed exporter, as `uservice_nbreport.tasks.publishnb.get_exporter` does.
+
+Run::
+
+   python benchmarks/bench_exporter_pool.py [NOTEBOOK] --repeat 20
+"""
+
+from pathlib import Path
+import statistics
+import time
+
+import click
+import nbformat
+
+from uservice_nbreport.publish.htmlexport import create_report_exporter
+
+
+DEFAULT_NOTEBOOK = Path(__file__).parent / '../tests/notebooks/basic.ipynb'
+
+
+def time_fresh_exporter(nb, repeat):
+    """Time conversions that each create a new exporter.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        exporter = create_report_exporter()
+        exporter.from_notebook_node(nb)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def time_reused_exporter(nb, repeat):
+    """Time conversions that share one warmed exporter.
+    """
+    exporter = create_report_exporter()
+    exporter.warm()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        exporter.from_notebook_node(nb)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+@click.command()
+@click.argument('notebook', default=str(DEFAULT_NOTEBOOK))
+@click.option('--repeat', default=20, show_default=True,
+              help='Number of conversions to time for each strategy.')
+def main(notebook, repeat):
+    """Compare per-task render times with new and reused exporters.
+    """
+    nb = nbformat.read(str(notebook), as_version=4)
+
+    fresh = time_fresh_exporter(nb, repeat)
+    reused = time_reused_exporter(nb, repeat)
+
+    fresh_mean = statistics.mean(fresh)
+    reused_mean = statistics.mean(reused)
+    click.echo('New exporter per task:    {0:8.2f} ms'.format(
+        fresh_mean * 1e3))
+    click.echo('Reused (warmed) exporter: {0:8.2f} ms'.format(
+        reused_mean * 1e3))
+    click.echo('Saved per task:           {0:8.2f} ms ({1:.0%})'.format(
+        (fresh_mean - reused_mean) * 1e3,
+        (fresh_mean - reused_mean) / fresh_mean))
+
+
+if __name__ == '__main__':
+    main()
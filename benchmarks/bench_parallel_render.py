@@ -0,0 +1,76 @@
+"""Benchmark parallel per-cell rendering of large notebooks.
+
+Compares the time to render a large notebook serially against rendering its
+cells in a pool of worker processes (the ``parallel_render`` setting of
+`LsstHtmlReportExporter`). The large notebook is built by repeating the
+cells of a notebook. The speedup depends on the number of CPUs.
+
+Run::
+
+   python benchmarks/bench_parallel_render.py [NOTEBOOK] --copies 200
+"""
+
+from pathlib import Path
+import os
+import statistics
+import time
+
+import click
+import nbformat
+
+from uservice_nbreport.publish.htmlexport import create_report_exporter
+
+
+DEFAULT_NOTEBOOK = Path(__file__).parent / '../tests/notebooks/basic.ipynb'
+
+
+def time_conversions(exporter, nb, repeat):
+    """Time conversions with a warmed exporter.
+    """
+    # The first conversion also starts the worker processes
+    exporter.from_notebook_node(nb)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        exporter.from_notebook_node(nb)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+@click.command()
+@click.argument('notebook', default=str(DEFAULT_NOTEBOOK))
+@click.option('--copies', default=200, show_default=True,
+              help='Number of times the notebook\'s cells are repeated.')
+@click.option('--processes', default=None, type=int,
+              help='Number of worker processes (default: number of CPUs).')
+@click.option('--repeat', default=3, show_default=True,
+              help='Number of conversions to time for each strategy.')
+def main(notebook, copies, processes, repeat):
+    """Compare serial and parallel render times of a large notebook.
+    """
+    nb = nbformat.read(str(notebook), as_version=4)
+    nb.cells = nb.cells * copies
+
+    serial_exporter = create_report_exporter()
+    parallel_exporter = create_report_exporter(
+        parallel_render=True,
+        parallel_render_min_cells=0,
+        parallel_render_processes=processes)
+    try:
+        serial = time_conversions(serial_exporter, nb, repeat)
+        parallel = time_conversions(parallel_exporter, nb, repeat)
+    finally:
+        parallel_exporter.close()
+
+    serial_mean = statistics.mean(serial)
+    parallel_mean = statistics.mean(parallel)
+    click.echo('Cells: {0}, CPUs: {1}, processes: {2}'.format(
+        len(nb.cells), os.cpu_count(), processes or os.cpu_count()))
+    click.echo('Serial render:   {0:8.1f} ms'.format(serial_mean * 1e3))
+    click.echo('Parallel render: {0:8.1f} ms'.format(parallel_mean * 1e3))
+    click.echo('Speedup:         {0:8.2f}x'.format(
+        serial_mean / parallel_mean))
+
+
+if __name__ == '__main__':
+    main()
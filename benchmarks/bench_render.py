@@ -0,0 +1,223 @@
+"""Render benchmark suite for report notebooks.
+
+Times each stage of rendering synthetic notebooks (see ``synthetic.py``)
+separately:
+
+- ``reads``: parsing the notebook JSON with `nbformat.reads`.
+- ``outline``: building the outline with `LsstOutlinePreprocessor`
+  (including parsing the markdown cells).
+- ``export``: converting the notebook with
+  `LsstHtmlReportExporter.from_notebook_node`.
+- ``write``: writing the site with `LsstHtmlReportExporter.write_site`.
+
+Results are compared with a JSON baseline, and stages that are slower than
+the baseline by more than the tolerance are flagged as regressions. The
+suite runs offline.
+
+Run::
+
+   make benchmark   # save a baseline of the base commit, then compare
+
+or, by hand::
+
+   python benchmarks/bench_render.py --save-baseline   # save baseline
+   python benchmarks/bench_render.py                   # compare
+
+Baselines depend on the machine, so they aren't committed: ``make
+benchmark-baseline`` renders with the code of the base commit
+(``$BENCHMARK_BASE``, checked out in a temporary git worktree) on the same
+machine, and comparisons refuse baselines from another Python version or
+platform, or with other exporter settings.
+
+The exporter has the service's default settings. Add ``--extract-outputs``
+(``make benchmark BENCHMARK_RENDER_ARGS=--extract-outputs``) to benchmark
+the opt-in extraction of output images (``$EXTRACT_OUTPUTS``) instead.
+"""
+
+import json
+from pathlib import Path
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import click
+import nbformat
+
+from uservice_nbreport.publish.htmlexport import create_report_exporter
+from uservice_nbreport.publish.outline import LsstOutlinePreprocessor
+from uservice_nbreport.version import get_version
+
+sys.path.insert(0, str(Path(__file__).parent))
+from synthetic import generate_notebook  # noqa: E402
+
+
+DEFAULT_BASELINE = Path(__file__).parent / 'baselines/render.json'
+
+SCENARIOS = {
+    'small': dict(cells=20, markdown_length=300, headers=5, images=1,
+                  tables=1),
+    'text-heavy': dict(cells=400, markdown_length=3000, headers=40,
+                       images=0, tables=0),
+    'many-headers': dict(cells=400, markdown_length=200, headers=400,
+                         images=0, tables=0),
+    'images': dict(cells=40, markdown_length=300, headers=10, images=40,
+                   image_size=256, tables=0),
+    'tables': dict(cells=40, markdown_length=300, headers=10, images=0,
+                   tables=40, table_rows=200),
+    'large': dict(cells=2000, markdown_length=800, headers=100, images=20,
+                  tables=20),
+}
+"""Keyword arguments of `generate_notebook` for each benchmark scenario."""
+
+STAGES = ('reads', 'outline', 'export', 'write')
+
+
+def time_scenario(exporter, nb, repeat):
+    """Time the render stages of a notebook.
+
+    Returns
+    -------
+    timings : `dict`
+        Median time of each stage, in seconds, and the size of the notebook
+        and the rendered HTML, in bytes.
+    """
+    nb_data = nbformat.writes(nb)
+    samples = {stage: [] for stage in STAGES}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        nb = nbformat.reads(nb_data, as_version=4)
+        samples['reads'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        LsstOutlinePreprocessor().preprocess(nb, {})
+        samples['outline'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        body, resources = exporter.from_notebook_node(nb)
+        samples['export'].append(time.perf_counter() - start)
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            start = time.perf_counter()
+            exporter.write_site(body, resources, Path(tempdir))
+            samples['write'].append(time.perf_counter() - start)
+
+    timings = {stage: statistics.median(values)
+               for stage, values in samples.items()}
+    timings['notebook_bytes'] = len(nb_data)
+    timings['html_bytes'] = len(body)
+    return timings
+
+
+def compare(results, baseline, tolerance):
+    """Compare results with a baseline.
+
+    Returns
+    -------
+    regressions : `list` of `tuple`
+        ``(scenario, stage, baseline time, time)`` of each stage that's
+        slower than the baseline by more than ``tolerance`` (a fraction).
+    """
+    regressions = []
+    for scenario, timings in results.items():
+        baseline_timings = baseline.get(scenario)
+        if baseline_timings is None:
+            continue
+        for stage in STAGES:
+            if stage not in baseline_timings:
+                continue
+            if timings[stage] > baseline_timings[stage] * (1 + tolerance):
+                regressions.append(
+                    (scenario, stage, baseline_timings[stage],
+                     timings[stage]))
+    return regressions
+
+
+@click.command()
+@click.option('--scenario', 'scenarios', multiple=True,
+              type=click.Choice(sorted(SCENARIOS)),
+              help='Scenario to run (default: all). Repeatable.')
+@click.option('--repeat', default=3, show_default=True,
+              help='Number of timed renders of each scenario.')
+@click.option('--baseline', 'baseline_path', default=str(DEFAULT_BASELINE),
+              show_default=True, type=click.Path(dir_okay=False),
+              help='JSON baseline file.')
+@click.option('--save-baseline', is_flag=True,
+              help='Save the results as the new baseline.')
+@click.option('--tolerance', default=0.25, show_default=True,
+              help='Fraction by which a stage can be slower than the '
+                   'baseline before it\'s flagged as a regression.')
+@click.option('--extract-outputs', is_flag=True,
+              help='Extract output images into files (opt-in in the '
+                   'service).')
+def main(scenarios, repeat, baseline_path, save_baseline, tolerance,
+         extract_outputs):
+    """Time the render stages of synthetic notebooks, and compare with a
+    baseline.
+    """
+    if not scenarios:
+        scenarios = list(SCENARIOS)
+
+    settings = {'extract_outputs': extract_outputs}
+    environment = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+    }
+    click.echo('Settings: {0}'.format(
+        'extract_outputs (opt-in)' if extract_outputs else 'service defaults'))
+    exporter = create_report_exporter(**settings)
+    exporter.warm()
+
+    results = {}
+    for scenario in scenarios:
+        nb = generate_notebook(**SCENARIOS[scenario])
+        results[scenario] = time_scenario(exporter, nb, repeat)
+        click.echo('{0:<14}'.format(scenario) + '  '.join(
+            '{0} {1:8.1f} ms'.format(stage, results[scenario][stage] * 1e3)
+            for stage in STAGES))
+
+    baseline_path = Path(baseline_path)
+    if save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline = {
+            'environment': dict(environment, uservice_nbreport=get_version()),
+            'settings': settings,
+            'results': results,
+        }
+        baseline_path.write_text(json.dumps(baseline, indent=2,
+                                            sort_keys=True))
+        click.echo('Saved baseline to {0}'.format(baseline_path))
+        return
+
+    if not baseline_path.exists():
+        click.echo('No baseline at {0}; run with --save-baseline (or make '
+                   'benchmark-baseline) to create one.'.format(
+                       baseline_path), err=True)
+        sys.exit(2)
+
+    baseline = json.loads(baseline_path.read_text())
+    baseline_environment = {key: baseline['environment'].get(key)
+                            for key in environment}
+    if baseline_environment != environment or \
+            baseline.get('settings') != settings:
+        click.echo('The baseline at {0} was recorded on {1} with {2}, not '
+                   'on {3} with {4}; save a baseline on this machine, with '
+                   'the same options (make benchmark-baseline).'.format(
+                       baseline_path, baseline_environment,
+                       baseline.get('settings'), environment, settings),
+                   err=True)
+        sys.exit(2)
+    regressions = compare(results, baseline['results'], tolerance)
+    for scenario, stage, baseline_time, stage_time in regressions:
+        click.echo('REGRESSION {0} {1}: {2:.1f} ms -> {3:.1f} ms '
+                   '({4:+.0%})'.format(
+                       scenario, stage, baseline_time * 1e3,
+                       stage_time * 1e3, stage_time / baseline_time - 1))
+    if regressions:
+        sys.exit(1)
+    click.echo('No regressions (tolerance {0:.0%})'.format(tolerance))
+
+
+if __name__ == '__main__':
+    main()
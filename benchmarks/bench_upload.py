@@ -0,0 +1,163 @@
+"""Benchmark of the throughput of uploading report sites to S3.
+
+Uploads a synthetic site (many small output images, a few large files)
+with `uservice_nbreport.publish.upload.upload_site` for several numbers of
+upload workers, and reports the objects and megabytes uploaded per second.
+It then times a republish of the site with one changed file, which copies
+the unchanged objects from the previous build.
+
+By default, the site is uploaded to an in-process S3 mock (moto), and each
+S3 request is delayed by ``--latency`` milliseconds to simulate the round
+trip to S3, since the mock itself responds instantly. Pass ``--endpoint-url``
+to upload to a real S3-compatible service (like a local MinIO server)
+instead, with the ``AWS_ACCESS_KEY_ID`` and ``AWS_SECRET_ACCESS_KEY``
+credentials.
+
+Run::
+
+   python benchmarks/bench_upload.py
+   python benchmarks/bench_upload.py --endpoint-url http://localhost:9000 \\
+       --bucket nbreport-bench
+"""
+
+import contextlib
+import os
+from pathlib import Path
+import tempfile
+import time
+from unittest import mock
+
+import boto3
+import botocore.client
+import click
+
+from uservice_nbreport.publish.upload import upload_site
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto < 5
+    from moto import mock_s3 as mock_aws
+
+
+def make_site(site_dir, *, small_files, small_size, large_files, large_size):
+    """Write a synthetic site, like a report with extracted outputs.
+
+    Returns
+    -------
+    size : `int`
+        Total size of the files, in bytes.
+    """
+    outputs_dir = site_dir / '_outputs'
+    outputs_dir.mkdir(parents=True)
+    (site_dir / 'index.html').write_bytes(os.urandom(large_size))
+    for i in range(small_files):
+        (outputs_dir / '{0:04d}.png'.format(i)).write_bytes(
+            os.urandom(small_size))
+    for i in range(large_files - 1):
+        (outputs_dir / 'large{0:02d}.html'.format(i)).write_bytes(
+            os.urandom(large_size))
+    return small_files * small_size + large_files * large_size
+
+
+@contextlib.contextmanager
+def simulated_latency(latency):
+    """Delay every AWS API request by ``latency`` seconds."""
+    make_api_call = botocore.client.BaseClient._make_api_call
+
+    def delayed_make_api_call(self, operation_name, api_params):
+        time.sleep(latency)
+        return make_api_call(self, operation_name, api_params)
+
+    with mock.patch.object(botocore.client.BaseClient, '_make_api_call',
+                           delayed_make_api_call):
+        yield
+
+
+@click.command()
+@click.option('--workers', 'worker_counts', multiple=True, type=int,
+              default=[1, 4, 8, 16], show_default=True,
+              help='Number of upload workers. Repeatable.')
+@click.option('--small-files', default=200, show_default=True,
+              help='Number of small files (output images).')
+@click.option('--small-size', default=50 * 1024, show_default=True,
+              help='Size of each small file, in bytes.')
+@click.option('--large-files', default=2, show_default=True,
+              help='Number of large files (uploaded in parts).')
+@click.option('--large-size', default=20 * 1024 ** 2, show_default=True,
+              help='Size of each large file, in bytes.')
+@click.option('--latency', default=20., show_default=True,
+              help='Simulated latency of each S3 request, in milliseconds '
+                   '(mock S3 only).')
+@click.option('--endpoint-url', default=None,
+              help='URL of an S3-compatible service (default: mock S3).')
+@click.option('--bucket', default='lsst-the-docs', show_default=True,
+              help='Bucket name. It must exist if --endpoint-url is set.')
+def main(worker_counts, small_files, small_size, large_files, large_size,
+         latency, endpoint_url, bucket):
+    """Time site uploads with different numbers of workers."""
+    with tempfile.TemporaryDirectory() as tempdir:
+        site_dir = Path(tempdir) / 'site'
+        site_size = make_site(site_dir, small_files=small_files,
+                              small_size=small_size, large_files=large_files,
+                              large_size=large_size)
+        object_count = small_files + large_files
+        click.echo('Site: {0} files, {1:.1f} MB'.format(
+            object_count, site_size / 1e6))
+
+        context = contextlib.ExitStack()
+        if endpoint_url is None:
+            context.enter_context(mock_aws())
+            context.enter_context(simulated_latency(latency / 1e3))
+            aws_id = aws_secret = 'bench'
+            os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+            boto3.client('s3', region_name='us-east-1').create_bucket(
+                Bucket=bucket)
+        else:
+            aws_id = os.getenv('AWS_ACCESS_KEY_ID')
+            aws_secret = os.getenv('AWS_SECRET_ACCESS_KEY')
+
+        with context:
+            for i, workers in enumerate(worker_counts):
+                start = time.perf_counter()
+                upload_site(site_dir,
+                            bucket_name=bucket,
+                            bucket_root='bench/builds/{0}'.format(i),
+                            aws_id=aws_id,
+                            aws_secret=aws_secret,
+                            cache_control='max-age=31536000',
+                            upload_dir_redirect_objects=True,
+                            max_workers=workers,
+                            endpoint_url=endpoint_url)
+                elapsed = time.perf_counter() - start
+                click.echo(
+                    'workers {0:>3d}: {1:7.2f} s  {2:7.1f} objects/s  '
+                    '{3:7.1f} MB/s'.format(
+                        workers, elapsed, object_count / elapsed,
+                        site_size / 1e6 / elapsed))
+
+            # Republish with one changed output, copying the other objects
+            # from the last build.
+            (site_dir / '_outputs' / '0000.png').write_bytes(
+                os.urandom(small_size))
+            start = time.perf_counter()
+            result = upload_site(
+                site_dir,
+                bucket_name=bucket,
+                bucket_root='bench/builds/{0}'.format(len(worker_counts)),
+                aws_id=aws_id,
+                aws_secret=aws_secret,
+                cache_control='max-age=31536000',
+                upload_dir_redirect_objects=True,
+                max_workers=worker_counts[-1],
+                previous_root='bench/builds/{0}'.format(
+                    len(worker_counts) - 1),
+                endpoint_url=endpoint_url)
+            elapsed = time.perf_counter() - start
+            click.echo(
+                'republish   : {0:7.2f} s  {1} objects copied, {2:.1f} MB '
+                'uploaded'.format(elapsed, result['copied'],
+                                  result['bytes'] / 1e6))
+
+
+if __name__ == '__main__':
+    main()
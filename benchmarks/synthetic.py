@@ -0,0 +1,190 @@
+"""Generator of synthetic report notebooks for benchmarks.
+
+The notebooks are deterministic for a given seed, and don't need any
+packages (like matplotlib or pandas) besides nbformat: images are
+random-noise PNGs and tables are HTML in the style of pandas DataFrames.
+"""
+
+import base64
+import random
+import struct
+import zlib
+
+import nbformat
+
+WORDS = (
+    'telescope survey camera sky galaxy star photometry astrometry image '
+    'pipeline data release calibration exposure filter magnitude catalog '
+    'source object flux detector sensor visit field pointing seeing '
+    'background template difference alert transient variable cadence'
+).split()
+
+
+def generate_notebook(*, cells=100, markdown_length=500, headers=20,
+                      images=5, image_size=128, tables=5, table_rows=50,
+                      seed=0):
+    """Generate a synthetic, executed, report notebook.
+
+    Parameters
+    ----------
+    cells : `int`
+        Approximate number of cells. Half of the cells are markdown cells
+        and half are code cells with text output. Headers, images, and
+        tables add cells.
+    markdown_length : `int`
+        Number of characters in each markdown cell.
+    headers : `int`
+        Number of header cells (the first is the report title).
+    images : `int`
+        Number of code cells with a PNG image output.
+    image_size : `int`
+        Width and height of the images, in pixels.
+    tables : `int`
+        Number of code cells with a DataFrame-like table output.
+    table_rows : `int`
+        Number of rows in each table.
+    seed : `int`
+        Random seed.
+
+    Returns
+    -------
+    nb : `nbformat.NotebookNode`
+        The notebook.
+    """
+    rng = random.Random(seed)
+
+    body_cells = []
+    for i in range(cells):
+        if i % 2 == 0:
+            body_cells.append(nbformat.v4.new_markdown_cell(
+                source=_make_markdown(rng, markdown_length)))
+        else:
+            body_cells.append(_make_code_cell(rng))
+    for i in range(images):
+        body_cells.append(_make_image_cell(rng, image_size))
+    for i in range(tables):
+        body_cells.append(_make_table_cell(rng, table_rows))
+    rng.shuffle(body_cells)
+
+    # Spread the headers evenly through the notebook, with the report title
+    # first.
+    nb_cells = [nbformat.v4.new_markdown_cell(source='# Synthetic report')]
+    section_count = max(headers - 1, 0)
+    step = max(len(body_cells) // max(section_count, 1), 1)
+    for i, cell in enumerate(body_cells):
+        if section_count and i % step == 0 and i // step < section_count:
+            level = 2 if (i // step) % 3 == 0 else 3
+            nb_cells.append(nbformat.v4.new_markdown_cell(
+                source='{0} Section {1}'.format('#' * level, i // step)))
+        nb_cells.append(cell)
+
+    nb = nbformat.v4.new_notebook(cells=nb_cells)
+    nb.metadata['language_info'] = {
+        'name': 'python',
+        'pygments_lexer': 'ipython3',
+    }
+    nb.metadata['nbreport'] = {
+        'handle': 'bench',
+        'title': 'Synthetic report',
+        'instance_id': '1',
+        'instance_handle': 'bench-1',
+        'published_url': 'https://bench.example.com/v/1',
+    }
+    return nb
+
+
+def _make_words(rng, length):
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return ' '.join(words)
+
+
+def _make_markdown(rng, length):
+    paragraphs = []
+    size = 0
+    while size < length:
+        paragraph = _make_words(rng, min(300, length - size))
+        if rng.random() < 0.3:
+            paragraph = paragraph.replace(' ', ' **', 1) + '**'
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    if rng.random() < 0.2:
+        paragraphs.append('\n'.join('- ' + _make_words(rng, 40)
+                                    for _ in range(5)))
+    return '\n\n'.join(paragraphs)
+
+
+def _make_code_cell(rng):
+    source = '\n'.join([
+        'import numpy as np',
+        'values = np.random.normal(size={0})'.format(rng.randint(10, 1000)),
+        'for value in values[:5]:',
+        '    print("{0}", value)'.format(rng.choice(WORDS)),
+    ])
+    text = ''.join('{0} {1:.6f}\n'.format(rng.choice(WORDS), rng.random())
+                   for _ in range(5))
+    cell = nbformat.v4.new_code_cell(source=source)
+    cell.outputs.append(nbformat.v4.new_output('stream', name='stdout',
+                                               text=text))
+    return cell
+
+
+def _make_image_cell(rng, size):
+    source = 'plt.imshow(image)\nplt.show()'
+    cell = nbformat.v4.new_code_cell(source=source)
+    png = base64.b64encode(_make_png(rng, size)).decode('ascii')
+    cell.outputs.append(nbformat.v4.new_output(
+        'display_data',
+        data={'image/png': png, 'text/plain': '<Figure>'}))
+    return cell
+
+
+def _make_table_cell(rng, rows):
+    columns = ['ra', 'dec', 'mag_g', 'mag_r', 'mag_i']
+    html_rows = []
+    text_rows = []
+    for i in range(rows):
+        values = ['{0:.5f}'.format(rng.uniform(0, 360)) for _ in columns]
+        html_rows.append(
+            '    <tr>\n      <th>{0}</th>\n{1}    </tr>\n'.format(
+                i, ''.join('      <td>{0}</td>\n'.format(v)
+                           for v in values)))
+        text_rows.append('{0:<5d} {1}'.format(i, ' '.join(values)))
+    html = (
+        '<div>\n<table border="1" class="dataframe">\n'
+        '  <thead>\n    <tr style="text-align: right;">\n'
+        '      <th></th>\n' +
+        ''.join('      <th>{0}</th>\n'.format(c) for c in columns) +
+        '    </tr>\n  </thead>\n  <tbody>\n' +
+        ''.join(html_rows) +
+        '  </tbody>\n</table>\n</div>'
+    )
+    cell = nbformat.v4.new_code_cell(source='df.head({0})'.format(rows))
+    cell.outputs.append(nbformat.v4.new_output(
+        'execute_result',
+        data={'text/html': html,
+              'text/plain': '\n'.join(['      ' + '  '.join(columns)] +
+                                      text_rows)},
+        execution_count=1))
+    return cell
+
+
+def _make_png(rng, size):
+    """Make an RGB PNG of random noise, which doesn't compress well (like
+    real plots with many points).
+    """
+    raw = b''.join(
+        b'\x00' + bytes(rng.getrandbits(8) for _ in range(size * 3))
+        for _ in range(size))
+
+    def chunk(chunk_type, data):
+        return (struct.pack('>I', len(data)) + chunk_type + data +
+                struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+    header = struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
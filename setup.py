@@ -27,11 +27,15 @@ tests_require = [
     'pytest-cov==2.5.1',
     'pytest-flake8==1.0.1',
     'responses==0.9.0',
-    'pytest-mock==1.10.0'
+    'pytest-mock==1.10.0',
+    'fakeredis==0.14.0',
+    'moto==1.3.6',
 ]
 
 extras_require = {
-    'dev': tests_require
+    'dev': tests_require,
+    'brotli': ['brotli==1.0.4'],
+    'gevent': ['gevent==1.3.6'],
 }
 
 package_data = {'uservice_nbreport': [
@@ -3,16 +3,19 @@
 
 from base64 import b64encode
 
+import fakeredis
 import pytest
 
 from uservice_nbreport.appfactory import create_flask_app
+from uservice_nbreport.blobstore import LocalBlobStore
+from uservice_nbreport.config import config_profiles
 
 TEST_USER = 'testuser'
 TEST_TOKEN = 'testtoken'
 
 
 @pytest.fixture
-def client():
+def client(redis_client, blob_store):
     """Client for testing the REST API endpoints, as a pytest fixture.
 
     Notes
@@ -25,6 +28,10 @@ def client():
     Using the client as a context manager allows access to application
     context, like ``flask.g``, after the response is completed. See
     test_routes_login.py for examples.
+
+    The app's Redis client is an in-memory fake (see the `redis_client`
+    fixture), and its blob store is in a temporary directory (see the
+    `blob_store` fixture).
     """
     app = create_flask_app(profile='test')
     client = app.test_client()
@@ -42,3 +49,29 @@ def github_auth_header():
     return {
         'Authorization': 'Basic {0!s}'.format(encoded_creds.decode('utf-8'))
     }
+
+
+@pytest.fixture
+def redis_client(mocker):
+    """In-memory Redis client (fakeredis), as a pytest fixture.
+
+    `uservice_nbreport.redisstore.get_redis` returns this client for the
+    test profile's ``REDIS_URL``.
+    """
+    client = fakeredis.FakeStrictRedis(decode_responses=True)
+    mocker.patch.dict('uservice_nbreport.redisstore._clients',
+                      {config_profiles['test'].REDIS_URL: client})
+    yield client
+
+
+@pytest.fixture
+def blob_store(tmpdir, mocker):
+    """Blob store in a temporary directory, as a pytest fixture.
+
+    `uservice_nbreport.blobstore.get_blob_store` returns this store for the
+    test profile's ``BLOB_STORE_URL``.
+    """
+    store = LocalBlobStore(str(tmpdir.join('blobs')))
+    mocker.patch.dict('uservice_nbreport.blobstore._stores',
+                      {config_profiles['test'].BLOB_STORE_URL: store})
+    yield store
@@ -0,0 +1,109 @@
+"""Tests for the uservice_nbreport.auth module.
+"""
+
+from flask import g
+import pytest
+import responses
+
+from uservice_nbreport.auth import (
+    check_github_org_membership, iter_github_endpoint,
+    verify_github_org_membership)
+from uservice_nbreport.exceptions import GitHubAuthorizationError
+
+
+def add_org_pages(page_count, per_page=2):
+    """Mock paginated ``GET /user/orgs`` responses, with organizations named
+    ``org-<page>-<i>``.
+    """
+    for page in range(1, page_count + 1):
+        headers = {}
+        if page < page_count:
+            headers['Link'] = (
+                '<https://api.github.com/user/orgs?page={0}>; '
+                'rel="next"'.format(page + 1))
+        url = 'https://api.github.com/user/orgs'
+        if page > 1:
+            url += '?page={0}'.format(page)
+        responses.add(
+            responses.GET,
+            url,
+            status=200,
+            json=[{'login': 'org-{0}-{1}'.format(page, i)}
+                  for i in range(per_page)],
+            headers=headers,
+            match_querystring=True
+        )
+
+
+@responses.activate
+def test_iter_github_endpoint_is_lazy():
+    add_org_pages(3)
+
+    items = iter_github_endpoint('https://api.github.com/user/orgs')
+    assert len(responses.calls) == 0
+    assert next(items) == {'login': 'org-1-0'}
+    assert len(responses.calls) == 1
+
+    assert [item['login'] for item in items] == [
+        'org-1-1', 'org-2-0', 'org-2-1', 'org-3-0', 'org-3-1']
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+@pytest.mark.parametrize('org,expected,call_count', [
+    ('org-1-1', True, 1),
+    ('org-3-0', True, 3),
+    ('lsst', False, 5),
+])
+def test_check_membership_orgs(org, expected, call_count):
+    """Pages are only requested until the organization is found."""
+    add_org_pages(5)
+
+    assert check_github_org_membership(
+        org, 'testuser', 'token', method='orgs') is expected
+    assert len(responses.calls) == call_count
+
+
+@responses.activate
+@pytest.mark.parametrize('status,expected', [(204, True), (404, False)])
+def test_check_membership_members(status, expected):
+    """The members method makes a single request, however many
+    organizations the user is a member of.
+    """
+    add_org_pages(5)
+    responses.add(
+        responses.GET,
+        'https://api.github.com/orgs/lsst/members/testuser',
+        status=status
+    )
+
+    assert check_github_org_membership(
+        'lsst', 'testuser', 'token', method='members') is expected
+    assert len(responses.calls) == 1
+
+
+def test_check_membership_unknown_method():
+    with pytest.raises(ValueError):
+        check_github_org_membership('lsst', 'testuser', 'token',
+                                    method='teams')
+
+
+def test_verify_membership_denials_not_cached(client, mocker):
+    """Users who are added to the organization get access on their next
+    request, while allowed decisions are cached.
+    """
+    mock_check = mocker.patch(
+        'uservice_nbreport.auth.check_github_org_membership',
+        side_effect=[False, True])
+
+    def verify():
+        with client.application.test_request_context():
+            g.github_user = 'testuser'
+            g.github_token = 'token'
+            verify_github_org_membership()
+
+    with pytest.raises(GitHubAuthorizationError):
+        verify()
+    verify()
+    verify()
+    assert mock_check.call_count == 2
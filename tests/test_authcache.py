@@ -0,0 +1,91 @@
+"""Tests for the uservice_nbreport.authcache module.
+"""
+
+import fakeredis
+
+from uservice_nbreport.authcache import GitHubAuthCache
+
+
+def test_get_set():
+    cache = GitHubAuthCache(ttl=60, max_size=10)
+    assert cache.get('user', 'testuser', 'token') is None
+
+    cache.set('user', 'testuser', 'token', {'login': 'testuser'})
+    cache.set('org:lsst', 'testuser', 'token', False)
+    assert cache.get('user', 'testuser', 'token') == {'login': 'testuser'}
+    assert cache.get('org:lsst', 'testuser', 'token') is False
+    # Entries are keyed by token
+    assert cache.get('user', 'testuser', 'other-token') is None
+
+    assert cache.stats == {'hits': 2, 'misses': 2, 'hit_rate': 0.5,
+                           'size': 2}
+
+
+def test_key_hides_token():
+    cache = GitHubAuthCache(ttl=60, max_size=10, salt=b'salt')
+    key = cache.make_key('user', 'testuser', 'secrettoken')
+    assert 'secrettoken' not in key
+    assert key.startswith('user:')
+    # The key depends on the salt
+    other_cache = GitHubAuthCache(ttl=60, max_size=10, salt=b'pepper')
+    assert other_cache.make_key('user', 'testuser', 'secrettoken') != key
+
+
+def test_expiry(mocker):
+    mock_time = mocker.patch(
+        'uservice_nbreport.authcache.time.monotonic', return_value=100.)
+    cache = GitHubAuthCache(ttl=60, max_size=10)
+    cache.set('user', 'testuser', 'token', {'login': 'testuser'})
+
+    mock_time.return_value = 159.
+    assert cache.get('user', 'testuser', 'token') is not None
+    mock_time.return_value = 161.
+    assert cache.get('user', 'testuser', 'token') is None
+    assert len(cache) == 0
+
+
+def test_eviction():
+    cache = GitHubAuthCache(ttl=60, max_size=2)
+    cache.set('user', 'user1', 'token', 1)
+    cache.set('user', 'user2', 'token', 2)
+    assert cache.get('user', 'user1', 'token') == 1
+    # user2 is the least-recently-used entry
+    cache.set('user', 'user3', 'token', 3)
+
+    assert len(cache) == 2
+    assert cache.get('user', 'user2', 'token') is None
+    assert cache.get('user', 'user1', 'token') == 1
+    assert cache.get('user', 'user3', 'token') == 3
+
+
+def test_shared_through_redis():
+    redis_client = fakeredis.FakeStrictRedis(decode_responses=True)
+    cache1 = GitHubAuthCache(ttl=60, max_size=10, salt=b'salt',
+                             redis_client=redis_client)
+    cache2 = GitHubAuthCache(ttl=60, max_size=10, salt=b'salt',
+                             redis_client=redis_client)
+
+    cache1.set('org:lsst', 'testuser', 'token', True)
+    assert cache2.get('org:lsst', 'testuser', 'token') is True
+    assert cache2.hits == 1
+    for key in redis_client.keys():
+        assert 'token' not in key.split(':', 2)[2]
+
+
+def test_entry_ttl(mocker):
+    """Entries can have a shorter lifetime than the cache's, which is kept
+    when they're shared through Redis.
+    """
+    mock_time = mocker.patch(
+        'uservice_nbreport.authcache.time.monotonic', return_value=100.)
+    redis_client = fakeredis.FakeStrictRedis(decode_responses=True)
+    cache1 = GitHubAuthCache(ttl=60, max_size=10, salt=b'salt',
+                             redis_client=redis_client)
+    cache2 = GitHubAuthCache(ttl=60, max_size=10, salt=b'salt',
+                             redis_client=redis_client)
+    cache1.set('org:lsst', 'testuser', 'token', False, ttl=5)
+    assert cache2.get('org:lsst', 'testuser', 'token') is False
+
+    mock_time.return_value = 106.
+    assert cache1.get('org:lsst', 'testuser', 'token') is None
+    assert cache2.get('org:lsst', 'testuser', 'token') is None
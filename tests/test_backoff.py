@@ -0,0 +1,76 @@
+"""Tests for the `uservice_nbreport.backoff` module.
+"""
+
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import ClientError, EndpointConnectionError
+from ltdconveyor.keeper.exceptions import KeeperError
+import pytest
+import requests
+
+from uservice_nbreport.backoff import get_backoff_delay, is_transient_error
+
+
+def test_get_backoff_delay():
+    for retries, (low, high) in enumerate([(5, 10), (10, 20), (20, 40),
+                                           (30, 60), (30, 60)]):
+        for _ in range(20):
+            delay = get_backoff_delay(retries, base=10, maximum=60)
+            assert low <= delay <= high
+
+
+def make_response(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return response
+
+
+def make_client_error(code, status_code):
+    return ClientError(
+        {'Error': {'Code': code},
+         'ResponseMetadata': {'HTTPStatusCode': status_code}},
+        'PutObject')
+
+
+def make_upload_failed_error(cause):
+    """Make an `S3UploadFailedError` like boto3 does, while handling the
+    error of the upload.
+    """
+    try:
+        raise cause
+    except Exception as e:
+        try:
+            raise S3UploadFailedError(
+                'Failed to upload index.html to bucket/index.html: '
+                '{0}'.format(e))
+        except S3UploadFailedError as wrapped:
+            return wrapped
+
+
+@pytest.mark.parametrize('error,transient', [
+    (requests.ConnectionError(), True),
+    (requests.Timeout(), True),
+    (requests.HTTPError(response=make_response(503)), True),
+    (requests.HTTPError(response=make_response(429)), True),
+    (requests.HTTPError(response=make_response(404)), False),
+    (KeeperError({'status': 502, 'message': 'Bad gateway'}), True),
+    (KeeperError({'status': 400, 'message': 'Bad request'}), False),
+    (KeeperError(make_response(500)), True),
+    (KeeperError(make_response(403)), False),
+    (EndpointConnectionError(endpoint_url='https://s3'), True),
+    (S3UploadFailedError('Failed to upload'), True),
+    (make_upload_failed_error(make_client_error('AccessDenied', 403)), False),
+    (make_upload_failed_error(make_client_error('NoSuchBucket', 404)), False),
+    (make_upload_failed_error(make_client_error('SlowDown', 503)), True),
+    (make_upload_failed_error(
+        EndpointConnectionError(endpoint_url='https://s3')), True),
+    (S3UploadFailedError(
+        'Failed to upload index.html to bucket/index.html: An error '
+        'occurred (AccessDenied) when calling the PutObject operation: '
+        'Access Denied'), False),
+    (make_client_error('SlowDown', 503), True),
+    (make_client_error('InternalError', 500), True),
+    (make_client_error('AccessDenied', 403), False),
+    (ValueError('Bad notebook'), False),
+])
+def test_is_transient_error(error, transient):
+    assert is_transient_error(error) is transient
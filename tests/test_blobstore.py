@@ -0,0 +1,118 @@
+"""Tests for the `uservice_nbreport.blobstore` module.
+"""
+
+import io
+import os
+import time
+
+import boto3
+import pytest
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto < 5
+    from moto import mock_s3 as mock_aws
+
+from uservice_nbreport.appfactory import create_flask_app
+from uservice_nbreport.blobstore import (
+    BlobError, LocalBlobStore, S3BlobStore, get_blob_store)
+from uservice_nbreport.config import ProductionConfig
+
+
+@pytest.fixture(params=['local', 's3'])
+def store(request, tmpdir):
+    """Local and S3 (mocked) blob stores."""
+    if request.param == 'local':
+        yield LocalBlobStore(str(tmpdir.join('blobs')))
+    else:
+        with mock_aws():
+            boto3.client('s3', region_name='us-east-1',
+                         aws_access_key_id='id',
+                         aws_secret_access_key='secret').create_bucket(
+                Bucket='nbreport')
+            yield S3BlobStore('nbreport', '/staging/', aws_id='id',
+                              aws_secret='secret')
+
+
+def test_put_get_delete(store):
+    content = b'{"cells": []}' * 10000
+    ref = store.put(io.BytesIO(content))
+    assert ref['size'] == len(content)
+    assert ref['stored_size'] < ref['size']
+    assert ref['key'].startswith(ref['sha256'])
+
+    assert store.get(ref) == content
+
+    store.delete(ref)
+    with pytest.raises(BlobError):
+        store.get(ref)
+    # Deleting a missing blob is fine
+    store.delete(ref)
+
+
+def test_put_identical(store):
+    """Identical payloads are stored in separate blobs."""
+    ref1 = store.put(io.BytesIO(b'notebook'))
+    ref2 = store.put(io.BytesIO(b'notebook'))
+    assert ref1['sha256'] == ref2['sha256']
+    assert ref1['key'] != ref2['key']
+    store.delete(ref1)
+    assert store.get(ref2) == b'notebook'
+
+
+def test_get_corrupted(store):
+    ref = store.put(io.BytesIO(b'notebook'))
+    ref['sha256'] = '0' * 64
+    with pytest.raises(BlobError):
+        store.get(ref)
+
+
+def test_collect_garbage_local(tmpdir):
+    store = LocalBlobStore(str(tmpdir))
+    old_ref = store.put(io.BytesIO(b'old'))
+    new_ref = store.put(io.BytesIO(b'new'))
+    old_time = time.time() - 7200
+    os.utime(str(tmpdir.join(old_ref['key'])), (old_time, old_time))
+
+    assert store.collect_garbage(3600) == 1
+    with pytest.raises(BlobError):
+        store.get(old_ref)
+    assert store.get(new_ref) == b'new'
+
+
+def test_collect_garbage_s3(store):
+    ref = store.put(io.BytesIO(b'notebook'))
+    assert store.collect_garbage(3600) == 0
+    assert store.collect_garbage(-1) == 1
+    with pytest.raises(BlobError):
+        store.get(ref)
+
+
+def test_get_blob_store(client, tmpdir):
+    with client.application.app_context():
+        local_store = get_blob_store('file://' + str(tmpdir))
+        assert isinstance(local_store, LocalBlobStore)
+        assert str(local_store.root_dir) == str(tmpdir)
+        assert get_blob_store('file://' + str(tmpdir)) is local_store
+
+        s3_store = get_blob_store('s3://nbreport/staging')
+        assert isinstance(s3_store, S3BlobStore)
+        assert s3_store.bucket_name == 'nbreport'
+        assert s3_store.prefix == 'staging'
+
+        with pytest.raises(ValueError):
+            get_blob_store('ftp://example.com/blobs')
+
+
+def test_blob_store_url_required(mocker):
+    """The production profile has no default blob store, since a local
+    directory isn't shared by the web and worker pods.
+    """
+    mocker.patch.object(ProductionConfig, 'BLOB_STORE_URL', None)
+    with pytest.raises(RuntimeError):
+        create_flask_app(profile='production')
+
+    mocker.patch.object(ProductionConfig, 'BLOB_STORE_URL',
+                        's3://bucket/blobs')
+    app = create_flask_app(profile='production')
+    assert app.config['BLOB_STORE_URL'] == 's3://bucket/blobs'
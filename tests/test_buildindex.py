@@ -0,0 +1,36 @@
+"""Tests for the uservice_nbreport.buildindex module.
+"""
+
+import fakeredis
+import redis
+
+from uservice_nbreport.buildindex import BuildIndex
+
+
+def test_build_index():
+    index = BuildIndex(fakeredis.FakeStrictRedis(decode_responses=True))
+    assert index.get_previous_root('testr-000', '1', 'lsst-the-docs') is None
+
+    index.set('testr-000', '1', 'lsst-the-docs', 'testr-000/builds/1')
+    assert index.get_previous_root('testr-000', '1', 'lsst-the-docs') \
+        == 'testr-000/builds/1'
+    # A new instance falls back to the report's latest build
+    assert index.get_previous_root('testr-000', '2', 'lsst-the-docs') \
+        == 'testr-000/builds/1'
+
+    index.set('testr-000', '2', 'lsst-the-docs', 'testr-000/builds/2')
+    assert index.get_previous_root('testr-000', '1', 'lsst-the-docs') \
+        == 'testr-000/builds/1'
+    # Builds in other buckets can't be copied
+    assert index.get_previous_root('testr-000', '1', 'other-bucket') is None
+    assert index.get_previous_root('testr-001', '1', 'lsst-the-docs') is None
+
+
+def test_build_index_redis_error(mocker):
+    client = mocker.Mock()
+    client.mget.side_effect = redis.ConnectionError('down')
+    client.pipeline.side_effect = redis.ConnectionError('down')
+    index = BuildIndex(client)
+
+    index.set('testr-000', '1', 'lsst-the-docs', 'testr-000/builds/1')
+    assert index.get_previous_root('testr-000', '1', 'lsst-the-docs') is None
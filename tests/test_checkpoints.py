@@ -0,0 +1,49 @@
+"""Tests for the `uservice_nbreport.checkpoints` module.
+"""
+
+import redis
+
+from uservice_nbreport.checkpoints import StageCheckpoints
+
+
+def test_checkpoints(redis_client):
+    checkpoints = StageCheckpoints(redis_client, 'pub-1')
+    assert checkpoints.get('register_build') is None
+    assert checkpoints.get_uploaded() == set()
+
+    build = {'self_url': 'https://keeper/builds/1', 'bucket_root_dir': 'b/1'}
+    checkpoints.set('register_build', build)
+    checkpoints.set('confirm_build', True)
+    checkpoints.add_uploaded('index.html')
+    checkpoints.add_uploaded('_outputs/a.png')
+
+    checkpoints = StageCheckpoints(redis_client, 'pub-1')
+    assert checkpoints.get('register_build') == build
+    assert checkpoints.get('confirm_build') is True
+    assert checkpoints.get_uploaded() == {'index.html', '_outputs/a.png'}
+    assert 0 < redis_client.ttl(checkpoints.key) <= checkpoints.ttl
+    assert 0 < redis_client.ttl(checkpoints.uploaded_key) <= checkpoints.ttl
+
+    # Other publications have their own checkpoints
+    assert StageCheckpoints(redis_client, 'pub-2').get('register_build') \
+        is None
+
+    checkpoints.clear()
+    assert checkpoints.get('register_build') is None
+    assert checkpoints.get_uploaded() == set()
+
+
+def test_redis_unavailable(mocker):
+    """Checkpoints are missing while Redis is unavailable."""
+    client = mocker.Mock()
+    client.hget.side_effect = redis.ConnectionError
+    client.smembers.side_effect = redis.ConnectionError
+    client.delete.side_effect = redis.ConnectionError
+    client.pipeline.return_value.execute.side_effect = redis.ConnectionError
+    checkpoints = StageCheckpoints(client, 'pub-1')
+
+    checkpoints.set('confirm_build', True)
+    checkpoints.add_uploaded('index.html')
+    assert checkpoints.get('confirm_build') is None
+    assert checkpoints.get_uploaded() == set()
+    checkpoints.clear()
@@ -0,0 +1,38 @@
+"""Tests for the uservice_nbreport.config module.
+"""
+
+import pytest
+
+from uservice_nbreport.config import _getenv_bool
+
+
+@pytest.mark.parametrize('value,expected', [
+    ('true', True),
+    ('True', True),
+    ('yes', True),
+    ('on', True),
+    ('1', True),
+    ('false', False),
+    ('FALSE', False),
+    ('no', False),
+    ('off', False),
+    ('0', False),
+])
+def test_getenv_bool(monkeypatch, value, expected):
+    monkeypatch.setenv('NBREPORT_TEST_BOOL', value)
+    assert _getenv_bool('NBREPORT_TEST_BOOL') is expected
+
+
+def test_getenv_bool_default(monkeypatch):
+    monkeypatch.delenv('NBREPORT_TEST_BOOL', raising=False)
+    assert _getenv_bool('NBREPORT_TEST_BOOL') is False
+    assert _getenv_bool('NBREPORT_TEST_BOOL', default=True) is True
+
+    monkeypatch.setenv('NBREPORT_TEST_BOOL', '')
+    assert _getenv_bool('NBREPORT_TEST_BOOL', default=True) is True
+
+
+def test_getenv_bool_invalid(monkeypatch):
+    monkeypatch.setenv('NBREPORT_TEST_BOOL', 'enabled')
+    with pytest.raises(ValueError):
+        _getenv_bool('NBREPORT_TEST_BOOL')
@@ -0,0 +1,123 @@
+"""Tests for the uservice_nbreport.editionindex module.
+"""
+
+import fakeredis
+import pytest
+import redis
+import responses
+
+from uservice_nbreport.editionindex import (
+    EditionIndex, find_edition_url, scan_editions)
+
+
+def add_editions(count):
+    """Mock the editions of the testr-000 product, with slugs equal to
+    their IDs.
+    """
+    responses.add(
+        responses.GET,
+        'https://keeper.lsst.codes/products/testr-000/editions/',
+        status=200,
+        json={
+            'editions': ['https://keeper.lsst.codes/editions/{0}'.format(i)
+                         for i in range(1, count + 1)]
+        }
+    )
+    for i in range(1, count + 1):
+        responses.add(
+            responses.GET,
+            'https://keeper.lsst.codes/editions/{0}'.format(i),
+            status=200,
+            json={'slug': str(i)}
+        )
+
+
+def test_edition_index():
+    index = EditionIndex(fakeredis.FakeStrictRedis(decode_responses=True))
+    assert index.get('testr-000', '1') is None
+
+    index.set('testr-000', '1', 'https://keeper.lsst.codes/editions/1')
+    index.update('testr-000', {'2': 'https://keeper.lsst.codes/editions/2'})
+    assert index.get('testr-000', '1') == \
+        'https://keeper.lsst.codes/editions/1'
+    assert index.get('testr-000', '2') == \
+        'https://keeper.lsst.codes/editions/2'
+    assert index.get('testr-001', '1') is None
+
+
+def test_edition_index_redis_error(mocker):
+    """Redis errors are index misses."""
+    client = mocker.Mock()
+    client.hget.side_effect = redis.ConnectionError('down')
+    client.pipeline.side_effect = redis.ConnectionError('down')
+    index = EditionIndex(client)
+
+    index.set('testr-000', '1', 'https://keeper.lsst.codes/editions/1')
+    assert index.get('testr-000', '1') is None
+
+
+@responses.activate
+def test_scan_editions_stops_after_page():
+    """The scan starts with the newest editions and stops after the page
+    that has the slug.
+    """
+    add_editions(25)
+
+    edition_urls = scan_editions(
+        keeper_url='https://keeper.lsst.codes',
+        ltd_token='testtoken',
+        ltd_product='testr-000',
+        instance_id='12',
+        page_size=5)
+
+    assert edition_urls['12'] == 'https://keeper.lsst.codes/editions/12'
+    # Editions 25 to 11 were fetched, in three pages
+    assert sorted(edition_urls, key=int) == [str(i) for i in range(11, 26)]
+    assert len(responses.calls) == 1 + 15
+
+
+@responses.activate
+def test_find_edition_url_index_hit():
+    index = EditionIndex(fakeredis.FakeStrictRedis(decode_responses=True))
+    index.set('testr-000', '1', 'https://keeper.lsst.codes/editions/1')
+
+    edition_url = find_edition_url(
+        keeper_url='https://keeper.lsst.codes',
+        ltd_token='testtoken',
+        ltd_product='testr-000',
+        instance_id='1',
+        edition_index=index)
+
+    assert edition_url == 'https://keeper.lsst.codes/editions/1'
+    assert len(responses.calls) == 0
+
+
+@responses.activate
+def test_find_edition_url_index_miss():
+    """A miss falls back to a scan, which fills the index."""
+    add_editions(3)
+    index = EditionIndex(fakeredis.FakeStrictRedis(decode_responses=True))
+
+    edition_url = find_edition_url(
+        keeper_url='https://keeper.lsst.codes',
+        ltd_token='testtoken',
+        ltd_product='testr-000',
+        instance_id='2',
+        edition_index=index)
+
+    assert edition_url == 'https://keeper.lsst.codes/editions/2'
+    for slug in ('1', '2', '3'):
+        assert index.get('testr-000', slug) == \
+            'https://keeper.lsst.codes/editions/{0}'.format(slug)
+
+
+@responses.activate
+def test_find_edition_url_not_found():
+    add_editions(3)
+
+    with pytest.raises(RuntimeError):
+        find_edition_url(
+            keeper_url='https://keeper.lsst.codes',
+            ltd_token='testtoken',
+            ltd_product='testr-000',
+            instance_id='4')
@@ -0,0 +1,66 @@
+"""Tests for the uservice_nbreport.httpclient module.
+"""
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import threading
+
+import pytest
+
+from uservice_nbreport import httpclient
+from uservice_nbreport.httpclient import (
+    UpstreamSession, get_http_metrics, get_session)
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def no_sessions(mocker):
+    """Start without the sessions that earlier tests created in this
+    process, and restore them afterwards.
+    """
+    mocker.patch.dict(httpclient._sessions, clear=True)
+    mocker.patch.object(httpclient, '_sessions_pid', None)
+
+
+def test_get_session(no_sessions):
+    session = get_session('keeper')
+    assert session is get_session('keeper')
+    assert session is not get_session('github')
+    assert session.timeout == (10., 60.)
+    assert set(get_http_metrics()) == {'keeper', 'github'}
+
+    with pytest.raises(ValueError):
+        get_session('gitlab')
+
+
+def test_connection_reuse(server_url):
+    session = UpstreamSession('keeper', timeout=(1., 1.), pool_maxsize=2)
+    for _ in range(5):
+        response = session.get(server_url + '/editions/1')
+        assert response.status_code == 200
+
+    assert session.metrics == {'requests': 5, 'connections': 1, 'reused': 4}
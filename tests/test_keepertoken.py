@@ -0,0 +1,107 @@
+"""Tests for the uservice_nbreport.keepertoken module.
+"""
+
+import fakeredis
+from ltdconveyor.keeper.exceptions import KeeperError
+import redis
+import requests
+import responses
+
+from uservice_nbreport.keepertoken import KeeperTokenCache, is_unauthorized
+
+
+def make_cache(redis_client, **kwargs):
+    return KeeperTokenCache(
+        redis_client,
+        keeper_url='https://keeper.lsst.codes',
+        username='user',
+        password='pass',
+        **kwargs)
+
+
+def add_token_responses(*tokens):
+    for token in tokens:
+        responses.add(
+            responses.GET,
+            'https://keeper.lsst.codes/token',
+            status=200,
+            json={'token': token}
+        )
+
+
+@responses.activate
+def test_token_is_shared():
+    """Caches sharing a Redis server request a token once."""
+    add_token_responses('token1', 'token2')
+    redis_client = fakeredis.FakeStrictRedis(decode_responses=True)
+
+    assert make_cache(redis_client).get_token() == 'token1'
+    assert make_cache(redis_client).get_token() == 'token1'
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_refresh_ahead(mocker):
+    add_token_responses('token1', 'token2')
+    redis_client = fakeredis.FakeStrictRedis(decode_responses=True)
+    cache = make_cache(redis_client, lifetime=3600, refresh_ahead=600)
+    mock_time = mocker.patch('uservice_nbreport.keepertoken.time.time')
+
+    mock_time.return_value = 1000.
+    assert cache.get_token() == 'token1'
+
+    mock_time.return_value = 1000. + 2999.
+    assert cache.get_token() == 'token1'
+
+    # Another process is refreshing the token, so the cached token is used
+    redis_client.set(cache.lock_key, 'other')
+    mock_time.return_value = 1000. + 3001.
+    assert cache.get_token() == 'token1'
+    assert len(responses.calls) == 1
+
+    redis_client.delete(cache.lock_key)
+    assert cache.get_token() == 'token2'
+    assert len(responses.calls) == 2
+    # The lock is released
+    assert redis_client.get(cache.lock_key) is None
+
+
+@responses.activate
+def test_invalidate():
+    add_token_responses('token1', 'token2')
+    redis_client = fakeredis.FakeStrictRedis(decode_responses=True)
+    cache = make_cache(redis_client)
+
+    assert cache.get_token() == 'token1'
+    # A token that's no longer cached doesn't clear the cache
+    cache.invalidate('token0')
+    assert cache.get_token() == 'token1'
+
+    cache.invalidate('token1')
+    assert cache.get_token() == 'token2'
+
+
+@responses.activate
+def test_redis_unavailable(mocker):
+    """Tokens are requested directly if Redis is unavailable."""
+    add_token_responses('token1', 'token2')
+    redis_client = mocker.Mock()
+    redis_client.get.side_effect = redis.ConnectionError('down')
+    redis_client.delete.side_effect = redis.ConnectionError('down')
+    cache = make_cache(redis_client)
+
+    assert cache.get_token() == 'token1'
+    assert cache.get_token() == 'token2'
+    cache.invalidate()
+
+
+def test_is_unauthorized():
+    response = requests.Response()
+    response.status_code = 401
+    assert is_unauthorized(requests.HTTPError(response=response))
+    response.status_code = 404
+    assert not is_unauthorized(requests.HTTPError(response=response))
+
+    assert is_unauthorized(KeeperError({'status': 401}))
+    assert not is_unauthorized(KeeperError('Could not authenticate'))
+    assert not is_unauthorized(ValueError())
@@ -0,0 +1,63 @@
+"""Tests for the `uservice_nbreport.progress` module.
+"""
+
+from unittest import mock
+
+from uservice_nbreport.progress import (
+    PROGRESS, ProgressReporter, publish_event, subscribe, wait_for_event)
+
+
+def test_publish_event(redis_client):
+    pubsub = subscribe(redis_client, 'pub-1')
+    other_pubsub = subscribe(redis_client, 'pub-2')
+    publish_event(redis_client, 'pub-1', {'event': 'state',
+                                          'state': 'SUCCESS'})
+
+    assert wait_for_event(pubsub, 1.) == {'event': 'state',
+                                          'state': 'SUCCESS'}
+    assert wait_for_event(pubsub, 0.05) is None
+    assert wait_for_event(other_pubsub, 0.05) is None
+    pubsub.close()
+    other_pubsub.close()
+
+
+def test_progress_reporter(redis_client):
+    task = mock.Mock()
+    task.request.id = 'task-1'
+    pubsub = subscribe(redis_client, 'pub-1')
+    progress = ProgressReporter(redis_client, 'pub-1', task=task,
+                                min_interval=60)
+
+    progress('render')
+    progress('upload', done=0, total=3)
+    # Throttled, until the upload is done
+    progress('upload', done=1, total=3)
+    progress('upload', done=2, total=3)
+    progress('upload', done=3, total=3)
+    progress('update_edition')
+
+    assert task.update_state.call_args_list == [
+        mock.call(task_id='task-1', state=PROGRESS, meta=meta)
+        for meta in ({'stage': 'render'},
+                     {'stage': 'upload', 'done': 0, 'total': 3},
+                     {'stage': 'upload', 'done': 3, 'total': 3},
+                     {'stage': 'update_edition'})]
+    events = []
+    while True:
+        event = wait_for_event(pubsub, 0.05)
+        if event is None:
+            break
+        events.append(event)
+    assert [event['progress'] for event in events] == [
+        call[1]['meta'] for call in task.update_state.call_args_list]
+    assert all(event['event'] == 'progress' for event in events)
+    pubsub.close()
+
+
+def test_progress_reporter_without_task(redis_client):
+    """Progress is still published for tasks that aren't tracked."""
+    pubsub = subscribe(redis_client, 'pub-1')
+    ProgressReporter(redis_client, 'pub-1')('render')
+    assert wait_for_event(pubsub, 1.) == {'event': 'progress',
+                                          'progress': {'stage': 'render'}}
+    pubsub.close()
@@ -0,0 +1,52 @@
+"""Tests for the `uservice_nbreport.publicationindex` module.
+"""
+
+import redis
+
+from uservice_nbreport.publicationindex import PublicationIndex
+
+
+def test_supersede(redis_client):
+    index = PublicationIndex(redis_client)
+
+    assert index.supersede('testr-000', '1', 'pub-1') is None
+    assert not index.is_superseded('pub-1')
+    assert index.pop_callback('pub-1') is None
+
+    assert index.supersede('testr-000', '1', 'pub-2') == 'pub-1'
+    assert index.is_superseded('pub-1')
+    assert not index.is_superseded('pub-2')
+
+    # Other instances aren't affected
+    assert index.supersede('testr-000', '2', 'pub-3') is None
+    assert not index.is_superseded('pub-2')
+
+    # Recording the same publication again doesn't supersede it
+    assert index.supersede('testr-000', '1', 'pub-2') is None
+    assert not index.is_superseded('pub-2')
+
+    assert 0 < redis_client.ttl('nbreport:publications:latest:testr-000:1') \
+        <= index.ttl
+
+
+def test_callback(redis_client):
+    index = PublicationIndex(redis_client)
+    callback = {'url': 'https://ci.example.com/hook', 'secret': 's3cret'}
+    index.set_callback('pub-1', callback)
+
+    assert index.pop_callback('pub-2') is None
+    assert index.pop_callback('pub-1') == callback
+    # Callbacks are only popped once
+    assert index.pop_callback('pub-1') is None
+
+
+def test_redis_unavailable(mocker):
+    """Publications aren't superseded while Redis is unavailable."""
+    client = mocker.Mock()
+    client.pipeline.return_value.execute.side_effect = redis.ConnectionError
+    client.exists.side_effect = redis.ConnectionError
+    index = PublicationIndex(client)
+
+    assert index.supersede('testr-000', '1', 'pub-1') is None
+    assert not index.is_superseded('pub-1')
+    assert index.pop_callback('pub-1') is None
@@ -0,0 +1,92 @@
+"""Tests for the ``uservice_nbreport.publish.assets`` module.
+"""
+
+from pathlib import Path
+
+import botocore.exceptions
+import nbformat
+
+from uservice_nbreport.publish.assets import (
+    SharedAsset, get_shared_assets, publish_shared_assets)
+from uservice_nbreport.publish.htmlexport import create_report_exporter
+
+ASSETS_URL = 'https://assets.example.com/nbreport/'
+
+
+def test_shared_asset():
+    asset = SharedAsset('app.css', b'body {}')
+    assert asset.content_type == 'text/css'
+    assert asset.hashed_name == 'app.{0}.css'.format(asset.content_hash[:16])
+    assert asset.get_url(ASSETS_URL) \
+        == 'https://assets.example.com/nbreport/' + asset.hashed_name
+
+
+def test_get_shared_assets():
+    exporter = create_report_exporter(shared_assets_url=ASSETS_URL)
+    assets = get_shared_assets(exporter)
+    assert [asset.name for asset in assets] \
+        == ['app.css', 'lsst-logo-dark-no-text.svg', 'notebook.css']
+    assert assets[1].content_type == 'image/svg+xml'
+
+
+def test_shared_assets_export(tmpdir):
+    path = Path(__file__).parent / 'notebooks/basic.ipynb'
+    nb = nbformat.read(str(path), as_version=4)
+
+    exporter = create_report_exporter(shared_assets_url=ASSETS_URL)
+    body, resources = exporter.from_notebook_node(nb)
+
+    for asset in exporter.shared_assets:
+        assert asset.get_url(ASSETS_URL) in body
+    # nbconvert's CSS isn't inlined
+    assert '<style type="text/css">' not in body
+
+    site_dir = Path(str(tmpdir))
+    exporter.write_site(body, resources, site_dir)
+    assert [p.name for p in site_dir.iterdir()] == ['index.html']
+
+
+def test_publish_shared_assets(mocker):
+    mocker.patch('uservice_nbreport.publish.assets._published_keys', set())
+    mock_session = mocker.patch(
+        'uservice_nbreport.publish.assets.boto3.session.Session')
+    mock_s3 = mock_session.return_value.client.return_value
+
+    app_css = SharedAsset('app.css', b'body {}')
+    logo = SharedAsset('logo.svg', b'<svg></svg>')
+
+    def head_object(Bucket, Key):
+        if Key.endswith('.css'):
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': '404'}}, 'HeadObject')
+        return {}
+
+    mock_s3.head_object.side_effect = head_object
+
+    uploaded_keys = publish_shared_assets(
+        [app_css, logo],
+        bucket_name='lsst-the-docs',
+        prefix='nbreport-assets/',
+        aws_id='id',
+        aws_secret='secret')
+
+    # Only the asset that wasn't in the bucket was uploaded
+    app_css_key = 'nbreport-assets/' + app_css.hashed_name
+    assert uploaded_keys == [app_css_key]
+    mock_s3.put_object.assert_called_once_with(
+        Bucket='lsst-the-docs',
+        Key=app_css_key,
+        Body=b'body {}',
+        ContentType='text/css',
+        CacheControl='public, max-age=31536000, immutable')
+
+    # Assets are only checked once per process
+    mock_session.reset_mock()
+    uploaded_keys = publish_shared_assets(
+        [app_css, logo],
+        bucket_name='lsst-the-docs',
+        prefix='nbreport-assets/',
+        aws_id='id',
+        aws_secret='secret')
+    assert uploaded_keys == []
+    mock_session.assert_not_called()
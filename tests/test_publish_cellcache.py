@@ -0,0 +1,75 @@
+"""Tests for the ``uservice_nbreport.publish.cellcache`` module.
+"""
+
+import os
+from pathlib import Path
+
+import nbformat
+
+from uservice_nbreport.publish.cellcache import (
+    CellRenderCache, compute_cell_key)
+from uservice_nbreport.publish.htmlexport import create_report_exporter
+
+
+def test_cell_render_cache(tmpdir):
+    cache = CellRenderCache(Path(str(tmpdir)) / 'report', max_bytes=10)
+
+    assert cache.get('a') is None
+    cache.put('a', '<p>a</p>')
+    assert 'a' in cache
+    assert cache.get('a') == '<p>a</p>'
+    assert cache.stats == {'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+    # Make "a" the least-recently-used entry
+    os.utime(str(cache.cache_dir / 'a.html'), (0, 0))
+    cache.put('b', '<p>b</p>')
+    cache.prune()
+    assert 'a' not in cache
+    assert 'b' in cache
+
+
+def test_compute_cell_key():
+    cell = nbformat.v4.new_code_cell(source='print("hello")')
+    cell.outputs.append(nbformat.v4.new_output(
+        'execute_result', data={'text/plain': 'hello'}, execution_count=1))
+    key = compute_cell_key(cell, 'fingerprint', 'ipython3')
+
+    # Execution counts aren't rendered
+    cell.execution_count = 2
+    cell.outputs[0].execution_count = 2
+    assert compute_cell_key(cell, 'fingerprint', 'ipython3') == key
+
+    assert compute_cell_key(cell, 'fingerprint', 'python') != key
+    assert compute_cell_key(cell, 'other', 'ipython3') != key
+    cell.outputs[0].data['text/plain'] = 'goodbye'
+    assert compute_cell_key(cell, 'fingerprint', 'ipython3') != key
+
+
+def test_cell_cache_export(tmpdir):
+    """Conversions with a cell cache only render changed cells, and produce
+    the same HTML as conversions without a cache.
+    """
+    path = Path(__file__).parent / 'notebooks/basic.ipynb'
+    nb = nbformat.read(str(path), as_version=4)
+    cell_count = len(nb.cells)
+
+    exporter = create_report_exporter()
+    cache = CellRenderCache(Path(str(tmpdir)) / 'report', max_bytes=10 ** 8)
+
+    expected, _ = exporter.from_notebook_node(nb)
+    body, resources = exporter.from_notebook_node(nb, cell_cache=cache)
+    assert body == expected
+    assert resources['lsst_cell_cache_stats'] == {
+        'hits': 0, 'misses': cell_count, 'hit_rate': 0.}
+
+    body, resources = exporter.from_notebook_node(nb, cell_cache=cache)
+    assert body == expected
+    assert resources['lsst_cell_cache_stats'] == {
+        'hits': cell_count, 'misses': 0, 'hit_rate': 1.}
+
+    # Only the changed cell is rendered
+    nb.cells[2].source += '\n\nA new paragraph.'
+    expected, _ = exporter.from_notebook_node(nb)
+    body, resources = exporter.from_notebook_node(nb, cell_cache=cache)
+    assert body == expected
+    assert resources['lsst_cell_cache_stats']['misses'] == 1
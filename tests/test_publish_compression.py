@@ -0,0 +1,52 @@
+"""Tests for the ``uservice_nbreport.publish.compression`` module.
+"""
+
+import gzip
+from pathlib import Path
+
+import pytest
+
+from uservice_nbreport.publish.compression import compress_site
+
+
+def test_compress_site(tmpdir):
+    site_dir = Path(str(tmpdir))
+    html = '<html><body>{0}</body></html>'.format('<p>Hello</p>' * 1000)
+    (site_dir / 'index.html').write_text(html, encoding='utf-8')
+    (site_dir / '_outputs').mkdir()
+    png_data = b'\x89PNG\r\n\x1a\n' + b'\x00' * 1000
+    (site_dir / '_outputs' / 'a.png').write_bytes(png_data)
+    # Compressing a tiny file makes it larger, so it's left alone
+    (site_dir / 'tiny.css').write_text('a{}', encoding='utf-8')
+
+    result = compress_site(site_dir, encoding='gzip')
+
+    assert result['encoding'] == 'gzip'
+    assert result['level'] == 9
+    assert result['content_encodings'] == {'index.html': 'gzip'}
+    assert result['original_bytes'] == len(html)
+    assert result['compressed_bytes'] < result['original_bytes']
+    assert result['ratio'] == pytest.approx(
+        result['compressed_bytes'] / result['original_bytes'])
+
+    compressed_data = (site_dir / 'index.html').read_bytes()
+    assert gzip.decompress(compressed_data).decode('utf-8') == html
+    assert (site_dir / '_outputs' / 'a.png').read_bytes() == png_data
+    assert (site_dir / 'tiny.css').read_text(encoding='utf-8') == 'a{}'
+
+
+def test_compress_site_deterministic(tmpdir):
+    digests = []
+    for name in ('a', 'b'):
+        site_dir = Path(str(tmpdir)) / name
+        site_dir.mkdir()
+        (site_dir / 'index.html').write_text('<p>Hello</p>' * 100,
+                                             encoding='utf-8')
+        compress_site(site_dir)
+        digests.append((site_dir / 'index.html').read_bytes())
+    assert digests[0] == digests[1]
+
+
+def test_compress_site_unknown_encoding(tmpdir):
+    with pytest.raises(ValueError):
+        compress_site(Path(str(tmpdir)), encoding='compress')
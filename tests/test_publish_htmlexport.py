@@ -3,7 +3,10 @@
 
 from pathlib import Path
 
-from uservice_nbreport.publish.htmlexport import build_site_from_filename
+import nbformat
+
+from uservice_nbreport.publish.htmlexport import (
+    build_site_from_filename, create_report_exporter)
 
 
 def test_basic_export(tmpdir):
@@ -16,3 +19,59 @@ def test_basic_export(tmpdir):
 
     assert (tmpdir / 'index.html').exists()
     assert (tmpdir / 'app.css').exists()
+
+
+def test_exporter_reuse():
+    """A reused exporter produces the same HTML as a new exporter, and
+    doesn't leak resources between conversions.
+    """
+    path = Path(__file__).parent / 'notebooks/basic.ipynb'
+    basic_nb = nbformat.read(str(path), as_version=4)
+
+    other_nb = nbformat.v4.new_notebook(metadata=basic_nb.metadata)
+    other_nb.cells.append(
+        nbformat.v4.new_markdown_cell(source='# Other report\n\n## Summary'))
+
+    exporter = create_report_exporter()
+    exporter.warm()
+    exporter.from_notebook_node(basic_nb)
+    body, resources = exporter.from_notebook_node(other_nb)
+
+    expected_body, expected_resources = \
+        create_report_exporter().from_notebook_node(other_nb)
+    assert body == expected_body
+
+    outline = resources['lsst_outline_root']
+    assert len(outline.children) == 1
+    assert outline.children[0].text == 'Other report'
+    assert [n.text for n in outline.children[0].children] == ['Summary']
+
+
+def test_extract_outputs_export(tmpdir):
+    """Export a notebook with its output images extracted into files.
+    """
+    path = Path(__file__).parent / 'notebooks/basic.ipynb'
+
+    build_site_from_filename(path, tmpdir, extract_outputs=True)
+
+    html = (tmpdir / 'index.html').read_text('utf-8')
+    assert 'src="data:image/png;base64' not in html
+    image_paths = (tmpdir / '_outputs').listdir()
+    assert len(image_paths) == 1
+    assert '_outputs/{0}'.format(image_paths[0].basename) in html
+
+
+def test_render_fingerprint(mocker):
+    """The template files are hashed once per exporter, but the fingerprint
+    still follows the exporter's settings.
+    """
+    exporter = create_report_exporter()
+    fingerprint = exporter.render_fingerprint
+    assert create_report_exporter().render_fingerprint == fingerprint
+
+    mock_read = mocker.patch.object(Path, 'read_bytes')
+    assert exporter.render_fingerprint == fingerprint
+    mock_read.assert_not_called()
+
+    exporter.anchor_link_text = 'Link'
+    assert exporter.render_fingerprint != fingerprint
@@ -0,0 +1,56 @@
+"""Tests for the ``uservice_nbreport.publish.markdown`` module.
+"""
+
+from nbconvert.exporters.html import HTMLExporter
+import nbformat
+
+from uservice_nbreport.publish.markdown import (
+    LsstMarkdown, LsstMarkdownPreprocessor, parse_markdown)
+
+SOURCE = (
+    '# Report title\n'
+    '\n'
+    'Setext section\n'
+    '--------------\n'
+    '\n'
+    '```python\n'
+    '# A comment, not a header\n'
+    'print("hello")\n'
+    '```\n'
+    '\n'
+    'Text with a footnote[^1] and a [link][ref].\n'
+    '\n'
+    '[^1]: The footnote.\n'
+    '\n'
+    '[ref]: https://example.com\n'
+)
+
+
+def test_parse_markdown_headers():
+    ast = parse_markdown(SOURCE)
+    assert ast.headers == [(1, 'Report title'), (2, 'Setext section')]
+
+
+def test_render_ast():
+    """Rendering the syntax tree gives the same HTML as nbconvert's
+    markdown2html filter, and the syntax tree can be rendered again.
+    """
+    expected = HTMLExporter().markdown2html(SOURCE)
+    markdown = LsstMarkdown()
+    ast = parse_markdown(SOURCE)
+    assert markdown.render_ast(ast) == expected
+    assert markdown.render_ast(ast) == expected
+    assert markdown.render(SOURCE) == expected
+
+
+def test_markdown_preprocessor():
+    nb = nbformat.v4.new_notebook()
+    nb.cells.append(nbformat.v4.new_markdown_cell(source=SOURCE))
+    nb.cells.append(nbformat.v4.new_code_cell(source='# Not markdown'))
+    nb.cells.append(nbformat.v4.new_markdown_cell(source=SOURCE))
+
+    nb, resources = LsstMarkdownPreprocessor().preprocess(nb, {})
+
+    asts = resources['lsst_markdown_asts']
+    assert list(asts.keys()) == [SOURCE]
+    assert asts[SOURCE].headers[0] == (1, 'Report title')
@@ -1,8 +1,13 @@
 """Tests for the ``uservice_nbreport.publish.outline`` module.
 """
 
+import random
+import sys
+import time
+
 import nbformat
 
+from uservice_nbreport.publish.markdown import parse_markdown
 from uservice_nbreport.publish.outline import (
     extract_markdown_headers,
     build_outline_hierarchy)
@@ -57,3 +62,88 @@ def test_build_outline_hierarchy():
     assert h1.children[1].text == 'Sibling subsection'
 
     assert h1.children[0].children[0].text == 'Sub-subsection'
+
+
+def test_build_outline_hierarchy_skipped_levels():
+    levels = [1, 3, 2, 4, 1, 2, 2, 5, 3]
+    headers = [dict(level=level, title=str(i), anchor='#{0}'.format(i))
+               for i, level in enumerate(levels)]
+
+    outline = build_outline_hierarchy(headers)
+
+    assert str(outline) == (
+        '0: Root\n'
+        '1: 0\n'
+        '2: 1\n'
+        '2: 2\n'
+        '3: 3\n'
+        '1: 4\n'
+        '2: 5\n'
+        '2: 6\n'
+        '3: 7\n'
+        '3: 8\n'
+    )
+    assert outline.children[1].children[1].children[1].parent.text == '6'
+
+
+def test_build_outline_hierarchy_deep():
+    """Deep outlines don't hit the recursion limit."""
+    depth = sys.getrecursionlimit() + 100
+    headers = [dict(level=level, title=str(level), anchor='')
+               for level in range(1, depth + 1)]
+
+    outline = build_outline_hierarchy(headers)
+
+    node = outline
+    while node.children:
+        node = node.children[0]
+    assert node.level == depth
+    assert node.get_parent_of_level(1) is outline.children[0]
+
+
+def test_build_outline_hierarchy_benchmark():
+    """Micro-benchmark for outlines of auto-generated reports with many
+    headers.
+    """
+    count = 20000
+    rng = random.Random(42)
+    headers = [dict(level=rng.randint(1, 6), title=str(i), anchor='')
+               for i in range(count)]
+
+    start_time = time.perf_counter()
+    outline = build_outline_hierarchy(headers)
+    duration = time.perf_counter() - start_time
+
+    node_count = 0
+    nodes = [outline]
+    while nodes:
+        node = nodes.pop()
+        nodes.extend(node.children)
+        node_count += 1
+    assert node_count == count + 1
+
+    # Building the outline takes ~25 ms; a generous bound catches
+    # accidentally quadratic builders without being flaky.
+    assert duration < 1.
+
+
+def test_extract_markdown_headers_code_and_setext():
+    source = (
+        'Report title\n'
+        '============\n'
+        '\n'
+        '```\n'
+        '# A comment\n'
+        '```\n'
+        '\n'
+        'Subsection\n'
+        '----------\n'
+    )
+    expected = [
+        dict(level=1, title='Report title', anchor='#Report-title'),
+        dict(level=2, title='Subsection', anchor='#Subsection'),
+    ]
+    cell = nbformat.v4.new_markdown_cell(source=source)
+    assert extract_markdown_headers(cell) == expected
+    assert extract_markdown_headers(cell, ast=parse_markdown(source)) \
+        == expected
@@ -0,0 +1,69 @@
+"""Tests for the ``uservice_nbreport.publish.outputs`` module.
+"""
+
+from base64 import b64encode
+import hashlib
+from pathlib import Path
+
+import nbformat
+
+from uservice_nbreport.publish.htmlexport import create_report_exporter
+from uservice_nbreport.publish.outputs import LsstExtractOutputPreprocessor
+
+
+def _make_image_cell(data):
+    return nbformat.v4.new_code_cell(
+        source='plot()',
+        outputs=[nbformat.v4.new_output(
+            'display_data',
+            data={'image/png': b64encode(data).decode('ascii'),
+                  'text/plain': '<Figure>'})])
+
+
+def _make_notebook():
+    nb = nbformat.v4.new_notebook(metadata={'nbreport': {}})
+    nb.cells.append(nbformat.v4.new_markdown_cell(source='# Plots'))
+    nb.cells.append(_make_image_cell(b'first image'))
+    nb.cells.append(_make_image_cell(b'second image'))
+    nb.cells.append(_make_image_cell(b'first image'))
+    return nb
+
+
+def test_extract_outputs():
+    preprocessor = LsstExtractOutputPreprocessor(enabled=True)
+    nb, resources = preprocessor(_make_notebook(), {})
+
+    first_filename = '_outputs/{0}.png'.format(
+        hashlib.sha256(b'first image').hexdigest())
+    second_filename = '_outputs/{0}.png'.format(
+        hashlib.sha256(b'second image').hexdigest())
+
+    # Identical images are only extracted once
+    assert resources['outputs'] == {
+        first_filename: b'first image',
+        second_filename: b'second image',
+    }
+
+    filenames = [cell.outputs[0].metadata.filenames['image/png']
+                 for cell in nb.cells[1:]]
+    assert filenames == [first_filename, second_filename, first_filename]
+
+
+def test_exporter_extract_outputs(tmpdir):
+    exporter = create_report_exporter(extract_outputs=True)
+    body, resources = exporter.from_notebook_node(_make_notebook())
+
+    first_filename = '_outputs/{0}.png'.format(
+        hashlib.sha256(b'first image').hexdigest())
+    assert 'src="{0}"'.format(first_filename) in body
+    assert 'src="data:image/png;base64' not in body
+
+    exporter.write_site(body, resources, Path(str(tmpdir)))
+    assert (tmpdir / first_filename).read_binary() == b'first image'
+
+
+def test_exporter_inline_outputs():
+    exporter = create_report_exporter()
+    body, resources = exporter.from_notebook_node(_make_notebook())
+    assert 'src="data:image/png;base64' in body
+    assert not resources['outputs']
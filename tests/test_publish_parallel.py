@@ -0,0 +1,89 @@
+"""Tests for the ``uservice_nbreport.publish.parallel`` module and parallel
+rendering with ``LsstHtmlReportExporter``.
+"""
+
+from pathlib import Path
+
+from billiard.pool import Pool
+import nbformat
+
+from uservice_nbreport.publish.htmlexport import create_report_exporter
+from uservice_nbreport.publish.parallel import split_cells
+
+
+def test_split_cells():
+    cells = [nbformat.v4.new_markdown_cell(source='x' * size)
+             for size in (10, 10, 10, 30, 10, 10)]
+    chunks = split_cells(cells, 3)
+    assert [len(chunk) for chunk in chunks] == [3, 1, 2]
+    assert [cell for chunk in chunks for cell in chunk] == cells
+
+    assert split_cells(cells, 1) == [cells]
+    assert split_cells([], 4) == []
+
+
+def test_parallel_render():
+    """Rendering cells in parallel gives the same HTML as rendering them
+    serially.
+    """
+    path = Path(__file__).parent / 'notebooks/basic.ipynb'
+    nb = nbformat.read(str(path), as_version=4)
+    nb.cells = nb.cells * 5
+
+    serial_exporter = create_report_exporter()
+    parallel_exporter = create_report_exporter(
+        parallel_render=True,
+        parallel_render_min_cells=len(nb.cells),
+        parallel_render_processes=2)
+    try:
+        expected, _ = serial_exporter.from_notebook_node(nb)
+        body, resources = parallel_exporter.from_notebook_node(nb)
+        assert resources['lsst_parallel_render'] is True
+        assert body == expected
+    finally:
+        parallel_exporter.close()
+
+
+def test_parallel_render_threshold():
+    path = Path(__file__).parent / 'notebooks/basic.ipynb'
+    nb = nbformat.read(str(path), as_version=4)
+
+    exporter = create_report_exporter(
+        parallel_render=True,
+        parallel_render_min_cells=len(nb.cells) + 1)
+    _, resources = exporter.from_notebook_node(nb)
+    assert resources['lsst_parallel_render'] is False
+    assert exporter._render_pool is None
+
+    exporter.parallel_render_min_bytes = 1
+    assert exporter._use_parallel_render(nb) is True
+
+
+def render_basic_notebook(parallel):
+    path = Path(__file__).parent / 'notebooks/basic.ipynb'
+    nb = nbformat.read(str(path), as_version=4)
+    nb.cells = nb.cells * 5
+    exporter = create_report_exporter(
+        parallel_render=parallel,
+        parallel_render_min_cells=len(nb.cells),
+        parallel_render_processes=2)
+    try:
+        body, resources = exporter.from_notebook_node(nb)
+    finally:
+        exporter.close()
+    return body, resources['lsst_parallel_render']
+
+
+def test_parallel_render_in_worker():
+    """Cells can be rendered in parallel from a Celery prefork worker, which
+    is a daemonic billiard process.
+    """
+    pool = Pool(processes=1)
+    try:
+        body, parallel = pool.apply_async(render_basic_notebook,
+                                          (True,)).get(timeout=120)
+    finally:
+        pool.close()
+        pool.join()
+    assert parallel is True
+    assert body == render_basic_notebook(False)[0]
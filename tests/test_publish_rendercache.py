@@ -0,0 +1,73 @@
+"""Tests for the ``uservice_nbreport.publish.rendercache`` module.
+"""
+
+import os
+from pathlib import Path
+
+import nbformat
+
+from uservice_nbreport.publish.htmlexport import create_report_exporter
+from uservice_nbreport.publish.rendercache import (
+    RenderCache, compute_render_key)
+
+
+def _make_site(path, content):
+    path.mkdir(parents=True, exist_ok=True)
+    (path / 'index.html').write_text(content)
+    (path / 'assets').mkdir(exist_ok=True)
+    (path / 'assets' / 'app.css').write_text('body {}')
+    return path
+
+
+def test_put_get(tmpdir):
+    cache = RenderCache(Path(str(tmpdir)) / 'cache', max_bytes=1024 ** 2)
+    site_dir = _make_site(Path(str(tmpdir)) / 'site', '<html></html>')
+
+    assert 'abc' not in cache
+    dest_dir = Path(str(tmpdir)) / 'dest'
+    assert cache.get('abc', dest_dir) is False
+
+    cache.put('abc', site_dir)
+    assert 'abc' in cache
+    assert cache.get('abc', dest_dir) is True
+    assert (dest_dir / 'index.html').read_text() == '<html></html>'
+    assert (dest_dir / 'assets' / 'app.css').read_text() == 'body {}'
+
+
+def test_lru_eviction(tmpdir):
+    tmpdir = Path(str(tmpdir))
+    # Each site is 1000 + 7 bytes; the cache fits two.
+    cache = RenderCache(tmpdir / 'cache', max_bytes=2100)
+    for i, key in enumerate(('a', 'b', 'c')):
+        cache.put(key, _make_site(tmpdir / key, str(i) * 1000))
+        # Make access times distinguishable.
+        os.utime(str(tmpdir / 'cache' / key), (i * 10, i * 10))
+        if key == 'b':
+            # Use "a" so that "b" becomes the least-recently used entry.
+            assert cache.get('a', tmpdir / 'dest')
+            os.utime(str(tmpdir / 'cache' / 'a'), (100, 100))
+
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+
+
+def test_compute_render_key():
+    exporter = create_report_exporter()
+    nb = nbformat.v4.new_notebook()
+    nb.cells.append(nbformat.v4.new_markdown_cell(source='# Title'))
+
+    # Notebooks that only differ in their JSON formatting have the same key.
+    reformatted_nb = nbformat.reads(
+        nbformat.writes(nb).replace('\n', '\n  '), as_version=4)
+    assert compute_render_key(nb, exporter) \
+        == compute_render_key(reformatted_nb, exporter)
+
+    other_nb = nbformat.v4.new_notebook()
+    other_nb.cells.append(nbformat.v4.new_markdown_cell(source='# Other'))
+    assert compute_render_key(nb, exporter) \
+        != compute_render_key(other_nb, exporter)
+
+    exporter.anchor_link_text = '¶'
+    assert compute_render_key(nb, exporter) \
+        != compute_render_key(reformatted_nb, create_report_exporter())
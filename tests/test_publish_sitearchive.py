@@ -0,0 +1,42 @@
+"""Tests for the `uservice_nbreport.publish.sitearchive` module.
+"""
+
+import io
+from pathlib import Path
+import tarfile
+
+import pytest
+
+from uservice_nbreport.publish.sitearchive import pack_site, unpack_site
+
+
+def test_pack_unpack_site(tmpdir):
+    site_dir = Path(str(tmpdir)) / 'site'
+    (site_dir / '_outputs').mkdir(parents=True)
+    (site_dir / 'index.html').write_bytes(b'<html></html>')
+    (site_dir / '_outputs' / 'cell1.png').write_bytes(b'\x89PNG' * 100)
+
+    archive = io.BytesIO()
+    pack_site(site_dir, archive)
+    archive.seek(0)
+
+    dest_dir = Path(str(tmpdir)) / 'dest'
+    nbytes = unpack_site(archive, dest_dir)
+    assert nbytes == 13 + 400
+    assert (dest_dir / 'index.html').read_bytes() == b'<html></html>'
+    assert (dest_dir / '_outputs' / 'cell1.png').read_bytes() \
+        == b'\x89PNG' * 100
+
+
+def test_unpack_site_outside_dir(tmpdir):
+    """Archives with paths outside the site directory are rejected."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as archive:
+        info = tarfile.TarInfo('../escape.html')
+        info.size = 4
+        archive.addfile(info, io.BytesIO(b'evil'))
+    buffer.seek(0)
+
+    with pytest.raises(ValueError):
+        unpack_site(buffer, Path(str(tmpdir)) / 'dest')
+    assert not (Path(str(tmpdir)) / 'escape.html').exists()
@@ -0,0 +1,224 @@
+"""Tests for the ``uservice_nbreport.publish.upload`` module.
+"""
+
+from pathlib import Path
+
+import boto3
+import pytest
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto < 5
+    from moto import mock_s3 as mock_aws
+
+from uservice_nbreport.publish.upload import (
+    build_manifest, read_manifest, upload_site)
+
+
+@pytest.fixture
+def s3():
+    """S3 client for a mocked S3 service with an ``lsst-the-docs`` bucket.
+    """
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1',
+                              aws_access_key_id='id',
+                              aws_secret_access_key='secret')
+        client.create_bucket(Bucket='lsst-the-docs')
+        yield client
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_upload_site(tmpdir, s3, max_workers):
+    site_dir = Path(str(tmpdir))
+    (site_dir / 'index.html').write_bytes(b'compressed')
+    (site_dir / '_outputs').mkdir()
+    (site_dir / '_outputs' / 'a.png').write_bytes(b'png')
+
+    result = upload_site(
+        site_dir,
+        bucket_name='lsst-the-docs',
+        bucket_root='testr-000/builds/1/',
+        aws_id='id',
+        aws_secret='secret',
+        surrogate_key='abc',
+        cache_control='max-age=31536000',
+        content_encodings={'index.html': 'gzip'},
+        max_workers=max_workers)
+
+    assert result == {'objects': 4, 'bytes': 13, 'copied': 0,
+                      'copied_bytes': 0}
+
+    keys = sorted(obj['Key'] for obj in
+                  s3.list_objects_v2(Bucket='lsst-the-docs')['Contents'])
+    assert keys == ['testr-000/builds/1',
+                    'testr-000/builds/1/.nbreport-manifest.json',
+                    'testr-000/builds/1/_outputs',
+                    'testr-000/builds/1/_outputs/a.png',
+                    'testr-000/builds/1/index.html']
+
+    obj = s3.get_object(Bucket='lsst-the-docs',
+                        Key='testr-000/builds/1/index.html')
+    assert obj['Body'].read() == b'compressed'
+    assert obj['Metadata'] == {'surrogate-key': 'abc'}
+    assert obj['CacheControl'] == 'max-age=31536000'
+    assert obj['ContentType'] == 'text/html'
+    assert obj['ContentEncoding'] == 'gzip'
+
+    obj = s3.get_object(Bucket='lsst-the-docs',
+                        Key='testr-000/builds/1/_outputs/a.png')
+    assert obj['ContentType'] == 'image/png'
+    assert 'ContentEncoding' not in obj
+
+    for key in ('testr-000/builds/1', 'testr-000/builds/1/_outputs'):
+        obj = s3.get_object(Bucket='lsst-the-docs', Key=key)
+        assert obj['Body'].read() == b''
+        assert obj['Metadata'] == {'surrogate-key': 'abc',
+                                   'dir-redirect': 'true'}
+        assert obj['CacheControl'] == 'max-age=31536000'
+
+
+def test_upload_site_multipart(tmpdir, s3):
+    """Files larger than the multipart threshold are uploaded in parts."""
+    site_dir = Path(str(tmpdir))
+    data = bytes(range(256)) * (12 * 1024 ** 2 // 256)
+    (site_dir / 'large.html').write_bytes(data)
+
+    upload_site(
+        site_dir,
+        bucket_name='lsst-the-docs',
+        bucket_root='testr-000/builds/1',
+        aws_id='id',
+        aws_secret='secret',
+        cache_control='max-age=31536000',
+        upload_dir_redirect_objects=False,
+        multipart_threshold=5 * 1024 ** 2)
+
+    obj = s3.get_object(Bucket='lsst-the-docs',
+                        Key='testr-000/builds/1/large.html')
+    assert obj['Body'].read() == data
+    # Multipart uploads have an ETag with the number of parts
+    assert obj['ETag'].strip('"').endswith('-3')
+    assert obj['CacheControl'] == 'max-age=31536000'
+
+
+def test_upload_site_incremental(tmpdir, s3):
+    """Unchanged files are copied from the previous build's objects."""
+    site_dir = Path(str(tmpdir)) / 'site1'
+    (site_dir / '_outputs').mkdir(parents=True)
+    (site_dir / 'index.html').write_bytes(b'<html>1</html>')
+    (site_dir / '_outputs' / 'a.png').write_bytes(b'png-a')
+    (site_dir / '_outputs' / 'b.png').write_bytes(b'png-b')
+    kwargs = {
+        'bucket_name': 'lsst-the-docs',
+        'aws_id': 'id',
+        'aws_secret': 'secret',
+        'cache_control': 'max-age=31536000',
+    }
+
+    result = upload_site(site_dir, bucket_root='testr-000/builds/1',
+                         surrogate_key='build1', **kwargs)
+    assert result == {'objects': 5, 'bytes': 24, 'copied': 0,
+                      'copied_bytes': 0}
+    manifest = read_manifest(s3, 'lsst-the-docs', 'testr-000/builds/1')
+    assert manifest == build_manifest(site_dir)
+
+    # The new build changes index.html and renames b.png
+    site_dir = Path(str(tmpdir)) / 'site2'
+    (site_dir / '_outputs').mkdir(parents=True)
+    (site_dir / 'index.html').write_bytes(b'<html>22</html>')
+    (site_dir / '_outputs' / 'a.png').write_bytes(b'png-a')
+    (site_dir / '_outputs' / 'c.png').write_bytes(b'png-b')
+
+    result = upload_site(site_dir, bucket_root='testr-000/builds/2',
+                         surrogate_key='build2',
+                         previous_root='testr-000/builds/1', **kwargs)
+    assert result == {'objects': 5, 'bytes': 15, 'copied': 2,
+                      'copied_bytes': 10}
+
+    obj = s3.get_object(Bucket='lsst-the-docs',
+                        Key='testr-000/builds/2/_outputs/c.png')
+    assert obj['Body'].read() == b'png-b'
+    # Copies have the new build's headers
+    assert obj['Metadata'] == {'surrogate-key': 'build2'}
+    assert obj['ContentType'] == 'image/png'
+    assert obj['CacheControl'] == 'max-age=31536000'
+    obj = s3.get_object(Bucket='lsst-the-docs',
+                        Key='testr-000/builds/2/index.html')
+    assert obj['Body'].read() == b'<html>22</html>'
+
+
+def test_upload_site_missing_previous(tmpdir, s3):
+    """Sites are uploaded in full if the previous build has no manifest."""
+    site_dir = Path(str(tmpdir))
+    (site_dir / 'index.html').write_bytes(b'<html></html>')
+
+    result = upload_site(site_dir,
+                         bucket_name='lsst-the-docs',
+                         bucket_root='testr-000/builds/2',
+                         aws_id='id',
+                         aws_secret='secret',
+                         previous_root='testr-000/builds/1')
+    assert result['copied'] == 0
+    assert result['bytes'] == 13
+
+
+def test_upload_site_progress(tmpdir, s3):
+    """The progress callback counts uploaded and copied objects."""
+    site_dir = Path(str(tmpdir)) / 'site1'
+    (site_dir / '_outputs').mkdir(parents=True)
+    (site_dir / 'index.html').write_bytes(b'<html>1</html>')
+    (site_dir / '_outputs' / 'a.png').write_bytes(b'png-a')
+    kwargs = {
+        'bucket_name': 'lsst-the-docs',
+        'aws_id': 'id',
+        'aws_secret': 'secret',
+    }
+    calls = []
+
+    upload_site(site_dir, bucket_root='testr-000/builds/1',
+                progress_callback=lambda *args: calls.append(args), **kwargs)
+    total = calls[0][1]
+    assert calls == [(done, total) for done in range(total + 1)]
+    assert total >= 3
+
+    # Copies count too
+    calls = []
+    site_dir = Path(str(tmpdir)) / 'site2'
+    (site_dir / '_outputs').mkdir(parents=True)
+    (site_dir / 'index.html').write_bytes(b'<html>2</html>')
+    (site_dir / '_outputs' / 'a.png').write_bytes(b'png-a')
+    upload_site(site_dir, bucket_root='testr-000/builds/2',
+                previous_root='testr-000/builds/1',
+                progress_callback=lambda *args: calls.append(args), **kwargs)
+    assert calls[-1] == (total, total)
+
+
+def test_upload_site_resume(tmpdir, s3):
+    """Files uploaded by an interrupted upload aren't uploaded again."""
+    site_dir = Path(str(tmpdir))
+    (site_dir / '_outputs').mkdir()
+    (site_dir / 'index.html').write_bytes(b'<html></html>')
+    (site_dir / '_outputs' / 'a.png').write_bytes(b'png-a')
+    kwargs = {
+        'bucket_name': 'lsst-the-docs',
+        'bucket_root': 'testr-000/builds/1',
+        'aws_id': 'id',
+        'aws_secret': 'secret',
+    }
+    uploaded = set()
+
+    upload_site(site_dir, object_callback=uploaded.add, **kwargs)
+    assert uploaded == {'index.html', '_outputs/a.png'}
+
+    (site_dir / 'index.html').write_bytes(b'<html>changed</html>')
+    calls = []
+    result = upload_site(site_dir, completed={'index.html'},
+                         progress_callback=lambda *args: calls.append(args),
+                         **kwargs)
+    assert result['bytes'] == 5
+    assert result['objects'] == 4
+    assert calls[0] == (1, 4)
+    assert calls[-1] == (4, 4)
+    obj = s3.get_object(Bucket='lsst-the-docs',
+                        Key='testr-000/builds/1/index.html')
+    assert obj['Body'].read() == b'<html></html>'
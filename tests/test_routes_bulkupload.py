@@ -0,0 +1,352 @@
+"""Tests for POST /bulk/notebooks and GET /queue/groups/<id>
+"""
+
+import io
+import json
+from unittest import mock
+
+import nbformat
+import pytest
+import responses
+from werkzeug.datastructures import MultiDict
+
+from uservice_nbreport import httpclient
+from uservice_nbreport.editionindex import EditionIndex
+from uservice_nbreport.tasks.pipeline import get_upload_task_id
+
+
+def add_auth_responses():
+    responses.add(
+        responses.GET,
+        'https://api.github.com/user',
+        status=200,
+        json={'login': 'testuser'}
+    )
+    responses.add(
+        responses.GET,
+        'https://api.github.com/user/orgs',
+        status=200,
+        json=[{'login': 'lsst'}]
+    )
+    responses.add(
+        responses.GET,
+        'https://keeper.lsst.codes/token',
+        status=200,
+        json={'token': 'ltdtoken'}
+    )
+
+
+def add_edition_responses(product, slug):
+    edition_url = 'https://keeper.lsst.codes/editions/{0}'.format(slug)
+    published_url = 'https://{0}.lsst.io/v/{1}'.format(product, slug)
+    responses.add(
+        responses.POST,
+        'https://keeper.lsst.codes/products/{0}/editions/'.format(product),
+        status=201,
+        json={},
+        headers={'Location': edition_url}
+    )
+    responses.add(
+        responses.GET,
+        edition_url,
+        status=200,
+        json={
+            'slug': slug,
+            'published_url': published_url,
+            'self_url': edition_url}
+    )
+
+
+def make_notebook(text):
+    nb = nbformat.v4.new_notebook()
+    nb.cells.append(nbformat.v4.new_markdown_cell(source=text))
+    return nb
+
+
+@responses.activate
+def test_bulk_upload_ndjson(client, github_auth_header, blob_store,
+                            redis_client, mocker):
+    add_auth_responses()
+    add_edition_responses('testr-001', '7')
+    mock_group = mocker.patch('uservice_nbreport.tasks.pipeline.group')
+
+    lines = [
+        {'report': 'testr-000', 'instance_id': '1',
+         'notebook': make_notebook('One')},
+        {'report': 'testr-000', 'instance_id': 2,
+         'notebook': make_notebook('Two')},
+        {'report': 'testr-001', 'notebook': make_notebook('Three')},
+    ]
+    body = '\n'.join(json.dumps(line) for line in lines) + '\n'
+
+    headers = dict(github_auth_header)
+    headers['Content-Type'] = 'application/x-ndjson'
+    response = client.post('/nbreport/bulk/notebooks', headers=headers,
+                           data=body)
+    assert response.status_code == 202
+    data = json.loads(response.data.decode('utf-8'))
+
+    # GitHub and LTD Keeper authentication run once
+    assert [call.request.url for call in responses.calls[:3]] == [
+        'https://api.github.com/user',
+        'https://api.github.com/user/orgs',
+        'https://keeper.lsst.codes/token']
+
+    publications = data['publications']
+    assert [(p['report'], p['instance_id']) for p in publications] \
+        == [('testr-000', '1'), ('testr-000', '2'), ('testr-001', '7')]
+    assert publications[2]['published_url'] \
+        == 'https://testr-001.lsst.io/v/7'
+    assert 'published_url' not in publications[0]
+    assert EditionIndex(redis_client).get('testr-001', '7') \
+        == 'https://keeper.lsst.codes/editions/7'
+
+    # One group of publication chains is queued, with staged notebooks
+    mock_group.return_value.apply_async.assert_called_once()
+    chains = mock_group.call_args[0][0]
+    assert len(chains) == 3
+    nb_ref = chains[0].tasks[0].args[0]
+    assert nbformat.reads(blob_store.get(nb_ref).decode('utf-8'),
+                          as_version=4).cells[0].source == 'One'
+    group_id = mock_group.return_value.apply_async.call_args[1]['group_id']
+    assert data['queue_url'].endswith('/queue/groups/' + group_id)
+
+
+@responses.activate
+def test_bulk_upload_multipart(client, github_auth_header, blob_store,
+                               mocker):
+    add_auth_responses()
+    add_edition_responses('testr-000', '3')
+    mock_group = mocker.patch('uservice_nbreport.tasks.pipeline.group')
+
+    files = MultiDict([
+        ('testr-000/1', (io.BytesIO(nbformat.writes(
+            make_notebook('One')).encode('utf-8')), 'one.ipynb')),
+        ('testr-000', (io.BytesIO(nbformat.writes(
+            make_notebook('New')).encode('utf-8')), 'new.ipynb')),
+    ])
+    response = client.post('/nbreport/bulk/notebooks',
+                           headers=github_auth_header,
+                           content_type='multipart/form-data',
+                           data=files)
+    assert response.status_code == 202
+    data = json.loads(response.data.decode('utf-8'))
+    assert [(p['report'], p['instance_id']) for p in data['publications']] \
+        == [('testr-000', '1'), ('testr-000', '3')]
+    assert len(mock_group.call_args[0][0]) == 2
+
+
+@responses.activate
+def test_bulk_upload_invalid(client, github_auth_header, blob_store,
+                             mocker):
+    """Invalid requests are rejected, and their staged notebooks are
+    deleted.
+    """
+    add_auth_responses()
+    mock_group = mocker.patch('uservice_nbreport.tasks.pipeline.group')
+    headers = dict(github_auth_header)
+
+    headers['Content-Type'] = 'application/json'
+    response = client.post('/nbreport/bulk/notebooks', headers=headers,
+                           data='{}')
+    assert response.status_code == 400
+
+    headers['Content-Type'] = 'application/x-ndjson'
+    body = json.dumps({'report': 'testr-000', 'instance_id': '1',
+                       'notebook': make_notebook('One')}) + '\n{"report": \n'
+    response = client.post('/nbreport/bulk/notebooks', headers=headers,
+                           data=body)
+    assert response.status_code == 400
+    assert 'Line 2' in json.loads(response.data.decode('utf-8'))['reason']
+
+    client.application.config['BULK_MAX_NOTEBOOKS'] = 1
+    body = '\n'.join(
+        json.dumps({'report': 'testr-000', 'instance_id': str(i),
+                    'notebook': make_notebook('One')})
+        for i in range(2))
+    response = client.post('/nbreport/bulk/notebooks', headers=headers,
+                           data=body)
+    assert response.status_code == 413
+
+    # Invalid notebooks are rejected before they're staged
+    client.application.config['BULK_MAX_NOTEBOOKS'] = 10
+    invalid_nb = make_notebook('Two')
+    invalid_nb.cells[0]['cell_type'] = 'bogus'
+    body = '\n'.join(
+        json.dumps({'report': 'testr-000', 'instance_id': str(i),
+                    'notebook': nb})
+        for i, nb in enumerate([make_notebook('One'), invalid_nb]))
+    response = client.post('/nbreport/bulk/notebooks', headers=headers,
+                           data=body)
+    assert response.status_code == 400
+    assert 'Line 2' in json.loads(response.data.decode('utf-8'))['reason']
+
+    files = MultiDict([
+        ('testr-000/1', (io.BytesIO(b'Not a notebook'), 'one.ipynb'))])
+    response = client.post('/nbreport/bulk/notebooks',
+                           headers=github_auth_header,
+                           content_type='multipart/form-data',
+                           data=files)
+    assert response.status_code == 400
+
+    mock_group.assert_not_called()
+    assert list(blob_store.root_dir.iterdir()) == []
+
+
+@responses.activate
+def test_bulk_upload_reserve_error(client, github_auth_header, blob_store,
+                                   redis_client, mocker):
+    """If an instance can't be reserved, the instances that were reserved
+    are deleted and nothing is published.
+    """
+    add_auth_responses()
+    add_edition_responses('testr-001', '7')
+    responses.add(
+        responses.POST,
+        'https://keeper.lsst.codes/products/testr-002/editions/',
+        status=500,
+        json={'message': 'Internal error'})
+    responses.add(
+        responses.DELETE,
+        'https://keeper.lsst.codes/editions/7',
+        status=200,
+        json={})
+    mock_group = mocker.patch('uservice_nbreport.tasks.pipeline.group')
+
+    headers = dict(github_auth_header)
+    headers['Content-Type'] = 'application/x-ndjson'
+    body = '\n'.join(
+        json.dumps({'report': report, 'notebook': make_notebook('One')})
+        for report in ('testr-001', 'testr-002'))
+    response = client.post('/nbreport/bulk/notebooks', headers=headers,
+                           data=body)
+    assert response.status_code == 502
+    data = json.loads(response.data.decode('utf-8'))
+    assert '1 of 2' in data['reason']
+    assert 'testr-002' in data['error_content']
+
+    deletes = [call.request.url for call in responses.calls
+               if call.request.method == 'DELETE']
+    assert deletes == ['https://keeper.lsst.codes/editions/7']
+    mock_group.assert_not_called()
+    assert list(blob_store.root_dir.iterdir()) == []
+
+
+@responses.activate
+def test_bulk_upload_queue_error(client, github_auth_header, blob_store,
+                                 redis_client, mocker):
+    """If the publications can't be queued, the staged notebooks and the
+    reserved instances are deleted.
+    """
+    add_auth_responses()
+    add_edition_responses('testr-001', '7')
+    responses.add(
+        responses.DELETE,
+        'https://keeper.lsst.codes/editions/7',
+        status=200,
+        json={})
+    mocker.patch(
+        'uservice_nbreport.routes.bulkupload.queue_publication_group',
+        side_effect=RuntimeError('Broker unavailable'))
+
+    headers = dict(github_auth_header)
+    headers['Content-Type'] = 'application/x-ndjson'
+    body = '\n'.join(
+        json.dumps(line) for line in (
+            {'report': 'testr-000', 'instance_id': '1',
+             'notebook': make_notebook('One')},
+            {'report': 'testr-001', 'notebook': make_notebook('Two')}))
+    with pytest.raises(RuntimeError):
+        client.post('/nbreport/bulk/notebooks', headers=headers, data=body)
+
+    deletes = [call.request.url for call in responses.calls
+               if call.request.method == 'DELETE']
+    assert deletes == ['https://keeper.lsst.codes/editions/7']
+    assert list(blob_store.root_dir.iterdir()) == []
+
+
+@responses.activate
+def test_bulk_upload_keeper_session(client, github_auth_header, blob_store,
+                                    redis_client, mocker):
+    """The LTD Keeper session of the reservation threads is configured by
+    the application.
+    """
+    add_auth_responses()
+    add_edition_responses('testr-001', '7')
+    mocker.patch('uservice_nbreport.tasks.pipeline.group')
+    # The LTD Keeper token is cached, so the reservations are the first
+    # LTD Keeper requests.
+    mock_token_cache = mocker.patch(
+        'uservice_nbreport.auth.get_keeper_token_cache')
+    mock_token_cache.return_value.get_token.return_value = 'ltdtoken'
+    mocker.patch.dict(httpclient._sessions, clear=True)
+    mocker.patch.object(httpclient, '_sessions_pid', None)
+    mocker.patch.dict(client.application.config,
+                      {'HTTP_READ_TIMEOUT': 5.})
+
+    headers = dict(github_auth_header)
+    headers['Content-Type'] = 'application/x-ndjson'
+    body = json.dumps({'report': 'testr-001',
+                       'notebook': make_notebook('One')})
+    response = client.post('/nbreport/bulk/notebooks', headers=headers,
+                           data=body)
+    assert response.status_code == 202
+    assert httpclient._sessions['keeper'].timeout == (10., 5.)
+
+
+@responses.activate
+def test_get_queue_group(client, github_auth_header, blob_store, mocker):
+    add_auth_responses()
+    mock_group = mocker.patch('uservice_nbreport.tasks.pipeline.group')
+    headers = dict(github_auth_header)
+    headers['Content-Type'] = 'application/x-ndjson'
+    body = '\n'.join(
+        json.dumps({'report': 'testr-000', 'instance_id': str(i),
+                    'notebook': make_notebook('One')})
+        for i in range(3))
+    response = client.post('/nbreport/bulk/notebooks', headers=headers,
+                           data=body)
+    data = json.loads(response.data.decode('utf-8'))
+    group_url = data['queue_url']
+    chains = mock_group.call_args[0][0]
+    publication_ids = [c.tasks[0].options['task_id'] for c in chains]
+
+    states = {}
+
+    def make_async_result(task_id):
+        task = mock.Mock()
+        task.state = states.get(task_id, 'PENDING')
+        task.successful.return_value = task.state == 'SUCCESS'
+        task.result = {'site': {}}
+        return task
+
+    mocker.patch('uservice_nbreport.tasks.pipeline.celery_app.AsyncResult',
+                 side_effect=make_async_result)
+
+    response = client.get(group_url)
+    assert response.status_code == 200
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['status'] == 'PENDING'
+    assert data['counts'] == {'PENDING': 3}
+    assert [p['publication_id'] for p in data['publications']] \
+        == publication_ids
+    assert data['publications'][0]['queue_url'].endswith(
+        '/queue/' + publication_ids[0])
+
+    states[publication_ids[0]] = 'SUCCESS'
+    states[get_upload_task_id(publication_ids[0])] = 'SUCCESS'
+    data = json.loads(client.get(group_url).data.decode('utf-8'))
+    assert data['status'] == 'STARTED'
+    assert data['counts'] == {'SUCCESS': 1, 'PENDING': 2}
+
+    for publication_id in publication_ids[1:]:
+        states[publication_id] = 'SUCCESS'
+        states[get_upload_task_id(publication_id)] = 'SUCCESS'
+    data = json.loads(client.get(group_url).data.decode('utf-8'))
+    assert data['status'] == 'SUCCESS'
+
+    states[get_upload_task_id(publication_ids[2])] = 'FAILURE'
+    data = json.loads(client.get(group_url).data.decode('utf-8'))
+    assert data['status'] == 'FAILURE'
+
+    assert client.get('/nbreport/queue/groups/unknown').status_code == 404
@@ -0,0 +1,263 @@
+"""Tests for GET /queue/<id>
+"""
+
+import json
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from uservice_nbreport.progress import publish_event
+from uservice_nbreport.publicationindex import PublicationIndex
+from uservice_nbreport.tasks.pipeline import get_upload_task_id
+
+
+def test_get_queue_item(client, mocker):
+    timings = {
+        'stages': [{'name': 'parse', 'wall': 0.1, 'cpu': 0.1, 'bytes': 10}],
+        'wall': 0.1,
+        'cpu': 0.1,
+    }
+    mock_async_result = mocker.patch(
+        'uservice_nbreport.tasks.pipeline.celery_app.AsyncResult')
+    mock_async_result.return_value.state = 'SUCCESS'
+    mock_async_result.return_value.successful.return_value = True
+    mock_async_result.return_value.result = {'timings': timings}
+
+    response = client.get('/nbreport/queue/12345')
+    assert response.status_code == 200
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['status'] == 'SUCCESS'
+    assert data['stage'] == 'publish'
+    assert 'timings' not in data
+
+    response = client.get('/nbreport/queue/12345?timings=true')
+    assert json.loads(response.data.decode('utf-8'))['timings'] == timings
+
+    mock_async_result.return_value.state = 'STARTED'
+    mock_async_result.return_value.successful.return_value = False
+    response = client.get('/nbreport/queue/12345?timings=true')
+    assert json.loads(response.data.decode('utf-8'))['timings'] is None
+
+
+def make_async_result(state, result=None):
+    task = mock.Mock()
+    task.state = state
+    task.successful.return_value = state == 'SUCCESS'
+    task.result = result
+    task.info = result
+    return task
+
+
+@pytest.mark.parametrize(
+    'render_state,upload_state,status,stage',
+    [('PENDING', 'PENDING', 'PENDING', 'render'),
+     ('STARTED', 'PENDING', 'STARTED', 'render'),
+     ('FAILURE', 'PENDING', 'FAILURE', 'render'),
+     ('SUCCESS', 'PENDING', 'STARTED', 'upload'),
+     ('SUCCESS', 'STARTED', 'STARTED', 'upload'),
+     ('SUCCESS', 'RETRY', 'RETRY', 'upload'),
+     ('SUCCESS', 'FAILURE', 'FAILURE', 'upload'),
+     ('SUCCESS', 'SUCCESS', 'SUCCESS', 'upload')])
+def test_get_queue_item_chain(client, mocker, render_state, upload_state,
+                              status, stage):
+    """The status of a publication combines its render and upload tasks."""
+    render_timings = {'stages': [], 'wall': 1., 'cpu': 1.}
+    timings = {'stages': [], 'wall': 2., 'cpu': 1.5}
+    tasks = {
+        '12345': make_async_result(
+            render_state, {'site': '', 'timings': render_timings}),
+        get_upload_task_id('12345'): make_async_result(
+            upload_state, {'timings': timings}),
+    }
+    mocker.patch(
+        'uservice_nbreport.tasks.pipeline.celery_app.AsyncResult',
+        side_effect=lambda task_id: tasks[task_id])
+
+    response = client.get('/nbreport/queue/12345?timings=true')
+    assert response.status_code == 200
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['status'] == status
+    assert data['stage'] == stage
+    if status == 'SUCCESS':
+        assert data['timings'] == timings
+    else:
+        assert data['timings'] is None
+
+
+@pytest.mark.parametrize(
+    'render_state,upload_state,status',
+    [('PENDING', 'PENDING', 'SUPERSEDED'),
+     ('STARTED', 'PENDING', 'SUPERSEDED'),
+     ('SUPERSEDED', 'PENDING', 'SUPERSEDED'),
+     ('SUCCESS', 'SUPERSEDED', 'SUPERSEDED'),
+     ('SUCCESS', 'SUCCESS', 'SUCCESS'),
+     ('FAILURE', 'PENDING', 'FAILURE')])
+def test_get_queue_item_superseded(client, redis_client, mocker,
+                                   render_state, upload_state, status):
+    """Unfinished publications that were superseded are reported as
+    SUPERSEDED.
+    """
+    tasks = {
+        '12345': make_async_result(render_state, {'site': {}}),
+        get_upload_task_id('12345'): make_async_result(upload_state, {}),
+    }
+    mocker.patch(
+        'uservice_nbreport.tasks.pipeline.celery_app.AsyncResult',
+        side_effect=lambda task_id: tasks[task_id])
+    index = PublicationIndex(redis_client)
+    index.supersede('testr-000', '1', '12345')
+    index.supersede('testr-000', '1', '12346')
+
+    response = client.get('/nbreport/queue/12345')
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['status'] == status
+
+
+def test_get_queue_item_progress(client, mocker):
+    """The latest progress of the running task is reported."""
+    progress = {'stage': 'upload', 'done': 2, 'total': 5}
+    tasks = {
+        '12345': make_async_result('SUCCESS', {'site': {}}),
+        get_upload_task_id('12345'): make_async_result('PROGRESS', progress),
+    }
+    mocker.patch(
+        'uservice_nbreport.tasks.pipeline.celery_app.AsyncResult',
+        side_effect=lambda task_id: tasks[task_id])
+
+    data = json.loads(client.get('/nbreport/queue/12345').data.decode('utf-8'))
+    assert data['status'] == 'STARTED'
+    assert data['stage'] == 'upload'
+    assert data['progress'] == progress
+
+    tasks['12345'] = make_async_result('PROGRESS', {'stage': 'render'})
+    data = json.loads(client.get('/nbreport/queue/12345').data.decode('utf-8'))
+    assert data['status'] == 'STARTED'
+    assert data['stage'] == 'render'
+    assert data['progress'] == {'stage': 'render'}
+
+
+def update_later(redis_client, tasks, updates, delay=0.1):
+    """Update the mocked tasks and publish events from another thread."""
+    def run():
+        for task_id, task, event in updates:
+            time.sleep(delay)
+            tasks[task_id] = task
+            publish_event(redis_client, '12345', event)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_get_queue_item_wait(client, redis_client, mocker):
+    tasks = {
+        '12345': make_async_result('STARTED'),
+        get_upload_task_id('12345'): make_async_result('PENDING'),
+    }
+    mocker.patch(
+        'uservice_nbreport.tasks.pipeline.celery_app.AsyncResult',
+        side_effect=lambda task_id: tasks[task_id])
+
+    thread = update_later(redis_client, tasks, [
+        ('12345', make_async_result('PROGRESS', {'stage': 'compress'}),
+         {'event': 'progress', 'progress': {'stage': 'compress'}})])
+    response = client.get('/nbreport/queue/12345?wait=10')
+    thread.join()
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['progress'] == {'stage': 'compress'}
+
+    # The wait is capped by QUEUE_MAX_WAIT
+    client.application.config['QUEUE_MAX_WAIT'] = 0.1
+    start = time.monotonic()
+    response = client.get('/nbreport/queue/12345?wait=10')
+    assert time.monotonic() - start < 5
+    assert json.loads(response.data.decode('utf-8'))['status'] == 'STARTED'
+
+    assert client.get('/nbreport/queue/12345?wait=x').status_code == 400
+
+
+def test_get_queue_item_events(client, redis_client, mocker):
+    tasks = {
+        '12345': make_async_result('STARTED'),
+        get_upload_task_id('12345'): make_async_result('PENDING'),
+    }
+    mocker.patch(
+        'uservice_nbreport.tasks.pipeline.celery_app.AsyncResult',
+        side_effect=lambda task_id: tasks[task_id])
+    client.application.config['QUEUE_EVENTS_ENABLED'] = True
+    client.application.config['QUEUE_EVENTS_HEARTBEAT'] = 0.5
+    upload_id = get_upload_task_id('12345')
+    thread = update_later(redis_client, tasks, [
+        ('12345', make_async_result('SUCCESS', {'site': {}}),
+         {'event': 'state', 'state': 'SUCCESS'}),
+        (upload_id, make_async_result('PROGRESS', {'stage': 'upload'}),
+         {'event': 'progress', 'progress': {'stage': 'upload'}}),
+        (upload_id, make_async_result('SUCCESS', {}),
+         {'event': 'state', 'state': 'SUCCESS'})])
+
+    response = client.get('/nbreport/queue/12345/events')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    # The stream is read as it's generated
+    body = response.data.decode('utf-8')
+    response.close()
+    thread.join()
+    events = [json.loads(line[len('data: '):])
+              for line in body.splitlines() if line.startswith('data: ')]
+    assert [(e['status'], e['stage']) for e in events] == [
+        ('STARTED', 'render'),
+        ('STARTED', 'upload'),
+        ('STARTED', 'upload'),
+        ('SUCCESS', 'upload')]
+    assert events[2]['progress'] == {'stage': 'upload'}
+
+    # The stream ends after QUEUE_EVENTS_MAX_DURATION
+    tasks['12345'] = make_async_result('STARTED')
+    client.application.config['QUEUE_EVENTS_MAX_DURATION'] = 0.2
+    client.application.config['QUEUE_EVENTS_HEARTBEAT'] = 0.05
+    response = client.get('/nbreport/queue/12345/events')
+    body = response.data.decode('utf-8')
+    assert body.startswith('event: status\n')
+    assert ': heartbeat' in body
+
+
+def test_get_queue_item_events_disabled(client, mocker):
+    mocker.patch(
+        'uservice_nbreport.tasks.pipeline.celery_app.AsyncResult',
+        return_value=make_async_result('STARTED'))
+    assert client.application.config['QUEUE_EVENTS_ENABLED'] is False
+    response = client.get('/nbreport/queue/12345/events')
+    assert response.status_code == 404
+
+
+def test_get_queue_item_max_waiters(client, redis_client, mocker):
+    """Requests over QUEUE_MAX_WAITERS don't wait, so that they don't hold
+    all of the app's threads.
+    """
+    mocker.patch(
+        'uservice_nbreport.tasks.pipeline.celery_app.AsyncResult',
+        return_value=make_async_result('STARTED'))
+    client.application.config['QUEUE_EVENTS_ENABLED'] = True
+    client.application.config['QUEUE_EVENTS_MAX_DURATION'] = 0.2
+    client.application.config['QUEUE_EVENTS_HEARTBEAT'] = 0.05
+
+    # Hold the only waiter of the app with a stream
+    stream = client.get('/nbreport/queue/12345/events', buffered=False)
+    assert stream.status_code == 200
+
+    start = time.monotonic()
+    response = client.get('/nbreport/queue/12345?wait=10')
+    assert time.monotonic() - start < 5
+    assert json.loads(response.data.decode('utf-8'))['status'] == 'STARTED'
+
+    response = client.get('/nbreport/queue/12345/events')
+    assert response.status_code == 503
+
+    # The waiter is released when the stream is closed, even if it wasn't
+    # read
+    stream.close()
+    response = client.get('/nbreport/queue/12345/events')
+    assert response.status_code == 200
+    assert ': heartbeat' in response.data.decode('utf-8')
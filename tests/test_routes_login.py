@@ -112,3 +112,36 @@ def test_failed_authorization(client, github_auth_header):
         # Authentication data exists, still
         assert g.github_user == TEST_USER
         assert g.github_token == TEST_TOKEN
+
+
+@responses.activate
+def test_login_cached(client, github_auth_header):
+    """Repeated log ins reuse the cached GitHub authentication and
+    membership.
+    """
+    responses.add(
+        responses.GET,
+        'https://api.github.com/user',
+        status=200,
+        json={
+            'login': 'testuser'
+        }
+    )
+    responses.add(
+        responses.GET,
+        'https://api.github.com/user/orgs',
+        status=200,
+        json=[
+            {
+                'login': 'lsst'
+            }
+        ]
+    )
+
+    for _ in range(3):
+        response = client.post(
+            '/nbreport/login',
+            headers=github_auth_header
+        )
+        assert response.status_code == 200
+    assert len(responses.calls) == 2
@@ -8,7 +8,7 @@ from werkzeug.http import parse_authorization_header
 
 
 @responses.activate
-def test_reserve_instance(client, github_auth_header):
+def test_reserve_instance(client, github_auth_header, redis_client):
     responses.add(
         responses.GET,
         'https://api.github.com/user',
@@ -76,3 +76,7 @@ def test_reserve_instance(client, github_auth_header):
         assert auth is not None
         assert auth.username == 'ltdtoken'
         assert auth.password == ''
+
+    # The new edition is indexed by its slug
+    assert redis_client.hget('nbreport:editions:testr-000', '1') \
+        == 'https://keeper.lsst.codes/editions/1'
@@ -1,12 +1,13 @@
 """Tests for POST /reports/<report>/instance/<id>/notebook
 """
 
+import pytest
 import responses
 import nbformat
 
 
 @responses.activate
-def test_upload_instance(client, github_auth_header, mocker):
+def test_upload_instance(client, github_auth_header, blob_store, mocker):
     responses.add(
         responses.GET,
         'https://api.github.com/user',
@@ -32,8 +33,9 @@ def test_upload_instance(client, github_auth_header, mocker):
         json={'token': 'ltdtoken'}
     )
 
-    mock_task = mocker.patch(
-        'uservice_nbreport.routes.uploadnb.publish_instance')
+    mock_queue = mocker.patch(
+        'uservice_nbreport.routes.uploadnb.queue_publication')
+    mock_queue.return_value = '12345'
     mock_url_for = mocker.patch(
         'uservice_nbreport.routes.uploadnb.url_for')
     mock_url_for.return_value = 'https://example.com/12345'
@@ -55,5 +57,113 @@ def test_upload_instance(client, github_auth_header, mocker):
         )
         assert response.status_code == 202
 
-        mock_task.apply_async.assert_called_once()
-        mock_url_for.assert_called_once()
+        # Only a reference to the notebook, staged in the blob store, is
+        # queued.
+        mock_queue.assert_called_once()
+        nb_ref, report, instance_id = mock_queue.call_args[0]
+        assert (report, instance_id) == ('testr-000', '1')
+        assert blob_store.get(nb_ref) == nb_data.encode('utf-8')
+        mock_url_for.assert_called_once_with(
+            'api.get_queue_item', id='12345', _external=True)
+
+
+@responses.activate
+def test_upload_instance_callback(client, github_auth_header, blob_store,
+                                  mocker):
+    responses.add(
+        responses.GET,
+        'https://api.github.com/user',
+        status=200,
+        json={'login': 'testuser'}
+    )
+    responses.add(
+        responses.GET,
+        'https://api.github.com/user/orgs',
+        status=200,
+        json=[{'login': 'lsst'}]
+    )
+    responses.add(
+        responses.GET,
+        'https://keeper.lsst.codes/token',
+        status=200,
+        json={'token': 'ltdtoken'}
+    )
+    mock_queue = mocker.patch(
+        'uservice_nbreport.routes.uploadnb.queue_publication')
+    mock_queue.return_value = '12345'
+    mock_getaddrinfo = mocker.patch(
+        'uservice_nbreport.tasks.callbacks.socket.getaddrinfo',
+        return_value=[(None, None, None, '', ('93.184.216.34', 443))])
+
+    nb_data = nbformat.writes(nbformat.v4.new_notebook(), version=4)
+    headers = dict(github_auth_header)
+    headers['Content-Type'] = 'application/x-ipynb+json'
+    headers['X-Callback-Secret'] = 's3cret'
+    response = client.post(
+        '/nbreport/reports/testr-000/instances/1/notebook'
+        '?callback_url=https://ci.example.com/hook',
+        headers=headers,
+        data=nb_data
+    )
+    assert response.status_code == 202
+    assert mock_queue.call_args[1]['callback'] == {
+        'url': 'https://ci.example.com/hook', 'secret': 's3cret'}
+
+    response = client.post(
+        '/nbreport/reports/testr-000/instances/1/notebook'
+        '?callback_url=file:///etc/passwd',
+        headers=headers,
+        data=nb_data
+    )
+    assert response.status_code == 400
+
+    # Hosts with internal addresses are rejected
+    mock_getaddrinfo.return_value = [
+        (None, None, None, '', ('169.254.169.254', 80))]
+    response = client.post(
+        '/nbreport/reports/testr-000/instances/1/notebook'
+        '?callback_url=http://metadata.example.com/latest',
+        headers=headers,
+        data=nb_data
+    )
+    assert response.status_code == 400
+    mock_queue.assert_called_once()
+
+
+@responses.activate
+def test_upload_instance_queue_error(client, github_auth_header, blob_store,
+                                     mocker):
+    """If the publication can't be queued, the staged notebook is deleted.
+    """
+    responses.add(
+        responses.GET,
+        'https://api.github.com/user',
+        status=200,
+        json={'login': 'testuser'}
+    )
+    responses.add(
+        responses.GET,
+        'https://api.github.com/user/orgs',
+        status=200,
+        json=[{'login': 'lsst'}]
+    )
+    responses.add(
+        responses.GET,
+        'https://keeper.lsst.codes/token',
+        status=200,
+        json={'token': 'ltdtoken'}
+    )
+    mocker.patch(
+        'uservice_nbreport.routes.uploadnb.queue_publication',
+        side_effect=RuntimeError('Broker unavailable'))
+
+    nb_data = nbformat.writes(nbformat.v4.new_notebook(), version=4)
+    headers = dict(github_auth_header)
+    headers['Content-Type'] = 'application/x-ipynb+json'
+    with pytest.raises(RuntimeError):
+        client.post(
+            '/nbreport/reports/testr-000/instances/1/notebook',
+            headers=headers,
+            data=nb_data
+        )
+    assert list(blob_store.root_dir.iterdir()) == []
@@ -0,0 +1,236 @@
+"""Tests for the `uservice_nbreport.tasks.callbacks` module.
+"""
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import threading
+
+from celery.exceptions import Retry
+import pytest
+
+from uservice_nbreport import flask_app
+from uservice_nbreport.publicationindex import PublicationIndex
+from uservice_nbreport.tasks.callbacks import (
+    SIGNATURE_HEADER, check_callback_url, deliver_callback,
+    queue_completion_callback, sign_payload)
+from uservice_nbreport.tasks.publishnb import render_instance, upload_instance
+
+
+@pytest.fixture
+def callback_server(client, mocker):
+    """Local HTTP server that records the callback requests it receives,
+    and responds with the status codes in its ``statuses`` list (``200``
+    once the list is empty).
+
+    The server's host is added to the ``CALLBACK_ALLOWED_HOSTS`` of the
+    tasks' app.
+    """
+    mocker.patch.dict(flask_app.config,
+                      {'CALLBACK_ALLOWED_HOSTS': ['127.0.0.1']})
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            server.requests.append({'path': self.path,
+                                    'headers': dict(self.headers),
+                                    'body': body})
+            status = server.statuses.pop(0) if server.statuses else 200
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = []
+    server.statuses = []
+    server.url = 'http://127.0.0.1:{0:d}/hook'.format(server.server_port)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_deliver_callback(client, callback_server):
+    payload = {'publication_id': 'pub-1', 'status': 'SUCCESS'}
+
+    result = deliver_callback(callback_server.url, payload, 's3cret')
+    assert result == {'delivered': True, 'attempts': 1, 'status_code': 200}
+
+    request = callback_server.requests[0]
+    assert request['path'] == '/hook'
+    assert json.loads(request['body'].decode('utf-8')) == payload
+    assert request['headers']['Content-Type'] == 'application/json'
+    assert request['headers'][SIGNATURE_HEADER] \
+        == sign_payload(request['body'], 's3cret')
+
+    # Requests without a secret aren't signed
+    deliver_callback(callback_server.url, payload)
+    assert SIGNATURE_HEADER not in callback_server.requests[1]['headers']
+
+
+def test_deliver_callback_retry(client, callback_server, mocker):
+    mock_delay = mocker.patch(
+        'uservice_nbreport.tasks.callbacks.get_backoff_delay',
+        return_value=5)
+    mock_retry = mocker.patch.object(deliver_callback, 'retry',
+                                     side_effect=Retry)
+    max_retries = client.application.config['CALLBACK_MAX_RETRIES']
+
+    for status in (503, 429):
+        callback_server.statuses.append(status)
+        with pytest.raises(Retry):
+            deliver_callback(callback_server.url, {})
+    mock_retry.assert_called_with(countdown=5, max_retries=None)
+    assert mock_delay.call_args[0] == (0,)
+
+    # Errors other than timeouts and rate limits aren't retried
+    callback_server.statuses.append(404)
+    result = deliver_callback(callback_server.url, {})
+    assert result == {'delivered': False, 'attempts': 1, 'status_code': 404}
+    assert mock_retry.call_count == 2
+
+    # The delivery is given up after the last retry
+    callback_server.statuses.append(500)
+    deliver_callback.push_request(retries=max_retries)
+    try:
+        result = deliver_callback(callback_server.url, {})
+    finally:
+        deliver_callback.pop_request()
+    assert result == {'delivered': False, 'attempts': max_retries + 1,
+                      'status_code': 500}
+    assert mock_retry.call_count == 2
+
+
+def test_deliver_callback_connection_error(client, callback_server, mocker):
+    mocker.patch.object(deliver_callback, 'retry', side_effect=Retry)
+    url = callback_server.url
+    callback_server.shutdown()
+    callback_server.server_close()
+    with pytest.raises(Retry):
+        deliver_callback(url, {})
+
+
+def mock_getaddrinfo(mocker, address):
+    return mocker.patch(
+        'uservice_nbreport.tasks.callbacks.socket.getaddrinfo',
+        return_value=[(None, None, None, '', (address, 443))])
+
+
+@pytest.mark.parametrize('address,allowed', [
+    ('93.184.216.34', True),
+    ('2606:2800:220:1::', True),
+    ('127.0.0.1', False),
+    ('10.0.0.5', False),
+    ('192.168.1.1', False),
+    ('169.254.169.254', False),
+    ('::1', False),
+    ('fe80::1%eth0', False),
+    ('::ffff:127.0.0.1', False),
+])
+def test_check_callback_url(mocker, address, allowed):
+    mock_getaddrinfo(mocker, address)
+    if allowed:
+        check_callback_url('https://ci.example.com/hook')
+    else:
+        with pytest.raises(ValueError):
+            check_callback_url('https://ci.example.com/hook')
+
+
+def test_check_callback_url_allowed_hosts(mocker):
+    mock = mock_getaddrinfo(mocker, '10.0.0.5')
+    allowed_hosts = ['ci.internal', '.example.com']
+    check_callback_url('http://ci.internal:8080/hook', allowed_hosts)
+    check_callback_url('https://ci.example.com/hook', allowed_hosts)
+    mock.assert_not_called()
+    for url in ('https://example.com.evil.org/hook',
+                'https://metadata.google.internal/',
+                'ftp://ci.example.com/hook'):
+        with pytest.raises(ValueError):
+            check_callback_url(url, allowed_hosts)
+
+
+def test_deliver_callback_not_allowed(client, callback_server, mocker):
+    mock_retry = mocker.patch.object(deliver_callback, 'retry',
+                                     side_effect=Retry)
+    mocker.patch.dict(flask_app.config, {'CALLBACK_ALLOWED_HOSTS': []})
+    result = deliver_callback(callback_server.url, {})
+    assert result == {'delivered': False, 'attempts': 1,
+                      'status_code': None}
+    assert callback_server.requests == []
+    mock_retry.assert_not_called()
+
+
+def test_queue_completion_callback(redis_client, mocker):
+    mock_deliver = mocker.patch(
+        'uservice_nbreport.tasks.callbacks.deliver_callback')
+    index = PublicationIndex(redis_client)
+    callback = {'url': 'https://ci.example.com/hook', 'secret': 's3cret',
+                'ltd_product': 'testr-000', 'instance_id': '1'}
+    index.set_callback('pub-1', callback)
+    render_result = {'publication_id': 'pub-1'}
+
+    # The publication isn't finished when its render task succeeds
+    queue_completion_callback(sender=render_instance, task_id='pub-1',
+                              args=({}, 'testr-000', '1'),
+                              retval=render_result, state='SUCCESS')
+    mock_deliver.apply_async.assert_not_called()
+
+    timings = {'stages': [], 'wall': 1., 'cpu': 1.}
+    retval = {'upload': {'published_url': 'https://testr-000.lsst.io/v/1'},
+              'timings': timings}
+    queue_completion_callback(sender=upload_instance, task_id='upload-1',
+                              args=(render_result,), retval=retval,
+                              state='SUCCESS')
+    mock_deliver.apply_async.assert_called_once_with((
+        'https://ci.example.com/hook',
+        {'publication_id': 'pub-1',
+         'ltd_product': 'testr-000',
+         'instance_id': '1',
+         'status': 'SUCCESS',
+         'published_url': 'https://testr-000.lsst.io/v/1',
+         'timings': timings,
+         'error': None},
+        's3cret'))
+
+    # Callbacks are delivered once
+    queue_completion_callback(sender=upload_instance, task_id='upload-1',
+                              args=(render_result,), retval=retval,
+                              state='SUCCESS')
+    assert mock_deliver.apply_async.call_count == 1
+
+
+def test_queue_completion_callback_failure(redis_client, mocker):
+    mock_deliver = mocker.patch(
+        'uservice_nbreport.tasks.callbacks.deliver_callback')
+    index = PublicationIndex(redis_client)
+    for publication_id in ('pub-1', 'pub-2'):
+        index.set_callback(publication_id,
+                           {'url': 'https://ci.example.com/hook',
+                            'secret': None, 'ltd_product': 'testr-000',
+                            'instance_id': '1'})
+
+    queue_completion_callback(sender=render_instance, task_id='pub-1',
+                              args=({}, 'testr-000', '1'),
+                              retval=ValueError('Bad notebook'),
+                              state='FAILURE')
+    payload = mock_deliver.apply_async.call_args[0][0][1]
+    assert payload['status'] == 'FAILURE'
+    assert payload['error'] == 'ValueError: Bad notebook'
+
+    queue_completion_callback(sender=render_instance, task_id='pub-2',
+                              args=({}, 'testr-000', '1'), retval=None,
+                              state='IGNORED')
+    payload = mock_deliver.apply_async.call_args[0][0][1]
+    assert payload['status'] == 'SUPERSEDED'
+
+    # Errors don't propagate to the publish tasks
+    index.set_callback('pub-3', {'url': 'https://ci.example.com/hook'})
+    queue_completion_callback(sender=render_instance, task_id='pub-3',
+                              args=({}, 'testr-000', '1'), retval=None,
+                              state='FAILURE')
+    assert mock_deliver.apply_async.call_count == 2
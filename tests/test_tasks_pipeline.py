@@ -0,0 +1,85 @@
+"""Tests for the `uservice_nbreport.tasks.pipeline` module.
+"""
+
+from uservice_nbreport.publicationindex import PublicationIndex
+from uservice_nbreport.tasks.pipeline import (
+    get_upload_task_id, queue_publication)
+
+
+def test_get_upload_task_id():
+    assert get_upload_task_id('12345') == get_upload_task_id('12345')
+    assert get_upload_task_id('12345') != get_upload_task_id('12346')
+    assert get_upload_task_id('12345') != '12345'
+
+
+def test_queue_publication(client, mocker):
+    """A publication is a render task chained to an upload task with a
+    derived ID, routed to their own queues.
+    """
+    mock_chain = mocker.patch('uservice_nbreport.tasks.pipeline.chain')
+
+    nb_ref = {'key': 'abc-123.gz', 'sha256': 'abc', 'size': 2,
+              'stored_size': 22}
+    with client.application.app_context():
+        publication_id = queue_publication(nb_ref, 'testr-000', '1')
+
+    mock_chain.return_value.apply_async.assert_called_once_with()
+    render_sig, upload_sig = mock_chain.call_args[0]
+    assert render_sig.task == \
+        'uservice_nbreport.tasks.publishnb.render_instance'
+    assert tuple(render_sig.args) == (nb_ref, 'testr-000', '1')
+    assert render_sig.options['task_id'] == publication_id
+    assert upload_sig.task == \
+        'uservice_nbreport.tasks.publishnb.upload_instance'
+    assert upload_sig.options['task_id'] == get_upload_task_id(publication_id)
+
+    from uservice_nbreport.celery import celery_app
+    router = celery_app.amqp.router
+    config = client.application.config
+    assert router.route({}, render_sig.task)['queue'].name \
+        == config['RENDER_QUEUE']
+    assert router.route({}, upload_sig.task)['queue'].name \
+        == config['UPLOAD_QUEUE']
+    assert router.route(
+        {}, 'uservice_nbreport.tasks.callbacks.deliver_callback'
+    )['queue'].name == config['CALLBACK_QUEUE']
+
+
+def test_queue_publication_supersedes(client, redis_client, mocker):
+    """A new publication of an instance supersedes the previous one."""
+    mocker.patch('uservice_nbreport.tasks.pipeline.chain')
+    index = PublicationIndex(redis_client)
+    client.application.config['COALESCE_PUBLICATIONS'] = True
+
+    with client.application.app_context():
+        first_id = queue_publication({}, 'testr-000', '1')
+        other_id = queue_publication({}, 'testr-000', '2')
+        second_id = queue_publication({}, 'testr-000', '1')
+
+    assert index.is_superseded(first_id)
+    assert not index.is_superseded(other_id)
+    assert not index.is_superseded(second_id)
+
+    # Publications aren't coalesced by default
+    client.application.config['COALESCE_PUBLICATIONS'] = False
+    with client.application.app_context():
+        third_id = queue_publication({}, 'testr-000', '1')
+    assert not index.is_superseded(second_id)
+    assert not index.is_superseded(third_id)
+
+
+def test_queue_publication_callback(client, redis_client, mocker):
+    """The callback of a publication is recorded for its last task."""
+    mocker.patch('uservice_nbreport.tasks.pipeline.chain')
+    index = PublicationIndex(redis_client)
+
+    with client.application.app_context():
+        publication_id = queue_publication(
+            {}, 'testr-000', '1',
+            callback={'url': 'https://ci.example.com/hook'})
+
+    assert index.pop_callback(publication_id) == {
+        'url': 'https://ci.example.com/hook',
+        'secret': None,
+        'ltd_product': 'testr-000',
+        'instance_id': '1'}
@@ -1,9 +1,25 @@
 """Tests for the `uservice_nbreport.tasks.publishnb` module.
 """
 
+import io
+from pathlib import Path
+import tarfile
+
+from boto3.exceptions import S3UploadFailedError
+from celery.exceptions import Ignore, Retry
+import nbformat
+import pytest
+import requests
 import responses
 
-from uservice_nbreport.tasks.publishnb import get_edition_url
+from uservice_nbreport import flask_app
+from uservice_nbreport.checkpoints import StageCheckpoints
+from uservice_nbreport.progress import subscribe, wait_for_event
+from uservice_nbreport.publicationindex import PublicationIndex
+from uservice_nbreport.publish.rendercache import RenderCache
+from uservice_nbreport.tasks.publishnb import (
+    get_edition_url, get_exporter, publish_instance, publish_task_state,
+    render_instance, run_publish_instance, upload_instance)
 
 
 @responses.activate
@@ -43,3 +59,364 @@ def test_get_edition_url():
         instance_id='1')
 
     assert edition_url == 'https://keeper.lsst.codes/editions/119'
+
+
+def test_get_exporter():
+    """The exporter is created once per process and then reused."""
+    exporter = get_exporter()
+    assert exporter is get_exporter()
+
+
+def test_run_publish_instance_render_cache(tmpdir, mocker):
+    """A cached render is uploaded without rendering the notebook again."""
+    mock_upload = mocker.patch(
+        'uservice_nbreport.tasks.publishnb.upload_html')
+    render_cache = RenderCache(Path(str(tmpdir)) / 'cache', 1024 ** 3)
+
+    nb = nbformat.v4.new_notebook(metadata={'nbreport': {}})
+    nb.cells.append(nbformat.v4.new_markdown_cell(source='# Title'))
+
+    kwargs = {
+        'keeper_url': 'https://keeper.lsst.codes',
+        'ltd_token': 'testtoken',
+        'ltd_product': 'testr-000',
+        'instance_id': '1',
+        'aws_id': None,
+        'aws_secret': None,
+        'render_cache': render_cache,
+    }
+
+    work_dir = Path(str(tmpdir)) / 'work1'
+    work_dir.mkdir()
+    result = run_publish_instance(nb=nb, work_dir=work_dir, **kwargs)
+    assert mock_upload.call_count == 1
+    assert [stage['name'] for stage in result['timings']['stages']] \
+        == ['render_cache_get', 'preprocess', 'template', 'write_site',
+            'render_cache_put']
+
+    mock_create_html = mocker.patch(
+        'uservice_nbreport.tasks.publishnb.create_html')
+    work_dir = Path(str(tmpdir)) / 'work2'
+    work_dir.mkdir()
+    run_publish_instance(nb=nb, work_dir=work_dir, **kwargs)
+    mock_create_html.assert_not_called()
+    assert mock_upload.call_count == 2
+    assert (work_dir / 'index.html').exists()
+
+
+@responses.activate
+def test_render_upload_instance(client, blob_store, mocker):
+    """The upload task publishes the site rendered by the render task."""
+    responses.add(
+        responses.GET,
+        'https://keeper.lsst.codes/token',
+        status=200,
+        json={'token': 'ltdtoken'}
+    )
+    uploaded = {}
+
+    def run_upload_instance(*, work_dir, content_encodings, timer,
+                            **kwargs):
+        uploaded['files'] = sorted(
+            p.relative_to(work_dir).as_posix()
+            for p in work_dir.glob('**/*') if p.is_file())
+        uploaded['content_encodings'] = content_encodings
+        uploaded['ltd_token'] = kwargs['ltd_token']
+        return {'objects': len(uploaded['files'])}
+
+    mocker.patch('uservice_nbreport.tasks.publishnb.run_upload_instance',
+                 side_effect=run_upload_instance)
+
+    nb = nbformat.v4.new_notebook(metadata={'nbreport': {}})
+    nb.cells.append(nbformat.v4.new_markdown_cell(source='# Title'))
+    nb_data = nbformat.writes(nb, version=4)
+    nb_ref = blob_store.put(io.BytesIO(nb_data.encode('utf-8')))
+
+    render_result = render_instance(nb_ref, 'testr-000', '1')
+    assert render_result['ltd_product'] == 'testr-000'
+    assert render_result['instance_id'] == '1'
+    assert 'upload' not in render_result
+    # The notebook's blob is deleted, and the site is staged in its own blob
+    assert [p.name for p in blob_store.root_dir.iterdir()] \
+        == [render_result['site']['key']]
+
+    result = upload_instance(render_result)
+    assert list(blob_store.root_dir.iterdir()) == []
+    assert 'index.html' in uploaded['files']
+    assert uploaded['content_encodings'] \
+        == render_result['content_encodings']
+    assert uploaded['ltd_token'] == 'ltdtoken'
+    assert result['upload'] == {'objects': len(uploaded['files'])}
+    stage_names = [stage['name'] for stage in result['timings']['stages']]
+    assert stage_names[:3] == ['get_notebook', 'parse', 'preprocess']
+    assert 'pack_site' in stage_names
+    assert stage_names.index('unpack_site') \
+        > stage_names.index('get_keeper_token') \
+        > stage_names.index('pack_site')
+
+
+def test_render_instance_superseded(client, blob_store, redis_client,
+                                    mocker):
+    """A superseded publication stops before rendering the notebook."""
+    mocker.patch.dict(flask_app.config, {'COALESCE_PUBLICATIONS': True})
+    mock_update_state = mocker.patch.object(render_instance, 'update_state')
+    mock_render = mocker.patch(
+        'uservice_nbreport.tasks.publishnb.run_render_instance')
+    index = PublicationIndex(redis_client)
+    index.supersede('testr-000', '1', 'pub-1')
+    index.supersede('testr-000', '1', 'pub-2')
+    nb_ref = blob_store.put(io.BytesIO(b'{}'))
+
+    render_instance.push_request(id='pub-1')
+    try:
+        with pytest.raises(Ignore):
+            render_instance(nb_ref, 'testr-000', '1')
+    finally:
+        render_instance.pop_request()
+
+    mock_update_state.assert_called_once_with(state='SUPERSEDED')
+    mock_render.assert_not_called()
+    assert list(blob_store.root_dir.iterdir()) == []
+
+
+def test_upload_instance_superseded(client, blob_store, redis_client,
+                                    mocker):
+    """A publication that's superseded during its upload doesn't update the
+    edition.
+    """
+    mocker.patch.dict(flask_app.config, {'COALESCE_PUBLICATIONS': True})
+    index = PublicationIndex(redis_client)
+    index.supersede('testr-000', '1', 'pub-1')
+    mock_update_state = mocker.patch.object(upload_instance, 'update_state')
+    mocker.patch('uservice_nbreport.tasks.publishnb.get_keeper_token_cache')
+    mocker.patch('uservice_nbreport.tasks.publishnb.register_build',
+                 return_value={'bucket_name': 'lsst-the-docs',
+                               'bucket_root_dir': 'testr-000/builds/1',
+                               'surrogate_key': 'abc',
+                               'self_url': 'https://keeper/builds/1'})
+    mocker.patch('uservice_nbreport.tasks.publishnb.confirm_build')
+    mock_update_edition = mocker.patch(
+        'uservice_nbreport.tasks.publishnb.update_edition')
+    mocker.patch('uservice_nbreport.tasks.publishnb.get_edition_url')
+
+    def upload_site(*args, **kwargs):
+        # A newer publication is queued during the upload
+        index.supersede('testr-000', '1', 'pub-2')
+        return {'objects': 1, 'bytes': 1, 'copied': 0, 'copied_bytes': 0}
+
+    mocker.patch('uservice_nbreport.tasks.publishnb.upload_site',
+                 side_effect=upload_site)
+
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode='w') as tar:
+        info = tarfile.TarInfo('index.html')
+        tar.addfile(info, io.BytesIO(b''))
+    archive.seek(0)
+    render_result = {
+        'publication_id': 'pub-1',
+        'ltd_product': 'testr-000',
+        'instance_id': '1',
+        'site': blob_store.put(archive),
+        'content_encodings': None,
+        'compression': None,
+        'cell_cache': None,
+        'timings': {'stages': []},
+    }
+
+    with pytest.raises(Ignore):
+        upload_instance(render_result)
+
+    mock_update_state.assert_called_once_with(state='SUPERSEDED')
+    mock_update_edition.assert_not_called()
+    assert list(blob_store.root_dir.iterdir()) == []
+
+
+def test_publish_task_state(redis_client):
+    """Finished tasks publish a state event on their publication's channel.
+    """
+    pubsub = subscribe(redis_client, 'pub-1')
+    publish_task_state(sender=render_instance, task_id='pub-1',
+                       args=({}, 'testr-000', '1'), state='SUCCESS')
+    assert wait_for_event(pubsub, 1.) == {'event': 'state',
+                                          'state': 'SUCCESS'}
+    publish_task_state(sender=upload_instance, task_id='upload-1',
+                       args=({'publication_id': 'pub-1'},), state='FAILURE')
+    assert wait_for_event(pubsub, 1.) == {'event': 'state',
+                                          'state': 'FAILURE'}
+    pubsub.close()
+
+
+def make_site_archive():
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode='w') as tar:
+        info = tarfile.TarInfo('index.html')
+        tar.addfile(info, io.BytesIO(b''))
+    archive.seek(0)
+    return archive
+
+
+def mock_keeper(mocker, confirm_errors=()):
+    """Mock the LTD Keeper calls of `upload_html`."""
+    mocks = {}
+    mocker.patch('uservice_nbreport.tasks.publishnb.get_keeper_token_cache')
+    mocks['register_build'] = mocker.patch(
+        'uservice_nbreport.tasks.publishnb.register_build',
+        return_value={'bucket_name': 'lsst-the-docs',
+                      'bucket_root_dir': 'testr-000/builds/1',
+                      'surrogate_key': 'abc',
+                      'self_url': 'https://keeper/builds/1'})
+    mocks['confirm_build'] = mocker.patch(
+        'uservice_nbreport.tasks.publishnb.confirm_build',
+        side_effect=list(confirm_errors) + [None])
+    mocker.patch('uservice_nbreport.tasks.publishnb.get_edition_url',
+                 return_value='https://keeper/editions/1')
+    mocks['update_edition'] = mocker.patch(
+        'uservice_nbreport.tasks.publishnb.update_edition',
+        return_value={'published_url': 'https://testr-000.lsst.io/v/1'})
+    return mocks
+
+
+def test_upload_instance_resume(client, blob_store, redis_client, mocker):
+    """A retried upload task resumes from its last completed stage."""
+    mock_retry = mocker.patch.object(upload_instance, 'retry',
+                                     side_effect=Retry)
+    mocks = mock_keeper(mocker, confirm_errors=[requests.ConnectionError()])
+    completed_calls = []
+
+    def upload_site(*args, completed, object_callback, **kwargs):
+        completed_calls.append(completed)
+        object_callback('index.html')
+        if len(completed_calls) == 1:
+            raise S3UploadFailedError('Connection reset')
+        return {'objects': 2, 'bytes': 1, 'copied': 0, 'copied_bytes': 0}
+
+    mock_upload = mocker.patch(
+        'uservice_nbreport.tasks.publishnb.upload_site',
+        side_effect=upload_site)
+    render_result = {
+        'publication_id': 'pub-1',
+        'ltd_product': 'testr-000',
+        'instance_id': '1',
+        'site': blob_store.put(make_site_archive()),
+        'content_encodings': None,
+        'compression': None,
+        'cell_cache': None,
+        'timings': {'stages': []},
+    }
+    checkpoints = StageCheckpoints(redis_client, 'pub-1')
+
+    # The upload fails
+    with pytest.raises(Retry):
+        upload_instance(render_result)
+    assert mock_retry.call_args[1]['countdown'] > 0
+    # The site and the checkpoints are kept for the retry
+    assert blob_store.get(render_result['site'])
+    assert checkpoints.get('register_build')['self_url'] \
+        == 'https://keeper/builds/1'
+    assert checkpoints.get_uploaded() == {'index.html'}
+
+    # The upload is resumed, and then the build confirmation fails
+    upload_instance.push_request(retries=1)
+    try:
+        with pytest.raises(Retry):
+            upload_instance(render_result)
+    finally:
+        upload_instance.pop_request()
+    assert completed_calls == [set(), {'index.html'}]
+
+    upload_instance.push_request(retries=2)
+    try:
+        result = upload_instance(render_result)
+    finally:
+        upload_instance.pop_request()
+
+    # The build is registered and uploaded once, and confirmed again
+    assert mocks['register_build'].call_count == 1
+    assert mock_upload.call_count == 2
+    assert mocks['confirm_build'].call_count == 2
+    mocks['update_edition'].assert_called_once()
+    assert result['upload']['published_url'] \
+        == 'https://testr-000.lsst.io/v/1'
+    assert list(blob_store.root_dir.iterdir()) == []
+    assert checkpoints.get('register_build') is None
+
+
+def test_upload_instance_no_retry(client, blob_store, redis_client, mocker):
+    """Errors that aren't transient, and the errors of the last retry, fail
+    the task.
+    """
+    mock_retry = mocker.patch.object(upload_instance, 'retry',
+                                     side_effect=Retry)
+    mocks = mock_keeper(mocker)
+    max_retries = client.application.config['PUBLISH_MAX_RETRIES']
+
+    for error, retries in [(ValueError('Bad site'), 0),
+                           (requests.ConnectionError(), max_retries)]:
+        mocks['register_build'].side_effect = error
+        render_result = {
+            'publication_id': 'pub-1',
+            'ltd_product': 'testr-000',
+            'instance_id': '1',
+            'site': blob_store.put(make_site_archive()),
+            'content_encodings': None,
+            'timings': {'stages': []},
+        }
+        upload_instance.push_request(retries=retries)
+        try:
+            with pytest.raises(type(error)):
+                upload_instance(render_result)
+        finally:
+            upload_instance.pop_request()
+        assert list(blob_store.root_dir.iterdir()) == []
+    mock_retry.assert_not_called()
+
+
+def test_publish_instance_resume(client, blob_store, redis_client, mocker):
+    """A retried publish task uploads the site it rendered before."""
+    mocker.patch.object(publish_instance, 'retry', side_effect=Retry)
+    mocker.patch.object(publish_instance, 'update_state')
+    mocker.patch('uservice_nbreport.tasks.publishnb.get_keeper_token_cache')
+
+    def run_render_instance(*, work_dir, **kwargs):
+        (work_dir / 'index.html').write_bytes(b'<html></html>')
+        return {'compression': None, 'cell_cache': None,
+                'content_encodings': {'index.html': 'gzip'}}
+
+    mock_render = mocker.patch(
+        'uservice_nbreport.tasks.publishnb.run_render_instance',
+        side_effect=run_render_instance)
+    uploaded = []
+
+    def run_upload_instance(*, work_dir, content_encodings,
+                            stage_checkpoints, **kwargs):
+        uploaded.append((work_dir / 'index.html').read_bytes())
+        assert content_encodings == {'index.html': 'gzip'}
+        if len(uploaded) == 1:
+            raise requests.ConnectionError()
+        return {'objects': 1}
+
+    mocker.patch('uservice_nbreport.tasks.publishnb.run_upload_instance',
+                 side_effect=run_upload_instance)
+    nb_data = nbformat.writes(nbformat.v4.new_notebook(), version=4)
+
+    publish_instance.push_request(id='task-1')
+    try:
+        with pytest.raises(Retry):
+            publish_instance(nb_data, 'testr-000', '1')
+    finally:
+        publish_instance.pop_request()
+    assert len(list(blob_store.root_dir.iterdir())) == 1
+
+    publish_instance.push_request(id='task-1', retries=1)
+    try:
+        result = publish_instance(nb_data, 'testr-000', '1')
+    finally:
+        publish_instance.pop_request()
+
+    mock_render.assert_called_once()
+    assert uploaded == [b'<html></html>', b'<html></html>']
+    assert result['upload'] == {'objects': 1}
+    stage_names = [stage['name'] for stage in result['timings']['stages']]
+    assert 'unpack_site' in stage_names
+    assert list(blob_store.root_dir.iterdir()) == []
+    assert StageCheckpoints(redis_client, 'task-1').get('render') is None
@@ -0,0 +1,26 @@
+"""Tests for the ``uservice_nbreport.timing`` module.
+"""
+
+import pytest
+
+from uservice_nbreport.timing import StageTimer
+
+
+def test_stage_timer():
+    timer = StageTimer()
+    with timer.stage('parse') as stage:
+        stage['bytes'] = 10
+    with pytest.raises(ValueError):
+        with timer.stage('render'):
+            raise ValueError
+    timer.add('upload', wall=1., cpu=0.5, nbytes=100)
+
+    timings = timer.as_dict()
+    assert [s['name'] for s in timings['stages']] \
+        == ['parse', 'render', 'upload']
+    assert timings['stages'][0]['bytes'] == 10
+    # Failed stages are still timed
+    assert timings['stages'][1]['wall'] >= 0.
+    assert timings['stages'][1]['bytes'] is None
+    assert timings['wall'] >= 1.
+    assert timings['cpu'] >= 0.5
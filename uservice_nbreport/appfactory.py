@@ -24,6 +24,11 @@ def create_flask_app(profile=None):
     -------
     app : apikit.APIFlask
         Flask application instance.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if ``BLOB_STORE_URL`` isn't set in the production profile.
     """
     app = APIFlask(
         name="uservice-nbreport",
@@ -39,6 +44,9 @@ def create_flask_app(profile=None):
     if profile is None:
         profile = os.getenv('NBREPORT_PROFILE', 'dev')
     app.config.from_object(config_profiles[profile])
+    if not app.config['BLOB_STORE_URL']:
+        raise RuntimeError(
+            'BLOB_STORE_URL must be set for the {0} profile'.format(profile))
 
     # Initialize the celery app
     from .celery import create_celery_app
@@ -4,16 +4,17 @@
 __all__ = ('github_token_auth', 'requires_github_org_membership', 'ltd_login')
 
 from functools import wraps
-from urllib.parse import urljoin
 
 from flask import g, current_app
 from flask_httpauth import HTTPBasicAuth
 
-import requests
 import structlog
 from apikit import BackendError
 
+from .authcache import get_github_auth_cache
 from .exceptions import GitHubAuthenticationError, GitHubAuthorizationError
+from .httpclient import get_session
+from .keepertoken import get_keeper_token_cache
 
 
 github_token_auth = HTTPBasicAuth()
@@ -53,6 +54,9 @@ def verify_github_token(username, token):
     3. The GitHub username is attached to ``flask.github_user``.
 
     4. The GitHub token is attached to ``flask.github_token``.
+
+    Successful authentications are cached (see
+    `uservice_nbreport.authcache.get_github_auth_cache`).
     """
     if username is None:
         return False
@@ -60,19 +64,28 @@ def verify_github_token(username, token):
     # Bind the username to the logger
     structlog.get_logger().bind(github_user=username)
 
-    response = requests.get(
-        'https://api.github.com/user',
-        auth=(username, token),
-        headers={'Accept': 'application/vnd.github.v3+json'}
-    )
-    if response.status_code >= 300:
-        # Means authentication failed
-        return False
+    auth_cache = get_github_auth_cache()
+    user_data = None
+    if auth_cache is not None:
+        user_data = auth_cache.get('user', username, token)
+
+    if user_data is None:
+        response = get_session('github').get(
+            'https://api.github.com/user',
+            auth=(username, token),
+            headers={'Accept': 'application/vnd.github.v3+json'}
+        )
+        if response.status_code >= 300:
+            # Means authentication failed
+            return False
+        user_data = response.json()
+        if auth_cache is not None:
+            auth_cache.set('user', username, token, user_data)
 
     # Store user data now that they're authenticated
     g.github_user = username
     g.github_token = token
-    g.github_user_data = response.json()
+    g.github_user_data = user_data
 
     return True
 
@@ -93,7 +106,6 @@ def requires_github_org_membership():
         def decorated_function(*args, **kwargs):
             try:
                 verify_github_org_membership()
-                return f(*args, **kwargs)
 
             except (GitHubAuthenticationError, GitHubAuthorizationError):
                 raise
@@ -104,6 +116,7 @@ def requires_github_org_membership():
                     status_code=500,
                     content=str(e)
                 )
+            return f(*args, **kwargs)
         return decorated_function
     return decorator
 
@@ -112,7 +125,11 @@ def verify_github_org_membership():
     """Verify that the authenticated GitHub user is a member of the
     GitHub organization configured in the ``AUTHORIZED_GITHUB_ORG`` config.
 
-    This function is used by `requires_github_org_membership`.
+    This function is used by `requires_github_org_membership`. Membership
+    is checked with the method set by the ``GITHUB_MEMBERSHIP_CHECK``
+    config (see `check_github_org_membership`), and decisions are cached
+    (see `uservice_nbreport.authcache.get_github_auth_cache`). Denials are
+    only cached for ``AUTH_CACHE_NEGATIVE_TTL`` seconds, if at all.
 
     Raises
     ------
@@ -128,43 +145,117 @@ def verify_github_org_membership():
     except AttributeError:
         raise GitHubAuthenticationError()
 
-    # Access the user's organization memberships (need to iterate)
-    # https://developer.github.com/v3/orgs/#list-your-organizations
-    org_data = iter_github_endpoint(
-        'https://api.github.com/user/orgs',
-        auth=(username, token),
-        headers={'Accept': 'application/vnd.github.v3+json'}
-    )
-
-    org_list = [org['login'] for org in org_data]
-    if current_app.config['AUTHORIZED_GITHUB_ORG'] not in org_list:
+    org = current_app.config['AUTHORIZED_GITHUB_ORG']
+    cache_kind = 'org:{0}'.format(org)
+    auth_cache = get_github_auth_cache()
+    is_member = None
+    if auth_cache is not None:
+        is_member = auth_cache.get(cache_kind, username, token)
+
+    if is_member is None:
+        is_member = check_github_org_membership(
+            org, username, token,
+            method=current_app.config['GITHUB_MEMBERSHIP_CHECK'])
+        if auth_cache is not None:
+            if is_member:
+                auth_cache.set(cache_kind, username, token, True)
+            else:
+                # Users who are denied may be added to the organization
+                # any time, so denials are cached briefly, if at all.
+                negative_ttl = current_app.config['AUTH_CACHE_NEGATIVE_TTL']
+                if negative_ttl > 0:
+                    auth_cache.set(cache_kind, username, token, False,
+                                   ttl=negative_ttl)
+
+    if not is_member:
         raise GitHubAuthorizationError()
 
 
-def iter_github_endpoint(url, verb='GET', auth=None, headers=None,
-                         current_data=None):
-    """Perform a request and follow GitHub-style pagination.
+def check_github_org_membership(org, username, token, method='orgs'):
+    """Check whether a GitHub user is a member of an organization.
+
+    Parameters
+    ----------
+    org : `str`
+        Name of the GitHub organization.
+    username : `str`
+        GitHub username.
+    token : `str`
+        The user's GitHub token.
+    method : `str`, optional
+        How membership is checked:
+
+        - ``'orgs'``: iterate over the pages of the user's organizations
+          (``GET /user/orgs``), stopping at the page that has ``org``.
+        - ``'members'``: a single ``GET /orgs/{org}/members/{username}``
+          request.
+
+    Returns
+    -------
+    is_member : `bool`
+        `True` if the user is a member of the organization.
     """
-    if current_data is None:
-        current_data = []
+    auth = (username, token)
+    headers = {'Accept': 'application/vnd.github.v3+json'}
+
+    if method == 'orgs':
+        # https://developer.github.com/v3/orgs/#list-your-organizations
+        org_data = iter_github_endpoint(
+            'https://api.github.com/user/orgs',
+            auth=auth,
+            headers=headers
+        )
+        return any(org_item['login'] == org for org_item in org_data)
+
+    elif method == 'members':
+        # https://developer.github.com/v3/orgs/members/#check-membership
+        # 204 means the user is a member, and 404 means they aren't (or
+        # that the token can't see the membership).
+        response = get_session('github').get(
+            'https://api.github.com/orgs/{0}/members/{1}'.format(
+                org, username),
+            auth=auth,
+            headers=headers
+        )
+        if response.status_code == 204:
+            return True
+        elif response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return False
 
-    response = requests.request(
-        verb,
-        url,
-        auth=auth,
-        headers=headers)
-    response.raise_for_status()
+    else:
+        raise ValueError(
+            'Unknown GitHub membership check method {0!r}'.format(method))
 
-    current_data.extend(response.json())
 
-    try:
-        next_url = response.links['next']['url']
-    except (AttributeError, KeyError):
-        return current_data
+def iter_github_endpoint(url, verb='GET', auth=None, headers=None):
+    """Perform a request and follow GitHub-style pagination, yielding items
+    lazily.
+
+    Each page is only requested once the items of the previous page have
+    been consumed, so callers that stop iterating early don't request the
+    remaining pages.
 
-    return iter_github_endpoint(
-        next_url, verb=verb, auth=auth, headers=headers,
-        current_data=current_data)
+    Yields
+    ------
+    item
+        Item of the JSON array in the response bodies.
+    """
+    while url is not None:
+        response = get_session('github').request(
+            verb,
+            url,
+            auth=auth,
+            headers=headers)
+        response.raise_for_status()
+
+        yield from response.json()
+
+        try:
+            url = response.links['next']['url']
+        except (AttributeError, KeyError):
+            url = None
 
 
 def ltd_login():
@@ -189,7 +280,6 @@ def ltd_login():
         def decorated_function(*args, **kwargs):
             try:
                 get_ltd_token()
-                return f(*args, **kwargs)
 
             except Exception as e:
                 raise BackendError(
@@ -197,6 +287,9 @@ def ltd_login():
                     'Docs ({0})'.format(current_app.config['KEEPER_URL']),
                     status_code=500,
                     content=str(e))
+            # Errors of the route itself, like validation errors, aren't
+            # reported as authentication errors.
+            return f(*args, **kwargs)
         return decorated_function
     return decorator
 
@@ -204,18 +297,13 @@ def ltd_login():
 def get_ltd_token():
     """Request and add the LTD Keeper token to the request context.
 
-    This function is meant to be called by the `ltd_login` decorator.
+    This function is meant to be called by the `ltd_login` decorator. The
+    token is shared with other processes through the token cache (see
+    `uservice_nbreport.keepertoken.get_keeper_token_cache`).
     """
     # Double check that we already logged-in with GitHub
     if not hasattr(g, 'github_token'):
         raise GitHubAuthenticationError()
 
-    response = requests.get(
-        urljoin(current_app.config['KEEPER_URL'], '/token'),
-        auth=(current_app.config['KEEPER_USERNAME'],
-              current_app.config['KEEPER_PASSWORD'])
-    )
-    response.raise_for_status()
-
     g.ltd_user = current_app.config['KEEPER_USERNAME']
-    g.ltd_token = response.json()['token']
+    g.ltd_token = get_keeper_token_cache().get_token()
@@ -0,0 +1,241 @@
+"""Cache of GitHub authentication and organization membership results.
+
+Without the cache, every authenticated request verifies the user's token
+with ``GET /user`` and then lists their organizations with
+``GET /user/orgs``. With the cache, these results are reused for
+``AUTH_CACHE_TTL`` seconds. Denied membership decisions are only cached for
+``AUTH_CACHE_NEGATIVE_TTL`` seconds (not at all by default), so that users
+who join the organization, or fix their token's scopes, aren't locked out.
+"""
+
+__all__ = ('GitHubAuthCache', 'get_github_auth_cache')
+
+from collections import OrderedDict
+import hashlib
+import hmac
+import json
+import os
+import time
+
+from flask import current_app
+import redis
+import structlog
+
+from .redisstore import get_redis
+
+
+class GitHubAuthCache:
+    """Short-lived cache of GitHub authentication results, keyed by user
+    credentials.
+
+    Entries are keyed by an HMAC of the username and token with a secret
+    salt, so raw tokens are never stored. Entries are kept in a
+    size-bounded, least-recently-used cache in process memory and,
+    optionally, in Redis, where other processes can reuse them.
+
+    Parameters
+    ----------
+    ttl : `float`
+        Lifetime of entries, in seconds.
+    max_size : `int`
+        Maximum number of entries in process memory.
+    salt : `bytes`, optional
+        Secret salt of the key hashes. Processes that share entries through
+        Redis must use the same salt. By default, a random salt is used.
+    redis_client : `redis.StrictRedis`, optional
+        Redis client for sharing entries between processes. It should decode
+        responses.
+    prefix : `str`, optional
+        Prefix of the Redis keys.
+
+    Attributes
+    ----------
+    hits : `int`
+        Number of `get` calls that found an entry.
+    misses : `int`
+        Number of `get` calls that didn't find an entry.
+    """
+
+    def __init__(self, *, ttl, max_size, salt=None, redis_client=None,
+                 prefix='nbreport:github-auth'):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.salt = salt if salt is not None else os.urandom(32)
+        self.redis = redis_client
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self):
+        """Hit and miss counts, hit rate, and size of the in-process cache
+        (`dict`).
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.,
+            'size': len(self._entries),
+        }
+
+    def make_key(self, kind, username, token):
+        """Make the key of an entry.
+
+        Parameters
+        ----------
+        kind : `str`
+            Kind of entry, like ``'user'`` for a user's data, or
+            ``'org:<org>'`` for a membership decision.
+        username : `str`
+            GitHub username.
+        token : `str`
+            GitHub token.
+
+        Returns
+        -------
+        key : `str`
+            ``kind`` and the hex digest of an HMAC of the username and token.
+        """
+        digest = hmac.new(
+            self.salt,
+            '{0}\0{1}'.format(username, token).encode('utf-8'),
+            hashlib.sha256).hexdigest()
+        return '{0}:{1}'.format(kind, digest)
+
+    def get(self, kind, username, token):
+        """Get a cached result.
+
+        Parameters
+        ----------
+        kind : `str`
+            Kind of entry (see `make_key`).
+        username : `str`
+            GitHub username.
+        token : `str`
+            GitHub token.
+
+        Returns
+        -------
+        value
+            The cached, JSON-serializable, value, or `None` if it isn't
+            cached or expired.
+        """
+        key = self.make_key(kind, username, token)
+        now = time.monotonic()
+        try:
+            expires, value = self._entries[key]
+        except KeyError:
+            value, ttl = self._get_shared(key)
+            if value is None:
+                self.misses += 1
+                return None
+            # Keep the entry until the shared entry expires
+            self._put_local(key, value, ttl)
+        else:
+            if expires <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, kind, username, token, value, ttl=None):
+        """Cache a result.
+
+        Parameters
+        ----------
+        kind : `str`
+            Kind of entry (see `make_key`).
+        username : `str`
+            GitHub username.
+        token : `str`
+            GitHub token.
+        value
+            The value, which must be JSON-serializable and not `None`.
+        ttl : `float`, optional
+            Lifetime of the entry, in seconds, if it isn't the cache's
+            ``ttl``.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        key = self.make_key(kind, username, token)
+        self._put_local(key, value, ttl)
+        if self.redis is not None:
+            try:
+                self.redis.set('{0}:{1}'.format(self.prefix, key),
+                               json.dumps(value),
+                               ex=max(int(ttl), 1))
+            except redis.RedisError as e:
+                structlog.get_logger(__name__).warning(
+                    'GitHub auth cache unavailable', error=str(e))
+
+    def _put_local(self, key, value, ttl):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _get_shared(self, key):
+        """Get a shared entry's value and remaining lifetime, or `None` and
+        `None`.
+        """
+        if self.redis is None:
+            return None, None
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            pipeline.get('{0}:{1}'.format(self.prefix, key))
+            pipeline.pttl('{0}:{1}'.format(self.prefix, key))
+            data, pttl = pipeline.execute()
+        except redis.RedisError as e:
+            structlog.get_logger(__name__).warning(
+                'GitHub auth cache unavailable', error=str(e))
+            return None, None
+        if data is None:
+            return None, None
+        ttl = min(self.ttl, pttl / 1000) if pttl > 0 else self.ttl
+        return json.loads(data), ttl
+
+
+def get_github_auth_cache():
+    """Get the GitHub authentication cache of the app, configured by the
+    ``AUTH_CACHE_TTL``, ``AUTH_CACHE_MAX_SIZE``, ``AUTH_CACHE_SALT``, and
+    ``AUTH_CACHE_REDIS`` configurations.
+
+    The cache is created once per app and process. Must be called within an
+    application context.
+
+    Returns
+    -------
+    auth_cache : `GitHubAuthCache`
+        The cache, or `None` if it's disabled (``AUTH_CACHE_TTL`` is 0).
+    """
+    config = current_app.config
+    if config['AUTH_CACHE_TTL'] <= 0:
+        return None
+    try:
+        return current_app.extensions['nbreport_auth_cache']
+    except KeyError:
+        pass
+
+    salt = config['AUTH_CACHE_SALT']
+    redis_client = None
+    if config['AUTH_CACHE_REDIS']:
+        if salt is None:
+            structlog.get_logger(__name__).warning(
+                'AUTH_CACHE_SALT is not set; GitHub auth results are not '
+                'shared through Redis.')
+        else:
+            redis_client = get_redis()
+    auth_cache = GitHubAuthCache(
+        ttl=config['AUTH_CACHE_TTL'],
+        max_size=config['AUTH_CACHE_MAX_SIZE'],
+        salt=salt.encode('utf-8') if salt is not None else None,
+        redis_client=redis_client)
+    current_app.extensions['nbreport_auth_cache'] = auth_cache
+    return auth_cache
@@ -0,0 +1,108 @@
+"""Exponential backoff with jitter, and detection of transient errors, for
+retrying tasks.
+"""
+
+__all__ = ('get_backoff_delay', 'is_transient_error')
+
+import random
+import re
+
+from boto3.exceptions import S3TransferFailedError, S3UploadFailedError
+from botocore.exceptions import (
+    ClientError, ConnectionError as BotoConnectionError, HTTPClientError)
+from ltdconveyor.keeper.exceptions import KeeperError
+import requests
+
+_TRANSIENT_STATUS_CODES = (408, 429)
+"""Status codes, besides ``5xx``, of transient HTTP errors."""
+
+_TRANSIENT_S3_CODES = ('RequestTimeout', 'SlowDown', 'Throttling',
+                       'InternalError', 'ServiceUnavailable')
+"""Error codes of transient S3 errors."""
+
+_CLIENT_ERROR_CODE = re.compile(r'An error occurred \((\w+)\)')
+"""Pattern of the error code in the message of a `ClientError`."""
+
+
+def get_backoff_delay(retries, *, base, maximum):
+    """Get the delay before retrying a failed operation.
+
+    The delay doubles with each retry, up to ``maximum``, and is randomized
+    between half and all of that ("equal jitter") so that operations that
+    failed together, like the deliveries to a server that was down, don't
+    retry in lockstep.
+
+    Parameters
+    ----------
+    retries : `int`
+        Number of retries so far (``0`` before the first retry).
+    base : `float`
+        Delay before the first retry, in seconds, before jitter.
+    maximum : `float`
+        Maximum delay, in seconds, before jitter.
+
+    Returns
+    -------
+    delay : `float`
+        Delay, in seconds.
+    """
+    delay = min(maximum, base * 2 ** retries)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def is_transient_error(error):
+    """Test whether an error is likely transient, so that the operation that
+    raised it can be retried.
+
+    Parameters
+    ----------
+    error : `Exception`
+        The exception.
+
+    Returns
+    -------
+    transient : `bool`
+        `True` for connection errors and timeouts, ``408``, ``429``, and
+        ``5xx`` responses from LTD Keeper (`requests.HTTPError` and
+        `ltdconveyor.keeper.KeeperError`), and S3 errors other than client
+        errors like a missing bucket or denied access. boto3's
+        `~boto3.exceptions.S3UploadFailedError` and
+        `~boto3.exceptions.S3TransferFailedError` are classified by the
+        error they wrap.
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout,
+                          BotoConnectionError, HTTPClientError)):
+        return True
+    if isinstance(error, (S3UploadFailedError, S3TransferFailedError)):
+        # boto3 raises these while handling the underlying error, which is
+        # chained, and also includes that error's message.
+        cause = error.__cause__ or error.__context__
+        if cause is not None:
+            return is_transient_error(cause)
+        match = _CLIENT_ERROR_CODE.search(str(error))
+        if match is not None:
+            return match.group(1) in _TRANSIENT_S3_CODES
+        return True
+    if isinstance(error, requests.HTTPError):
+        return (error.response is not None and
+                _is_transient_status(error.response.status_code))
+    if isinstance(error, KeeperError):
+        # ltdconveyor raises KeeperError with the JSON error body, which has
+        # the response's status, or with the response itself.
+        for arg in error.args:
+            if isinstance(arg, dict) and isinstance(arg.get('status'), int):
+                return _is_transient_status(arg['status'])
+            if isinstance(arg, requests.Response):
+                return _is_transient_status(arg.status_code)
+        return False
+    if isinstance(error, ClientError):
+        response = error.response
+        status_code = response.get('ResponseMetadata', {}).get(
+            'HTTPStatusCode', 0)
+        return (response.get('Error', {}).get('Code') in _TRANSIENT_S3_CODES
+                or status_code >= 500)
+    return False
+
+
+def _is_transient_status(status_code):
+    return status_code >= 500 or status_code in _TRANSIENT_STATUS_CODES
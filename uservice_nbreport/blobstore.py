@@ -0,0 +1,326 @@
+"""Staging store for the payloads of publish tasks (notebooks and rendered
+sites).
+
+Payloads are written once, gzip-compressed, to a local directory or an S3
+bucket, and tasks are sent a small reference to the payload instead of the
+payload itself. This keeps large notebooks out of the Celery broker and
+result backend (Redis).
+"""
+
+__all__ = ('BlobStore', 'LocalBlobStore', 'S3BlobStore', 'BlobError',
+           'get_blob_store')
+
+import abc
+import gzip
+import hashlib
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import time
+from urllib.parse import urlparse
+import uuid
+
+from botocore.exceptions import ClientError
+from flask import current_app
+import structlog
+
+from .publish.upload import get_s3_client
+
+_stores = {}
+"""Blob stores of this process, keyed by URL (see `get_blob_store`)."""
+
+_CHUNK_SIZE = 1024 ** 2
+"""Size of the chunks that payloads are read and compressed in."""
+
+
+class BlobError(Exception):
+    """Raised if a blob is missing or its content doesn't match its
+    reference.
+    """
+
+
+class BlobStore(metaclass=abc.ABCMeta):
+    """Base class of blob stores.
+
+    A blob is stored under a key made of the SHA-256 hash of its content
+    and a random suffix, so that identical payloads of concurrent tasks
+    don't share a blob that one task could delete before the other reads
+    it.
+
+    Parameters
+    ----------
+    compresslevel : `int`, optional
+        Gzip compression level of the stored blobs.
+    """
+
+    def __init__(self, compresslevel=6):
+        self.compresslevel = compresslevel
+
+    def put(self, fileobj):
+        """Store a blob.
+
+        Parameters
+        ----------
+        fileobj : file-like object
+            Binary file (or stream) with the blob's content. It's read in
+            chunks, so the content doesn't need to fit in memory.
+
+        Returns
+        -------
+        ref : `dict`
+            Reference to the blob, which is JSON-serializable, with fields:
+
+            - ``key``: key of the blob in the store.
+            - ``sha256``: hex digest of the SHA-256 hash of the content.
+            - ``size``: size of the content, in bytes.
+            - ``stored_size``: size of the compressed blob, in bytes.
+        """
+        sha256 = hashlib.sha256()
+        size = 0
+        with tempfile.SpooledTemporaryFile(max_size=16 * _CHUNK_SIZE) as f:
+            with gzip.GzipFile(fileobj=f, mode='wb', mtime=0,
+                               compresslevel=self.compresslevel) as gz:
+                while True:
+                    chunk = fileobj.read(_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    gz.write(chunk)
+            stored_size = f.tell()
+            f.seek(0)
+            digest = sha256.hexdigest()
+            key = '{0}-{1}.gz'.format(digest, uuid.uuid4().hex[:12])
+            self._write(key, f)
+        return {'key': key, 'sha256': digest, 'size': size,
+                'stored_size': stored_size}
+
+    def get(self, ref):
+        """Get the content of a blob.
+
+        Parameters
+        ----------
+        ref : `dict`
+            Reference to the blob (see `put`).
+
+        Returns
+        -------
+        content : `bytes`
+            Content of the blob.
+
+        Raises
+        ------
+        BlobError
+            Raised if the blob doesn't exist, or its content doesn't match
+            the reference's hash.
+        """
+        content = gzip.decompress(self._read(ref['key']))
+        if hashlib.sha256(content).hexdigest() != ref['sha256']:
+            raise BlobError('Blob {0} is corrupted'.format(ref['key']))
+        return content
+
+    @abc.abstractmethod
+    def delete(self, ref):
+        """Delete a blob, if it exists.
+
+        Parameters
+        ----------
+        ref : `dict`
+            Reference to the blob (see `put`).
+        """
+
+    def collect_garbage(self, max_age):
+        """Delete blobs that are older than a maximum age.
+
+        Tasks delete the blobs they've read, so old blobs are the leftovers
+        of tasks that never ran or were interrupted.
+
+        Parameters
+        ----------
+        max_age : `float`
+            Maximum age of blobs, in seconds.
+
+        Returns
+        -------
+        count : `int`
+            Number of deleted blobs.
+        """
+        cutoff = time.time() - max_age
+        count = 0
+        for key, mtime in list(self._list()):
+            if mtime < cutoff:
+                self.delete({'key': key})
+                count += 1
+        if count:
+            structlog.get_logger(__name__).info(
+                'Collected blobs', count=count, max_age=max_age)
+        return count
+
+    @abc.abstractmethod
+    def _write(self, key, f):
+        """Write the compressed blob read from file ``f``."""
+
+    @abc.abstractmethod
+    def _read(self, key):
+        """Read the compressed blob, raising `BlobError` if it's missing."""
+
+    @abc.abstractmethod
+    def _list(self):
+        """Iterate over the ``(key, mtime)`` tuples of the blobs."""
+
+
+class LocalBlobStore(BlobStore):
+    """Blob store in a local directory.
+
+    The directory must be shared by the web and worker processes, for
+    example with a volume mounted in every container.
+
+    Parameters
+    ----------
+    root_dir : `str` or `pathlib.Path`
+        Directory where blobs are stored. It's created if necessary.
+    compresslevel : `int`, optional
+        Gzip compression level of the stored blobs.
+    """
+
+    def __init__(self, root_dir, compresslevel=6):
+        super().__init__(compresslevel=compresslevel)
+        self.root_dir = Path(root_dir)
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+
+    def delete(self, ref):
+        try:
+            (self.root_dir / ref['key']).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _write(self, key, f):
+        # Write to a temporary file and rename it so that blobs are never
+        # read partially written.
+        tmp_path = self.root_dir / '.{0}.tmp'.format(key)
+        with tmp_path.open('wb') as dest:
+            shutil.copyfileobj(f, dest)
+        os.replace(str(tmp_path), str(self.root_dir / key))
+
+    def _read(self, key):
+        try:
+            return (self.root_dir / key).read_bytes()
+        except FileNotFoundError:
+            raise BlobError('Blob {0} not found'.format(key))
+
+    def _list(self):
+        for path in self.root_dir.iterdir():
+            if path.name.startswith('.') and not path.name.endswith('.tmp'):
+                continue
+            try:
+                yield path.name, path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+
+
+class S3BlobStore(BlobStore):
+    """Blob store in an S3 (or S3-compatible) bucket.
+
+    Parameters
+    ----------
+    bucket_name : `str`
+        Name of the bucket.
+    prefix : `str`
+        Directory of the blobs in the bucket.
+    aws_id : `str`
+        AWS key identifier.
+    aws_secret : `str`
+        AWS secret key.
+    endpoint_url : `str`, optional
+        URL of an S3-compatible service, instead of AWS S3.
+    compresslevel : `int`, optional
+        Gzip compression level of the stored blobs.
+    """
+
+    def __init__(self, bucket_name, prefix, *, aws_id, aws_secret,
+                 endpoint_url=None, compresslevel=6):
+        super().__init__(compresslevel=compresslevel)
+        self.bucket_name = bucket_name
+        self.prefix = prefix.strip('/')
+        self.aws_id = aws_id
+        self.aws_secret = aws_secret
+        self.endpoint_url = endpoint_url
+
+    @property
+    def s3(self):
+        """S3 client of this process (see
+        `uservice_nbreport.publish.upload.get_s3_client`).
+        """
+        return get_s3_client(self.aws_id, self.aws_secret, self.endpoint_url)
+
+    def delete(self, ref):
+        self.s3.delete_object(Bucket=self.bucket_name,
+                              Key=self._get_object_key(ref['key']))
+
+    def _write(self, key, f):
+        self.s3.upload_fileobj(f, self.bucket_name, self._get_object_key(key))
+
+    def _read(self, key):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket_name,
+                                          Key=self._get_object_key(key))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                raise BlobError('Blob {0} not found'.format(key))
+            raise
+        return response['Body'].read()
+
+    def _list(self):
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name,
+                                       Prefix=self.prefix + '/'):
+            for obj in page.get('Contents', []):
+                yield (obj['Key'][len(self.prefix) + 1:],
+                       obj['LastModified'].timestamp())
+
+    def _get_object_key(self, key):
+        return '{0}/{1}'.format(self.prefix, key)
+
+
+def get_blob_store(url=None):
+    """Get the blob store of this process.
+
+    Parameters
+    ----------
+    url : `str`, optional
+        URL of the store: ``file:///path/to/dir`` (or a path) for a
+        `LocalBlobStore`, or ``s3://bucket/prefix`` for an `S3BlobStore`.
+        By default, the ``BLOB_STORE_URL`` configuration is used, and so
+        this function must be called from within a Flask application
+        context. S3 stores use the ``KEEPER_AWS_ID``,
+        ``KEEPER_AWS_SECRET``, and ``BLOB_STORE_ENDPOINT_URL``
+        configurations.
+
+    Returns
+    -------
+    blob_store : `BlobStore`
+        The blob store.
+    """
+    if url is None:
+        url = current_app.config['BLOB_STORE_URL']
+    try:
+        return _stores[url]
+    except KeyError:
+        pass
+
+    config = current_app.config
+    parts = urlparse(url)
+    if parts.scheme == 's3':
+        store = S3BlobStore(parts.netloc, parts.path,
+                            aws_id=config['KEEPER_AWS_ID'],
+                            aws_secret=config['KEEPER_AWS_SECRET'],
+                            endpoint_url=config['BLOB_STORE_ENDPOINT_URL'],
+                            compresslevel=config['BLOB_COMPRESSION_LEVEL'])
+    elif parts.scheme in ('file', ''):
+        store = LocalBlobStore(parts.path,
+                               compresslevel=config['BLOB_COMPRESSION_LEVEL'])
+    else:
+        raise ValueError('Unsupported blob store URL {0!r}'.format(url))
+    _stores[url] = store
+    return store
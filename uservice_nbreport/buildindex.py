@@ -0,0 +1,103 @@
+"""Index of the latest build uploaded for each report and report instance.
+
+Publish tasks upload only the files that changed since the previous build
+of the same instance (or, for a new instance, of the same report), and copy
+the other files from that build (see
+`uservice_nbreport.publish.upload.upload_site`). This index, stored in
+Redis, records where those builds are in the S3 bucket.
+"""
+
+__all__ = ('BuildIndex',)
+
+import json
+
+import redis
+import structlog
+
+
+class BuildIndex:
+    """Index of the latest builds of reports and instances, stored in Redis.
+
+    Redis errors are logged and treated as index misses, so that sites are
+    uploaded in full while Redis is unavailable.
+
+    Parameters
+    ----------
+    redis_client : `redis.StrictRedis`
+        Redis client (see `uservice_nbreport.redisstore.get_redis`). It
+        should decode responses.
+    prefix : `str`, optional
+        Prefix of the Redis keys.
+    """
+
+    def __init__(self, redis_client, prefix='nbreport:builds'):
+        self.redis = redis_client
+        self.prefix = prefix
+
+    def get_previous_root(self, product, instance_id, bucket_name):
+        """Get the bucket directory of the latest build of an instance, or
+        else of its report.
+
+        Parameters
+        ----------
+        product : `str`
+            Slug of the LTD Product.
+        instance_id : `str`
+            Slug of the edition (the instance ID).
+        bucket_name : `str`
+            Name of the S3 bucket of the new build. Builds in other buckets
+            are ignored since objects can't be copied from them.
+
+        Returns
+        -------
+        bucket_root : `str`
+            Directory of the build in the bucket, or `None` if neither the
+            instance nor the report has an indexed build.
+        """
+        try:
+            values = self.redis.mget(
+                [self._get_key(product, instance_id),
+                 self._get_key(product)])
+        except redis.RedisError as e:
+            structlog.get_logger(__name__).warning(
+                'Build index lookup failed', product=product,
+                instance_id=instance_id, error=str(e))
+            return None
+        for value in values:
+            if value is None:
+                continue
+            build = json.loads(value)
+            if build['bucket_name'] == bucket_name:
+                return build['bucket_root']
+        return None
+
+    def set(self, product, instance_id, bucket_name, bucket_root):
+        """Record the latest build of an instance (and its report).
+
+        Parameters
+        ----------
+        product : `str`
+            Slug of the LTD Product.
+        instance_id : `str`
+            Slug of the edition (the instance ID).
+        bucket_name : `str`
+            Name of the S3 bucket of the build.
+        bucket_root : `str`
+            Directory of the build in the bucket.
+        """
+        value = json.dumps({'bucket_name': bucket_name,
+                            'bucket_root': bucket_root})
+        try:
+            pipeline = self.redis.pipeline()
+            pipeline.set(self._get_key(product, instance_id), value)
+            pipeline.set(self._get_key(product), value)
+            pipeline.execute()
+        except redis.RedisError as e:
+            structlog.get_logger(__name__).warning(
+                'Build index update failed', product=product,
+                instance_id=instance_id, error=str(e))
+
+    def _get_key(self, product, instance_id=None):
+        if instance_id is None:
+            return '{0}:{1}'.format(self.prefix, product)
+        return '{0}:{1}:{2}'.format(self.prefix, product, instance_id)
@@ -25,6 +25,19 @@ def create_celery_app(flask_app):
                         broker=flask_app.config['CELERY_BROKER_URL'],
                         task_track_started=True)
     celery_app.conf.update(flask_app.config)
+    # Route the render and upload stages of publications, and callback
+    # deliveries, to their own queues so that each can be served by workers
+    # with a suitable pool.
+    celery_app.conf.task_routes = {
+        'uservice_nbreport.tasks.publishnb.publish_instance': {
+            'queue': flask_app.config['RENDER_QUEUE']},
+        'uservice_nbreport.tasks.publishnb.render_instance': {
+            'queue': flask_app.config['RENDER_QUEUE']},
+        'uservice_nbreport.tasks.publishnb.upload_instance': {
+            'queue': flask_app.config['UPLOAD_QUEUE']},
+        'uservice_nbreport.tasks.callbacks.deliver_callback': {
+            'queue': flask_app.config['CALLBACK_QUEUE']},
+    }
     TaskBase = celery_app.Task
 
     class ContextTask(TaskBase):
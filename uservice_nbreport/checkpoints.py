@@ -0,0 +1,131 @@
+"""Checkpoints of the stages completed by a publication's tasks.
+
+When a publish task is retried after a transient error, it resumes from its
+last completed stage rather than starting over: the rendered site is
+persisted in the blob store, the LSST the Docs build is registered once,
+the objects that were already uploaded to it aren't uploaded again, and the
+build is confirmed once (see `uservice_nbreport.tasks.publishnb`).
+"""
+
+__all__ = ('StageCheckpoints',)
+
+import json
+
+import redis
+import structlog
+
+
+class StageCheckpoints:
+    """Checkpoints of a publication's completed stages, stored in Redis.
+
+    Redis errors are logged and checkpoints are then treated as missing, so
+    that a retried task redoes the stages rather than failing.
+
+    Parameters
+    ----------
+    redis_client : `redis.StrictRedis`
+        Redis client (see `uservice_nbreport.redisstore.get_redis`). It
+        should decode responses.
+    publication_id : `str`
+        ID of the publication (or of the task, which keeps its ID when it's
+        retried).
+    ttl : `int`, optional
+        Lifetime of the checkpoints, in seconds. This should be longer than
+        a task is retried for.
+    prefix : `str`, optional
+        Prefix of the Redis keys.
+    """
+
+    def __init__(self, redis_client, publication_id, ttl=24 * 3600,
+                 prefix='nbreport:checkpoints'):
+        self.redis = redis_client
+        self.publication_id = publication_id
+        self.ttl = ttl
+        self.key = '{0}:{1}'.format(prefix, publication_id)
+        self.uploaded_key = self.key + ':uploaded'
+
+    def get(self, stage):
+        """Get the checkpoint of a stage.
+
+        Parameters
+        ----------
+        stage : `str`
+            Name of the stage, like ``'register_build'``.
+
+        Returns
+        -------
+        value
+            The stage's checkpoint (see `set`), or `None` if the stage
+            wasn't completed.
+        """
+        try:
+            data = self.redis.hget(self.key, stage)
+        except redis.RedisError as e:
+            self._log_error('Checkpoint lookup failed', e, stage=stage)
+            return None
+        if data is None:
+            return None
+        return json.loads(data)
+
+    def set(self, stage, value):
+        """Record that a stage is completed.
+
+        Parameters
+        ----------
+        stage : `str`
+            Name of the stage.
+        value
+            JSON-serializable result of the stage that's needed to resume
+            the publication, like the registered build resource.
+        """
+        try:
+            pipeline = self.redis.pipeline()
+            pipeline.hset(self.key, stage, json.dumps(value))
+            pipeline.expire(self.key, self.ttl)
+            pipeline.execute()
+        except redis.RedisError as e:
+            self._log_error('Checkpoint update failed', e, stage=stage)
+
+    def add_uploaded(self, path):
+        """Record that an object of the site was uploaded to the build.
+
+        Parameters
+        ----------
+        path : `str`
+            POSIX-style path of the object, relative to the site's root.
+        """
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            pipeline.sadd(self.uploaded_key, path)
+            pipeline.expire(self.uploaded_key, self.ttl)
+            pipeline.execute()
+        except redis.RedisError as e:
+            self._log_error('Checkpoint update failed', e, path=path)
+
+    def get_uploaded(self):
+        """Get the objects that were uploaded to the build (see
+        `add_uploaded`).
+
+        Returns
+        -------
+        paths : `set` of `str`
+            Paths of the objects, relative to the site's root.
+        """
+        try:
+            return set(self.redis.smembers(self.uploaded_key))
+        except redis.RedisError as e:
+            self._log_error('Checkpoint lookup failed', e)
+            return set()
+
+    def clear(self):
+        """Delete the publication's checkpoints, once it's finished.
+        """
+        try:
+            self.redis.delete(self.key, self.uploaded_key)
+        except redis.RedisError as e:
+            self._log_error('Checkpoint deletion failed', e)
+
+    def _log_error(self, message, error, **kwargs):
+        structlog.get_logger(__name__).warning(
+            message, publication_id=self.publication_id, error=str(error),
+            **kwargs)
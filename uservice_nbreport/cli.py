@@ -4,11 +4,13 @@ Flask CLI subcommands are implemented with Click. The application factory
 (`uservice_nbreport.appfactory`) registers these.
 """
 
-__all__ = ('add_app_commands', 'version_command')
+__all__ = ('add_app_commands', 'version_command', 'collect_blobs_command')
 
 import click
+from flask import current_app
 from flask.cli import with_appcontext
 
+from .blobstore import get_blob_store
 from .version import get_version
 
 
@@ -17,6 +19,7 @@ def add_app_commands(app):
     This function is called by `keeper.appfactory.create_flask_app`.
     """
     app.cli.add_command(version_command)
+    app.cli.add_command(collect_blobs_command)
 
 
 @click.command('version')
@@ -29,3 +32,21 @@ def version_command():
        flask --version
     """
     click.echo(get_version())
+
+
+@click.command('collect-blobs')
+@click.option('--max-age', type=int, default=None,
+              help='Maximum age of blobs, in seconds (default: '
+                   '$BLOB_MAX_AGE).')
+@with_appcontext
+def collect_blobs_command(max_age):
+    """Delete staged notebooks and sites left over by interrupted publish
+    tasks.
+
+    Run this periodically, for example from a cron job (see
+    ``kubernetes/uservice-nbreport-collect-blobs-cronjob.yaml``).
+    """
+    if max_age is None:
+        max_age = current_app.config['BLOB_MAX_AGE']
+    count = get_blob_store().collect_garbage(max_age)
+    click.echo('Deleted {0:d} blobs'.format(count))
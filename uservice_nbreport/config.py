@@ -5,6 +5,39 @@ __all__ = ('config_profiles',)
 
 import abc
 import os
+import tempfile
+
+
+def _getenv_bool(name, default=False):
+    """Get a boolean setting from an environment variable.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the environment variable.
+    default : `bool`, optional
+        Value if the environment variable isn't set, or is empty.
+
+    Returns
+    -------
+    value : `bool`
+        `True` for ``true``, ``yes``, ``on``, or ``1``, and `False` for
+        ``false``, ``no``, ``off``, or ``0`` (case-insensitive).
+
+    Raises
+    ------
+    ValueError
+        Raised if the environment variable has any other value.
+    """
+    value = os.getenv(name, '').strip().lower()
+    if not value:
+        return default
+    if value in ('true', 'yes', 'on', '1'):
+        return True
+    if value in ('false', 'no', 'off', '0'):
+        return False
+    raise ValueError('${0} must be true or false, not {1!r}'.format(
+        name, os.getenv(name)))
 
 
 class ConfigurationBase(metaclass=abc.ABCMeta):
@@ -24,6 +57,67 @@ class ConfigurationBase(metaclass=abc.ABCMeta):
     Set via ``$AUTH_GITHUB_ORG``.
     """
 
+    GITHUB_MEMBERSHIP_CHECK = os.getenv('GITHUB_MEMBERSHIP_CHECK', 'orgs')
+    """How membership of ``AUTHORIZED_GITHUB_ORG`` is checked:
+
+    - ``orgs``: page through the user's organizations
+      (``GET /user/orgs``), stopping once the organization is found.
+    - ``members``: a single ``GET /orgs/{org}/members/{user}`` request.
+      The user's token must be able to read the organization's members.
+
+    Default: ``orgs``.
+
+    Set via ``$GITHUB_MEMBERSHIP_CHECK``.
+    """
+
+    AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', '300'))
+    """Number of seconds that GitHub authentication results and allowed
+    organization membership decisions are cached (see
+    `uservice_nbreport.authcache.GitHubAuthCache` and
+    ``AUTH_CACHE_NEGATIVE_TTL``). Set to 0 to disable the cache.
+
+    Default: 300.
+
+    Set via ``$AUTH_CACHE_TTL``.
+    """
+
+    AUTH_CACHE_NEGATIVE_TTL = float(
+        os.getenv('AUTH_CACHE_NEGATIVE_TTL', '0'))
+    """Number of seconds that denied organization membership decisions are
+    cached. By default they aren't cached, so users who are added to the
+    organization, or who fix their token's scopes, get access on their next
+    request. A few seconds limits the GitHub requests of repeatedly denied
+    users. Allowed decisions are cached for ``AUTH_CACHE_TTL``.
+
+    Default: 0.
+
+    Set via ``$AUTH_CACHE_NEGATIVE_TTL``.
+    """
+
+    AUTH_CACHE_MAX_SIZE = int(os.getenv('AUTH_CACHE_MAX_SIZE', '1024'))
+    """Maximum number of GitHub authentication results cached in each
+    process's memory. Least-recently-used results are evicted.
+
+    Set via ``$AUTH_CACHE_MAX_SIZE``.
+    """
+
+    AUTH_CACHE_SALT = os.getenv('AUTH_CACHE_SALT')
+    """Secret salt for hashing the credentials that key cached GitHub
+    authentication results. By default, each process uses a random salt.
+    Required for sharing results through Redis.
+
+    Set via ``$AUTH_CACHE_SALT``.
+    """
+
+    AUTH_CACHE_REDIS = _getenv_bool('AUTH_CACHE_REDIS')
+    """Share cached GitHub authentication results between processes
+    through Redis (``REDIS_URL``). ``AUTH_CACHE_SALT`` must be set.
+
+    Default: `False`.
+
+    Set via ``$AUTH_CACHE_REDIS`` (``true`` or ``false``).
+    """
+
     KEEPER_URL = os.getenv('KEEPER_URL', 'https://keeper.lsst.codes')
     """URL of the LSST the Docs API server.
 
@@ -44,6 +138,50 @@ class ConfigurationBase(metaclass=abc.ABCMeta):
     Set via ``$KEEPER_PASSWORD``.
     """
 
+    HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '10'))
+    """Maximum number of kept-alive connections to each host of an
+    upstream API (GitHub and LTD Keeper), in each process (see
+    `uservice_nbreport.httpclient.get_session`). Set this to at least the
+    number of uWSGI threads per process. Celery's prefork worker processes
+    run one task at a time, but scanning editions uses up to 10 threads.
+
+    Default: 10.
+
+    Set via ``$HTTP_POOL_MAXSIZE``.
+    """
+
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '10'))
+    """Timeout, in seconds, for connecting to an upstream API.
+
+    Set via ``$HTTP_CONNECT_TIMEOUT``.
+    """
+
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '60'))
+    """Timeout, in seconds, for reading a response from an upstream API.
+
+    Set via ``$HTTP_READ_TIMEOUT``.
+    """
+
+    KEEPER_TOKEN_LIFETIME = int(os.getenv('KEEPER_TOKEN_LIFETIME', '3600'))
+    """Lifetime of LTD Keeper tokens, in seconds. Tokens are cached in
+    Redis and shared by all processes (see
+    `uservice_nbreport.keepertoken.KeeperTokenCache`).
+
+    Default: 3600 (LTD Keeper's default token lifetime).
+
+    Set via ``$KEEPER_TOKEN_LIFETIME``.
+    """
+
+    KEEPER_TOKEN_REFRESH_AHEAD = int(
+        os.getenv('KEEPER_TOKEN_REFRESH_AHEAD', '600'))
+    """Number of seconds before a cached LTD Keeper token expires when a
+    new token is requested.
+
+    Default: 600.
+
+    Set via ``$KEEPER_TOKEN_REFRESH_AHEAD``.
+    """
+
     CELERY_RESULT_URL = os.getenv('REDIS_URL', 'redis://localhost:6379')
     """URI for the celery result store (Redis).
     """
@@ -52,6 +190,246 @@ class ConfigurationBase(metaclass=abc.ABCMeta):
     """URI for the celery task broker (Redis).
     """
 
+    RENDER_QUEUE = os.getenv('RENDER_QUEUE', 'celery')
+    """Name of the Celery queue of the render stage of publications (the
+    ``render_instance`` and ``publish_instance`` tasks).
+
+    Workers that consume this queue run CPU-bound rendering, so they
+    typically use the prefork pool, with a process per CPU.
+
+    Default: ``celery`` (Celery's default queue).
+
+    Set via ``$RENDER_QUEUE``.
+    """
+
+    UPLOAD_QUEUE = os.getenv('UPLOAD_QUEUE', 'celery')
+    """Name of the Celery queue of the upload stage of publications (the
+    ``upload_instance`` task).
+
+    Workers that consume this queue mostly wait on S3 and LTD Keeper, so
+    they can run many tasks at once with the gevent or eventlet pool.
+
+    Default: ``celery`` (Celery's default queue).
+
+    Set via ``$UPLOAD_QUEUE``.
+    """
+
+    PUBLISH_MAX_RETRIES = int(os.getenv('PUBLISH_MAX_RETRIES', '5'))
+    """Maximum number of times a publish task is retried after a transient
+    error, like a connection error or a ``5xx`` response from S3 or LTD
+    Keeper. Retried tasks resume from their last completed stage.
+
+    Default: 5.
+
+    Set via ``$PUBLISH_MAX_RETRIES``.
+    """
+
+    PUBLISH_RETRY_DELAY = float(os.getenv('PUBLISH_RETRY_DELAY', '15'))
+    """Delay, in seconds, before the first retry of a publish task. Later
+    retries back off exponentially, with jitter, up to
+    ``PUBLISH_RETRY_MAX_DELAY``.
+
+    Default: 15.
+
+    Set via ``$PUBLISH_RETRY_DELAY``.
+    """
+
+    PUBLISH_RETRY_MAX_DELAY = float(
+        os.getenv('PUBLISH_RETRY_MAX_DELAY', '300'))
+    """Maximum delay, in seconds, between retries of a publish task.
+
+    Default: 300.
+
+    Set via ``$PUBLISH_RETRY_MAX_DELAY``.
+    """
+
+    CALLBACK_QUEUE = os.getenv('CALLBACK_QUEUE', 'celery')
+    """Name of the Celery queue of the deliveries of completion callbacks
+    (the ``deliver_callback`` task).
+
+    Deliveries wait on the clients' servers, so they're queued separately
+    from publications, for a small pool of workers.
+
+    Default: ``celery`` (Celery's default queue).
+
+    Set via ``$CALLBACK_QUEUE``.
+    """
+
+    CALLBACK_ALLOWED_HOSTS = [
+        host.strip().lower()
+        for host in os.getenv('CALLBACK_ALLOWED_HOSTS', '').split(',')
+        if host.strip()]
+    """Hosts that completion callbacks can be delivered to. Entries starting
+    with ``.``, like ``.example.com``, also allow the host's subdomains.
+    Listed hosts are trusted even if they resolve to internal addresses.
+    If the list is empty, any host can be used as long as all of its
+    addresses are public, so that clients can't make the workers send
+    requests to cluster-internal services or cloud metadata addresses.
+
+    Default: empty.
+
+    Set via ``$CALLBACK_ALLOWED_HOSTS`` (comma-separated).
+    """
+
+    CALLBACK_MAX_RETRIES = int(os.getenv('CALLBACK_MAX_RETRIES', '8'))
+    """Maximum number of times the delivery of a completion callback is
+    retried after a connection error or a ``408``, ``429``, or ``5xx``
+    response.
+
+    Default: 8.
+
+    Set via ``$CALLBACK_MAX_RETRIES``.
+    """
+
+    CALLBACK_RETRY_DELAY = float(os.getenv('CALLBACK_RETRY_DELAY', '10'))
+    """Delay, in seconds, before the first retry of a callback delivery.
+    Later retries back off exponentially, with jitter, up to
+    ``CALLBACK_RETRY_MAX_DELAY``.
+
+    Default: 10.
+
+    Set via ``$CALLBACK_RETRY_DELAY``.
+    """
+
+    CALLBACK_RETRY_MAX_DELAY = float(
+        os.getenv('CALLBACK_RETRY_MAX_DELAY', '600'))
+    """Maximum delay, in seconds, between retries of a callback delivery.
+
+    Default: 600.
+
+    Set via ``$CALLBACK_RETRY_MAX_DELAY``.
+    """
+
+    COALESCE_PUBLICATIONS = _getenv_bool('COALESCE_PUBLICATIONS')
+    """Coalesce publications of the same report instance: when a notebook
+    is uploaded for an instance, the instance's earlier publications that
+    are still queued or running skip their remaining stages and end with
+    the ``SUPERSEDED`` status, so the intermediate notebooks are never
+    published.
+
+    Default: `False`.
+
+    Set via ``$COALESCE_PUBLICATIONS`` (``true`` or ``false``).
+    """
+
+    BULK_MAX_NOTEBOOKS = int(os.getenv('BULK_MAX_NOTEBOOKS', '100'))
+    """Maximum number of notebooks in a ``POST /bulk/notebooks`` request.
+
+    Default: 100.
+
+    Set via ``$BULK_MAX_NOTEBOOKS``.
+    """
+
+    PROGRESS_MIN_INTERVAL = float(os.getenv('PROGRESS_MIN_INTERVAL', '0.5'))
+    """Minimum time, in seconds, between progress reports of the same
+    stage of a publication, like the number of uploaded files (see
+    `uservice_nbreport.progress.ProgressReporter`).
+
+    Default: 0.5.
+
+    Set via ``$PROGRESS_MIN_INTERVAL``.
+    """
+
+    QUEUE_MAX_WAIT = float(os.getenv('QUEUE_MAX_WAIT', '20'))
+    """Maximum time, in seconds, that ``GET /queue/<id>?wait=<seconds>``
+    waits for the publication's status to change. Keep it below the
+    timeouts of the proxies in front of the app.
+
+    Default: 20.
+
+    Set via ``$QUEUE_MAX_WAIT``.
+    """
+
+    QUEUE_MAX_WAITERS = int(os.getenv('QUEUE_MAX_WAITERS', '1'))
+    """Maximum number of requests in each app process that wait for
+    publications to change (long-polls and event streams). Each of them
+    holds one of uWSGI's threads, so keep it below ``threads`` in
+    ``uwsgi.ini`` to leave threads for the other routes. Long-polls over
+    the limit respond without waiting, and event streams over the limit
+    get a 503 error.
+
+    Default: 1.
+
+    Set via ``$QUEUE_MAX_WAITERS``.
+    """
+
+    QUEUE_EVENTS_ENABLED = _getenv_bool('QUEUE_EVENTS_ENABLED')
+    """Toggle for the ``GET /queue/<id>/events`` stream (Server-Sent
+    Events). The app runs on synchronous uWSGI threads, so only enable it
+    on deployments with threads to spare (see ``QUEUE_MAX_WAITERS``).
+
+    Default: `False`.
+
+    Set via ``$QUEUE_EVENTS_ENABLED`` (``true`` or ``false``).
+    """
+
+    QUEUE_EVENTS_MAX_DURATION = float(
+        os.getenv('QUEUE_EVENTS_MAX_DURATION', '60'))
+    """Maximum duration, in seconds, of a ``GET /queue/<id>/events``
+    stream. Clients reconnect to continue following the publication.
+
+    Default: 60.
+
+    Set via ``$QUEUE_EVENTS_MAX_DURATION``.
+    """
+
+    QUEUE_EVENTS_HEARTBEAT = float(os.getenv('QUEUE_EVENTS_HEARTBEAT', '15'))
+    """Interval, in seconds, of the heartbeat comments of a
+    ``GET /queue/<id>/events`` stream, which keep idle connections open.
+
+    Default: 15.
+
+    Set via ``$QUEUE_EVENTS_HEARTBEAT``.
+    """
+
+    REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379')
+    """URI of the Redis server used by the app's own indexes and caches
+    (see `uservice_nbreport.redisstore`).
+
+    Set via ``$REDIS_URL``.
+    """
+
+    BLOB_STORE_URL = os.getenv(
+        'BLOB_STORE_URL',
+        'file://' + os.path.join(tempfile.gettempdir(), 'nbreport-blobs'))
+    """URL of the store where uploaded notebooks and rendered sites are
+    staged for publish tasks (see `uservice_nbreport.blobstore`):
+    ``file:///path/to/dir`` for a directory, which must be shared by the web
+    and worker processes, or ``s3://bucket/prefix`` for an S3 bucket, which
+    is accessed with the ``$AWS_ID`` and ``$AWS_SECRET`` credentials.
+
+    Default: ``nbreport-blobs`` in the system's temporary directory, which
+    only works when the web and worker processes run on the same machine.
+    The production profile has no default (see `ProductionConfig`).
+
+    Set via ``$BLOB_STORE_URL``.
+    """
+
+    BLOB_STORE_ENDPOINT_URL = os.getenv('BLOB_STORE_ENDPOINT_URL')
+    """URL of an S3-compatible service (like MinIO) for an ``s3://``
+    ``BLOB_STORE_URL``, instead of AWS S3.
+
+    Set via ``$BLOB_STORE_ENDPOINT_URL``.
+    """
+
+    BLOB_COMPRESSION_LEVEL = int(os.getenv('BLOB_COMPRESSION_LEVEL', '6'))
+    """Gzip compression level of staged blobs.
+
+    Default: 6.
+
+    Set via ``$BLOB_COMPRESSION_LEVEL``.
+    """
+
+    BLOB_MAX_AGE = int(os.getenv('BLOB_MAX_AGE', str(24 * 3600)))
+    """Age, in seconds, after which staged blobs are deleted by the
+    ``flask collect-blobs`` command. Tasks delete their blobs when they
+    finish, so older blobs are leftovers of interrupted tasks.
+
+    Default: 86400 (one day).
+
+    Set via ``$BLOB_MAX_AGE``.
+    """
+
     KEEPER_AWS_ID = os.getenv('AWS_ID')
     """AWS key identifier. Used for uploading files to LSST the Docs's
     S3 bucket.
@@ -61,6 +439,173 @@ class ConfigurationBase(metaclass=abc.ABCMeta):
     """AWS secret key. Used for uploading files to LSST the Docs's S3 bucket.
     """
 
+    EXTRACT_OUTPUTS = _getenv_bool('EXTRACT_OUTPUTS')
+    """Toggle for writing output images (PNG and JPEG) as separate,
+    content-addressed, files rather than embedding them in the report's HTML
+    as base64 data. This changes the layout of published sites, which then
+    have an ``_outputs`` directory.
+
+    Default: `False`.
+
+    Set via ``$EXTRACT_OUTPUTS`` (``true`` or ``false``).
+    """
+
+    SHARED_ASSETS_URL = os.getenv('SHARED_ASSETS_URL')
+    """Base URL where the static assets shared by all reports (stylesheets
+    and images) are served from. This URL corresponds to the
+    ``SHARED_ASSETS_PREFIX`` directory of the ``SHARED_ASSETS_BUCKET``.
+
+    Default: `None`, meaning that the assets are uploaded with each report
+    instance instead.
+
+    Set via ``$SHARED_ASSETS_URL``.
+    """
+
+    SHARED_ASSETS_BUCKET = os.getenv('SHARED_ASSETS_BUCKET', 'lsst-the-docs')
+    """Name of the S3 bucket where shared static assets are published.
+
+    Set via ``$SHARED_ASSETS_BUCKET``.
+    """
+
+    SHARED_ASSETS_PREFIX = os.getenv('SHARED_ASSETS_PREFIX',
+                                     'nbreport-assets')
+    """Directory in the ``SHARED_ASSETS_BUCKET`` where shared static assets
+    are published.
+
+    Set via ``$SHARED_ASSETS_PREFIX``.
+    """
+
+    COMPRESSION_ENCODING = os.getenv('COMPRESSION_ENCODING', 'none')
+    """Content encoding for pre-compressing the text files of reports (HTML,
+    CSS, SVG, and JSON) before they're uploaded: ``gzip`` or ``br``
+    (Brotli, which requires the ``brotli`` package). The S3 objects are then
+    stored compressed, with a ``Content-Encoding`` header, so check that
+    the CDN and clients in front of the bucket handle it before enabling it.
+
+    Default: ``none``, meaning that files are uploaded uncompressed.
+
+    Set via ``$COMPRESSION_ENCODING``.
+    """
+    if COMPRESSION_ENCODING.lower() == 'none':
+        COMPRESSION_ENCODING = None
+
+    COMPRESSION_LEVEL = (int(os.getenv('COMPRESSION_LEVEL'))
+                         if os.getenv('COMPRESSION_LEVEL') else None)
+    """Compression level for ``COMPRESSION_ENCODING``.
+
+    Default: `None`, meaning a default level for the encoding (see
+    `uservice_nbreport.publish.compression.DEFAULT_COMPRESSION_LEVELS`).
+
+    Set via ``$COMPRESSION_LEVEL``.
+    """
+
+    UPLOAD_MAX_WORKERS = int(os.getenv('UPLOAD_MAX_WORKERS', '8'))
+    """Maximum number of concurrent S3 uploads (of objects or parts of large
+    objects) in a publish task.
+
+    Default: 8.
+
+    Set via ``$UPLOAD_MAX_WORKERS``.
+    """
+
+    UPLOAD_MULTIPART_THRESHOLD = int(
+        os.getenv('UPLOAD_MULTIPART_THRESHOLD', str(8 * 1024 ** 2)))
+    """Size, in bytes, from which files are uploaded to S3 in parts of this
+    size.
+
+    Default: 8 MiB.
+
+    Set via ``$UPLOAD_MULTIPART_THRESHOLD``.
+    """
+
+    INCREMENTAL_UPLOAD = _getenv_bool('INCREMENTAL_UPLOAD')
+    """Copy files that haven't changed since the previous build of a report
+    instance (or report) from that build, with server-side S3 copies,
+    rather than uploading them. Builds are tracked in Redis, and the
+    credentials need permission to read the previous builds' objects.
+
+    Default: `False`.
+
+    Set via ``$INCREMENTAL_UPLOAD`` (``true`` or ``false``).
+    """
+
+    PARALLEL_RENDER = _getenv_bool('PARALLEL_RENDER')
+    """Toggle for rendering the cells of large notebooks in parallel, in a
+    pool of worker processes started by each Celery worker process.
+
+    Default: `False`.
+
+    Set via ``$PARALLEL_RENDER`` (``true`` or ``false``).
+    """
+
+    PARALLEL_RENDER_MIN_CELLS = int(os.getenv('PARALLEL_RENDER_MIN_CELLS',
+                                              '1000'))
+    """Minimum number of cells in a notebook for rendering it in parallel
+    (if ``PARALLEL_RENDER`` is enabled).
+
+    Set via ``$PARALLEL_RENDER_MIN_CELLS``.
+    """
+
+    PARALLEL_RENDER_MIN_BYTES = int(os.getenv('PARALLEL_RENDER_MIN_BYTES',
+                                              str(10000000)))
+    """Minimum size of the cell sources and outputs of a notebook for
+    rendering it in parallel (if ``PARALLEL_RENDER`` is enabled).
+
+    Default: 10 MB.
+
+    Set via ``$PARALLEL_RENDER_MIN_BYTES``.
+    """
+
+    PARALLEL_RENDER_PROCESSES = (int(os.getenv('PARALLEL_RENDER_PROCESSES'))
+                                 if os.getenv('PARALLEL_RENDER_PROCESSES')
+                                 else None)
+    """Number of worker processes for parallel rendering.
+
+    Default: `None`, meaning the number of CPUs.
+
+    Set via ``$PARALLEL_RENDER_PROCESSES``.
+    """
+
+    RENDER_CACHE_DIR = os.getenv('RENDER_CACHE_DIR')
+    """Directory where Celery workers cache rendered reports, so that
+    re-uploads of an identical notebook aren't rendered again.
+
+    Default: `None`, which disables the render cache.
+
+    Set via ``$RENDER_CACHE_DIR``.
+    """
+
+    RENDER_CACHE_MAX_BYTES = int(
+        os.getenv('RENDER_CACHE_MAX_BYTES', str(1024 ** 3)))
+    """Maximum size of the render cache, in bytes. Least-recently-used
+    entries are evicted beyond this size.
+
+    Default: 1 GiB.
+
+    Set via ``$RENDER_CACHE_MAX_BYTES``.
+    """
+
+    CELL_CACHE_DIR = os.getenv('CELL_CACHE_DIR')
+    """Directory where rendered cells are cached, in a subdirectory for each
+    report. Instances of a report reuse the HTML of cells that didn't
+    change since an earlier instance. The directory can be shared by the
+    Celery worker processes on a host.
+
+    Default: `None`, which disables the cell cache.
+
+    Set via ``$CELL_CACHE_DIR``.
+    """
+
+    CELL_CACHE_MAX_BYTES = int(
+        os.getenv('CELL_CACHE_MAX_BYTES', str(100 * 1024 ** 2)))
+    """Maximum size of the cell cache of each report, in bytes.
+    Least-recently-used cells are evicted beyond this size.
+
+    Default: 100 MiB.
+
+    Set via ``$CELL_CACHE_MAX_BYTES``.
+    """
+
 
 class DevelopmentConfig(ConfigurationBase):
     """Configuration defaults for development.
@@ -100,6 +645,16 @@ class ProductionConfig(ConfigurationBase):
     """Name of this configuration profile.
     """
 
+    BLOB_STORE_URL = os.getenv('BLOB_STORE_URL')
+    """URL of the blob store (see `ConfigurationBase.BLOB_STORE_URL`).
+
+    It must be set in production, since the web and worker processes run
+    in different pods: use an ``s3://bucket/prefix`` store, or a
+    ``file://`` directory on a volume that all of the pods mount.
+
+    Set via ``$BLOB_STORE_URL``.
+    """
+
 
 config_profiles = {
     'dev': DevelopmentConfig,
@@ -0,0 +1,206 @@
+"""Index of LTD Keeper edition URLs, keyed by product and edition slug.
+
+LTD Keeper doesn't have an endpoint for getting an edition from its slug,
+which is the report's instance ID. The index, stored in Redis, maps the
+slugs of each product's editions to their API URLs. `reserve_instance
+<uservice_nbreport.routes.reserveinstance.reserve_instance>` adds each
+edition it creates, and `find_edition_url` falls back to scanning the
+product's editions, and indexing them, when a slug isn't in the index.
+"""
+
+__all__ = ('EditionIndex', 'find_edition_url', 'scan_editions')
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import redis
+import structlog
+
+from .httpclient import get_session
+
+
+class EditionIndex:
+    """Index of edition URLs stored in Redis.
+
+    Each product's index is a Redis hash, named ``{prefix}:{product}``, that
+    maps edition slugs to edition URLs. Redis errors are logged and treated
+    as index misses, so that publishing still works (with slower edition
+    lookups) while Redis is unavailable.
+
+    Parameters
+    ----------
+    redis_client : `redis.StrictRedis`
+        Redis client (see `uservice_nbreport.redisstore.get_redis`). It
+        should decode responses.
+    prefix : `str`, optional
+        Prefix of the Redis keys.
+    """
+
+    def __init__(self, redis_client, prefix='nbreport:editions'):
+        self.redis = redis_client
+        self.prefix = prefix
+
+    def get(self, product, slug):
+        """Get the URL of an edition.
+
+        Parameters
+        ----------
+        product : `str`
+            Slug of the LTD Product.
+        slug : `str`
+            Slug of the edition (the instance ID).
+
+        Returns
+        -------
+        edition_url : `str`
+            URL of the edition in the LTD Keeper API, or `None` if the
+            edition isn't indexed.
+        """
+        try:
+            return self.redis.hget(self._get_key(product), slug)
+        except redis.RedisError as e:
+            structlog.get_logger(__name__).warning(
+                'Edition index lookup failed', product=product, slug=slug,
+                error=str(e))
+            return None
+
+    def set(self, product, slug, edition_url):
+        """Index the URL of an edition.
+
+        Parameters
+        ----------
+        product : `str`
+            Slug of the LTD Product.
+        slug : `str`
+            Slug of the edition (the instance ID).
+        edition_url : `str`
+            URL of the edition in the LTD Keeper API.
+        """
+        self.update(product, {slug: edition_url})
+
+    def update(self, product, edition_urls):
+        """Index the URLs of several editions of a product.
+
+        Parameters
+        ----------
+        product : `str`
+            Slug of the LTD Product.
+        edition_urls : `dict`
+            Mapping of edition slugs to edition URLs.
+        """
+        if not edition_urls:
+            return
+        key = self._get_key(product)
+        try:
+            pipeline = self.redis.pipeline()
+            for slug, edition_url in edition_urls.items():
+                pipeline.hset(key, slug, edition_url)
+            pipeline.execute()
+        except redis.RedisError as e:
+            structlog.get_logger(__name__).warning(
+                'Edition index update failed', product=product,
+                error=str(e))
+
+    def _get_key(self, product):
+        return '{0}:{1}'.format(self.prefix, product)
+
+
+def scan_editions(*, keeper_url, ltd_token, ltd_product, instance_id=None,
+                  page_size=10):
+    """Scan the editions of a product for an edition slug.
+
+    Editions are fetched newest-first, in pages of ``page_size`` editions
+    that are fetched concurrently. The scan stops after the page that
+    contains the slug.
+
+    Parameters
+    ----------
+    keeper_url : `str`
+        Base URL of the LTD Keeper API.
+    ltd_token : `str`
+        Token for the LTD Keeper API.
+    ltd_product : `str`
+        Slug of the LTD Product resource corresponding to the report.
+    instance_id : `str`, optional
+        Slug of the edition to find. If `None`, every edition is scanned.
+    page_size : `int`, optional
+        Number of editions fetched concurrently.
+
+    Returns
+    -------
+    edition_urls : `dict`
+        Mapping of the slugs of the scanned editions to their URLs.
+    """
+    root_url = urljoin(
+        keeper_url, '/products/{0}/editions/'.format(ltd_product))
+    session = get_session('keeper')
+    response = session.get(root_url, auth=(ltd_token, ''))
+    response.raise_for_status()
+    # Newer editions are more likely to be the ones being published.
+    urls = list(reversed(response.json()['editions']))
+
+    def get_slug(edition_url):
+        response = session.get(edition_url, auth=(ltd_token, ''))
+        response.raise_for_status()
+        return response.json()['slug']
+
+    edition_urls = {}
+    with ThreadPoolExecutor(max_workers=page_size) as executor:
+        for start in range(0, len(urls), page_size):
+            page = urls[start:start + page_size]
+            for edition_url, slug in zip(page, executor.map(get_slug, page)):
+                edition_urls[slug] = edition_url
+            if instance_id is not None and instance_id in edition_urls:
+                break
+    return edition_urls
+
+
+def find_edition_url(*, keeper_url, ltd_token, ltd_product, instance_id,
+                     edition_index=None, page_size=10):
+    """Find the API URL of the edition corresponding to an instance ID.
+
+    Parameters
+    ----------
+    keeper_url : `str`
+        Base URL of the LTD Keeper API.
+    ltd_token : `str`
+        Token for the LTD Keeper API.
+    ltd_product : `str`
+        Slug of the LTD Product resource corresponding to the report.
+    instance_id : `str`
+        Identifier of the instance. This is the slug of the LTD Edition
+        corresponding to the report instance.
+    edition_index : `EditionIndex`, optional
+        Index that's checked first. Editions found by the fallback scan (see
+        `scan_editions`) are added to it.
+    page_size : `int`, optional
+        Number of editions fetched concurrently by the fallback scan.
+
+    Returns
+    -------
+    edition_url : `str`
+        URL of the edition in the LTD Keeper API (not the front-end website
+        URL).
+
+    Raises
+    ------
+    RuntimeError
+        Raised if the product doesn't have an edition with the slug.
+    """
+    if edition_index is not None:
+        edition_url = edition_index.get(ltd_product, instance_id)
+        if edition_url is not None:
+            return edition_url
+
+    edition_urls = scan_editions(
+        keeper_url=keeper_url, ltd_token=ltd_token, ltd_product=ltd_product,
+        instance_id=instance_id, page_size=page_size)
+    if edition_index is not None:
+        edition_index.update(ltd_product, edition_urls)
+
+    try:
+        return edition_urls[instance_id]
+    except KeyError:
+        raise RuntimeError(
+            'Could not identify the URL for an edition with slug={0}'.format(
+                instance_id))
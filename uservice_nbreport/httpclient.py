@@ -0,0 +1,143 @@
+"""Pooled HTTP sessions for the upstream APIs (GitHub and LTD Keeper), and
+for the delivery of completion callbacks.
+
+Each process has one `requests.Session` per upstream, so that connections
+are kept alive and reused across requests and tasks instead of opening a
+new TCP and TLS connection for every call.
+"""
+
+__all__ = ('UPSTREAMS', 'UpstreamSession', 'get_session', 'get_http_metrics')
+
+import os
+
+from flask import current_app, has_app_context
+import requests
+from requests.adapters import HTTPAdapter
+
+UPSTREAMS = ('github', 'keeper', 'callbacks')
+"""Names of the upstream APIs that have a session."""
+
+_DEFAULTS = {
+    'HTTP_POOL_MAXSIZE': 10,
+    'HTTP_CONNECT_TIMEOUT': 10.,
+    'HTTP_READ_TIMEOUT': 60.,
+}
+"""Settings used outside an application context."""
+
+_sessions = {}
+"""Sessions of this process, keyed by upstream (see `get_session`)."""
+
+_sessions_pid = None
+"""ID of the process that created the sessions in ``_sessions``."""
+
+
+class UpstreamSession(requests.Session):
+    """A `requests.Session` with a default timeout.
+
+    Parameters
+    ----------
+    upstream : `str`
+        Name of the upstream API.
+    timeout : `tuple` of `float`
+        Default connect and read timeouts, in seconds, for requests that
+        don't set a ``timeout``.
+    pool_maxsize : `int`
+        Maximum number of connections kept alive for each host. Set this to
+        the number of threads of the process that make concurrent requests.
+    """
+
+    def __init__(self, upstream, *, timeout, pool_maxsize):
+        super().__init__()
+        self.upstream = upstream
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+    @property
+    def metrics(self):
+        """Connection reuse metrics of the session's connection pools
+        (`dict`).
+
+        - ``requests``: number of requests sent.
+        - ``connections``: number of connections opened.
+        - ``reused``: number of requests sent over a connection that was
+          already open.
+        """
+        request_count = 0
+        connection_count = 0
+        adapters = {id(adapter): adapter for adapter in self.adapters.values()}
+        for adapter in adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools[key]
+                request_count += pool.num_requests
+                connection_count += pool.num_connections
+        return {
+            'requests': request_count,
+            'connections': connection_count,
+            'reused': max(request_count - connection_count, 0),
+        }
+
+
+def get_session(upstream):
+    """Get the pooled session of an upstream API for this process.
+
+    Sessions are configured by the ``HTTP_POOL_MAXSIZE``,
+    ``HTTP_CONNECT_TIMEOUT``, and ``HTTP_READ_TIMEOUT`` configurations when
+    called within an application context.
+
+    Parameters
+    ----------
+    upstream : `str`
+        Name of the upstream API: ``'github'`` or ``'keeper'``, or
+        ``'callbacks'`` for the clients' callback URLs.
+
+    Returns
+    -------
+    session : `UpstreamSession`
+        The session.
+
+    Notes
+    -----
+    Sessions are created again in a forked process (like uWSGI and Celery
+    worker processes) so that processes don't share sockets.
+    """
+    global _sessions_pid
+    if upstream not in UPSTREAMS:
+        raise ValueError('Unknown upstream {0!r}'.format(upstream))
+    if _sessions_pid != os.getpid():
+        _sessions.clear()
+        _sessions_pid = os.getpid()
+
+    try:
+        return _sessions[upstream]
+    except KeyError:
+        pass
+
+    config = current_app.config if has_app_context() else _DEFAULTS
+    session = UpstreamSession(
+        upstream,
+        timeout=(config['HTTP_CONNECT_TIMEOUT'], config['HTTP_READ_TIMEOUT']),
+        pool_maxsize=config['HTTP_POOL_MAXSIZE'])
+    _sessions[upstream] = session
+    return session
+
+
+def get_http_metrics():
+    """Get the connection reuse metrics of this process's sessions.
+
+    Returns
+    -------
+    metrics : `dict`
+        Metrics (see `UpstreamSession.metrics`) keyed by upstream name, for
+        the upstreams that have a session.
+    """
+    if _sessions_pid != os.getpid():
+        return {}
+    return {upstream: session.metrics
+            for upstream, session in _sessions.items()}
@@ -0,0 +1,245 @@
+"""Cache of LTD Keeper API tokens shared by the web and worker processes.
+
+LTD Keeper tokens stay valid for a long time (``KEEPER_TOKEN_LIFETIME``), so
+rather than requesting a token for every request and publish task, the
+token is cached in Redis where every uWSGI and Celery worker process can
+reuse it.
+"""
+
+__all__ = ('KeeperTokenCache', 'get_keeper_token_cache', 'is_unauthorized')
+
+import json
+import time
+from urllib.parse import urljoin
+import uuid
+
+from flask import current_app
+from ltdconveyor.keeper.exceptions import KeeperError
+import redis
+import requests
+import structlog
+
+from .httpclient import get_session
+from .redisstore import get_redis
+
+
+class KeeperTokenCache:
+    """Cache of the LTD Keeper token of an account, stored in Redis.
+
+    A cached token is used until ``refresh_ahead`` seconds before it
+    expires. From then on, one process refreshes the token while the others
+    keep using the cached token, which is still valid. A Redis lock ensures
+    that only one process requests a new token at a time, including when
+    the cache is empty.
+
+    If Redis is unavailable, tokens are requested from LTD Keeper without
+    being cached.
+
+    Parameters
+    ----------
+    redis_client : `redis.StrictRedis`
+        Redis client (see `uservice_nbreport.redisstore.get_redis`). It
+        should decode responses.
+    keeper_url : `str`
+        Base URL of the LTD Keeper API.
+    username : `str`
+        Username of the LTD Keeper account.
+    password : `str`
+        Password of the LTD Keeper account.
+    lifetime : `int`, optional
+        Lifetime of LTD Keeper tokens, in seconds.
+    refresh_ahead : `int`, optional
+        Number of seconds before a token expires when it's refreshed.
+    lock_timeout : `int`, optional
+        Maximum time, in seconds, a process holds the refresh lock and waits
+        for it.
+    prefix : `str`, optional
+        Prefix of the Redis keys.
+    """
+
+    expiry_margin = 60
+    """Number of seconds before a token expires when it's evicted from the
+    cache, so that a token is valid for at least this long after it's been
+    returned by `get_token`.
+    """
+
+    def __init__(self, redis_client, *, keeper_url, username, password,
+                 lifetime=3600, refresh_ahead=600, lock_timeout=30,
+                 prefix='nbreport:keeper-token'):
+        self.redis = redis_client
+        self.keeper_url = keeper_url
+        self.username = username
+        self.password = password
+        self.lifetime = lifetime
+        self.refresh_ahead = refresh_ahead
+        self.lock_timeout = lock_timeout
+        self.key = '{0}:{1}@{2}'.format(prefix, username, keeper_url)
+        self.lock_key = self.key + ':lock'
+
+    def get_token(self):
+        """Get a token, from the cache if possible.
+
+        Returns
+        -------
+        token : `str`
+            LTD Keeper API token.
+
+        Raises
+        ------
+        ltdconveyor.keeper.KeeperError
+            Raised if LTD Keeper can't return a token.
+        """
+        try:
+            return self._get_token()
+        except redis.RedisError as e:
+            structlog.get_logger(__name__).warning(
+                'Keeper token cache unavailable', error=str(e))
+            return self._fetch_token()
+
+    def invalidate(self, token=None):
+        """Remove the cached token, typically because LTD Keeper rejected it
+        with a 401 status.
+
+        Parameters
+        ----------
+        token : `str`, optional
+            The rejected token. The cache is only cleared if it still has
+            this token, so that a token that was already refreshed by
+            another process isn't discarded.
+        """
+        try:
+            if token is not None:
+                entry = self._read_entry()
+                if entry is None or entry['token'] != token:
+                    return
+            self.redis.delete(self.key)
+        except redis.RedisError as e:
+            structlog.get_logger(__name__).warning(
+                'Keeper token cache unavailable', error=str(e))
+
+    def _get_token(self):
+        entry = self._read_entry()
+        if entry is not None:
+            if time.time() < entry['refresh_at']:
+                return entry['token']
+            # Refresh ahead of expiry, unless another process is already
+            # refreshing the token, in which case the cached token is still
+            # valid.
+            lock_owner = self._acquire_lock(blocking=False)
+            if lock_owner is None:
+                return entry['token']
+        else:
+            lock_owner = self._acquire_lock(blocking=True)
+            if lock_owner is not None:
+                # Another process may have cached a token while this one
+                # waited for the lock.
+                entry = self._read_entry()
+                if entry is not None:
+                    self._release_lock(lock_owner)
+                    return entry['token']
+
+        try:
+            return self._refresh_token()
+        finally:
+            if lock_owner is not None:
+                self._release_lock(lock_owner)
+
+    def _refresh_token(self):
+        token = self._fetch_token()
+        now = time.time()
+        entry = {
+            'token': token,
+            'refresh_at': now + self.lifetime - self.refresh_ahead,
+        }
+        self.redis.set(self.key, json.dumps(entry),
+                       ex=max(int(self.lifetime - self.expiry_margin), 1))
+        return token
+
+    def _fetch_token(self):
+        response = get_session('keeper').get(
+            urljoin(self.keeper_url, '/token'),
+            auth=(self.username, self.password))
+        if response.status_code != 200:
+            raise KeeperError(
+                'Could not authenticate to {0}: error {1:d}\n{2}'.format(
+                    self.keeper_url, response.status_code, response.text))
+        return response.json()['token']
+
+    def _read_entry(self):
+        data = self.redis.get(self.key)
+        if data is None:
+            return None
+        return json.loads(data)
+
+    def _acquire_lock(self, blocking):
+        """Acquire the refresh lock.
+
+        Returns
+        -------
+        owner : `str`
+            Identifier of the lock owner, for `_release_lock`, or `None` if
+            the lock wasn't acquired.
+        """
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            if self.redis.set(self.lock_key, owner, nx=True,
+                              ex=self.lock_timeout):
+                return owner
+            if not blocking or time.monotonic() >= deadline:
+                return None
+            time.sleep(0.05)
+
+    def _release_lock(self, owner):
+        # The lock expires on its own if this process dies, or if it took
+        # longer than lock_timeout and another process acquired the lock.
+        if self.redis.get(self.lock_key) == owner:
+            self.redis.delete(self.lock_key)
+
+
+def get_keeper_token_cache():
+    """Get the token cache of the app's LTD Keeper account, configured by
+    the ``KEEPER_URL``, ``KEEPER_USERNAME``, ``KEEPER_PASSWORD``,
+    ``KEEPER_TOKEN_LIFETIME``, and ``KEEPER_TOKEN_REFRESH_AHEAD``
+    configurations.
+
+    Must be called within an application context.
+
+    Returns
+    -------
+    token_cache : `KeeperTokenCache`
+        The token cache.
+    """
+    return KeeperTokenCache(
+        get_redis(),
+        keeper_url=current_app.config['KEEPER_URL'],
+        username=current_app.config['KEEPER_USERNAME'],
+        password=current_app.config['KEEPER_PASSWORD'],
+        lifetime=current_app.config['KEEPER_TOKEN_LIFETIME'],
+        refresh_ahead=current_app.config['KEEPER_TOKEN_REFRESH_AHEAD'])
+
+
+def is_unauthorized(error):
+    """Test whether an exception was caused by a 401 response from LTD
+    Keeper.
+
+    Parameters
+    ----------
+    error : `Exception`
+        The exception, typically a `requests.HTTPError` or a
+        `ltdconveyor.keeper.KeeperError`.
+
+    Returns
+    -------
+    unauthorized : `bool`
+        `True` if the response had a 401 status.
+    """
+    if isinstance(error, requests.HTTPError):
+        return (error.response is not None and
+                error.response.status_code == 401)
+    if isinstance(error, KeeperError):
+        # ltdconveyor raises KeeperError with the JSON error body, which
+        # has the response's status.
+        return any(isinstance(arg, dict) and arg.get('status') == 401
+                   for arg in error.args)
+    return False
@@ -0,0 +1,168 @@
+"""Progress reporting of publications, through task states and Redis
+pub/sub.
+
+Publish tasks report the stage they're in (and, while uploading, how many
+objects are uploaded) as the ``PROGRESS`` state of the task, and publish an
+event on the publication's Redis channel whenever their progress or state
+changes. ``GET /queue/<id>?wait=<seconds>`` and ``GET /queue/<id>/events``
+subscribe to the channel to respond as soon as the publication changes,
+rather than clients polling for changes.
+"""
+
+__all__ = ('PROGRESS', 'ProgressReporter', 'publish_event', 'subscribe',
+           'wait_for_event')
+
+import json
+import threading
+import time
+
+import redis
+import structlog
+
+PROGRESS = 'PROGRESS'
+"""Celery state of a publish task that reported its progress."""
+
+_PREFIX = 'nbreport:progress'
+"""Prefix of the Redis channels of publications."""
+
+
+class ProgressReporter:
+    """Reporter of the progress of a publication's task.
+
+    Instances are callables with the progress callback signature used by the
+    publish functions (see `__call__`), and are thread-safe.
+
+    Parameters
+    ----------
+    redis_client : `redis.StrictRedis`
+        Redis client (see `uservice_nbreport.redisstore.get_redis`).
+    publication_id : `str`
+        ID of the publication.
+    task : `celery.Task`, optional
+        The running task, whose state is set to ``PROGRESS``, with the
+        progress as its metadata.
+    min_interval : `float`, optional
+        Minimum time, in seconds, between reports of the same stage. Reports
+        within this interval are dropped, except for the report that
+        completes the stage's work (``done == total``).
+    """
+
+    def __init__(self, redis_client, publication_id, *, task=None,
+                 min_interval=0.5):
+        self.redis = redis_client
+        self.publication_id = publication_id
+        self.task = task
+        # The task's request is thread-local, so its ID is read here for
+        # reports from other threads, like the upload threads.
+        self.task_id = task.request.id if task is not None else None
+        self.min_interval = min_interval
+        self._last_stage = None
+        self._last_time = 0.
+        self._lock = threading.Lock()
+
+    def __call__(self, stage, **info):
+        """Report progress.
+
+        Parameters
+        ----------
+        stage : `str`
+            Name of the current stage, like ``'render'`` or ``'upload'``.
+        **info
+            Other JSON-serializable progress information, like the ``done``
+            and ``total`` number of uploaded objects.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if stage == self._last_stage \
+                    and now - self._last_time < self.min_interval \
+                    and info.get('done') != info.get('total'):
+                return
+            self._last_stage = stage
+            self._last_time = now
+
+        progress = dict(info, stage=stage)
+        if self.task_id is not None:
+            self.task.update_state(task_id=self.task_id, state=PROGRESS,
+                                   meta=progress)
+        publish_event(self.redis, self.publication_id,
+                      {'event': 'progress', 'progress': progress})
+
+
+def publish_event(redis_client, publication_id, event):
+    """Publish an event on a publication's channel.
+
+    Redis errors are logged, not raised, since clients still get the
+    publication's status when they poll or their wait times out.
+
+    Parameters
+    ----------
+    redis_client : `redis.StrictRedis`
+        Redis client.
+    publication_id : `str`
+        ID of the publication.
+    event : `dict`
+        JSON-serializable event.
+    """
+    try:
+        redis_client.publish(_get_channel(publication_id), json.dumps(event))
+    except redis.RedisError as e:
+        structlog.get_logger(__name__).warning(
+            'Progress event not published', publication_id=publication_id,
+            error=str(e))
+
+
+def subscribe(redis_client, publication_id):
+    """Subscribe to the events of a publication.
+
+    Subscribe before reading the publication's status, so that no change
+    is missed between reading the status and waiting for events.
+
+    Parameters
+    ----------
+    redis_client : `redis.StrictRedis`
+        Redis client.
+    publication_id : `str`
+        ID of the publication.
+
+    Returns
+    -------
+    pubsub : `redis.client.PubSub`
+        The subscription, for `wait_for_event`. Close it when it's no longer
+        needed.
+    """
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(_get_channel(publication_id))
+    return pubsub
+
+
+def wait_for_event(pubsub, timeout):
+    """Wait for the next event of a publication.
+
+    Parameters
+    ----------
+    pubsub : `redis.client.PubSub`
+        Subscription to the publication's events (see `subscribe`).
+    timeout : `float`
+        Maximum time to wait, in seconds.
+
+    Returns
+    -------
+    event : `dict`
+        The event, or `None` if there was no event before the timeout.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        message = pubsub.get_message(timeout=remaining)
+        if message is not None and message['type'] == 'message':
+            return json.loads(message['data'])
+        if message is None:
+            # get_message returns early when there are no subscriptions
+            # yet, so don't spin.
+            time.sleep(min(0.01, max(remaining, 0)))
+
+
+def _get_channel(publication_id):
+    return '{0}:{1}'.format(_PREFIX, publication_id)
@@ -0,0 +1,226 @@
+"""Index of the latest publication queued for each report instance.
+
+When a client uploads several notebooks for the same instance in quick
+succession, only the latest one needs to be published. Queueing a
+publication supersedes the earlier publication of the instance, and the
+tasks of a superseded publication skip their remaining stages (see
+`uservice_nbreport.tasks.publishnb`).
+
+The index also records the groups of publications queued by bulk uploads,
+and the completion callbacks of publications.
+"""
+
+__all__ = ('PublicationIndex', 'PublicationSuperseded', 'SUPERSEDED')
+
+import json
+
+import redis
+import structlog
+
+SUPERSEDED = 'SUPERSEDED'
+"""Celery state of the tasks of a superseded publication."""
+
+
+class PublicationSuperseded(Exception):
+    """Raised to stop a publication that was superseded by a newer one.
+    """
+
+
+class PublicationIndex:
+    """Index of the latest publication of each report instance, stored in
+    Redis.
+
+    Redis errors are logged and publications are then treated as not
+    superseded, so that every upload is published while Redis is
+    unavailable.
+
+    Parameters
+    ----------
+    redis_client : `redis.StrictRedis`
+        Redis client (see `uservice_nbreport.redisstore.get_redis`). It
+        should decode responses.
+    ttl : `int`, optional
+        Lifetime of the index entries, in seconds. This should be longer
+        than publications stay queued.
+    prefix : `str`, optional
+        Prefix of the Redis keys.
+    """
+
+    def __init__(self, redis_client, ttl=24 * 3600,
+                 prefix='nbreport:publications'):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def supersede(self, product, instance_id, publication_id):
+        """Record a new publication of an instance, superseding the
+        instance's previous publication.
+
+        Parameters
+        ----------
+        product : `str`
+            Slug of the LTD Product.
+        instance_id : `str`
+            Slug of the edition (the instance ID).
+        publication_id : `str`
+            ID of the new publication.
+
+        Returns
+        -------
+        previous_id : `str`
+            ID of the superseded publication, or `None` if the index didn't
+            have a publication of the instance.
+        """
+        latest_key = '{0}:latest:{1}:{2}'.format(self.prefix, product,
+                                                 instance_id)
+        try:
+            pipeline = self.redis.pipeline()
+            pipeline.getset(latest_key, publication_id)
+            pipeline.expire(latest_key, self.ttl)
+            previous_id = pipeline.execute()[0]
+            if previous_id is not None and previous_id != publication_id:
+                self.redis.set(self._get_superseded_key(previous_id),
+                               publication_id, ex=self.ttl)
+            else:
+                previous_id = None
+        except redis.RedisError as e:
+            structlog.get_logger(__name__).warning(
+                'Publication index update failed', product=product,
+                instance_id=instance_id, error=str(e))
+            return None
+        return previous_id
+
+    def is_superseded(self, publication_id):
+        """Test whether a publication was superseded.
+
+        Parameters
+        ----------
+        publication_id : `str`
+            ID of the publication.
+
+        Returns
+        -------
+        superseded : `bool`
+            `True` if a newer publication of the same instance was queued.
+        """
+        try:
+            return bool(self.redis.exists(
+                self._get_superseded_key(publication_id)))
+        except redis.RedisError as e:
+            structlog.get_logger(__name__).warning(
+                'Publication index lookup failed',
+                publication_id=publication_id, error=str(e))
+            return False
+
+    def set_group(self, group_id, publications):
+        """Record the publications of a group, queued together by a bulk
+        upload.
+
+        Parameters
+        ----------
+        group_id : `str`
+            ID of the group.
+        publications : `list` of `dict`
+            The group's publications, with ``publication_id``,
+            ``ltd_product``, and ``instance_id`` fields.
+        """
+        try:
+            self.redis.set(self._get_group_key(group_id),
+                           json.dumps(publications), ex=self.ttl)
+        except redis.RedisError as e:
+            structlog.get_logger(__name__).warning(
+                'Publication index update failed', group_id=group_id,
+                error=str(e))
+
+    def get_group(self, group_id):
+        """Get the publications of a group.
+
+        Parameters
+        ----------
+        group_id : `str`
+            ID of the group.
+
+        Returns
+        -------
+        publications : `list` of `dict`
+            The group's publications (see `set_group`), or `None` if the
+            group isn't in the index.
+        """
+        try:
+            data = self.redis.get(self._get_group_key(group_id))
+        except redis.RedisError as e:
+            structlog.get_logger(__name__).warning(
+                'Publication index lookup failed', group_id=group_id,
+                error=str(e))
+            return None
+        if data is None:
+            return None
+        return json.loads(data)
+
+    def set_callback(self, publication_id, callback):
+        """Record the completion callback of a publication.
+
+        Parameters
+        ----------
+        publication_id : `str`
+            ID of the publication.
+        callback : `dict`
+            The callback, with ``url`` and ``secret`` fields, and the
+            ``ltd_product`` and ``instance_id`` of the publication (see
+            `uservice_nbreport.tasks.callbacks`).
+
+        Notes
+        -----
+        The ``secret`` is stored in plain text in Redis until the callback
+        is popped, or for the index's TTL, since it's needed to sign the
+        callback request. It is also sent through the Celery broker to the
+        ``deliver_callback`` task. Clients should use a secret per
+        publication, or per client, rather than a long-lived credential.
+
+        Raises
+        ------
+        redis.RedisError
+            Raised if the callback isn't recorded, since it then wouldn't be
+            delivered.
+        """
+        self.redis.set(self._get_callback_key(publication_id),
+                       json.dumps(callback), ex=self.ttl)
+
+    def pop_callback(self, publication_id):
+        """Get and remove the completion callback of a publication, so that
+        it's delivered once.
+
+        Parameters
+        ----------
+        publication_id : `str`
+            ID of the publication.
+
+        Returns
+        -------
+        callback : `dict`
+            The callback (see `set_callback`), or `None` if the publication
+            has no callback (or it was already popped).
+        """
+        key = self._get_callback_key(publication_id)
+        try:
+            pipeline = self.redis.pipeline()
+            pipeline.get(key)
+            pipeline.delete(key)
+            data = pipeline.execute()[0]
+        except redis.RedisError as e:
+            structlog.get_logger(__name__).warning(
+                'Publication index lookup failed',
+                publication_id=publication_id, error=str(e))
+            return None
+        if data is None:
+            return None
+        return json.loads(data)
+
+    def _get_callback_key(self, publication_id):
+        return '{0}:callback:{1}'.format(self.prefix, publication_id)
+
+    def _get_group_key(self, group_id):
+        return '{0}:group:{1}'.format(self.prefix, group_id)
+
+    def _get_superseded_key(self, publication_id):
+        return '{0}:superseded:{1}'.format(self.prefix, publication_id)
@@ -0,0 +1,171 @@
+"""Static assets shared by all report instances.
+
+Rather than copying the stylesheets and images that every report uses into
+each build, these assets can be published once under a shared prefix in
+the S3 bucket. Each asset's filename includes a hash of its content, so
+published assets never change and can be cached indefinitely by the CDN and
+browsers.
+"""
+
+__all__ = ('SharedAsset', 'get_shared_assets', 'publish_shared_assets')
+
+import hashlib
+import mimetypes
+from pathlib import PurePosixPath
+
+import boto3
+import botocore.exceptions
+from jupyter_core.paths import jupyter_config_dir
+from nbconvert.preprocessors import CSSHTMLHeaderPreprocessor
+
+
+SHARED_ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+"""Cache-Control header for shared assets, which are immutable.
+"""
+
+_published_keys = set()
+"""Keys of the shared assets that this process already published, or found
+in the bucket.
+"""
+
+
+class SharedAsset:
+    """A static asset that's shared by all report instances.
+
+    Parameters
+    ----------
+    name : `str`
+        Logical name of the asset, like ``app.css``. Templates refer to
+        assets by this name.
+    content : `bytes`
+        Content of the asset.
+    content_type : `str`, optional
+        Media type of the asset. By default, the type is guessed from
+        ``name``.
+    """
+
+    def __init__(self, name, content, content_type=None):
+        self.name = name
+        self.content = content
+        if content_type is None:
+            content_type, _ = mimetypes.guess_type(name)
+        self.content_type = content_type or 'application/octet-stream'
+
+    def __repr__(self):
+        return 'SharedAsset({0!r})'.format(self.hashed_name)
+
+    @property
+    def content_hash(self):
+        """SHA-256 hex digest of the asset's content (`str`).
+        """
+        return hashlib.sha256(self.content).hexdigest()
+
+    @property
+    def hashed_name(self):
+        """Filename of the asset that includes a hash of its content, like
+        ``app.0123456789abcdef.css`` (`str`).
+        """
+        path = PurePosixPath(self.name)
+        return '{0}.{1}{2}'.format(path.stem, self.content_hash[:16],
+                                   path.suffix)
+
+    def get_url(self, base_url):
+        """Get the URL of the published asset.
+
+        Parameters
+        ----------
+        base_url : `str`
+            URL that corresponds to the shared prefix in the bucket.
+
+        Returns
+        -------
+        url : `str`
+            URL of the asset.
+        """
+        return base_url.rstrip('/') + '/' + self.hashed_name
+
+
+def get_shared_assets(exporter):
+    """Get the static assets used by every report rendered by an exporter.
+
+    Parameters
+    ----------
+    exporter : `uservice_nbreport.publish.htmlexport.LsstHtmlReportExporter`
+        The exporter.
+
+    Returns
+    -------
+    assets : `list` of `SharedAsset`
+        The exporter's assets (see
+        `~uservice_nbreport.publish.htmlexport.LsstHtmlReportExporter.asset_paths`)
+        and a ``notebook.css`` stylesheet with nbconvert's notebook and
+        Pygments styles, which would otherwise be inlined in every page.
+    """
+    assets = [SharedAsset(path.name, path.read_bytes())
+              for path in exporter.asset_paths]
+
+    css_preprocessor = CSSHTMLHeaderPreprocessor(parent=exporter)
+    # _generate_header is what CSSHTMLHeaderPreprocessor uses to build the
+    # inlined CSS
+    css = '\n'.join(css_preprocessor._generate_header(
+        {'config_dir': jupyter_config_dir()}))
+    assets.append(SharedAsset('notebook.css', css.encode('utf-8'),
+                              content_type='text/css'))
+
+    return assets
+
+
+def publish_shared_assets(assets, *, bucket_name, prefix, aws_id,
+                          aws_secret):
+    """Upload shared assets to S3, unless they're already published.
+
+    Parameters
+    ----------
+    assets : `list` of `SharedAsset`
+        The assets (see `get_shared_assets`).
+    bucket_name : `str`
+        Name of the S3 bucket.
+    prefix : `str`
+        Shared prefix (directory) in the bucket for the assets.
+    aws_id : `str`
+        AWS key identifier.
+    aws_secret : `str`
+        AWS secret key.
+
+    Returns
+    -------
+    uploaded_keys : `list` of `str`
+        Keys of the assets that were uploaded. Assets that were already in
+        the bucket aren't uploaded again.
+    """
+    keys = {asset: '/'.join((prefix.strip('/'), asset.hashed_name))
+            for asset in assets}
+    if all(key in _published_keys for key in keys.values()):
+        return []
+
+    session = boto3.session.Session(
+        aws_access_key_id=aws_id,
+        aws_secret_access_key=aws_secret)
+    s3 = session.client('s3')
+
+    uploaded_keys = []
+    for asset, key in keys.items():
+        if key in _published_keys:
+            continue
+
+        try:
+            s3.head_object(Bucket=bucket_name, Key=key)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                raise
+            s3.put_object(
+                Bucket=bucket_name,
+                Key=key,
+                Body=asset.content,
+                ContentType=asset.content_type,
+                CacheControl=SHARED_ASSET_CACHE_CONTROL)
+            uploaded_keys.append(key)
+
+        _published_keys.add(key)
+
+    return uploaded_keys
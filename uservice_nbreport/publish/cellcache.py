@@ -0,0 +1,175 @@
+"""Local disk cache of rendered cell HTML fragments.
+
+Instances of a report usually share most of their markdown and code cells,
+with only some outputs and parameters changing between instances. The cell
+cache lets the exporter reuse the HTML of cells that were already rendered
+for an earlier instance, and only render the cells that changed.
+"""
+
+__all__ = ('CellRenderCache', 'compute_cell_key')
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import uuid
+
+
+class CellRenderCache:
+    """A size-bounded, least-recently-used cache of rendered cell HTML
+    fragments, stored on the local disk.
+
+    Each cache entry is a file, named after its key, that contains the HTML
+    of a cell. Use a separate cache directory for each report so that a
+    report's cells aren't evicted by other reports. Several processes can
+    share the same cache directory.
+
+    Parameters
+    ----------
+    cache_dir : `str` or `pathlib.Path`
+        Directory where cache entries are stored. It's created if necessary.
+    max_bytes : `int`
+        Maximum total size of the cached fragments. Least-recently-used
+        entries are evicted by `prune`.
+
+    Attributes
+    ----------
+    hits : `int`
+        Number of `get` calls that found a cached fragment.
+    misses : `int`
+        Number of `get` calls that didn't find a cached fragment.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return self._get_path(key).is_file()
+
+    @property
+    def stats(self):
+        """Hit and miss counts, and the hit rate (`dict`).
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.,
+        }
+
+    def get(self, key):
+        """Get a cached cell fragment.
+
+        Parameters
+        ----------
+        key : `str`
+            Cache key (see `compute_cell_key`).
+
+        Returns
+        -------
+        html : `str`
+            HTML of the cell, or `None` if the key isn't in the cache.
+        """
+        path = self._get_path(key)
+        try:
+            # Mark the entry as recently used.
+            os.utime(str(path))
+            html = path.read_text(encoding='utf-8')
+        except FileNotFoundError:
+            # Not cached, or the entry was evicted by another process.
+            self.misses += 1
+            return None
+        self.hits += 1
+        return html
+
+    def put(self, key, html):
+        """Add a cell fragment to the cache.
+
+        Parameters
+        ----------
+        key : `str`
+            Cache key (see `compute_cell_key`).
+        html : `str`
+            HTML of the cell.
+
+        Notes
+        -----
+        The cache isn't pruned when entries are added. Call `prune` after
+        adding the fragments of a notebook.
+        """
+        # Write the entry under a temporary name so that other processes
+        # never see a partially-written entry.
+        tmp_path = self.cache_dir / '.tmp-{0}'.format(uuid.uuid4().hex)
+        tmp_path.write_text(html, encoding='utf-8')
+        os.replace(str(tmp_path), str(self._get_path(key)))
+
+    def prune(self):
+        """Evict least-recently-used entries until the cache fits within
+        ``max_bytes``.
+        """
+        entries = []
+        total_size = 0
+        for path in self.cache_dir.iterdir():
+            if path.name.startswith('.'):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def _get_path(self, key):
+        return self.cache_dir / '{0}.html'.format(key)
+
+
+def compute_cell_key(cell, render_fingerprint, pygments_lexer=None):
+    """Compute the cell cache key of a preprocessed cell.
+
+    Parameters
+    ----------
+    cell : `nbformat.NotebookNode`
+        The cell, after the notebook was preprocessed.
+    render_fingerprint : `str`
+        Render fingerprint of the exporter that renders the cell (see
+        `~uservice_nbreport.publish.htmlexport.LsstHtmlReportExporter.render_fingerprint`).
+        It's a parameter, rather than computed from the exporter, so that
+        it's only computed once for all the cells of a notebook.
+    pygments_lexer : `str`, optional
+        Name of the notebook's Pygments lexer, which highlights code cells.
+
+    Returns
+    -------
+    key : `str`
+        Hex digest of a hash of the cell's type, source, metadata, and
+        outputs, the Pygments lexer, and the exporter's render fingerprint.
+    """
+    h = hashlib.sha256()
+    h.update(render_fingerprint.encode('utf-8'))
+    h.update(str(pygments_lexer).encode('utf-8'))
+    # Execution counts aren't rendered (prompts are excluded), so they
+    # don't change the HTML.
+    cell_data = {
+        'cell_type': cell.cell_type,
+        'source': cell.source,
+        'metadata': cell.get('metadata', {}),
+        'outputs': [{k: v for k, v in output.items()
+                     if k != 'execution_count'}
+                    for output in cell.get('outputs', [])],
+    }
+    h.update(json.dumps(cell_data, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
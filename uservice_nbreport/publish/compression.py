@@ -0,0 +1,136 @@
+"""Pre-compression of the text files in a report site.
+
+Compressing text files (HTML, CSS, SVG, and JSON) before they're uploaded
+lets S3 and the CDN serve them as-is with a ``Content-Encoding`` header,
+which makes reports with large HTML pages much smaller to transfer.
+"""
+
+__all__ = ('compress_site', 'COMPRESSIBLE_CONTENT_TYPES',
+           'DEFAULT_COMPRESSION_LEVELS')
+
+import gzip
+import io
+import mimetypes
+import time
+
+
+COMPRESSIBLE_CONTENT_TYPES = {
+    'text/html',
+    'text/css',
+    'text/plain',
+    'image/svg+xml',
+    'application/json',
+    'application/javascript',
+}
+"""Media types of the files that are compressed.
+"""
+
+DEFAULT_COMPRESSION_LEVELS = {
+    'gzip': 9,
+    'br': 9,
+}
+"""Default compression level for each encoding.
+"""
+
+
+def compress_site(site_dir, encoding='gzip', level=None):
+    """Compress the text files in a site directory, in place.
+
+    Parameters
+    ----------
+    site_dir : `pathlib.Path`
+        Directory containing the site. Compressed files keep their original
+        names.
+    encoding : `str`, optional
+        Content encoding: ``'gzip'`` or ``'br'`` (Brotli). Brotli requires
+        the ``brotli`` package.
+    level : `int`, optional
+        Compression level. Defaults to the level in
+        `DEFAULT_COMPRESSION_LEVELS` for the encoding.
+
+    Returns
+    -------
+    result : `dict`
+        Summary of the compression, with fields:
+
+        - ``encoding``: the content encoding (`str`).
+        - ``level``: the compression level (`int`).
+        - ``content_encodings``: mapping of the paths of compressed files,
+          relative to ``site_dir`` and POSIX-style, to their content
+          encoding (`dict`). This mapping is used for setting the
+          ``Content-Encoding`` header when uploading.
+        - ``original_bytes``: size of the compressed files before
+          compression (`int`).
+        - ``compressed_bytes``: size of the compressed files (`int`).
+        - ``ratio``: ``compressed_bytes / original_bytes`` (`float`).
+        - ``time``: time spent compressing, in seconds (`float`).
+
+        Files that would not become smaller aren't compressed.
+    """
+    compress = _get_compressor(encoding)
+    if level is None:
+        level = DEFAULT_COMPRESSION_LEVELS[encoding]
+
+    start_time = time.perf_counter()
+    content_encodings = {}
+    original_bytes = 0
+    compressed_bytes = 0
+    for path in sorted(site_dir.glob('**/*')):
+        if not path.is_file():
+            continue
+        content_type, _ = mimetypes.guess_type(str(path), strict=False)
+        if content_type not in COMPRESSIBLE_CONTENT_TYPES:
+            continue
+
+        data = path.read_bytes()
+        compressed_data = compress(data, level)
+        if len(compressed_data) >= len(data):
+            continue
+
+        path.write_bytes(compressed_data)
+        content_encodings[path.relative_to(site_dir).as_posix()] = encoding
+        original_bytes += len(data)
+        compressed_bytes += len(compressed_data)
+
+    return {
+        'encoding': encoding,
+        'level': level,
+        'content_encodings': content_encodings,
+        'original_bytes': original_bytes,
+        'compressed_bytes': compressed_bytes,
+        'ratio': (compressed_bytes / original_bytes
+                  if original_bytes else 1.),
+        'time': time.perf_counter() - start_time,
+    }
+
+
+def _get_compressor(encoding):
+    """Get the function that compresses data with a content encoding.
+    """
+    if encoding == 'gzip':
+        return _gzip_compress
+    elif encoding == 'br':
+        try:
+            import brotli
+        except ImportError:
+            raise RuntimeError(
+                'Brotli compression requires the brotli package.')
+
+        def _brotli_compress(data, level):
+            return brotli.compress(data, quality=level)
+        return _brotli_compress
+    else:
+        raise ValueError('Unknown content encoding {0!r}'.format(encoding))
+
+
+def _gzip_compress(data, level):
+    """Compress data with gzip.
+
+    Unlike `gzip.compress`, this function sets a fixed modification time so
+    that the same data always compresses to the same bytes.
+    """
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level,
+                       mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
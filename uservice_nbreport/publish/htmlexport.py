@@ -1,16 +1,35 @@
 """Notebook HTML export with nbconvert, customized for LSST reports.
 """
 
-__all__ = ('LsstHtmlReportExporter', 'build_site_from_filename', 'cli')
+__all__ = ('LsstHtmlReportExporter', 'LsstHighlight2HTML',
+           'create_report_exporter', 'build_site_from_filename', 'cli')
 
+from functools import lru_cache
+import hashlib
+import os
 from pathlib import Path
 import shutil
+import time
+from warnings import warn
 
+from billiard.pool import Pool
 import click
+import nbconvert
+import nbformat
 from nbconvert.exporters.html import HTMLExporter
-from traitlets import default, Unicode
+from nbconvert.filters.highlight import Highlight2HTML
+from nbconvert.preprocessors import CSSHTMLHeaderPreprocessor
+from traitlets import default, Bool, Int, Unicode
 
+from ..version import get_version
+from .assets import get_shared_assets
+from .markdown import LsstMarkdown, LsstMarkdownPreprocessor
 from .outline import LsstOutlinePreprocessor
+from .outputs import LsstExtractOutputPreprocessor
+from .cellcache import compute_cell_key
+from .parallel import (
+    CELLS_TEMPLATE_FILE, get_notebook_size, iter_cell_notebooks,
+    make_cells_notebook, make_chunk_args, render_cell_chunk, split_cells)
 
 
 class LsstHtmlReportExporter(HTMLExporter):
@@ -21,10 +40,74 @@ class LsstHtmlReportExporter(HTMLExporter):
         '#',
         help="The text used as the text for anchor links.").tag(config=True)
 
+    extract_outputs = Bool(
+        False,
+        help="Extract output images into content-addressed files rather than "
+             "embedding them in the HTML as base64 data. Set this when "
+             "creating the exporter (see create_report_exporter)."
+    ).tag(config=True)
+
+    shared_assets_url = Unicode(
+        None,
+        allow_none=True,
+        help="Base URL where the shared static assets (see "
+             "uservice_nbreport.publish.assets) are published. If set, "
+             "reports link to the shared assets rather than including them "
+             "in each site. Set this when creating the exporter."
+    ).tag(config=True)
+
+    parallel_render = Bool(
+        False,
+        help="Render the cells of large notebooks in parallel, in a pool of "
+             "worker processes. See parallel_render_min_cells and "
+             "parallel_render_min_bytes."
+    ).tag(config=True)
+
+    parallel_render_min_cells = Int(
+        1000,
+        help="Minimum number of cells in a notebook for rendering its cells "
+             "in parallel (if parallel_render is enabled)."
+    ).tag(config=True)
+
+    parallel_render_min_bytes = Int(
+        10000000,
+        help="Minimum size, in characters of cell sources and outputs, of a "
+             "notebook for rendering its cells in parallel (if "
+             "parallel_render is enabled)."
+    ).tag(config=True)
+
+    parallel_render_processes = Int(
+        None,
+        allow_none=True,
+        help="Number of worker processes for parallel rendering. Defaults "
+             "to the number of CPUs."
+    ).tag(config=True)
+
     exclude_input_prompt = True
 
     exclude_output_prompt = True
 
+    def __init__(self, config=None, **kw):
+        super().__init__(config=config, **kw)
+        # highlight_code filters, keyed by Pygments lexer name
+        self._highlighters = {}
+        self._shared_assets = None
+        # markdown renderer, created by markdown_ast2html
+        self._markdown = None
+        # process pool for parallel rendering, created by render_cells
+        self._render_pool = None
+        # cell cache of the current conversion (see from_notebook_node)
+        self._cell_cache = None
+        # hash of the template and asset files (see render_fingerprint)
+        self._template_files_digest = None
+
+        if self.shared_assets_url is not None:
+            # nbconvert's CSS is published as a shared asset, rather than
+            # inlined in each page.
+            for preprocessor in self._preprocessors:
+                if isinstance(preprocessor, CSSHTMLHeaderPreprocessor):
+                    preprocessor.enabled = False
+
     @property
     def export_from_notebook(self):
         """Name of the notebook in the File -> Download as menu (`str`).
@@ -56,24 +139,462 @@ class LsstHtmlReportExporter(HTMLExporter):
         logo_path = template_dir / 'lsst-logo-dark-no-text.svg'
         return [css_path, logo_path]
 
+    @property
+    def shared_assets(self):
+        """Static assets that are shared by all reports (`list` of
+        `uservice_nbreport.publish.assets.SharedAsset`).
 
-def build_site_from_filename(notebook_path, output_dir):
-    output_dir = Path(output_dir)
-    output_dir.mkdir(parents=True, exist_ok=True)
+        Only used if ``shared_assets_url`` is set.
+        """
+        if self._shared_assets is None:
+            self._shared_assets = get_shared_assets(self)
+        return self._shared_assets
+
+    @property
+    def asset_urls(self):
+        """Mapping of static asset names, like ``app.css``, to the URLs that
+        the HTML pages link to (`dict`).
+
+        Templates access this mapping through the ``lsst_asset_urls``
+        resource. The ``notebook.css`` asset is only present when assets
+        are shared; otherwise nbconvert's CSS is inlined in the page.
+        """
+        if self.shared_assets_url is None:
+            return {path.name: path.name for path in self.asset_paths}
+        else:
+            return {asset.name: asset.get_url(self.shared_assets_url)
+                    for asset in self.shared_assets}
+
+    @property
+    def render_fingerprint(self):
+        """Hash of everything besides the notebook itself that the rendered
+        HTML depends on (`str`).
+
+        This includes the application and nbconvert versions, the template
+        and asset files, and the exporter's settings. Two renders of the same
+        notebook with the same fingerprint produce the same site.
+
+        The template and asset files are only hashed once per exporter,
+        since they don't change while a worker runs.
+        """
+        if self._template_files_digest is None:
+            h = hashlib.sha256()
+            template_dir = Path(__file__).parent / 'templates'
+            for path in sorted(template_dir.glob('**/*')):
+                if path.is_file():
+                    h.update(str(path.relative_to(template_dir)).encode(
+                        'utf-8'))
+                    h.update(path.read_bytes())
+            self._template_files_digest = h.digest()
+
+        h = hashlib.sha256()
+        h.update(get_version().encode('utf-8'))
+        h.update(nbconvert.__version__.encode('utf-8'))
+        h.update(self.template_file.encode('utf-8'))
+        h.update(self.anchor_link_text.encode('utf-8'))
+        h.update(str(self.extract_outputs).encode('utf-8'))
+        h.update(str(self.shared_assets_url).encode('utf-8'))
+        h.update(self._template_files_digest)
+        return h.hexdigest()
+
+    def from_notebook_node(self, nb, resources=None, cell_cache=None, **kw):
+        """Convert a notebook node into an HTML report.
+
+        This method is the same as
+        `nbconvert.exporters.html.HTMLExporter.from_notebook_node`, except
+        that the ``highlight_code`` filter is reused between conversions
+        that share a Pygments lexer rather than being rebuilt every time.
 
-    exporter = LsstHtmlReportExporter()
+        Each conversion still gets its own ``resources`` dictionary, so the
+        same exporter instance can be reused for many notebooks.
+
+        If ``parallel_render`` is enabled and the notebook has at least
+        ``parallel_render_min_cells`` cells, or is at least
+        ``parallel_render_min_bytes`` large, the cells are rendered in
+        parallel (see `render_cells`).
+
+        Parameters
+        ----------
+        nb : `nbformat.NotebookNode`
+            The notebook.
+        resources : `dict`, optional
+            Additional resources used in the conversion process.
+        cell_cache : `~uservice_nbreport.publish.cellcache.CellRenderCache`
+            Cache of rendered cells (optional). Cells that are in the cache
+            aren't rendered again, and newly-rendered cells are added to the
+            cache. The cache's hit and miss counts for this conversion are
+            persisted in ``resources`` under the ``lsst_cell_cache_stats``
+            field.
+
+        Returns
+        -------
+        body : `str`
+            The HTML page.
+        resources : `dict`
+            Resources from the conversion process.
+        """
+        langinfo = nb.metadata.get('language_info', {})
+        lexer = langinfo.get('pygments_lexer', langinfo.get('name', None))
+        self.register_filter('highlight_code', self._get_highlighter(lexer))
+        resources = dict(resources or {})
+        resources['lsst_parallel_render'] = self._use_parallel_render(nb)
+        resources['lsst_render_cells'] = (resources['lsst_parallel_render'] or
+                                          cell_cache is not None)
+        resources['lsst_pygments_lexer'] = lexer
+        self._cell_cache = cell_cache
+        try:
+            # Skip HTMLExporter.from_notebook_node, which creates a new
+            # Highlight2HTML filter for every notebook.
+            return super(HTMLExporter, self).from_notebook_node(
+                nb, resources, **kw)
+        finally:
+            self._cell_cache = None
+
+    def _preprocess(self, nb, resources):
+        # Record the time spent preprocessing so that it can be told apart
+        # from the template rendering.
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        nb, resources = super()._preprocess(nb, resources)
+        resources['lsst_preprocess_time'] = {
+            'wall': time.perf_counter() - wall_start,
+            'cpu': time.process_time() - cpu_start,
+        }
+        return nb, resources
+
+    def default_filters(self):
+        for pair in super().default_filters():
+            yield pair
+        yield ('markdown_ast2html', self.markdown_ast2html)
+        yield ('render_cells', self.render_cells)
+
+    def _use_parallel_render(self, nb):
+        if not self.parallel_render:
+            return False
+        return (len(nb.cells) >= self.parallel_render_min_cells or
+                get_notebook_size(nb) >= self.parallel_render_min_bytes)
+
+    def render_cells(self, nb, resources):
+        """Render the cells of a preprocessed notebook, reusing cached cells
+        and rendering in parallel if enabled (Jinja filter).
+
+        Each cell is rendered by the ``report-cells.jinja`` template. With
+        parallel rendering, the cells are split into contiguous chunks,
+        which are rendered in the worker processes.
+
+        Parameters
+        ----------
+        nb : `nbformat.NotebookNode`
+            The preprocessed notebook.
+        resources : `dict`
+            The resources of the conversion.
+
+        Returns
+        -------
+        html : `str`
+            HTML of the cells, identical to the HTML rendered by the report
+            template without a cell cache or parallel rendering.
+        """
+        cache = self._cell_cache
+        lexer = resources.get('lsst_pygments_lexer')
+        fragments = [None] * len(nb.cells)
+
+        if cache is not None:
+            hits = cache.hits
+            misses = cache.misses
+            fingerprint = self.render_fingerprint
+            keys = [compute_cell_key(cell, fingerprint, lexer)
+                    for cell in nb.cells]
+            fragments = [cache.get(key) for key in keys]
+
+        missing = [i for i, fragment in enumerate(fragments)
+                   if fragment is None]
+        if missing:
+            missing_nb = make_cells_notebook(
+                nb, [nb.cells[i] for i in missing])
+            if resources.get('lsst_parallel_render'):
+                rendered = self._render_fragments_parallel(
+                    missing_nb, resources)
+            else:
+                rendered = self._render_fragments(missing_nb, resources)
+            for i, fragment in zip(missing, rendered):
+                fragments[i] = fragment
+                if cache is not None:
+                    cache.put(keys[i], fragment)
+
+        if cache is not None:
+            if missing:
+                cache.prune()
+            lookups = len(nb.cells)
+            resources['lsst_cell_cache_stats'] = {
+                'hits': cache.hits - hits,
+                'misses': cache.misses - misses,
+                'hit_rate': ((cache.hits - hits) / lookups
+                             if lookups else 0.),
+            }
+
+        return ''.join(fragments)
+
+    def _render_fragments(self, nb, resources):
+        """Render each cell of a preprocessed notebook to HTML with the
+        ``report-cells.jinja`` template.
+        """
+        template = self.environment.get_template(CELLS_TEMPLATE_FILE)
+        return [template.render(nb=cell_nb, resources=resources)
+                for cell_nb in iter_cell_notebooks(nb)]
+
+    def _render_fragments_parallel(self, nb, resources):
+        """Render each cell of a preprocessed notebook to HTML in the pool
+        of worker processes.
+        """
+        pool = self._get_render_pool()
+        chunks = split_cells(nb.cells, self._get_render_processes() * 4)
+        results = []
+        for cells in chunks:
+            chunk_nb, chunk_resources = make_chunk_args(nb, resources, cells)
+            results.append(pool.apply_async(
+                render_cell_chunk,
+                ({'anchor_link_text': self.anchor_link_text},
+                 resources.get('lsst_pygments_lexer'),
+                 chunk_nb,
+                 chunk_resources)))
+        fragments = []
+        for result in results:
+            fragments.extend(result.get())
+        return fragments
+
+    def _get_render_processes(self):
+        return self.parallel_render_processes or os.cpu_count() or 1
+
+    def _get_render_pool(self):
+        # billiard's pool, unlike concurrent.futures and multiprocessing,
+        # can start worker processes from a Celery prefork worker, which is
+        # a daemonic process.
+        if self._render_pool is None:
+            self._render_pool = Pool(processes=self._get_render_processes())
+        return self._render_pool
+
+    def close(self):
+        """Shut down the worker processes for parallel rendering, if they
+        were started.
+        """
+        if self._render_pool is not None:
+            self._render_pool.close()
+            self._render_pool.join()
+            self._render_pool = None
+
+    def markdown2html(self, source):
+        """Markdown to HTML filter respecting the anchor_link_text setting.
+
+        The markdown renderer is reused between calls.
+        """
+        return self.markdown_ast2html(source)
+
+    def markdown_ast2html(self, ast):
+        """Markdown syntax tree to HTML filter respecting the
+        anchor_link_text setting.
+
+        Parameters
+        ----------
+        ast : `uservice_nbreport.publish.markdown.MarkdownAst` or `str`
+            Syntax tree from
+            `~uservice_nbreport.publish.markdown.LsstMarkdownPreprocessor`,
+            or markdown source.
+
+        Returns
+        -------
+        html : `str`
+            HTML of the markdown document.
+        """
+        if self._markdown is None:
+            self._markdown = LsstMarkdown(
+                anchor_link_text=self.anchor_link_text)
+        return self._markdown.render_ast(ast)
+
+    def _init_resources(self, resources):
+        resources = super()._init_resources(resources)
+        resources['lsst_asset_urls'] = self.asset_urls
+        return resources
+
+    def _get_highlighter(self, pygments_lexer):
+        """Get the cached ``highlight_code`` filter for a Pygments lexer.
+        """
+        try:
+            return self._highlighters[pygments_lexer]
+        except KeyError:
+            highlighter = LsstHighlight2HTML(pygments_lexer=pygments_lexer,
+                                             parent=self)
+            self._highlighters[pygments_lexer] = highlighter
+            return highlighter
+
+    def write_site(self, body, resources, site_dir):
+        """Write a converted notebook, its extracted outputs, and the static
+        assets to a site directory.
+
+        Parameters
+        ----------
+        body : `str`
+            HTML page, from `from_notebook_node`.
+        resources : `dict`
+            Resources, from `from_notebook_node`. Files in the ``outputs``
+            field are written relative to the HTML page.
+        site_dir : `pathlib.Path`
+            Directory where the site is written.
+
+        Notes
+        -----
+        The static assets are only copied into the site if they aren't
+        shared (see ``shared_assets_url``).
+        """
+        (site_dir / 'index.html').write_text(body)
+
+        for filename, data in resources.get('outputs', {}).items():
+            dest = site_dir / filename
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            dest.write_bytes(data)
+
+        if self.shared_assets_url is None:
+            # Shared assets are published separately (see
+            # uservice_nbreport.publish.assets).
+            for asset_path in self.asset_paths:
+                # NOTE: assumes all asset paths should reside in same
+                # directory as index.html
+                dest = site_dir / asset_path.name
+                shutil.copy(str(asset_path), str(dest))
+
+    def warm(self):
+        """Prepare the exporter ahead of its first real conversion.
+
+        Converting a small notebook loads and compiles the Jinja templates,
+        creates the filters, and imports the Pygments lexers so that the
+        first report rendered by a worker process doesn't pay for that setup.
+        """
+        nb = nbformat.v4.new_notebook(
+            metadata={'nbreport': {},
+                      'language_info': {'name': 'python',
+                                        'pygments_lexer': 'ipython3'}})
+        nb.cells.append(nbformat.v4.new_markdown_cell(
+            source='# Title\n\nText with *emphasis*.'))
+        nb.cells.append(nbformat.v4.new_code_cell(
+            source='print("Hello world")',
+            outputs=[nbformat.v4.new_output(
+                'stream', name='stdout', text='Hello world\n')]))
+        self.from_notebook_node(nb)
+
+
+class LsstHighlight2HTML(Highlight2HTML):
+    """Pygments syntax highlighting filter that reuses lexers and formatters.
+
+    nbconvert's `~nbconvert.filters.highlight.Highlight2HTML` looks up a
+    Pygments lexer and creates a formatter for every code cell. This filter
+    produces the same HTML, but caches both.
+    """
+
+    def __call__(self, source, language=None, metadata=None):
+        """Return a syntax-highlighted version of the input source as HTML.
+
+        Parameters
+        ----------
+        source : `str`
+            Source of the cell to highlight.
+        language : `str`, optional
+            Language to highlight the syntax of.
+        metadata : `nbformat.NotebookNode`, optional
+            Metadata of the cell to highlight.
+        """
+        from pygments import highlight
+
+        if not language:
+            language = self.pygments_lexer
+        formatter = _get_html_formatter(language)
+
+        # If the cell uses a magic extension language, use the magic
+        # language instead.
+        if language.startswith('ipython') \
+                and metadata \
+                and 'magics_language' in metadata:
+            language = metadata['magics_language']
+
+        return highlight(source if len(source) > 0 else ' ',
+                         _get_lexer(language),
+                         formatter)
+
+
+@lru_cache(maxsize=None)
+def _get_lexer(language):
+    """Get a (shared) Pygments lexer for a language, with the same fallbacks
+    as `nbconvert.filters.highlight`.
+    """
+    from pygments.lexers import get_lexer_by_name
+    from pygments.util import ClassNotFound
+
+    if language == 'ipython2':
+        try:
+            from IPython.lib.lexers import IPythonLexer
+        except ImportError:
+            warn("IPython lexer unavailable, falling back on Python")
+            language = 'python'
+        else:
+            return IPythonLexer()
+    elif language == 'ipython3':
+        try:
+            from IPython.lib.lexers import IPython3Lexer
+        except ImportError:
+            warn("IPython3 lexer unavailable, falling back on Python 3")
+            language = 'python3'
+        else:
+            return IPython3Lexer()
+
+    try:
+        return get_lexer_by_name(language, stripall=True)
+    except ClassNotFound:
+        warn("No lexer found for language %r. Treating as plain text."
+             % language)
+        from pygments.lexers.special import TextLexer
+        return TextLexer()
+
+
+@lru_cache(maxsize=None)
+def _get_html_formatter(language):
+    """Get a (shared) Pygments HTML formatter for a language.
+    """
+    from pygments.formatters import HtmlFormatter
+
+    # The hl-<language> class is needed to help post processors.
+    return HtmlFormatter(cssclass=" highlight hl-" + language)
+
+
+def create_report_exporter(**kwargs):
+    """Create an `LsstHtmlReportExporter` with the LSST report preprocessors
+    registered.
+
+    Parameters
+    ----------
+    **kwargs
+        Keyword arguments passed to `LsstHtmlReportExporter`.
+
+    Returns
+    -------
+    exporter : `LsstHtmlReportExporter`
+        The exporter. The same exporter can be used to convert any number of
+        notebooks.
+    """
+    exporter = LsstHtmlReportExporter(**kwargs)
+    exporter.register_preprocessor(LsstExtractOutputPreprocessor,
+                                   enabled=exporter.extract_outputs)
+    exporter.register_preprocessor(LsstMarkdownPreprocessor, enabled=True)
     exporter.register_preprocessor(LsstOutlinePreprocessor, enabled=True)
-    body, resources = exporter.from_filename(str(notebook_path))
+    return exporter
 
-    (output_dir / 'index.html').write_text(body)
 
-    for asset_path in exporter.asset_paths:
-        dest = output_dir / asset_path.name
-        shutil.copy(asset_path, dest)
-        # NOTE: assumes all asset paths should reside in same directory
-        # as index.html
+def build_site_from_filename(notebook_path, output_dir,
+                             extract_outputs=False):
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
 
-    # FIXME write out the resources too.
+    exporter = create_report_exporter(extract_outputs=extract_outputs)
+    body, resources = exporter.from_filename(str(notebook_path))
+    exporter.write_site(body, resources, output_dir)
 
 
 @click.command()
@@ -83,10 +604,16 @@ def build_site_from_filename(notebook_path, output_dir):
 @click.argument(
     'site_dir',
     default=Path('test-sites/basic'))
-def cli(notebook, site_dir):
+@click.option(
+    '--extract-outputs/--inline-outputs',
+    default=False,
+    help='Write output images to separate files rather than embedding them '
+         'in the HTML.')
+def cli(notebook, site_dir, extract_outputs):
     """Build the HTML site for a notebook using the LSST report notebook
     to HTML converter.
     """
     notebook = Path(notebook)
     site_dir = Path(site_dir)
-    build_site_from_filename(notebook, site_dir)
+    build_site_from_filename(notebook, site_dir,
+                             extract_outputs=extract_outputs)
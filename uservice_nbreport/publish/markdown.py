@@ -0,0 +1,173 @@
+"""Markdown parsing that's shared by the outline preprocessor and the HTML
+rendering of markdown cells.
+"""
+
+__all__ = ('MarkdownAst', 'parse_markdown', 'LsstMarkdown',
+           'LsstMarkdownPreprocessor')
+
+import mistune
+from nbconvert.filters.markdown_mistune import (
+    IPythonRenderer, MarkdownWithMath)
+from nbconvert.preprocessors import Preprocessor
+
+
+class MarkdownAst:
+    """Block-level syntax tree of a markdown document, as parsed by
+    mistune's block lexer.
+
+    Parameters
+    ----------
+    tokens : `list` of `dict`
+        Block tokens, in document order.
+    def_links : `dict`
+        Link reference definitions.
+    def_footnotes : `dict`
+        Footnote definitions.
+    """
+
+    __slots__ = ('tokens', 'def_links', 'def_footnotes')
+
+    def __init__(self, tokens, def_links, def_footnotes):
+        self.tokens = tokens
+        self.def_links = def_links
+        self.def_footnotes = def_footnotes
+
+    @property
+    def headers(self):
+        """Headers (ATX and setext) of the document, in document order, as
+        ``(level, text)`` tuples.
+
+        Lines starting with ``#`` inside code blocks aren't headers.
+        """
+        return [(token['level'], token['text'])
+                for token in self.tokens
+                if token['type'] == 'heading']
+
+
+def parse_markdown(source):
+    """Parse markdown source into a `MarkdownAst`.
+
+    Parameters
+    ----------
+    source : `str`
+        Markdown source.
+
+    Returns
+    -------
+    ast : `MarkdownAst`
+        The syntax tree, which can be rendered with `LsstMarkdown.render_ast`
+        any number of times.
+    """
+    lexer = mistune.BlockLexer(mistune.BlockGrammar())
+    tokens = lexer(mistune.preprocessing(source))
+    return MarkdownAst(tokens, lexer.def_links, lexer.def_footnotes)
+
+
+class LsstMarkdown(MarkdownWithMath):
+    """Markdown renderer that renders pre-parsed `MarkdownAst` syntax trees.
+
+    This renderer produces the same HTML as nbconvert's ``markdown2html``
+    filter for `~nbconvert.exporters.HTMLExporter`.
+
+    Parameters
+    ----------
+    anchor_link_text : `str`, optional
+        Text of the anchor links added to headers.
+    """
+
+    def __init__(self, anchor_link_text='¶'):
+        renderer = IPythonRenderer(escape=False,
+                                   anchor_link_text=anchor_link_text)
+        super().__init__(renderer=renderer)
+
+    def parse(self, text):
+        return self.render_ast(parse_markdown(text))
+
+    def render_ast(self, ast):
+        """Render a markdown syntax tree to HTML.
+
+        Parameters
+        ----------
+        ast : `MarkdownAst` or `str`
+            Syntax tree from `parse_markdown`. Markdown source is also
+            accepted, and is parsed first.
+
+        Returns
+        -------
+        html : `str`
+            HTML of the document.
+        """
+        if isinstance(ast, str):
+            ast = parse_markdown(ast)
+
+        # Rendering numbers the footnotes in this mapping, so it's a copy
+        # to keep the syntax tree reusable.
+        keys = dict(ast.def_footnotes)
+        self.inline.setup(ast.def_links, keys)
+
+        self.tokens = ast.tokens[::-1]
+        out = self.renderer.placeholder()
+        while self.pop():
+            out += self.tok()
+
+        # reset inline
+        self.inline.links = {}
+        self.inline.footnotes = {}
+
+        if not self.footnotes:
+            return out
+
+        footnotes = filter(lambda o: keys.get(o['key']), self.footnotes)
+        self.footnotes = sorted(
+            footnotes, key=lambda o: keys.get(o['key']), reverse=True
+        )
+
+        body = self.renderer.placeholder()
+        while self.footnotes:
+            note = self.footnotes.pop()
+            body += self.renderer.footnote_item(
+                note['key'], note['text']
+            )
+
+        out += self.renderer.footnotes(body)
+        return out
+
+
+class LsstMarkdownPreprocessor(Preprocessor):
+    """Nbconvert preprocessor that parses each markdown cell once.
+
+    The syntax trees are persisted in ``resources`` under the
+    ``lsst_markdown_asts`` field, a `dict` of `MarkdownAst` keyed by cell
+    source. `~uservice_nbreport.publish.outline.LsstOutlinePreprocessor`
+    extracts headers from these syntax trees, and the report template
+    renders markdown cells from them.
+    """
+
+    def preprocess(self, nb, resources):
+        """Preprocess an entire notebook document.
+
+        Parameters
+        ----------
+        nb : `nbformat.NotebookNode`
+            Notebook being converted.
+        resources : `dict`
+            Additional resources used in the conversion process. This
+            dictionary is available to Jinja templates.
+
+        Returns
+        -------
+        nb : `nbformat.NotebookNode`
+            Notebook being converted (unchanged).
+        resources : `dict`
+            Additional resources used in the conversion process. This
+            dictionary is available to Jinja templates.
+        """
+        asts = {}
+        for cell in nb.cells:
+            if cell.cell_type.lower() != 'markdown':
+                continue
+            if cell.source not in asts:
+                asts[cell.source] = parse_markdown(cell.source)
+
+        resources['lsst_markdown_asts'] = asts
+        return nb, resources
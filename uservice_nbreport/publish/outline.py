@@ -3,11 +3,11 @@
 
 __all__ = ('LsstOutlinePreprocessor',)
 
-from copy import deepcopy
-
 from nbconvert.preprocessors import Preprocessor
 from nbconvert.filters.strings import _convert_header_id  # I know...
 
+from .markdown import parse_markdown
+
 
 class LsstOutlinePreprocessor(Preprocessor):
     """Nbconvert preprocessor that generates a notebook section outline
@@ -15,6 +15,10 @@ class LsstOutlinePreprocessor(Preprocessor):
 
     The outline is persisted in ``resources`` under the ``lsst_outline``
     field.
+
+    Headers are extracted from the markdown syntax trees parsed by
+    `~uservice_nbreport.publish.markdown.LsstMarkdownPreprocessor`, if that
+    preprocessor runs first. Otherwise, markdown cells are parsed here.
     """
 
     def preprocess(self, nb, resources):
@@ -39,11 +43,13 @@ class LsstOutlinePreprocessor(Preprocessor):
         # cell_headers is a list of headers tuples
         # (int level, text, #anchor)
         cell_headers = []
+        asts = resources.get('lsst_markdown_asts', {})
         for cell in nb.cells:
             if cell.cell_type.lower() != 'markdown':
                 continue
 
-            cell_headers.extend(extract_markdown_headers(cell))
+            cell_headers.extend(
+                extract_markdown_headers(cell, ast=asts.get(cell.source)))
 
         # Now we need to convert this list of headers into a hierchical
         # structure to build the section outline.
@@ -53,19 +59,23 @@ class LsstOutlinePreprocessor(Preprocessor):
         return nb, resources
 
 
-def extract_markdown_headers(cell):
+def extract_markdown_headers(cell, ast=None):
     """Extract the headers from a markdown cell.
 
     Parameters
     ----------
     cell : `nbformat.NotebookNode`
         A notebook cell, ``cell.cell_type == 'Markdown'``.
+    ast : `uservice_nbreport.publish.markdown.MarkdownAst`, optional
+        Syntax tree of the cell's source. If not set, the source is parsed.
 
     Returns
     -------
     headers : list of dict
         List of headers, ordered as they occur in the cell's source. If the
-        cell doesn't have any headers, the list is empty.
+        cell doesn't have any headers, the list is empty. Both ATX
+        (``# Title``) and setext (underlined) headers are extracted, but not
+        lines inside code blocks that start with ``#``.
 
         Each list item is a dict with these fields:
 
@@ -78,51 +88,76 @@ def extract_markdown_headers(cell):
     if cell.cell_type.lower() != 'markdown':
         return headers
 
-    lines = cell.source.splitlines()
-    for line in lines:
-        if line.startswith('#'):
-            parts = line.split()
-            h = {
-                'level': len(parts[0]),
-                'title': ' '.join(parts[1:]),
-            }
-            h['anchor'] = ''.join(('#', _convert_header_id(h['title'])))
-            headers.append(h)
+    if ast is None:
+        ast = parse_markdown(cell.source)
+
+    for level, title in ast.headers:
+        h = {
+            'level': level,
+            'title': title,
+            'anchor': ''.join(('#', _convert_header_id(title))),
+        }
+        headers.append(h)
     return headers
 
 
 def build_outline_hierarchy(headers):
-    headers = deepcopy(headers)
+    """Build a section outline from a flat list of headers.
 
+    Parameters
+    ----------
+    headers : `list` of `dict`
+        Headers, in document order, as returned by `extract_markdown_headers`.
+        The headers aren't modified.
+
+    Returns
+    -------
+    root : `RootNode`
+        Root of the outline. Top-level sections are its ``children``.
+
+    Notes
+    -----
+    A header becomes a sibling of the previous node if its level equals the
+    depth of the previous node, and a child of the previous node if its level
+    is greater. Otherwise, the header is attached to the ancestor of the
+    previous node whose depth is one less than the header's level. This means
+    that skipped header levels (``#`` followed by ``###``) don't create empty
+    intermediate sections.
+
+    The outline is built in a single pass with a stack of the nodes on the
+    path from the root to the previous node, so that ``stack[depth]`` is the
+    node at that depth.
+    """
     root = RootNode()
-    last = root
-    while headers:
-        header = headers.pop(0)
-        if header['level'] == last.level:
+    stack = [root]
+    for header in headers:
+        level = header['level']
+        depth = len(stack) - 1
+        if level == depth:
             # Create sibling of last node
-            node = OutlineNode(last.parent, header)
-            last.parent.children.append(node)
-        elif header['level'] > last.level:
-            # create child of last node
-            node = OutlineNode(last, header)
-            last.children.append(node)
-        else:
-            # header['level'] < last.level
-            parent = last.get_parent_of_level(header['level'] - 1)
-            node = OutlineNode(parent, header)
-            parent.children.append(node)
-        last = node
+            del stack[-1]
+        elif level < depth:
+            # Attach to the ancestor at depth level - 1
+            del stack[level:]
+        # else level > depth: create child of last node
+        parent = stack[-1]
+        node = OutlineNode(parent, header)
+        parent.children.append(node)
+        stack.append(node)
     return root
 
 
 class RootNode:
+    """Root node of a header outline hierarchy."""
+
+    __slots__ = ('children',)
+
+    parent = None
 
-    children = None
     level = 0
 
     def __init__(self):
         self.children = []
-        self.level = 0
 
     def get_parent_of_level(self, level):
         return self
@@ -135,20 +170,31 @@ class RootNode:
 
 
 class OutlineNode:
-    """Node in an header outline hierarchy."""
+    """Node in an header outline hierarchy.
 
-    @classmethod
-    def from_headers(cls, headers, parent=None):
-        next_header = headers.pop(0)
+    Parameters
+    ----------
+    parent : `OutlineNode` or `RootNode`
+        Parent node.
+    header_obj : `dict`
+        Header, with ``title`` and ``anchor`` fields (see
+        `extract_markdown_headers`).
 
-        return cls(parent, next_header['title'], next_header['anchor'],
-                   remaining_header=headers)
+    Attributes
+    ----------
+    level : `int`
+        Depth of the node in the outline: ``1`` for the children of the
+        root node.
+    """
+
+    __slots__ = ('parent', 'text', 'anchor', 'children', 'level')
 
     def __init__(self, parent, header_obj):
         self.parent = parent
         self.text = header_obj['title']
         self.anchor = header_obj['anchor']
         self.children = []
+        self.level = parent.level + 1
 
     def __str__(self):
         text = '{0}: {1}\n'.format(self.level, self.text)
@@ -159,15 +205,8 @@ class OutlineNode:
     def __repr__(self):
         return '{0}: {1}\n'.format(self.level, self.text)
 
-    @property
-    def level(self):
-        if self.parent is None:
-            return 0
-        else:
-            return self.parent.level + 1
-
     def get_parent_of_level(self, level):
-        if self.parent.level == level:
-            return self.parent
-        else:
-            return self.parent.get_parent_of_level(level)
+        node = self.parent
+        while node.parent is not None and node.level != level:
+            node = node.parent
+        return node
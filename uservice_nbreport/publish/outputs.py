@@ -0,0 +1,108 @@
+"""nbconvert preprocessor for extracting output images into files.
+"""
+
+__all__ = ('LsstExtractOutputPreprocessor',)
+
+from binascii import a2b_base64
+import hashlib
+import posixpath
+
+from nbconvert.preprocessors import ExtractOutputPreprocessor
+from nbconvert.preprocessors.extractoutput import guess_extension_without_jpe
+from traitlets import Set, Unicode
+
+
+class LsstExtractOutputPreprocessor(ExtractOutputPreprocessor):
+    """Nbconvert preprocessor that extracts base64-encoded output images
+    into content-addressed files.
+
+    Each image is named after a hash of its content, so an image that's
+    displayed by several cells is only stored once. Like nbconvert's
+    `~nbconvert.preprocessors.ExtractOutputPreprocessor`, the image data is
+    persisted in ``resources`` under the ``outputs`` field (keyed by file
+    path) and the path is set in the output's ``metadata.filenames`` for
+    the HTML template to link to.
+    """
+
+    output_files_dir = Unicode(
+        '_outputs',
+        help="Directory, relative to the HTML page, where output files are "
+             "written.").tag(config=True)
+
+    extract_output_types = Set(
+        {'image/png', 'image/jpeg'}
+    ).tag(config=True)
+
+    def preprocess_cell(self, cell, resources, cell_index):
+        """Extract the images from a cell's outputs.
+
+        Parameters
+        ----------
+        cell : `nbformat.NotebookNode`
+            Notebook cell being processed.
+        resources : `dict`
+            Additional resources used in the conversion process. Extracted
+            images are added to the ``outputs`` field.
+        cell_index : `int`
+            Index of the cell being processed.
+
+        Returns
+        -------
+        cell : `nbformat.NotebookNode`
+            Notebook cell, with ``metadata.filenames`` set on outputs
+            with extracted images.
+        resources : `dict`
+            Additional resources used in the conversion process.
+        """
+        if not isinstance(resources.get('outputs'), dict):
+            resources['outputs'] = {}
+
+        for output in cell.get('outputs', []):
+            if output.output_type not in {'display_data', 'execute_result'}:
+                continue
+            for mime_type in self.extract_output_types:
+                if mime_type not in output.data:
+                    continue
+
+                data = output.data[mime_type]
+                if mime_type in BINARY_MIME_TYPES:
+                    # Binary data is base64-encoded in the notebook.
+                    data = a2b_base64(data)
+                else:
+                    data = data.encode('utf-8')
+                filename = posixpath.join(
+                    self.output_files_dir,
+                    _get_content_filename(data, mime_type))
+
+                output.metadata.setdefault('filenames', {})
+                output.metadata['filenames'][mime_type] = filename
+                resources['outputs'][filename] = data
+
+        return cell, resources
+
+
+BINARY_MIME_TYPES = {'image/png', 'image/jpeg', 'application/pdf'}
+"""Media types of outputs that are base64-encoded in notebooks.
+"""
+
+
+def _get_content_filename(data, mime_type):
+    """Get the content-addressed filename of an output.
+
+    Parameters
+    ----------
+    data : `bytes`
+        Content of the output.
+    mime_type : `str`
+        Media type of the output.
+
+    Returns
+    -------
+    filename : `str`
+        Filename made from the SHA-256 hash of the content and an extension
+        for the media type.
+    """
+    extension = guess_extension_without_jpe(mime_type)
+    if extension is None:
+        extension = '.' + mime_type.rsplit('/')[-1]
+    return hashlib.sha256(data).hexdigest() + extension
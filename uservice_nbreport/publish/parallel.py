@@ -0,0 +1,199 @@
+"""Parallel rendering of notebook cells in a process pool.
+
+`~uservice_nbreport.publish.htmlexport.LsstHtmlReportExporter` uses these
+functions when its ``parallel_render`` setting is enabled and a notebook is
+large enough.
+"""
+
+__all__ = ('CELLS_TEMPLATE_FILE', 'get_notebook_size', 'split_cells',
+           'make_cells_notebook', 'make_chunk_args', 'iter_cell_notebooks',
+           'render_cell_chunk')
+
+import nbformat
+from nbconvert.exporters.exporter import ResourcesDict
+
+CELLS_TEMPLATE_FILE = 'report-cells.jinja'
+"""Template that renders only the cells of a notebook, with the same blocks
+as the report template.
+"""
+
+_EXCLUDED_RESOURCES = {'outputs', 'inlining', 'lsst_outline_root',
+                       'lsst_markdown_asts'}
+"""Resources that cell templates don't need, and so aren't sent to the
+worker processes.
+"""
+
+_worker_exporters = {}
+"""Exporters in a worker process, keyed by their settings."""
+
+
+def get_notebook_size(nb):
+    """Estimate the size of a notebook from the size of its cell sources and
+    outputs, without serializing it.
+
+    Parameters
+    ----------
+    nb : `nbformat.NotebookNode`
+        The notebook.
+
+    Returns
+    -------
+    size : `int`
+        Approximate size of the notebook, in characters.
+    """
+    size = 0
+    for cell in nb.cells:
+        size += len(cell.source)
+        for output in cell.get('outputs', []):
+            if 'text' in output:
+                size += len(output['text'])
+            for data in output.get('data', {}).values():
+                if isinstance(data, str):
+                    size += len(data)
+    return size
+
+
+def split_cells(cells, chunk_count):
+    """Split cells into contiguous chunks with about the same number of
+    characters.
+
+    Parameters
+    ----------
+    cells : `list` of `nbformat.NotebookNode`
+        The cells.
+    chunk_count : `int`
+        Maximum number of chunks.
+
+    Returns
+    -------
+    chunks : `list` of `list`
+        The cells, in order, split into at most ``chunk_count`` non-empty
+        chunks.
+    """
+    sizes = [get_notebook_size(nbformat.NotebookNode(cells=[cell]))
+             for cell in cells]
+    target_size = max(sum(sizes) / max(chunk_count, 1), 1)
+
+    chunks = []
+    chunk = []
+    chunk_size = 0
+    for cell, size in zip(cells, sizes):
+        chunk.append(cell)
+        chunk_size += size
+        if chunk_size >= target_size and len(chunks) < chunk_count - 1:
+            chunks.append(chunk)
+            chunk = []
+            chunk_size = 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def make_cells_notebook(nb, cells):
+    """Make a notebook with the metadata of a notebook and some of its cells.
+
+    Parameters
+    ----------
+    nb : `nbformat.NotebookNode`
+        The notebook.
+    cells : `list` of `nbformat.NotebookNode`
+        Cells of ``nb``.
+
+    Returns
+    -------
+    cells_nb : `nbformat.NotebookNode`
+        Notebook with only ``cells``.
+    """
+    return nbformat.NotebookNode(
+        cells=cells,
+        metadata=nb.metadata,
+        nbformat=nb.nbformat,
+        nbformat_minor=nb.nbformat_minor)
+
+
+def make_chunk_args(nb, resources, cells):
+    """Make the notebook and resources for rendering a chunk of cells in a
+    worker process.
+
+    Parameters
+    ----------
+    nb : `nbformat.NotebookNode`
+        The preprocessed notebook.
+    resources : `dict`
+        The resources of the conversion.
+    cells : `list` of `nbformat.NotebookNode`
+        The chunk of cells.
+
+    Returns
+    -------
+    chunk_nb : `nbformat.NotebookNode`
+        Notebook with only the chunk's cells.
+    chunk_resources : `dict`
+        Resources needed to render the cells.
+    """
+    chunk_nb = make_cells_notebook(nb, cells)
+
+    chunk_resources = {key: value for key, value in resources.items()
+                       if key not in _EXCLUDED_RESOURCES}
+    if 'lsst_markdown_asts' in resources:
+        asts = resources['lsst_markdown_asts']
+        chunk_resources['lsst_markdown_asts'] = {
+            cell.source: asts[cell.source] for cell in cells
+            if cell.cell_type == 'markdown' and cell.source in asts}
+    return chunk_nb, chunk_resources
+
+
+def iter_cell_notebooks(nb):
+    """Iterate over notebooks that each contain one cell of a notebook.
+
+    Parameters
+    ----------
+    nb : `nbformat.NotebookNode`
+        The notebook.
+
+    Yields
+    ------
+    cell_nb : `nbformat.NotebookNode`
+        Notebook with the metadata of ``nb`` and only one of its cells, in
+        order.
+    """
+    for cell in nb.cells:
+        yield make_cells_notebook(nb, [cell])
+
+
+def render_cell_chunk(exporter_settings, pygments_lexer, nb, resources):
+    """Render a chunk of cells to HTML (runs in a worker process).
+
+    Parameters
+    ----------
+    exporter_settings : `dict`
+        Keyword arguments for creating the
+        `~uservice_nbreport.publish.htmlexport.LsstHtmlReportExporter`.
+        The exporter is created once per worker process and settings.
+    pygments_lexer : `str`
+        Name of the notebook's Pygments lexer, for the ``highlight_code``
+        filter.
+    nb : `nbformat.NotebookNode`
+        Notebook with only the chunk's cells (see `make_chunk_args`).
+    resources : `dict`
+        Resources of the conversion (see `make_chunk_args`).
+
+    Returns
+    -------
+    fragments : `list` of `str`
+        HTML of each cell, exactly as the report template renders them.
+    """
+    from .htmlexport import LsstHtmlReportExporter
+
+    key = tuple(sorted(exporter_settings.items()))
+    try:
+        exporter = _worker_exporters[key]
+    except KeyError:
+        exporter = LsstHtmlReportExporter(**exporter_settings)
+        _worker_exporters[key] = exporter
+
+    exporter.register_filter('highlight_code',
+                             exporter._get_highlighter(pygments_lexer))
+    chunk_resources = ResourcesDict()
+    chunk_resources.update(resources)
+    return exporter._render_fragments(nb, chunk_resources)
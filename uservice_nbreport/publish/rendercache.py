@@ -0,0 +1,161 @@
+"""Local disk cache of rendered report sites.
+
+The cache lets a publish task skip rendering a notebook that was already
+rendered, which is common when a client re-uploads the same notebook (for
+example, after a CI retry).
+"""
+
+__all__ = ('RenderCache', 'compute_render_key')
+
+import hashlib
+import os
+from pathlib import Path
+import shutil
+import uuid
+
+import nbformat
+
+
+class RenderCache:
+    """A size-bounded, least-recently-used cache of rendered sites, stored on
+    the local disk.
+
+    Each cache entry is a directory, named after its key, that contains the
+    files of a rendered site (such as ``index.html`` and its assets).
+    Several processes can share the same cache directory.
+
+    Parameters
+    ----------
+    cache_dir : `str` or `pathlib.Path`
+        Directory where cache entries are stored. It's created if necessary.
+    max_bytes : `int`
+        Maximum total size of the cached files. Least-recently-used entries
+        are evicted when a new entry makes the cache exceed this size.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def __contains__(self, key):
+        return (self.cache_dir / key).is_dir()
+
+    def get(self, key, dest_dir):
+        """Copy a cached site into a directory.
+
+        Parameters
+        ----------
+        key : `str`
+            Cache key (see `compute_render_key`).
+        dest_dir : `pathlib.Path`
+            Directory where the site's files are copied.
+
+        Returns
+        -------
+        hit : `bool`
+            `True` if the key is in the cache and its files were copied into
+            ``dest_dir``, `False` otherwise.
+        """
+        entry_dir = self.cache_dir / key
+        try:
+            # Mark the entry as recently used.
+            os.utime(str(entry_dir))
+            _copy_tree(entry_dir, Path(dest_dir))
+        except FileNotFoundError:
+            # Not cached, or the entry was evicted by another process.
+            return False
+        return True
+
+    def put(self, key, source_dir):
+        """Add a rendered site to the cache.
+
+        Parameters
+        ----------
+        key : `str`
+            Cache key (see `compute_render_key`).
+        source_dir : `pathlib.Path`
+            Directory containing the site's files.
+        """
+        entry_dir = self.cache_dir / key
+        if entry_dir.is_dir():
+            return
+
+        # Stage the entry under a temporary name so that other processes
+        # never see a partially-written entry.
+        tmp_dir = self.cache_dir / '.tmp-{0}'.format(uuid.uuid4().hex)
+        _copy_tree(Path(source_dir), tmp_dir)
+        try:
+            tmp_dir.rename(entry_dir)
+        except OSError:
+            # Another process added the same entry first.
+            shutil.rmtree(str(tmp_dir), ignore_errors=True)
+
+        self.prune()
+
+    def prune(self):
+        """Evict least-recently-used entries until the cache fits within
+        ``max_bytes``.
+        """
+        entries = []
+        total_size = 0
+        for entry_dir in self.cache_dir.iterdir():
+            if entry_dir.name.startswith('.'):
+                continue
+            try:
+                size = _get_tree_size(entry_dir)
+                mtime = entry_dir.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            entries.append((mtime, size, entry_dir))
+            total_size += size
+
+        entries.sort()
+        for _, size, entry_dir in entries:
+            if total_size <= self.max_bytes:
+                break
+            shutil.rmtree(str(entry_dir), ignore_errors=True)
+            total_size -= size
+
+
+def compute_render_key(nb, exporter):
+    """Compute the render cache key of a notebook.
+
+    Parameters
+    ----------
+    nb : `nbformat.NotebookNode`
+        The notebook document.
+    exporter : `uservice_nbreport.publish.htmlexport.LsstHtmlReportExporter`
+        The exporter that renders the notebook.
+
+    Returns
+    -------
+    key : `str`
+        Hex digest of a hash of the normalized notebook and the exporter's
+        `~uservice_nbreport.publish.htmlexport.LsstHtmlReportExporter.render_fingerprint`.
+    """
+    h = hashlib.sha256()
+    h.update(exporter.render_fingerprint.encode('utf-8'))
+    # nbformat.writes serializes with sorted keys and consistent
+    # indentation, which normalizes notebooks that only differ in their
+    # JSON formatting.
+    h.update(nbformat.writes(nb, version=4).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _copy_tree(source_dir, dest_dir):
+    """Copy the files in ``source_dir`` into ``dest_dir``, which may already
+    exist.
+    """
+    for source_path in source_dir.glob('**/*'):
+        if not source_path.is_file():
+            continue
+        dest_path = dest_dir / source_path.relative_to(source_dir)
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(str(source_path), str(dest_path))
+
+
+def _get_tree_size(path):
+    """Get the total size, in bytes, of the files in a directory.
+    """
+    return sum(p.stat().st_size for p in path.glob('**/*') if p.is_file())
@@ -0,0 +1,69 @@
+"""Packing of rendered sites for the upload task.
+
+The render and upload stages of a publication run as separate Celery tasks,
+possibly on different hosts, so the render task packs the site it rendered
+into an archive that's staged in the blob store (see
+`uservice_nbreport.blobstore`), and the upload task unpacks it into its own
+work directory.
+"""
+
+__all__ = ('pack_site', 'unpack_site')
+
+from pathlib import Path
+import tarfile
+
+
+def pack_site(site_dir, fileobj):
+    """Pack the files of a site into a tar archive.
+
+    Parameters
+    ----------
+    site_dir : `str` or `pathlib.Path`
+        Directory of the site.
+    fileobj : file-like object
+        Binary file where the archive is written. Paths in the archive are
+        relative to ``site_dir``.
+    """
+    site_dir = Path(site_dir)
+    with tarfile.open(fileobj=fileobj, mode='w') as archive:
+        for path in sorted(site_dir.glob('**/*')):
+            if path.is_file():
+                archive.add(str(path),
+                            arcname=path.relative_to(site_dir).as_posix(),
+                            recursive=False)
+
+
+def unpack_site(fileobj, site_dir):
+    """Unpack a site packed by `pack_site`.
+
+    Parameters
+    ----------
+    fileobj : file-like object
+        Binary file with the archive.
+    site_dir : `str` or `pathlib.Path`
+        Directory where the site's files are written. It's created if
+        necessary.
+
+    Returns
+    -------
+    nbytes : `int`
+        Total size of the unpacked files, in bytes.
+
+    Raises
+    ------
+    ValueError
+        Raised if the archive has a path outside ``site_dir``.
+    """
+    site_dir = Path(site_dir)
+    site_dir.mkdir(parents=True, exist_ok=True)
+    nbytes = 0
+    with tarfile.open(fileobj=fileobj, mode='r') as archive:
+        members = archive.getmembers()
+        for member in members:
+            if not member.isfile() or member.name.startswith('/') \
+                    or '..' in Path(member.name).parts:
+                raise ValueError(
+                    'Unexpected archive member {0!r}'.format(member.name))
+            nbytes += member.size
+        archive.extractall(str(site_dir), members=members)
+    return nbytes
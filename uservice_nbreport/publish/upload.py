@@ -0,0 +1,439 @@
+"""Upload report sites to the LSST the Docs S3 bucket.
+"""
+
+__all__ = ('upload_site', 'build_manifest', 'read_manifest', 'get_s3_client',
+           'MANIFEST_FILENAME', 'DEFAULT_MAX_WORKERS',
+           'DEFAULT_MULTIPART_THRESHOLD')
+
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import posixpath
+import threading
+
+import boto3
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.exceptions import ClientError
+from s3transfer.subscribers import BaseSubscriber
+
+MANIFEST_FILENAME = '.nbreport-manifest.json'
+"""Name of the manifest object that `upload_site` writes in the root of
+each site.
+"""
+
+DEFAULT_MAX_WORKERS = 8
+"""Default number of concurrent object and part uploads."""
+
+DEFAULT_MULTIPART_THRESHOLD = 8 * 1024 ** 2
+"""Default size, in bytes, from which files are uploaded in parts (this is
+also the part size).
+"""
+
+_s3_clients = {}
+"""S3 clients of this process, keyed by process ID, credentials, and
+endpoint (see `get_s3_client`).
+"""
+
+_s3_clients_lock = threading.Lock()
+
+
+def upload_site(site_dir, *, bucket_name, bucket_root, aws_id, aws_secret,
+                surrogate_key=None, surrogate_control=None,
+                cache_control=None, content_encodings=None,
+                upload_dir_redirect_objects=True,
+                max_workers=DEFAULT_MAX_WORKERS,
+                multipart_threshold=DEFAULT_MULTIPART_THRESHOLD,
+                previous_root=None, endpoint_url=None,
+                progress_callback=None, completed=None,
+                object_callback=None):
+    """Upload a site directory to a (new) directory in an S3 bucket.
+
+    This function has the same semantics as `ltdconveyor.s3.upload_dir`
+    for metadata and directory redirect objects, but also sets the
+    ``Content-Encoding`` of pre-compressed files. Unlike
+    `ltdconveyor.s3.upload_dir`, it doesn't delete existing objects since
+    each LSST the Docs build is uploaded to a new directory.
+
+    Objects are uploaded concurrently by a bounded pool of threads that
+    share one S3 client, and files larger than ``multipart_threshold`` are
+    uploaded in parts, which are also uploaded concurrently.
+
+    The site's manifest (see `build_manifest`) is uploaded along with it,
+    as ``MANIFEST_FILENAME``. If ``previous_root`` is set, files with the
+    same content as an object in the manifest of that earlier site are
+    copied within the bucket rather than uploaded.
+
+    Parameters
+    ----------
+    site_dir : `pathlib.Path`
+        Directory containing the site's files.
+    bucket_name : `str`
+        Name of the S3 bucket.
+    bucket_root : `str`
+        Directory in the bucket where the site is uploaded.
+    aws_id : `str`
+        AWS key identifier.
+    aws_secret : `str`
+        AWS secret key.
+    surrogate_key : `str`, optional
+        Value of the ``x-amz-meta-surrogate-key`` header, which is used to
+        purge builds from the Fastly CDN.
+    surrogate_control : `str`, optional
+        Value of the ``x-amz-meta-surrogate-control`` header.
+    cache_control : `str`, optional
+        Value of the ``Cache-Control`` header.
+    content_encodings : `dict`, optional
+        Mapping of the POSIX-style paths of files, relative to ``site_dir``,
+        to their ``Content-Encoding`` (see
+        `uservice_nbreport.publish.compression.compress_site`).
+    upload_dir_redirect_objects : `bool`, optional
+        If `True`, an object is created for every directory, with a
+        ``x-amz-meta-dir-redirect=true`` header that tells Fastly to
+        redirect from the directory to its ``index.html``.
+    max_workers : `int`, optional
+        Maximum number of concurrent uploads (of objects or parts).
+    multipart_threshold : `int`, optional
+        Size, in bytes, from which files are uploaded with a multipart
+        upload. It's also the size of the parts.
+    previous_root : `str`, optional
+        Directory in the bucket of an earlier site, like the previous build
+        of the same report instance, whose unchanged objects are copied.
+    endpoint_url : `str`, optional
+        URL of the S3 API, for S3-compatible services other than AWS.
+    progress_callback : callable, optional
+        Function called with the number of objects that are uploaded (or
+        copied) and the total number of objects, before the first upload
+        and then each time an object is uploaded. It's called from the
+        upload threads, but never concurrently.
+    completed : `set` of `str`, optional
+        Paths of files, relative to ``site_dir``, that an earlier,
+        interrupted, call already uploaded to ``bucket_root``. They're not
+        uploaded again.
+    object_callback : callable, optional
+        Function called with the path of each file, relative to
+        ``site_dir``, once it's uploaded (or copied), for recording the
+        ``completed`` files. It's called from the upload threads.
+
+    Returns
+    -------
+    result : `dict`
+        Summary of the upload, with fields:
+
+        - ``objects``: number of objects uploaded or copied, not counting
+          the manifest (`int`). This includes the ``completed`` files.
+        - ``bytes``: number of bytes uploaded (`int`).
+        - ``copied``: number of objects copied from the previous site
+          (`int`).
+        - ``copied_bytes``: number of bytes copied (`int`).
+    """
+    if content_encodings is None:
+        content_encodings = {}
+
+    s3 = get_s3_client(aws_id, aws_secret, endpoint_url)
+    transfer_config = TransferConfig(
+        multipart_threshold=multipart_threshold,
+        multipart_chunksize=multipart_threshold,
+        max_concurrency=max_workers,
+        use_threads=max_workers > 1)
+
+    metadata = {}
+    if surrogate_key is not None:
+        metadata['surrogate-key'] = surrogate_key
+    if surrogate_control is not None:
+        metadata['surrogate-control'] = surrogate_control
+
+    manifest = build_manifest(site_dir, content_encodings=content_encodings)
+    previous_objects = {}
+    if previous_root is not None:
+        previous_manifest = read_manifest(s3, bucket_name, previous_root)
+        if previous_manifest is not None:
+            # Index the previous build's objects by content so that renamed
+            # files are copied too.
+            for rel_path, entry in previous_manifest['objects'].items():
+                previous_objects[(entry['sha256'],
+                                  entry['content_encoding'])] = rel_path
+
+    result = {'objects': 0, 'bytes': 0, 'copied': 0, 'copied_bytes': 0}
+    uploads = []
+    copies = []
+    skipped = set(manifest['objects']) & set(completed or ())
+    subscribers = []
+    if progress_callback is not None:
+        total = len(manifest['objects'])
+        if upload_dir_redirect_objects:
+            total += len(manifest['directories'])
+        subscribers.append(_ProgressSubscriber(progress_callback, total,
+                                               done=len(skipped)))
+        progress_callback(len(skipped), total)
+    with create_transfer_manager(s3, transfer_config) as manager:
+        for rel_path, entry in sorted(manifest['objects'].items()):
+            result['objects'] += 1
+            if rel_path in skipped:
+                continue
+            key = posixpath.join(bucket_root, rel_path)
+            object_subscribers = list(subscribers)
+            if object_callback is not None:
+                object_subscribers.append(
+                    _DoneCallback(object_callback, rel_path))
+            extra_args = _make_object_args(
+                metadata=metadata,
+                cache_control=cache_control,
+                content_type=_guess_content_type(rel_path),
+                content_encoding=entry['content_encoding'])
+            upload_args = (str(site_dir / rel_path), bucket_name, key,
+                           extra_args, object_subscribers)
+
+            previous_path = previous_objects.get(
+                (entry['sha256'], entry['content_encoding']))
+            if previous_path is not None:
+                # Server-side copy of the unchanged object, with this
+                # build's headers.
+                copy_args = dict(extra_args, MetadataDirective='REPLACE')
+                copy_source = {
+                    'Bucket': bucket_name,
+                    'Key': posixpath.join(previous_root, previous_path)}
+                copies.append((
+                    manager.copy(copy_source, bucket_name, key,
+                                 extra_args=copy_args,
+                                 subscribers=[_SizeProvider(entry['size'])]
+                                 + object_subscribers),
+                    upload_args, entry['size']))
+            else:
+                uploads.append(_upload(manager, *upload_args))
+                result['bytes'] += entry['size']
+
+        if upload_dir_redirect_objects:
+            redirect_metadata = dict(metadata)
+            # header used by LTD's Fastly Varnish config to create a 301
+            # redirect
+            redirect_metadata['dir-redirect'] = 'true'
+            redirect_args = _make_object_args(metadata=redirect_metadata,
+                                              cache_control=cache_control)
+            for dirname in sorted(manifest['directories']):
+                key = posixpath.join(bucket_root, dirname).rstrip('/')
+                uploads.append(manager.upload(
+                    io.BytesIO(b''), bucket_name, key,
+                    extra_args=redirect_args, subscribers=subscribers))
+                result['objects'] += 1
+
+        for future, upload_args, size in copies:
+            try:
+                future.result()
+            except ClientError:
+                # The previous build's object is missing, so upload the file
+                # instead.
+                uploads.append(_upload(manager, *upload_args))
+                result['bytes'] += size
+            else:
+                result['copied'] += 1
+                result['copied_bytes'] += size
+
+        # Raise the first upload error, if any. Leaving the manager's
+        # context waits for (or, after an error, cancels) the other
+        # uploads.
+        for future in uploads:
+            future.result()
+
+    # Write the manifest last, so that it only describes complete builds.
+    s3.put_object(Bucket=bucket_name,
+                  Key=posixpath.join(bucket_root, MANIFEST_FILENAME),
+                  Body=json.dumps(manifest, sort_keys=True).encode('utf-8'),
+                  ContentType='application/json',
+                  **_make_object_args(metadata=metadata,
+                                      cache_control=cache_control))
+
+    return result
+
+
+def build_manifest(site_dir, content_encodings=None):
+    """Build the manifest of a site directory.
+
+    Parameters
+    ----------
+    site_dir : `pathlib.Path`
+        Directory containing the site's files.
+    content_encodings : `dict`, optional
+        Mapping of the POSIX-style paths of files, relative to ``site_dir``,
+        to their ``Content-Encoding``.
+
+    Returns
+    -------
+    manifest : `dict`
+        Manifest, with fields:
+
+        - ``objects``: mapping of the POSIX-style path of each file,
+          relative to ``site_dir``, to its ``size`` (bytes), ``sha256`` hex
+          digest, and ``content_encoding`` (or `None`).
+        - ``directories``: sorted `list` of the paths of the directories,
+          including ``''`` for ``site_dir`` itself.
+    """
+    if content_encodings is None:
+        content_encodings = {}
+
+    objects = {}
+    directories = {''}
+    for path in sorted(site_dir.glob('**/*')):
+        rel_path = path.relative_to(site_dir).as_posix()
+        if path.is_dir():
+            directories.add(rel_path)
+            continue
+        h = hashlib.sha256()
+        size = 0
+        with path.open('rb') as f:
+            for chunk in iter(lambda: f.read(1024 ** 2), b''):
+                h.update(chunk)
+                size += len(chunk)
+        objects[rel_path] = {
+            'size': size,
+            'sha256': h.hexdigest(),
+            'content_encoding': content_encodings.get(rel_path),
+        }
+    return {'objects': objects, 'directories': sorted(directories)}
+
+
+def read_manifest(s3, bucket_name, bucket_root):
+    """Read the manifest of a site uploaded by `upload_site`.
+
+    Parameters
+    ----------
+    s3 : `botocore.client.S3`
+        S3 client.
+    bucket_name : `str`
+        Name of the S3 bucket.
+    bucket_root : `str`
+        Directory in the bucket where the site was uploaded.
+
+    Returns
+    -------
+    manifest : `dict`
+        The manifest (see `build_manifest`), or `None` if the site doesn't
+        have one.
+    """
+    try:
+        response = s3.get_object(
+            Bucket=bucket_name,
+            Key=posixpath.join(bucket_root, MANIFEST_FILENAME))
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            return None
+        raise
+    return json.loads(response['Body'].read().decode('utf-8'))
+
+
+def get_s3_client(aws_id, aws_secret, endpoint_url=None):
+    """Get an S3 client that's shared by all uploads in this process with
+    the same credentials.
+
+    Creating a client loads botocore's service models, which takes longer
+    than uploading a small site. Clients are thread-safe, but aren't shared
+    with forked processes.
+
+    Parameters
+    ----------
+    aws_id : `str`
+        AWS key identifier.
+    aws_secret : `str`
+        AWS secret key.
+    endpoint_url : `str`, optional
+        URL of an S3-compatible service, instead of AWS S3.
+
+    Returns
+    -------
+    client : `botocore.client.S3`
+        The S3 client.
+    """
+    key = (os.getpid(), aws_id, aws_secret, endpoint_url)
+    with _s3_clients_lock:
+        try:
+            return _s3_clients[key]
+        except KeyError:
+            session = boto3.session.Session(
+                aws_access_key_id=aws_id,
+                aws_secret_access_key=aws_secret)
+            client = session.client('s3', endpoint_url=endpoint_url)
+            _s3_clients[key] = client
+            return client
+
+
+class _SizeProvider(BaseSubscriber):
+    """Provides the size of a copied object, from the manifest, so that
+    the transfer manager doesn't request it with a ``HeadObject`` request.
+    """
+
+    def __init__(self, size):
+        self.size = size
+
+    def on_queued(self, future, **kwargs):
+        future.meta.provide_transfer_size(self.size)
+
+
+class _ProgressSubscriber(BaseSubscriber):
+    """Counts the objects that are transferred, and reports the count to a
+    progress callback.
+    """
+
+    def __init__(self, callback, total, done=0):
+        self.callback = callback
+        self.total = total
+        self.done = done
+        self._lock = threading.Lock()
+
+    def on_done(self, future, **kwargs):
+        try:
+            future.result()
+        except Exception:
+            # Failed copies are uploaded instead, and failed uploads fail
+            # the whole site.
+            return
+        with self._lock:
+            self.done += 1
+            self.callback(self.done, self.total)
+
+
+class _DoneCallback(BaseSubscriber):
+    """Calls a function with an object's path once it's transferred.
+    """
+
+    def __init__(self, callback, path):
+        self.callback = callback
+        self.path = path
+
+    def on_done(self, future, **kwargs):
+        try:
+            future.result()
+        except Exception:
+            return
+        self.callback(self.path)
+
+
+def _upload(manager, filename, bucket_name, key, extra_args,
+            subscribers=None):
+    return manager.upload(filename, bucket_name, key, extra_args=extra_args,
+                          subscribers=subscribers)
+
+
+def _guess_content_type(path):
+    """Guess the media type of a file from its name, like
+    `ltdconveyor.s3.upload_file`.
+    """
+    content_type, _ = mimetypes.guess_type(path, strict=False)
+    return content_type
+
+
+def _make_object_args(*, metadata=None, cache_control=None,
+                      content_type=None, content_encoding=None):
+    """Make the keyword arguments for an S3 object's headers, leaving out
+    headers that aren't set.
+    """
+    args = {}
+    if metadata:
+        args['Metadata'] = metadata
+    if cache_control is not None:
+        args['CacheControl'] = cache_control
+    if content_type is not None:
+        args['ContentType'] = content_type
+    if content_encoding is not None:
+        args['ContentEncoding'] = content_encoding
+    return args
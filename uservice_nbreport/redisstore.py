@@ -0,0 +1,38 @@
+"""Redis client shared by the app's indexes and caches.
+"""
+
+__all__ = ('get_redis',)
+
+from flask import current_app
+import redis
+
+_clients = {}
+"""Redis clients of this process, keyed by URL (see `get_redis`)."""
+
+
+def get_redis(url=None):
+    """Get the Redis client of this process.
+
+    Clients are created once per process and URL, and then reused, so that
+    their connection pools are shared.
+
+    Parameters
+    ----------
+    url : `str`, optional
+        URL of the Redis server. By default, the ``REDIS_URL`` configuration
+        is used, and so this function must be called from within a Flask
+        application context.
+
+    Returns
+    -------
+    client : `redis.StrictRedis`
+        The Redis client. Responses are decoded as UTF-8 strings.
+    """
+    if url is None:
+        url = current_app.config['REDIS_URL']
+    try:
+        return _clients[url]
+    except KeyError:
+        client = redis.StrictRedis.from_url(url, decode_responses=True)
+        _clients[url] = client
+        return client
@@ -14,4 +14,5 @@ from .login import *
 from .registerreport import *
 from .reserveinstance import *
 from .uploadnb import *
+from .bulkupload import *
 from .getqueueitem import *
@@ -0,0 +1,269 @@
+"""Implementation for the POST /bulk/notebooks endpoint, which publishes
+notebooks for many report instances in one request.
+"""
+
+__all__ = ('bulk_upload_notebooks',)
+
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+
+from apikit import BackendError
+from flask import current_app, g, jsonify, request, url_for
+import nbformat
+import structlog
+
+from . import api
+from .reserveinstance import delete_edition, reserve_edition
+from ..auth import github_token_auth, requires_github_org_membership, ltd_login
+from ..blobstore import get_blob_store
+from ..editionindex import EditionIndex
+from ..exceptions import ValidationError
+from ..httpclient import get_session
+from ..keepertoken import get_keeper_token_cache
+from ..redisstore import get_redis
+from ..tasks import queue_publication_group
+
+
+@api.route('/bulk/notebooks', methods=['POST'])
+@github_token_auth.login_required
+@requires_github_org_membership()
+@ltd_login()
+def bulk_upload_notebooks():
+    """Upload notebooks for many report instances, of one or more reports,
+    for publication.
+
+    The request body is either:
+
+    - NDJSON (``application/x-ndjson``), with an object per line that has
+      ``report``, ``notebook`` (the notebook document), and optionally
+      ``instance_id`` fields.
+    - ``multipart/form-data``, with a file per notebook whose field name is
+      ``<report>/<instance_id>``, or just ``<report>``.
+
+    Notebooks without an instance ID are published to a new instance,
+    reserved like with ``POST /reports/<report>/instances/``. Each notebook
+    is validated with nbformat and staged in the blob store as soon as it's
+    read, and all publications are queued as one Celery group. The
+    ``queue_url`` of the response is the aggregated status of the group.
+
+    Nothing is published if a notebook is invalid, an instance can't be
+    reserved, or the publications can't be queued: the staged notebooks are
+    deleted, and so are the instances that were reserved.
+    """
+    max_notebooks = current_app.config['BULK_MAX_NOTEBOOKS']
+    if request.mimetype == 'application/x-ndjson':
+        notebooks = _iter_ndjson_notebooks(request.stream)
+    elif request.mimetype == 'multipart/form-data':
+        notebooks = _iter_multipart_notebooks(request.files)
+    else:
+        raise ValidationError(
+            'Content-Type must be application/x-ndjson or '
+            'multipart/form-data',
+            status_code=400,
+            content='Sent mimetype {}'.format(request.mimetype))
+
+    blob_store = get_blob_store()
+    items = []
+    try:
+        for report, instance_id, fileobj in notebooks:
+            if len(items) == max_notebooks:
+                raise ValidationError(
+                    'Too many notebooks (the maximum is {0:d})'.format(
+                        max_notebooks),
+                    status_code=413)
+            items.append({'report': report,
+                          'instance_id': instance_id,
+                          'nb_ref': blob_store.put(fileobj)})
+        if not items:
+            raise ValidationError('The request has no notebooks',
+                                  status_code=400)
+        _reserve_instances(items)
+        group_id, publication_ids = queue_publication_group(
+            [(item['nb_ref'], item['report'], item['instance_id'])
+             for item in items])
+    except Exception:
+        for item in items:
+            blob_store.delete(item['nb_ref'])
+        _delete_editions(
+            [item['edition'] for item in items if 'edition' in item],
+            ltd_token=g.ltd_token)
+        raise
+
+    publications = []
+    for item, publication_id in zip(items, publication_ids):
+        publication = {
+            'report': item['report'],
+            'instance_id': item['instance_id'],
+            'queue_url': url_for('api.get_queue_item', id=publication_id,
+                                 _external=True),
+        }
+        if 'edition' in item:
+            publication['published_url'] = item['edition']['published_url']
+            publication['ltd_edition_url'] = item['edition']['self_url']
+        publications.append(publication)
+
+    data = {
+        'queue_url': url_for('api.get_queue_group', id=group_id,
+                             _external=True),
+        'publications': publications,
+    }
+    return jsonify(data), 202
+
+
+def _iter_ndjson_notebooks(stream):
+    """Iterate over the notebooks of an NDJSON request body.
+
+    Yields
+    ------
+    report : `str`
+        Report slug.
+    instance_id : `str`
+        Instance ID, or `None` to reserve a new instance.
+    fileobj : file-like object
+        The serialized notebook.
+    """
+    line_number = 0
+    while True:
+        line = stream.readline()
+        if not line:
+            break
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line.decode('utf-8'))
+        except ValueError as e:
+            raise ValidationError(
+                'Line {0:d} is not valid JSON'.format(line_number),
+                status_code=400, content=str(e))
+        if not isinstance(item, dict) or \
+                not isinstance(item.get('report'), str) or \
+                not isinstance(item.get('notebook'), dict):
+            raise ValidationError(
+                'Line {0:d} must be an object with report and notebook '
+                'fields'.format(line_number),
+                status_code=400)
+        instance_id = item.get('instance_id')
+        if instance_id is not None:
+            instance_id = str(instance_id)
+        nb_data = json.dumps(item['notebook']).encode('utf-8')
+        _validate_notebook(nb_data, 'Line {0:d}'.format(line_number))
+        yield item['report'], instance_id, io.BytesIO(nb_data)
+
+
+def _iter_multipart_notebooks(files):
+    """Iterate over the notebooks of a multipart request body.
+
+    Yields
+    ------
+    report : `str`
+        Report slug.
+    instance_id : `str`
+        Instance ID, or `None` to reserve a new instance.
+    fileobj : file-like object
+        The serialized notebook.
+    """
+    for name, file_storage in files.items(multi=True):
+        report, _, instance_id = name.partition('/')
+        if not report:
+            raise ValidationError(
+                'Notebook fields must be named <report>/<instance_id> or '
+                '<report>',
+                status_code=400,
+                content='Field {0!r}'.format(name))
+        nb_data = file_storage.stream.read()
+        _validate_notebook(nb_data, 'Field {0!r}'.format(name))
+        yield report, instance_id or None, io.BytesIO(nb_data)
+
+
+def _validate_notebook(nb_data, location):
+    """Validate a serialized notebook, so that invalid notebooks are
+    rejected before they're staged rather than failing their render task.
+
+    Raises
+    ------
+    uservice_nbreport.exceptions.ValidationError
+        Raised, with a 400 status, if the notebook is invalid.
+    """
+    try:
+        nb = nbformat.reads(nb_data.decode('utf-8'), as_version=4)
+        nbformat.validate(nb)
+    except (ValueError, nbformat.ValidationError) as e:
+        raise ValidationError(
+            '{0} is not a valid notebook'.format(location),
+            status_code=400, content=str(e).splitlines()[0])
+
+
+def _reserve_instances(items):
+    """Reserve new instances, concurrently, for the items without an
+    instance ID.
+    """
+    new_items = [item for item in items if item['instance_id'] is None]
+    if not new_items:
+        return
+
+    keeper_url = current_app.config['KEEPER_URL']
+    ltd_token = g.ltd_token
+    token_cache = get_keeper_token_cache()
+    # Create the pooled session here, so that it's configured by the
+    # application's HTTP settings, rather than in a thread without an
+    # application context.
+    get_session('keeper')
+
+    def reserve(item):
+        try:
+            return reserve_edition(item['report'], keeper_url=keeper_url,
+                                   ltd_token=ltd_token,
+                                   token_cache=token_cache)
+        except Exception as e:
+            return e
+
+    max_workers = min(len(new_items), current_app.config['HTTP_POOL_MAXSIZE'])
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        editions = list(executor.map(reserve, new_items))
+
+    errors = [(item, edition) for item, edition in zip(new_items, editions)
+              if isinstance(edition, Exception)]
+    if errors:
+        _delete_editions(
+            [edition for edition in editions
+             if not isinstance(edition, Exception)],
+            ltd_token=ltd_token)
+        raise BackendError(
+            'Instances could not be reserved for {0:d} of {1:d} '
+            'notebooks; nothing was published'.format(
+                len(errors), len(new_items)),
+            status_code=502,
+            content='; '.join(
+                '{0}: {1}'.format(item['report'], error)
+                for item, error in errors))
+
+    edition_urls = {}
+    for item, edition in zip(new_items, editions):
+        item['instance_id'] = edition['slug']
+        item['edition'] = edition
+        edition_urls.setdefault(item['report'], {})[edition['slug']] = \
+            edition['self_url']
+    # Index the editions so that the publish tasks can find them by their
+    # slugs without scanning the products' editions.
+    edition_index = EditionIndex(get_redis())
+    for report, urls in edition_urls.items():
+        edition_index.update(report, urls)
+
+
+def _delete_editions(editions, *, ltd_token):
+    """Delete reserved editions, so that they aren't left without a
+    publication.
+
+    Editions that can't be deleted are logged rather than raised, so that
+    the original error is reported.
+    """
+    logger = structlog.get_logger(__name__)
+    for edition in editions:
+        try:
+            delete_edition(edition['self_url'], ltd_token=ltd_token)
+        except Exception as e:
+            logger.warning('Reserved edition not deleted',
+                           edition_url=edition['self_url'],
+                           error=str(e))
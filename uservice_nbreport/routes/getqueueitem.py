@@ -1,22 +1,234 @@
-__all__ = ('get_queue_item',)
+__all__ = ('get_queue_item', 'get_queue_item_events', 'get_queue_group')
 
-from flask import jsonify, abort, url_for
-from ..celery import celery_app
+import json
+import threading
+import time
+
+from flask import (Response, abort, current_app, jsonify, request,
+                   stream_with_context, url_for)
+import redis
+import structlog
+
+from ..exceptions import ValidationError
+from ..progress import subscribe, wait_for_event
+from ..redisstore import get_redis
+from ..tasks import FINAL_STATES, get_group_status, get_publication_status
 
 from . import api
 
 
 @api.route('/queue/<id>', methods=['GET'])
 def get_queue_item(id):
+    """Get the status of a queued publication.
+
+    The ``status`` is the combined status of the publication's render and
+    upload tasks (see
+    `uservice_nbreport.tasks.pipeline.get_publication_status`), ``stage`` is
+    the stage it describes, and ``progress`` is the latest progress reported
+    by the running task (like the number of uploaded files), or `None`.
+
+    Add a ``wait=<seconds>`` query parameter to long-poll: if the
+    publication isn't finished, the response is sent as soon as its status
+    or progress changes, or after the given time (at most
+    ``QUEUE_MAX_WAIT``), whichever is first. If ``QUEUE_MAX_WAITERS``
+    requests are already waiting in the app process, the response is sent
+    without waiting.
+
+    Add a ``timings=true`` query parameter to include the ``timings`` of the
+    task's stages (see `uservice_nbreport.timing.StageTimer.as_dict`). The
+    field is `None` until the task succeeds.
+    """
+    try:
+        wait = float(request.args.get('wait', '0'))
+    except ValueError:
+        raise ValidationError('wait must be a number of seconds',
+                              status_code=400)
+    wait = min(max(wait, 0.), current_app.config['QUEUE_MAX_WAIT'])
+
+    waiters = _get_waiters()
+    if wait > 0 and not waiters.acquire(blocking=False):
+        wait = 0.
+    try:
+        # Subscribe before reading the status so that no change is missed.
+        pubsub = _subscribe(id) if wait > 0 else None
+        try:
+            data = _get_queue_item_data(id)
+            if pubsub is not None and data['status'] not in FINAL_STATES:
+                if _wait_for_event(pubsub, wait) is not None:
+                    data = _get_queue_item_data(id)
+        finally:
+            if pubsub is not None:
+                pubsub.close()
+    finally:
+        if wait > 0:
+            waiters.release()
+
+    return jsonify(data), 200, {'Location': data['self_url']}
+
+
+@api.route('/queue/<id>/events', methods=['GET'])
+def get_queue_item_events(id):
+    """Stream the status of a queued publication as Server-Sent Events.
+
+    Each ``status`` event has the data of ``GET /queue/<id>`` as JSON. The
+    first event is the current status, and then an event is sent whenever
+    the status or progress changes. The stream ends after the event of a
+    finished publication, or after ``QUEUE_EVENTS_MAX_DURATION``. Comments
+    are sent every ``QUEUE_EVENTS_HEARTBEAT`` seconds while nothing changes.
+
+    The endpoint is disabled (404) unless ``QUEUE_EVENTS_ENABLED`` is set,
+    and responds with a 503 error if ``QUEUE_MAX_WAITERS`` requests are
+    already waiting in the app process.
+    """
+    config = current_app.config
+    if not config['QUEUE_EVENTS_ENABLED']:
+        abort(404)
+    heartbeat = config['QUEUE_EVENTS_HEARTBEAT']
+    deadline = time.monotonic() + config['QUEUE_EVENTS_MAX_DURATION']
+
+    waiters = _get_waiters()
+    if not waiters.acquire(blocking=False):
+        raise ValidationError('Too many event streams; poll the status '
+                              'instead', status_code=503)
+    pubsub = None
+    try:
+        pubsub = _subscribe(id)
+        # Read the first status here so that unknown publications are 404s
+        data = _get_queue_item_data(id)
+    except Exception:
+        if pubsub is not None:
+            pubsub.close()
+        waiters.release()
+        raise
+
+    def generate(pubsub, data):
+        try:
+            yield _format_event('status', data)
+            while data['status'] not in FINAL_STATES:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                timeout = min(heartbeat, remaining)
+                if pubsub is not None:
+                    try:
+                        _wait_for_event(pubsub, timeout, reraise=True)
+                    except redis.RedisError:
+                        # Keep streaming by polling the status
+                        pubsub.close()
+                        pubsub = None
+                else:
+                    time.sleep(timeout)
+                # The status is also read after each heartbeat, in case an
+                # event was missed.
+                new_data = _get_queue_item_data(id)
+                if new_data != data:
+                    data = new_data
+                    yield _format_event('status', data)
+                else:
+                    yield ': heartbeat\n\n'
+        finally:
+            if pubsub is not None:
+                pubsub.close()
+
+    headers = {
+        'Cache-Control': 'no-cache',
+        # Don't let nginx buffer the stream
+        'X-Accel-Buffering': 'no',
+    }
+    response = Response(stream_with_context(generate(pubsub, data)),
+                        mimetype='text/event-stream', headers=headers)
+
+    def close():
+        # Called when the stream ends, even if the generator never started
+        if pubsub is not None:
+            pubsub.close()
+        waiters.release()
+
+    response.call_on_close(close)
+    return response
+
+
+@api.route('/queue/groups/<id>', methods=['GET'])
+def get_queue_group(id):
+    """Get the aggregated status of a group of publications queued by
+    ``POST /bulk/notebooks`` (see
+    `uservice_nbreport.tasks.pipeline.get_group_status`).
+    """
+    status = get_group_status(id)
+    if status is None:
+        abort(404)
+
+    for publication in status['publications']:
+        publication['queue_url'] = url_for(
+            'api.get_queue_item', id=publication['publication_id'],
+            _external=True)
+
+    data = {
+        'id': id,
+        'self_url': url_for('api.get_queue_group', id=id, _external=True),
+        'status': status['status'],
+        'counts': status['counts'],
+        'publications': status['publications'],
+    }
+    return jsonify(data), 200, {'Location': data['self_url']}
+
+
+def _get_queue_item_data(id):
+    """Get the response data of ``GET /queue/<id>``.
+    """
     try:
-        task = celery_app.AsyncResult(id)
+        status = get_publication_status(id)
     except Exception:
         abort(404)
 
     data = {
         'id': id,
         'self_url': url_for('api.get_queue_item', id=id, _external=True),
-        'status': task.state,
+        'status': status['status'],
+        'stage': status['stage'],
+        'progress': status['progress'],
     }
 
-    return jsonify(data), 200, {'Location': data['self_url']}
+    if request.args.get('timings', 'false').lower() == 'true':
+        data['timings'] = None
+        if isinstance(status['result'], dict):
+            data['timings'] = status['result'].get('timings')
+
+    return data
+
+
+def _get_waiters():
+    """Get the semaphore that limits the requests of the app process that
+    wait for publications to change (see ``QUEUE_MAX_WAITERS``).
+    """
+    return current_app.extensions.setdefault(
+        'nbreport_queue_waiters',
+        threading.BoundedSemaphore(current_app.config['QUEUE_MAX_WAITERS']))
+
+
+def _subscribe(id):
+    """Subscribe to a publication's events, or return `None` if Redis isn't
+    available (clients then get the status without waiting).
+    """
+    try:
+        return subscribe(get_redis(), id)
+    except redis.RedisError as e:
+        structlog.get_logger(__name__).warning(
+            'Subscription to publication events failed', publication_id=id,
+            error=str(e))
+        return None
+
+
+def _wait_for_event(pubsub, timeout, reraise=False):
+    try:
+        return wait_for_event(pubsub, timeout)
+    except redis.RedisError as e:
+        structlog.get_logger(__name__).warning(
+            'Waiting for publication events failed', error=str(e))
+        if reraise:
+            raise
+        return None
+
+
+def _format_event(event, data):
+    return 'event: {0}\ndata: {1}\n\n'.format(event, json.dumps(data))
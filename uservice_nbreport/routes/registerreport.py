@@ -8,11 +8,11 @@ from urllib.parse import urljoin
 
 from apikit import BackendError
 from flask import g, jsonify, request, current_app
-import requests
 
 from . import api
 from ..auth import github_token_auth, requires_github_org_membership, ltd_login
 from ..exceptions import ValidationError
+from ..httpclient import get_session
 
 
 @api.route('/reports/', methods=['POST'])
@@ -40,7 +40,7 @@ def register_report():
         'title': title,
         'main_mode': 'manual'
     }
-    product_response = requests.post(
+    product_response = get_session('keeper').post(
         urljoin(current_app.config['KEEPER_URL'], '/products/'),
         json=product_data,
         auth=(g.ltd_token, '')
@@ -54,7 +54,7 @@ def register_report():
     product_url = product_response.headers['Location']
 
     # Get more data about the product
-    product_response = requests.get(
+    product_response = get_session('keeper').get(
         product_url,
         auth=(g.ltd_token, '')
     )
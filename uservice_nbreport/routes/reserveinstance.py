@@ -3,16 +3,19 @@
 Reserving an instance is done by creating an edition for the given product.
 """
 
-__all__ = ('reserve_instance',)
+__all__ = ('reserve_instance', 'reserve_edition', 'delete_edition')
 
 from urllib.parse import urljoin
 
 from apikit import BackendError
 from flask import g, jsonify, current_app
-import requests
 
 from . import api
 from ..auth import github_token_auth, requires_github_org_membership, ltd_login
+from ..editionindex import EditionIndex
+from ..httpclient import get_session
+from ..keepertoken import get_keeper_token_cache
+from ..redisstore import get_redis
 
 
 @api.route('/reports/<report>/instances/', methods=['POST'])
@@ -26,18 +29,69 @@ def reserve_instance(report):
     # LTD Keeper API.
     product = report
 
+    edition = reserve_edition(product,
+                              keeper_url=current_app.config['KEEPER_URL'],
+                              ltd_token=g.ltd_token,
+                              token_cache=get_keeper_token_cache())
+
+    # Index the edition so that the publish task can find it by its slug
+    # without scanning the product's editions.
+    EditionIndex(get_redis()).set(product, edition['slug'],
+                                  edition['self_url'])
+
+    return_data = {
+        'instance_id': edition['slug'],
+        'published_url': edition['published_url'],
+        'ltd_edition_url': edition['self_url']
+    }
+
+    return jsonify(return_data), 201
+
+
+def reserve_edition(product, *, keeper_url, ltd_token, token_cache=None):
+    """Create a new edition of a product, with an auto-incremented slug, in
+    LTD Keeper.
+
+    This function doesn't need an application context, so editions can be
+    reserved concurrently by several threads.
+
+    Parameters
+    ----------
+    product : `str`
+        Slug of the LTD Product (the report).
+    keeper_url : `str`
+        Base URL of the LTD Keeper API.
+    ltd_token : `str`
+        Token for the LTD Keeper API.
+    token_cache : `uservice_nbreport.keepertoken.KeeperTokenCache`, optional
+        Cache of ``ltd_token``. The token is removed from the cache if LTD
+        Keeper rejects it.
+
+    Returns
+    -------
+    edition : `dict`
+        The edition resource. Its ``slug`` is the instance ID.
+
+    Raises
+    ------
+    apikit.BackendError
+        Raised if LTD Keeper responds with an error.
+    """
     edition_request_data = {
         'autoincrement': True,
         'mode': 'manual'
     }
     new_edition_endpoint = urljoin(
-        current_app.config['KEEPER_URL'],
+        keeper_url,
         '/products/{product}/editions/'.format(product=product))
-    response = requests.post(
+    response = get_session('keeper').post(
         new_edition_endpoint,
         json=edition_request_data,
-        auth=(g.ltd_token, '')
+        auth=(ltd_token, '')
     )
+    if response.status_code == 401 and token_cache is not None:
+        # The cached token was rejected; the next request gets a new one.
+        token_cache.invalidate(ltd_token)
     if response.status_code >= 300:
         raise BackendError(
             "Unexcepted error calling LSST the Docs's "
@@ -46,7 +100,7 @@ def reserve_instance(report):
             content=str(response.json()))
 
     edition_url = response.headers['location']
-    response = requests.get(edition_url)
+    response = get_session('keeper').get(edition_url)
     if response.status_code >= 300:
         raise BackendError(
             "Unexcepted error calling LSST the Docs's "
@@ -54,11 +108,30 @@ def reserve_instance(report):
             status_code=500,
             content=str(response.json()))
 
-    edition = response.json()
-    return_data = {
-        'instance_id': edition['slug'],
-        'published_url': edition['published_url'],
-        'ltd_edition_url': edition['self_url']
-    }
+    return response.json()
 
-    return jsonify(return_data), 201
+
+def delete_edition(edition_url, *, ltd_token):
+    """Delete an edition that was reserved by `reserve_edition`, but won't be
+    published.
+
+    Parameters
+    ----------
+    edition_url : `str`
+        URL of the edition resource in LTD Keeper (its ``self_url``).
+    ltd_token : `str`
+        Token for the LTD Keeper API.
+
+    Raises
+    ------
+    apikit.BackendError
+        Raised if LTD Keeper responds with an error.
+    """
+    response = get_session('keeper').delete(edition_url,
+                                            auth=(ltd_token, ''))
+    if response.status_code >= 300:
+        raise BackendError(
+            "Unexcepted error calling LSST the Docs's "
+            "DELETE {} endpoint".format(edition_url),
+            status_code=500,
+            content=response.text)
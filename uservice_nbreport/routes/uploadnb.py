@@ -3,12 +3,13 @@
 
 __all__ = ('upload_notebook',)
 
-from flask import request, jsonify, url_for
+from flask import current_app, request, jsonify, url_for
 
 from . import api
 from ..auth import github_token_auth, requires_github_org_membership, ltd_login
+from ..blobstore import get_blob_store
 from ..exceptions import ValidationError
-from ..tasks import publish_instance
+from ..tasks import check_callback_url, queue_publication
 
 
 @api.route('/reports/<report>/instances/<instance_id>/notebook',
@@ -19,6 +20,13 @@ from ..tasks import publish_instance
 def upload_notebook(report, instance_id):
     """Upload a notebook file corresponding to an instance of a report
     for publication.
+
+    Add a ``callback_url`` query parameter to have the publication's final
+    status POSTed to that URL when it finishes (see
+    `uservice_nbreport.tasks.callbacks`). Its host must be one of
+    ``CALLBACK_ALLOWED_HOSTS`` if that's set, or else only have public
+    addresses. If the request has an ``X-Callback-Secret`` header, the
+    callback request is signed with it.
     """
     # Check mimetype: application/x-ipynb+json
     # https://jupyter.readthedocs.io/en/latest/reference/mimetype.html
@@ -31,11 +39,36 @@ def upload_notebook(report, instance_id):
             status_code=400,
             content='Sent mimetype {}'.format(request.mimetype))
 
-    nb_data = request.data.decode('utf-8')
+    callback = None
+    callback_url = request.args.get('callback_url')
+    if callback_url is not None:
+        try:
+            check_callback_url(
+                callback_url, current_app.config['CALLBACK_ALLOWED_HOSTS'])
+        except ValueError as e:
+            raise ValidationError(
+                str(e), status_code=400,
+                content='Sent callback_url {}'.format(callback_url))
+        except OSError as e:
+            raise ValidationError(
+                'callback_url host cannot be resolved', status_code=400,
+                content=str(e))
+        callback = {'url': callback_url,
+                    'secret': request.headers.get('X-Callback-Secret')}
+
+    # Stage the notebook in the blob store so that only a reference to it
+    # is sent through the Celery broker.
+    blob_store = get_blob_store()
+    nb_ref = blob_store.put(request.stream)
 
-    task = publish_instance.apply_async(args=[nb_data, report, instance_id])
+    try:
+        publication_id = queue_publication(nb_ref, report, instance_id,
+                                           callback=callback)
+    except Exception:
+        blob_store.delete(nb_ref)
+        raise
 
-    url = url_for('api.get_queue_item', id=task.id, _external=True)
+    url = url_for('api.get_queue_item', id=publication_id, _external=True)
 
     data = {
         'queue_url': url
@@ -2,3 +2,5 @@
 """
 
 from .publishnb import *
+from .pipeline import *
+from .callbacks import *
@@ -0,0 +1,250 @@
+"""Completion callbacks of publications.
+
+Clients can upload a notebook with a callback URL rather than polling the
+publication's status. When the publication finishes, its final status is
+POSTed to the URL by the `deliver_callback` task, which runs on its own
+queue (``CALLBACK_QUEUE``) and retries with exponential backoff, so that
+slow or unavailable callback servers never hold up publications.
+
+Callback URLs are checked with `check_callback_url` when they're submitted
+and again before each delivery, so that clients can't make the workers
+send requests to internal services.
+"""
+
+__all__ = ('check_callback_url', 'deliver_callback',
+           'queue_completion_callback', 'sign_payload', 'SIGNATURE_HEADER')
+
+import hashlib
+import hmac
+import ipaddress
+import json
+import socket
+from urllib.parse import urlsplit
+
+from celery import states
+from celery.signals import task_postrun
+from celery.utils.log import get_task_logger
+from flask import current_app
+import requests
+
+from ..backoff import get_backoff_delay
+from ..celery import celery_app
+from ..httpclient import get_session
+from ..publicationindex import PublicationIndex, SUPERSEDED
+from ..redisstore import get_redis
+from .publishnb import publish_instance, render_instance, upload_instance
+
+logger = get_task_logger(__name__)
+
+SIGNATURE_HEADER = 'X-Nbreport-Signature'
+"""Header of the HMAC signature of callback requests (see
+`sign_payload`).
+"""
+
+_RETRY_STATUS_CODES = (408, 429)
+"""Status codes, besides ``5xx``, of responses whose delivery is retried.
+"""
+
+
+def sign_payload(body, secret):
+    """Sign the body of a callback request.
+
+    Callback servers verify requests by computing this signature with their
+    copy of the secret, and comparing it, in constant time, with the
+    ``X-Nbreport-Signature`` header.
+
+    Parameters
+    ----------
+    body : `bytes`
+        Request body.
+    secret : `str`
+        Secret that the client sent with the callback URL.
+
+    Returns
+    -------
+    signature : `str`
+        ``sha256=`` followed by the hex digest of the HMAC-SHA256 of
+        ``body``.
+    """
+    digest = hmac.new(secret.encode('utf-8'), body, hashlib.sha256)
+    return 'sha256=' + digest.hexdigest()
+
+
+def check_callback_url(url, allowed_hosts=()):
+    """Check that callbacks can be delivered to a URL.
+
+    Parameters
+    ----------
+    url : `str`
+        Callback URL.
+    allowed_hosts : sequence of `str`, optional
+        Hosts that callbacks can be delivered to (``CALLBACK_ALLOWED_HOSTS``).
+        Entries starting with ``.``, like ``.example.com``, also allow the
+        subdomains of the host. If this is empty, any host can be used as
+        long as all of its addresses are public (not loopback, private,
+        link-local, or otherwise reserved addresses).
+
+    Raises
+    ------
+    ValueError
+        Raised if the URL isn't an http or https URL, or its host isn't
+        allowed.
+    OSError
+        Raised if the host can't be resolved.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError('callback_url must be an http or https URL')
+    host = parts.hostname.lower()
+
+    if allowed_hosts:
+        for allowed_host in allowed_hosts:
+            if host == allowed_host or (allowed_host.startswith('.') and
+                                        host.endswith(allowed_host)):
+                return
+        raise ValueError(
+            'callback_url host {0} is not allowed'.format(host))
+
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP):
+        # Strip the scope of IPv6 link-local addresses, like fe80::1%eth0
+        address = ipaddress.ip_address(info[4][0].split('%')[0])
+        if not address.is_global or address.is_multicast:
+            raise ValueError(
+                'callback_url host {0} has a non-public address {1}'.format(
+                    host, address))
+
+
+@celery_app.task(bind=True)
+def deliver_callback(self, url, payload, secret=None):
+    """POST the completion payload of a publication to its callback URL
+    (Celery task).
+
+    Connection errors and ``408``, ``429``, and ``5xx`` responses are
+    retried up to ``CALLBACK_MAX_RETRIES`` times, with an exponential
+    backoff from ``CALLBACK_RETRY_DELAY`` to ``CALLBACK_RETRY_MAX_DELAY``.
+    Other responses aren't retried, and redirects aren't followed. URLs
+    that `check_callback_url` rejects, since DNS records can change after
+    the URL was submitted, aren't delivered.
+
+    Parameters
+    ----------
+    url : `str`
+        Callback URL.
+    payload : `dict`
+        JSON-serializable payload (see `queue_completion_callback`).
+    secret : `str`, optional
+        Secret for signing the request (see `sign_payload`). Requests aren't
+        signed without a secret.
+
+    Returns
+    -------
+    result : `dict`
+        Summary of the delivery, with ``delivered`` (`bool`), ``attempts``,
+        and ``status_code`` (`None` after a connection error) fields.
+    """
+    config = current_app.config
+    attempts = self.request.retries + 1
+    body = json.dumps(payload, sort_keys=True).encode('utf-8')
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Nbreport-Event': 'publication',
+    }
+    if self.request.id is not None:
+        # Lets servers ignore redelivered requests
+        headers['X-Nbreport-Delivery'] = self.request.id
+    if secret:
+        headers[SIGNATURE_HEADER] = sign_payload(body, secret)
+
+    status_code = None
+    try:
+        check_callback_url(url, config['CALLBACK_ALLOWED_HOSTS'])
+        response = get_session('callbacks').post(
+            url, data=body, headers=headers, allow_redirects=False)
+    except ValueError as e:
+        logger.warning('Callback to %s not delivered: %s', url, e)
+        return {'delivered': False, 'attempts': attempts,
+                'status_code': None}
+    except (requests.RequestException, OSError) as e:
+        error = str(e)
+    else:
+        status_code = response.status_code
+        if status_code < 300:
+            return {'delivered': True, 'attempts': attempts,
+                    'status_code': status_code}
+        if status_code < 500 and status_code not in _RETRY_STATUS_CODES:
+            logger.warning('Callback to %s rejected with status %d', url,
+                           status_code)
+            return {'delivered': False, 'attempts': attempts,
+                    'status_code': status_code}
+        error = 'Status {0:d}'.format(status_code)
+
+    if self.request.retries >= config['CALLBACK_MAX_RETRIES']:
+        logger.error('Callback to %s failed after %d attempts: %s', url,
+                     attempts, error)
+        return {'delivered': False, 'attempts': attempts,
+                'status_code': status_code}
+
+    countdown = get_backoff_delay(self.request.retries,
+                                  base=config['CALLBACK_RETRY_DELAY'],
+                                  maximum=config['CALLBACK_RETRY_MAX_DELAY'])
+    logger.info('Callback to %s failed (%s), retrying in %.0f s', url, error,
+                countdown)
+    raise self.retry(countdown=countdown, max_retries=None)
+
+
+@task_postrun.connect
+def queue_completion_callback(sender=None, task_id=None, args=None,
+                              retval=None, state=None, **kwargs):
+    """Queue the delivery of a publication's completion callback when the
+    publication's last task finishes.
+
+    The payload has the ``publication_id``, ``ltd_product``,
+    ``instance_id``, final ``status`` (``SUCCESS``, ``FAILURE``, or
+    ``SUPERSEDED``), ``published_url``, and ``timings`` of the publication,
+    and the ``error`` of a failed publication. Errors are logged rather than
+    raised, so that callbacks never fail publications.
+    """
+    if sender is upload_instance:
+        publication_id = args[0].get('publication_id') if args else None
+        final_states = (states.SUCCESS, states.FAILURE, states.IGNORED)
+    elif sender is render_instance:
+        # The upload task runs next unless the render task failed or
+        # stopped because the publication was superseded.
+        publication_id = task_id
+        final_states = (states.FAILURE, states.IGNORED)
+    elif sender is publish_instance:
+        publication_id = task_id
+        final_states = (states.SUCCESS, states.FAILURE)
+    else:
+        return
+    if publication_id is None or state not in final_states:
+        return
+
+    try:
+        # Signal handlers run outside of the task's application context.
+        redis_client = get_redis(celery_app.conf['REDIS_URL'])
+        callback = PublicationIndex(redis_client).pop_callback(
+            publication_id)
+        if callback is None:
+            return
+        payload = {
+            'publication_id': publication_id,
+            'ltd_product': callback['ltd_product'],
+            'instance_id': callback['instance_id'],
+            'status': SUPERSEDED if state == states.IGNORED else state,
+            'published_url': None,
+            'timings': None,
+            'error': None,
+        }
+        if state == states.SUCCESS and isinstance(retval, dict):
+            payload['published_url'] = retval['upload'].get('published_url')
+            payload['timings'] = retval.get('timings')
+        elif state == states.FAILURE:
+            payload['error'] = '{0}: {1}'.format(type(retval).__name__,
+                                                 retval)
+        deliver_callback.apply_async(
+            (callback['url'], payload, callback.get('secret')))
+    except Exception:
+        logger.exception('Callback of publication %s not queued',
+                         publication_id)
@@ -0,0 +1,273 @@
+"""Queueing of publications as a chain of render and upload tasks, and
+their combined status.
+"""
+
+__all__ = ('queue_publication', 'queue_publication_group',
+           'get_publication_status', 'get_group_status', 'get_upload_task_id',
+           'FINAL_STATES')
+
+import uuid
+
+from celery import chain, group
+from flask import current_app
+
+from ..celery import celery_app
+from ..progress import PROGRESS
+from ..publicationindex import PublicationIndex, SUPERSEDED
+from ..redisstore import get_redis
+from .publishnb import render_instance, upload_instance
+
+_RENDER_STATES = ('PENDING', 'RECEIVED', 'STARTED', 'RETRY', 'FAILURE',
+                  'REVOKED', SUPERSEDED)
+"""States of the render task that are the state of the whole chain."""
+
+FINAL_STATES = ('SUCCESS', 'FAILURE', 'REVOKED', SUPERSEDED)
+"""States of a publication that are final."""
+
+
+def get_upload_task_id(render_task_id):
+    """Get the ID of the upload task chained to a render task.
+
+    Parameters
+    ----------
+    render_task_id : `str`
+        ID of the `~uservice_nbreport.tasks.publishnb.render_instance` task,
+        which is the ID of the publication.
+
+    Returns
+    -------
+    upload_task_id : `str`
+        ID of the `~uservice_nbreport.tasks.publishnb.upload_instance` task.
+        It's derived from ``render_task_id`` so that the status of the chain
+        can be found from the publication's ID alone.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL,
+                          'nbreport-upload:{0}'.format(render_task_id)))
+
+
+def queue_publication(nb_ref, ltd_product, instance_id, callback=None):
+    """Queue the publication of a notebook instance.
+
+    The publication is a chain of the
+    `~uservice_nbreport.tasks.publishnb.render_instance` task, routed to the
+    ``RENDER_QUEUE``, and the
+    `~uservice_nbreport.tasks.publishnb.upload_instance` task, routed to the
+    ``UPLOAD_QUEUE``.
+
+    If the ``COALESCE_PUBLICATIONS`` configuration is enabled, the new
+    publication supersedes the instance's previous publication, whose tasks
+    skip their remaining stages.
+
+    Must be called within an application context.
+
+    Parameters
+    ----------
+    nb_ref : `dict`
+        Reference to the notebook document in the blob store (see
+        `uservice_nbreport.blobstore.BlobStore.put`).
+    ltd_product : `str`
+        Slug of the LTD Product resource corresponding to the report.
+    instance_id : `str`
+        Identifier of the instance (the slug of its LTD Edition).
+    callback : `dict`, optional
+        Completion callback, with ``url`` and ``secret`` (optional) fields.
+        The publication's final status is POSTed to the URL when it
+        finishes (see `uservice_nbreport.tasks.callbacks`).
+
+    Returns
+    -------
+    publication_id : `str`
+        ID of the publication, for `get_publication_status`.
+    """
+    publication_id, signature = _make_publication(nb_ref, ltd_product,
+                                                  instance_id)
+    if callback is not None:
+        PublicationIndex(get_redis()).set_callback(
+            publication_id,
+            {'url': callback['url'], 'secret': callback.get('secret'),
+             'ltd_product': ltd_product, 'instance_id': instance_id})
+    signature.apply_async()
+    return publication_id
+
+
+def queue_publication_group(publications):
+    """Queue the publications of several notebook instances as one Celery
+    group.
+
+    Each publication is queued like by `queue_publication`. Must be called
+    within an application context.
+
+    Parameters
+    ----------
+    publications : `list` of `tuple`
+        The ``(nb_ref, ltd_product, instance_id)`` arguments of each
+        publication (see `queue_publication`).
+
+    Returns
+    -------
+    group_id : `str`
+        ID of the group, for `get_group_status`.
+    publication_ids : `list` of `str`
+        IDs of the publications, in the order of ``publications``.
+    """
+    group_id = str(uuid.uuid4())
+    publication_ids = []
+    signatures = []
+    members = []
+    for nb_ref, ltd_product, instance_id in publications:
+        publication_id, signature = _make_publication(nb_ref, ltd_product,
+                                                      instance_id)
+        publication_ids.append(publication_id)
+        signatures.append(signature)
+        members.append({'publication_id': publication_id,
+                        'ltd_product': ltd_product,
+                        'instance_id': instance_id})
+    PublicationIndex(get_redis()).set_group(group_id, members)
+    group(signatures).apply_async(group_id=group_id)
+    return group_id, publication_ids
+
+
+def _make_publication(nb_ref, ltd_product, instance_id):
+    """Make the task chain of a publication, superseding the instance's
+    previous publication.
+    """
+    render_task_id = str(uuid.uuid4())
+    if current_app.config['COALESCE_PUBLICATIONS']:
+        PublicationIndex(get_redis()).supersede(ltd_product, instance_id,
+                                                render_task_id)
+    signature = chain(
+        render_instance.s(nb_ref, ltd_product, instance_id).set(
+            task_id=render_task_id),
+        upload_instance.s().set(
+            task_id=get_upload_task_id(render_task_id))
+    )
+    return render_task_id, signature
+
+
+def get_publication_status(publication_id):
+    """Get the combined status of a publication's tasks.
+
+    Must be called within an application context.
+
+    Parameters
+    ----------
+    publication_id : `str`
+        ID of the publication (see `queue_publication`), or the ID of a
+        `~uservice_nbreport.tasks.publishnb.publish_instance` task.
+
+    Returns
+    -------
+    status : `dict`
+        Status, with fields:
+
+        - ``status``: Celery state of the publication. It's the state of the
+          render task until it succeeds, and then the state of the upload
+          task, except that a queued upload task is reported as
+          ``STARTED``. Publications that were superseded by a newer
+          publication of the same instance before they finished are
+          ``SUPERSEDED``. Tasks that reported their progress are
+          ``STARTED``.
+        - ``stage``: the stage that ``status`` describes, ``'render'`` or
+          ``'upload'`` (or ``'publish'`` for a ``publish_instance`` task
+          that finished).
+        - ``progress``: the latest progress reported by the running task,
+          with a ``stage`` field (like ``'upload'``) and stage-specific
+          fields (like ``done`` and ``total``), or `None` (see
+          `uservice_nbreport.progress.ProgressReporter`).
+        - ``result``: result of the publication (see
+          `~uservice_nbreport.tasks.publishnb.run_publish_instance`) if it
+          succeeded, and otherwise `None`.
+    """
+    status = _get_chain_status(publication_id)
+    if status['status'] not in FINAL_STATES \
+            and PublicationIndex(get_redis()).is_superseded(publication_id):
+        # The publication's tasks haven't noticed that they're superseded
+        # yet (for example, they're still queued).
+        status['status'] = SUPERSEDED
+    return status
+
+
+def _get_chain_status(publication_id):
+    task = celery_app.AsyncResult(publication_id)
+    state = task.state
+    if state == PROGRESS:
+        # A running render_instance (or publish_instance) task
+        return {'status': 'STARTED', 'stage': 'render', 'result': None,
+                'progress': task.info}
+    if state in _RENDER_STATES:
+        return {'status': state, 'stage': 'render', 'result': None,
+                'progress': None}
+
+    result = task.result if task.successful() else None
+    if not isinstance(result, dict) or 'site' not in result:
+        # A single publish_instance task
+        return {'status': state, 'stage': 'publish', 'result': result,
+                'progress': None}
+
+    upload_task = celery_app.AsyncResult(
+        get_upload_task_id(publication_id))
+    state = upload_task.state
+    progress = None
+    if state == PROGRESS:
+        progress = upload_task.info
+        state = 'STARTED'
+    elif state == 'PENDING':
+        state = 'STARTED'
+    return {
+        'status': state,
+        'stage': 'upload',
+        'result': upload_task.result if upload_task.successful() else None,
+        'progress': progress,
+    }
+
+
+def get_group_status(group_id):
+    """Get the aggregated status of a group of publications (see
+    `queue_publication_group`).
+
+    Must be called within an application context.
+
+    Parameters
+    ----------
+    group_id : `str`
+        ID of the group.
+
+    Returns
+    -------
+    status : `dict`
+        Status, or `None` if the group isn't known, with fields:
+
+        - ``status``: ``PENDING`` if every publication is pending,
+          ``STARTED`` until every publication is finished, and then
+          ``SUCCESS`` if every publication succeeded or was superseded,
+          and otherwise ``FAILURE``.
+        - ``counts``: number of publications in each state (`dict`).
+        - ``publications``: the group's publications, with
+          ``publication_id``, ``ltd_product``, ``instance_id``, ``status``,
+          and ``stage`` fields (see `get_publication_status`).
+    """
+    members = PublicationIndex(get_redis()).get_group(group_id)
+    if members is None:
+        return None
+
+    counts = {}
+    publications = []
+    for member in members:
+        member_status = get_publication_status(member['publication_id'])
+        publication = dict(member)
+        publication['status'] = member_status['status']
+        publication['stage'] = member_status['stage']
+        publications.append(publication)
+        counts[publication['status']] = \
+            counts.get(publication['status'], 0) + 1
+
+    if all(state == 'PENDING' for state in counts):
+        status = 'PENDING'
+    elif any(state not in FINAL_STATES for state in counts):
+        status = 'STARTED'
+    elif all(state in ('SUCCESS', SUPERSEDED) for state in counts):
+        status = 'SUCCESS'
+    else:
+        status = 'FAILURE'
+    return {'status': status, 'counts': counts,
+            'publications': publications}
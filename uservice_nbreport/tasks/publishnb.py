@@ -1,31 +1,158 @@
-"""Celery task for publishing a notebook report instance.
+"""Celery tasks for publishing a notebook report instance.
 """
 
-__all__ = ('publish_instance',)
+__all__ = ('publish_instance', 'render_instance', 'upload_instance',
+           'get_exporter')
 
+import io
 from pathlib import Path
-import shutil
 import tempfile
-from urllib.parse import urljoin
+import time
 
 from flask import current_app
+from celery.exceptions import Ignore
+from celery.signals import task_postrun, worker_process_init
 from celery.utils.log import get_task_logger
 from ltdconveyor.keeper.build import register_build, confirm_build
-from ltdconveyor.keeper.login import get_keeper_token
-from ltdconveyor.s3 import upload_dir
-import requests
 import nbformat
+import structlog
 
+from ..backoff import get_backoff_delay, is_transient_error
+from ..blobstore import BlobError, get_blob_store
+from ..buildindex import BuildIndex
 from ..celery import celery_app
-from ..publish.htmlexport import LsstHtmlReportExporter
-from ..publish.outline import LsstOutlinePreprocessor
+from ..checkpoints import StageCheckpoints
+from ..editionindex import EditionIndex, find_edition_url
+from ..httpclient import get_http_metrics, get_session
+from ..keepertoken import get_keeper_token_cache, is_unauthorized
+from ..publish.assets import publish_shared_assets
+from ..publish.cellcache import CellRenderCache
+from ..publish.compression import compress_site
+from ..publish.htmlexport import create_report_exporter
+from ..publish.rendercache import RenderCache, compute_render_key
+from ..publish.sitearchive import pack_site, unpack_site
+from ..progress import ProgressReporter, publish_event
+from ..publish.upload import upload_site
+from ..publicationindex import (
+    PublicationIndex, PublicationSuperseded, SUPERSEDED)
+from ..redisstore import get_redis
+from ..timing import StageTimer
 
 logger = get_task_logger(__name__)
 
+_exporter = None
+"""The `~uservice_nbreport.publish.htmlexport.LsstHtmlReportExporter`
+instance shared by all tasks in this process (see `get_exporter`).
+"""
+
+
+def get_exporter():
+    """Get the HTML report exporter for this process.
+
+    The exporter is created once per process and then reused by every
+    publish task so that the Jinja templates, filters, and Pygments lexers
+    are only loaded once. Conversions don't share ``resources``.
+
+    The exporter is configured by the application's ``EXTRACT_OUTPUTS``,
+    ``SHARED_ASSETS_URL``, and ``PARALLEL_RENDER*`` configurations.
+
+    Returns
+    -------
+    exporter : `uservice_nbreport.publish.htmlexport.LsstHtmlReportExporter`
+        The exporter.
+
+    Notes
+    -----
+    The exporter isn't meant to be used by several threads at once. This is
+    fine for Celery's default prefork pool, where each worker process runs
+    one task at a time.
+    """
+    global _exporter
+    if _exporter is None:
+        _exporter = create_report_exporter(
+            extract_outputs=celery_app.conf['EXTRACT_OUTPUTS'],
+            shared_assets_url=celery_app.conf['SHARED_ASSETS_URL'],
+            parallel_render=celery_app.conf['PARALLEL_RENDER'],
+            parallel_render_min_cells=celery_app.conf[
+                'PARALLEL_RENDER_MIN_CELLS'],
+            parallel_render_min_bytes=celery_app.conf[
+                'PARALLEL_RENDER_MIN_BYTES'],
+            parallel_render_processes=celery_app.conf[
+                'PARALLEL_RENDER_PROCESSES'])
+    return _exporter
+
+
+_render_cache = None
+"""The `~uservice_nbreport.publish.rendercache.RenderCache` used by this
+process (see `get_render_cache`).
+"""
+
+
+def get_render_cache():
+    """Get the render cache configured by the ``RENDER_CACHE_DIR`` and
+    ``RENDER_CACHE_MAX_BYTES`` configurations.
+
+    This function must be called from within a Flask application context.
+
+    Returns
+    -------
+    render_cache : `uservice_nbreport.publish.rendercache.RenderCache`
+        The render cache, or `None` if the cache isn't enabled.
+    """
+    global _render_cache
+    cache_dir = current_app.config['RENDER_CACHE_DIR']
+    if cache_dir is None:
+        return None
+    if _render_cache is None or str(_render_cache.cache_dir) != cache_dir:
+        _render_cache = RenderCache(
+            cache_dir, current_app.config['RENDER_CACHE_MAX_BYTES'])
+    return _render_cache
+
+
+def get_cell_cache(ltd_product):
+    """Get the cell cache of a report, configured by the ``CELL_CACHE_DIR``
+    and ``CELL_CACHE_MAX_BYTES`` configurations.
+
+    Must be called within an application context.
+
+    Parameters
+    ----------
+    ltd_product : `str`
+        Slug of the LTD Product resource corresponding to the report.
+
+    Returns
+    -------
+    cell_cache : `uservice_nbreport.publish.cellcache.CellRenderCache`
+        The report's cell cache, or `None` if the cache isn't enabled.
+    """
+    cache_dir = current_app.config['CELL_CACHE_DIR']
+    if cache_dir is None:
+        return None
+    return CellRenderCache(Path(cache_dir) / ltd_product,
+                           current_app.config['CELL_CACHE_MAX_BYTES'])
+
+
+@worker_process_init.connect
+def prewarm_exporter(**kwargs):
+    """Create and warm up the process's exporter when a Celery worker
+    process starts, rather than during its first task.
+    """
+    get_exporter().warm()
+
 
 @celery_app.task(bind=True)
 def publish_instance(self, nb_data, ltd_product, instance_id):
-    """Publish a notebook instance (Celery task).
+    """Publish a notebook instance in a single task (Celery task).
+
+    Publications queued by ``POST /reports/<report>/instances/<id>/notebook``
+    run as a chain of the `render_instance` and `upload_instance` tasks
+    instead (see `uservice_nbreport.tasks.pipeline.queue_publication`).
+
+    Transient errors are retried with an exponential backoff (see
+    `retry_with_backoff`). The rendered site is persisted in the blob store,
+    and the upload stages are checkpointed (see `upload_html`), so that the
+    retried task resumes from its last completed stage rather than rendering
+    the notebook again.
 
     Parameters
     ----------
@@ -36,35 +163,490 @@ def publish_instance(self, nb_data, ltd_product, instance_id):
     instance_id : `str`
         Identifier of the instance, usually an integer as a string. This is
         the slug of the LTD Edition corresponding to the report instance.
+
+    Returns
+    -------
+    result : `dict`
+        Summary of the publication (see `run_publish_instance`).
     """
-    ltd_token = get_keeper_token(
-        current_app.config['KEEPER_URL'],
-        current_app.config['KEEPER_USERNAME'],
-        current_app.config['KEEPER_PASSWORD'],
-    )
+    task_id = self.request.id
+    timer = StageTimer()
+    blob_store = get_blob_store()
+    stage_checkpoints = get_stage_checkpoints(task_id)
+    progress = get_progress_reporter(self, task_id)
+    token_cache = get_keeper_token_cache()
+    ltd_token = None
+    render_result = None
+    retrying = False
+
+    try:
+        with timer.stage('get_keeper_token'):
+            ltd_token = token_cache.get_token()
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            work_dir = Path(tempdir) / 'site'
+            work_dir.mkdir()
 
-    kwargs = {
-        'keeper_url': current_app.config['KEEPER_URL'],
-        'ltd_token': ltd_token,
-        'ltd_product': ltd_product,
-        'instance_id': instance_id,
-        'aws_id': current_app.config['KEEPER_AWS_ID'],
-        'aws_secret': current_app.config['KEEPER_AWS_SECRET'],
+            render_result = stage_checkpoints.get('render')
+            if render_result is not None:
+                try:
+                    with timer.stage('unpack_site') as stage:
+                        archive = io.BytesIO(
+                            blob_store.get(render_result['site']))
+                        stage['bytes'] = unpack_site(archive, work_dir)
+                except BlobError as e:
+                    logger.warning('Rendering again: %s', e)
+                    render_result = None
+            if render_result is None:
+                with timer.stage('parse') as stage:
+                    nb = nbformat.reads(nb_data, as_version=4)
+                    stage['bytes'] = len(nb_data)
+                render_result = run_render_instance(
+                    nb=nb, work_dir=work_dir, progress=progress,
+                    timer=timer, **get_render_options(ltd_product))
+                if task_id is not None:
+                    # Persist the site for retries
+                    with timer.stage('pack_site') as stage:
+                        with tempfile.TemporaryFile(dir=tempdir) as archive:
+                            pack_site(work_dir, archive)
+                            archive.seek(0)
+                            render_result['site'] = blob_store.put(archive)
+                        stage['bytes'] = render_result['site']['stored_size']
+                    stage_checkpoints.set('render', render_result)
+
+            upload_result = run_upload_instance(
+                work_dir=work_dir, ltd_token=ltd_token,
+                ltd_product=ltd_product, instance_id=instance_id,
+                content_encodings=render_result['content_encodings'],
+                progress=progress, stage_checkpoints=stage_checkpoints,
+                timer=timer, **get_upload_options())
+    except Exception as e:
+        if is_unauthorized(e) and ltd_token is not None:
+            # Don't let other tasks reuse the rejected token.
+            token_cache.invalidate(ltd_token)
+        if should_retry(self, e):
+            retrying = True
+            retry_with_backoff(self, e)
+        raise
+    finally:
+        if not retrying:
+            if render_result is not None and 'site' in render_result:
+                blob_store.delete(render_result['site'])
+            stage_checkpoints.clear()
+
+    result = {
+        'compression': render_result['compression'],
+        'cell_cache': render_result['cell_cache'],
+        'upload': upload_result,
+        'timings': timer.as_dict(),
     }
+    log_timings(ltd_product, instance_id, result['timings'])
+    return result
 
-    nb = nbformat.reads(nb_data, as_version=4)
 
-    with tempfile.TemporaryDirectory() as tempdir:
-        work_dir = Path(tempdir)
-        run_publish_instance(nb=nb, work_dir=work_dir, **kwargs)
+@celery_app.task(bind=True)
+def render_instance(self, nb_ref, ltd_product, instance_id):
+    """Render a notebook instance into a site, the first stage of a
+    publication (Celery task).
+
+    Parameters
+    ----------
+    nb_ref : `dict`
+        Reference to the notebook document in the blob store (see
+        `uservice_nbreport.blobstore.BlobStore.put`). The blob is deleted
+        once the notebook is rendered.
+    ltd_product : `str`
+        Slug of the LTD Product resource corresponding to the report.
+    instance_id : `str`
+        Identifier of the instance, usually an integer as a string. This is
+        the slug of the LTD Edition corresponding to the report instance.
+
+    Returns
+    -------
+    render_result : `dict`
+        Input of the `upload_instance` task, with fields:
+
+        - ``ltd_product`` and ``instance_id``: the instance.
+        - ``site``: reference to the rendered site, packed by
+          `uservice_nbreport.publish.sitearchive.pack_site`, in the blob
+          store.
+        - ``content_encodings``: content encodings of the pre-compressed
+          files of the site.
+        - ``compression`` and ``cell_cache``: see `run_publish_instance`.
+        - ``timings``: timings of the render stages.
+        - ``publication_id``: ID of the publication (this task's ID).
+
+        If the publication is superseded by a newer publication of the
+        instance, the task stops with the ``SUPERSEDED`` state instead, and
+        the upload task isn't run.
+
+        Transient errors are retried with an exponential backoff (see
+        `retry_with_backoff`).
+    """
+    publication_id = self.request.id
+    timer = StageTimer()
+    kwargs = get_render_options(ltd_product)
+    blob_store = get_blob_store()
+    progress = get_progress_reporter(self, publication_id)
+    retrying = False
+
+    try:
+        check_superseded(publication_id)
+
+        with timer.stage('get_notebook') as stage:
+            nb_data = blob_store.get(nb_ref)
+            stage['bytes'] = nb_ref['stored_size']
+
+        with timer.stage('parse') as stage:
+            nb = nbformat.reads(nb_data.decode('utf-8'), as_version=4)
+            stage['bytes'] = len(nb_data)
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            work_dir = Path(tempdir) / 'site'
+            work_dir.mkdir()
+            render_result = run_render_instance(nb=nb, work_dir=work_dir,
+                                                progress=progress,
+                                                timer=timer, **kwargs)
+            check_superseded(publication_id)
+            if progress is not None:
+                progress('stage_site')
+            with timer.stage('pack_site') as stage:
+                with tempfile.TemporaryFile(dir=tempdir) as archive:
+                    pack_site(work_dir, archive)
+                    archive.seek(0)
+                    render_result['site'] = blob_store.put(archive)
+                stage['bytes'] = render_result['site']['stored_size']
+    except PublicationSuperseded:
+        stop_superseded(self, publication_id)
+    except Exception as e:
+        if should_retry(self, e):
+            # Keep the notebook for the retry
+            retrying = True
+            retry_with_backoff(self, e)
+        raise
+    finally:
+        if not retrying:
+            blob_store.delete(nb_ref)
+
+    render_result['publication_id'] = publication_id
+    render_result['ltd_product'] = ltd_product
+    render_result['instance_id'] = instance_id
+    render_result['timings'] = timer.as_dict()
+    return render_result
+
+
+@celery_app.task(bind=True)
+def upload_instance(self, render_result):
+    """Upload a site rendered by `render_instance` to LSST the Docs and
+    update the instance's edition, the second stage of a publication
+    (Celery task).
+
+    Parameters
+    ----------
+    render_result : `dict`
+        Result of the `render_instance` task. The site's blob is deleted
+        once it's uploaded, unless the task is retried.
+
+    Returns
+    -------
+    result : `dict`
+        Summary of the publication (see `run_publish_instance`). The
+        ``timings`` include the render stages.
+
+        If the publication is superseded by a newer publication of the
+        instance before the edition is updated, the task stops with the
+        ``SUPERSEDED`` state instead.
+
+        Transient errors are retried with an exponential backoff (see
+        `retry_with_backoff`). The upload stages are checkpointed (see
+        `upload_html`) so that the retried task resumes the upload to the
+        same build.
+    """
+    publication_id = render_result.get('publication_id')
+    ltd_product = render_result['ltd_product']
+    instance_id = render_result['instance_id']
+    timer = StageTimer()
+    timer.stages.extend(render_result['timings']['stages'])
+    blob_store = get_blob_store()
+    stage_checkpoints = get_stage_checkpoints(publication_id)
+    token_cache = get_keeper_token_cache()
+    ltd_token = None
+    retrying = False
+
+    try:
+        check_superseded(publication_id)
+
+        with timer.stage('get_keeper_token'):
+            ltd_token = token_cache.get_token()
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            work_dir = Path(tempdir)
+            with timer.stage('unpack_site') as stage:
+                archive = io.BytesIO(blob_store.get(render_result['site']))
+                stage['bytes'] = unpack_site(archive, work_dir)
+            upload_result = run_upload_instance(
+                work_dir=work_dir, ltd_token=ltd_token,
+                ltd_product=ltd_product, instance_id=instance_id,
+                content_encodings=render_result['content_encodings'],
+                checkpoint=lambda: check_superseded(publication_id),
+                progress=get_progress_reporter(self, publication_id),
+                stage_checkpoints=stage_checkpoints,
+                timer=timer, **get_upload_options())
+    except PublicationSuperseded:
+        stop_superseded(self, publication_id)
+    except Exception as e:
+        if is_unauthorized(e) and ltd_token is not None:
+            # Don't let other tasks reuse the rejected token.
+            token_cache.invalidate(ltd_token)
+        if should_retry(self, e):
+            # Keep the site and the checkpoints for the retry
+            retrying = True
+            retry_with_backoff(self, e)
+        raise
+    finally:
+        if not retrying:
+            blob_store.delete(render_result['site'])
+            stage_checkpoints.clear()
+
+    result = {
+        'compression': render_result['compression'],
+        'cell_cache': render_result['cell_cache'],
+        'upload': upload_result,
+        'timings': timer.as_dict(),
+    }
+    log_timings(ltd_product, instance_id, result['timings'])
+    return result
+
+
+def check_superseded(publication_id):
+    """Check whether a publication was superseded by a newer publication of
+    the same instance (see `uservice_nbreport.publicationindex`), if the
+    ``COALESCE_PUBLICATIONS`` configuration is enabled.
+
+    Must be called within an application context.
+
+    Parameters
+    ----------
+    publication_id : `str`
+        ID of the publication, or `None` if the task wasn't queued as part
+        of a publication.
+
+    Raises
+    ------
+    uservice_nbreport.publicationindex.PublicationSuperseded
+        Raised if the publication was superseded.
+    """
+    if publication_id is None \
+            or not current_app.config['COALESCE_PUBLICATIONS']:
+        return
+    if PublicationIndex(get_redis()).is_superseded(publication_id):
+        raise PublicationSuperseded(publication_id)
+
+
+def stop_superseded(task, publication_id):
+    """Stop a task of a superseded publication with the ``SUPERSEDED``
+    state, without running the rest of its chain.
+
+    Raises
+    ------
+    celery.exceptions.Ignore
+        Always raised, so that the worker keeps the ``SUPERSEDED`` state.
+    """
+    logger.info('Publication %s was superseded', publication_id)
+    task.update_state(state=SUPERSEDED)
+    raise Ignore()
+
+
+def should_retry(task, error):
+    """Test whether a publish task should be retried after an error.
+
+    Must be called within an application context.
+
+    Parameters
+    ----------
+    task : `celery.Task`
+        The running task.
+    error : `Exception`
+        The error.
+
+    Returns
+    -------
+    retry : `bool`
+        `True` if the error is transient (see
+        `uservice_nbreport.backoff.is_transient_error`) and the task was
+        retried fewer than ``PUBLISH_MAX_RETRIES`` times.
+    """
+    return (is_transient_error(error) and
+            task.request.retries < current_app.config['PUBLISH_MAX_RETRIES'])
+
+
+def retry_with_backoff(task, error):
+    """Retry a publish task after an exponential backoff with jitter, from
+    ``PUBLISH_RETRY_DELAY`` to ``PUBLISH_RETRY_MAX_DELAY`` seconds.
+
+    The task is retried with the same ID and arguments, so that it finds the
+    checkpoints of its earlier attempts (see
+    `uservice_nbreport.checkpoints.StageCheckpoints`).
+
+    Must be called within an application context.
+
+    Raises
+    ------
+    celery.exceptions.Retry
+        Always raised (or ``error`` itself if the task was called directly
+        rather than by a worker).
+    """
+    config = current_app.config
+    countdown = get_backoff_delay(task.request.retries,
+                                  base=config['PUBLISH_RETRY_DELAY'],
+                                  maximum=config['PUBLISH_RETRY_MAX_DELAY'])
+    logger.warning('Retrying in %.0f s after a transient error: %s',
+                   countdown, error)
+    raise task.retry(exc=error, countdown=countdown, max_retries=None)
+
+
+def get_stage_checkpoints(publication_id):
+    """Get the stage checkpoints of a publication.
+
+    Must be called within an application context.
+
+    Parameters
+    ----------
+    publication_id : `str`
+        ID of the publication (or of a ``publish_instance`` task), or `None`
+        if the task wasn't queued.
+
+    Returns
+    -------
+    stage_checkpoints : `uservice_nbreport.checkpoints.StageCheckpoints`
+        The checkpoints, or a stand-in that doesn't record anything if
+        ``publication_id`` is `None`.
+    """
+    if publication_id is None:
+        return _NoCheckpoints()
+    return StageCheckpoints(get_redis(), publication_id)
+
+
+def get_progress_reporter(task, publication_id):
+    """Get the progress reporter of a publication's task.
+
+    Must be called within an application context.
+
+    Parameters
+    ----------
+    task : `celery.Task`
+        The running task.
+    publication_id : `str`
+        ID of the publication, or `None` if the task wasn't queued as part
+        of a publication.
+
+    Returns
+    -------
+    progress : `uservice_nbreport.progress.ProgressReporter`
+        Reporter that sets the task's ``PROGRESS`` state and publishes the
+        publication's progress events, or `None` if ``publication_id`` is
+        `None`.
+    """
+    if publication_id is None:
+        return None
+    return ProgressReporter(
+        get_redis(), publication_id, task=task,
+        min_interval=current_app.config['PROGRESS_MIN_INTERVAL'])
+
+
+@task_postrun.connect
+def publish_task_state(sender=None, task_id=None, args=None, state=None,
+                       **kwargs):
+    """Publish a ``state`` event on the publication's channel when a
+    publish task finishes, so that clients waiting for the publication
+    (see `uservice_nbreport.progress`) get its new status.
+    """
+    if sender is upload_instance:
+        publication_id = args[0].get('publication_id') if args else None
+    elif sender in (render_instance, publish_instance):
+        publication_id = task_id
+    else:
+        return
+    if publication_id is None:
+        return
+    # Signal handlers run outside of the task's application context.
+    redis_client = get_redis(celery_app.conf['REDIS_URL'])
+    publish_event(redis_client, publication_id,
+                  {'event': 'state', 'state': state})
+
+
+def get_render_options(ltd_product):
+    """Get the keyword arguments of `run_render_instance` from the
+    application's configuration.
+
+    Must be called within an application context.
+
+    Parameters
+    ----------
+    ltd_product : `str`
+        Slug of the LTD Product resource corresponding to the report.
+
+    Returns
+    -------
+    options : `dict`
+        Keyword arguments, except for ``nb``, ``work_dir``, and ``timer``.
+    """
+    config = current_app.config
+    options = {
+        'aws_id': config['KEEPER_AWS_ID'],
+        'aws_secret': config['KEEPER_AWS_SECRET'],
+        'render_cache': get_render_cache(),
+        'cell_cache': get_cell_cache(ltd_product),
+        'compression_encoding': config['COMPRESSION_ENCODING'],
+        'compression_level': config['COMPRESSION_LEVEL'],
+    }
+    if config['SHARED_ASSETS_URL'] is not None:
+        options['shared_assets_bucket'] = config['SHARED_ASSETS_BUCKET']
+        options['shared_assets_prefix'] = config['SHARED_ASSETS_PREFIX']
+    return options
+
+
+def get_upload_options():
+    """Get the keyword arguments of `run_upload_instance` that come from
+    the application's configuration.
+
+    Must be called within an application context.
+
+    Returns
+    -------
+    options : `dict`
+        Keyword arguments, except for ``work_dir``, ``ltd_token``,
+        ``ltd_product``, ``instance_id``, ``content_encodings``, and
+        ``timer``.
+    """
+    config = current_app.config
+    return {
+        'keeper_url': config['KEEPER_URL'],
+        'aws_id': config['KEEPER_AWS_ID'],
+        'aws_secret': config['KEEPER_AWS_SECRET'],
+        'edition_index': EditionIndex(get_redis()),
+        'build_index': (BuildIndex(get_redis())
+                        if config['INCREMENTAL_UPLOAD'] else None),
+        'upload_max_workers': config['UPLOAD_MAX_WORKERS'],
+        'upload_multipart_threshold': config['UPLOAD_MULTIPART_THRESHOLD'],
+    }
 
 
 def run_publish_instance(*, nb, work_dir, keeper_url, ltd_token, ltd_product,
-                         instance_id, aws_id, aws_secret):
+                         instance_id, aws_id, aws_secret, render_cache=None,
+                         cell_cache=None,
+                         shared_assets_bucket=None,
+                         shared_assets_prefix=None,
+                         compression_encoding=None, compression_level=None,
+                         upload_max_workers=None,
+                         upload_multipart_threshold=None,
+                         edition_index=None, build_index=None,
+                         progress=None, timer=None):
     """Publish a notebook instance.
 
     This is a standalone function typically called by the `publish_instance`
-    task.
+    task. It runs `run_render_instance` and then `run_upload_instance` in
+    the same work directory.
 
     Parameters
     ----------
@@ -73,17 +655,246 @@ def run_publish_instance(*, nb, work_dir, keeper_url, ltd_token, ltd_product,
     work_dir : `pathlib.Path`
         Directory where the HTML and other website assets are staged for
         upload.
+    render_cache : `~uservice_nbreport.publish.rendercache.RenderCache`
+        Cache of rendered sites (optional). If the notebook was already
+        rendered, the cached site is uploaded without rendering the notebook
+        again.
+    cell_cache : `~uservice_nbreport.publish.cellcache.CellRenderCache`
+        Cache of the report's rendered cells (optional). Only cells that
+        changed since an earlier instance are rendered.
+    shared_assets_bucket : `str`, optional
+        Name of the S3 bucket where shared static assets are published. Set
+        this if the exporter is configured with a ``shared_assets_url``.
+    shared_assets_prefix : `str`, optional
+        Directory in ``shared_assets_bucket`` for shared static assets.
+    compression_encoding : `str`, optional
+        Content encoding (``'gzip'`` or ``'br'``) for pre-compressing the
+        site's text files before they're uploaded. If `None`, files are
+        uploaded uncompressed.
+    compression_level : `int`, optional
+        Compression level. The default depends on ``compression_encoding``.
+    upload_max_workers : `int`, optional
+        Maximum number of concurrent S3 uploads (see
+        `uservice_nbreport.publish.upload.upload_site`).
+    upload_multipart_threshold : `int`, optional
+        Size, in bytes, from which files are uploaded in parts.
+    edition_index : `uservice_nbreport.editionindex.EditionIndex`, optional
+        Index of edition URLs, for finding the instance's edition without
+        scanning the product's editions.
+    build_index : `uservice_nbreport.buildindex.BuildIndex`, optional
+        Index of the latest builds. If set, files that haven't changed since
+        the previous build of the instance or report are copied from that
+        build instead of uploaded.
+    progress : callable, optional
+        Function called with the name of each stage, like ``'render'`` or
+        ``'upload'``, as it starts, and with the ``done`` and ``total``
+        number of objects as keyword arguments while the site is uploaded
+        (see `uservice_nbreport.progress.ProgressReporter`).
+    timer : `uservice_nbreport.timing.StageTimer`, optional
+        Timer that records the time of each stage. Stages timed before this
+        function is called (like parsing the notebook) are included in the
+        result.
+
+    Returns
+    -------
+    result : `dict`
+        Summary of the publication, with fields:
+
+        - ``compression``: summary of the text file compression (see
+          `uservice_nbreport.publish.compression.compress_site`), or `None`
+          if files weren't compressed. The ``content_encodings`` field is
+          omitted.
+        - ``cell_cache``: ``hits``, ``misses``, and ``hit_rate`` of the cell
+          cache, or `None` if the cell cache isn't enabled or the notebook
+          wasn't rendered.
+        - ``upload``: summary of the upload (see
+          `uservice_nbreport.publish.upload.upload_site`), and the
+          ``published_url`` of the edition.
+        - ``timings``: wall-clock time, CPU time, and byte count of each
+          stage (see `uservice_nbreport.timing.StageTimer.as_dict`).
+    """
+    if timer is None:
+        timer = StageTimer()
+
+    result = run_render_instance(
+        nb=nb, work_dir=work_dir, aws_id=aws_id, aws_secret=aws_secret,
+        render_cache=render_cache, cell_cache=cell_cache,
+        shared_assets_bucket=shared_assets_bucket,
+        shared_assets_prefix=shared_assets_prefix,
+        compression_encoding=compression_encoding,
+        compression_level=compression_level, progress=progress, timer=timer)
+    content_encodings = result.pop('content_encodings')
+
+    result['upload'] = run_upload_instance(
+        work_dir=work_dir, keeper_url=keeper_url, ltd_token=ltd_token,
+        ltd_product=ltd_product, instance_id=instance_id, aws_id=aws_id,
+        aws_secret=aws_secret, content_encodings=content_encodings,
+        upload_max_workers=upload_max_workers,
+        upload_multipart_threshold=upload_multipart_threshold,
+        edition_index=edition_index, build_index=build_index,
+        progress=progress, timer=timer)
+
+    result['timings'] = timer.as_dict()
+    log_timings(ltd_product, instance_id, result['timings'])
+    return result
+
+
+def run_render_instance(*, nb, work_dir, aws_id=None, aws_secret=None,
+                        render_cache=None, cell_cache=None,
+                        shared_assets_bucket=None, shared_assets_prefix=None,
+                        compression_encoding=None, compression_level=None,
+                        progress=None, timer=None):
+    """Render a notebook instance into a site that's ready to upload.
+
+    The notebook is rendered (unless it's in the render cache), the shared
+    assets are published, and the site's text files are pre-compressed.
+    See `run_publish_instance` for the parameters.
+
+    Returns
+    -------
+    result : `dict`
+        Summary of the render, with fields:
+
+        - ``compression`` and ``cell_cache``: see `run_publish_instance`.
+        - ``content_encodings``: mapping of the paths of pre-compressed
+          files, relative to ``work_dir``, to their content encoding, or
+          `None` if files weren't compressed.
+    """
+    if timer is None:
+        timer = StageTimer()
+    if progress is None:
+        progress = _ignore_progress
+    result = {'compression': None, 'cell_cache': None,
+              'content_encodings': None}
+
+    progress('render')
+
+    # Export report notebook to HTML, unless an identical notebook was
+    # already rendered.
+    if render_cache is not None:
+        with timer.stage('render_cache_get'):
+            render_key = compute_render_key(nb, get_exporter())
+            cache_hit = render_cache.get(render_key, work_dir)
+        if cache_hit:
+            logger.info('Using cached render %s', render_key)
+        else:
+            result['cell_cache'] = create_html(nb, work_dir,
+                                               cell_cache=cell_cache,
+                                               timer=timer)
+            with timer.stage('render_cache_put'):
+                render_cache.put(render_key, work_dir)
+    else:
+        result['cell_cache'] = create_html(nb, work_dir,
+                                           cell_cache=cell_cache,
+                                           timer=timer)
+    if result['cell_cache'] is not None:
+        logger.info('Cell cache hit rate %.2f (%d hits, %d misses)',
+                    result['cell_cache']['hit_rate'],
+                    result['cell_cache']['hits'],
+                    result['cell_cache']['misses'])
+
+    # Make sure the assets the HTML links to are published before the HTML
+    if shared_assets_bucket is not None:
+        progress('shared_assets')
+        with timer.stage('shared_assets'):
+            uploaded_keys = publish_shared_assets(
+                get_exporter().shared_assets,
+                bucket_name=shared_assets_bucket,
+                prefix=shared_assets_prefix,
+                aws_id=aws_id,
+                aws_secret=aws_secret)
+        for key in uploaded_keys:
+            logger.info('Published shared asset %s', key)
+
+    # Pre-compress text files so that they're served with a Content-Encoding
+    if compression_encoding is not None:
+        progress('compress')
+        with timer.stage('compress') as stage:
+            compression = compress_site(work_dir,
+                                        encoding=compression_encoding,
+                                        level=compression_level)
+            stage['bytes'] = compression['original_bytes']
+        result['content_encodings'] = compression.pop('content_encodings')
+        logger.info('Compressed %d bytes to %d bytes (%s) in %.3f s',
+                    compression['original_bytes'],
+                    compression['compressed_bytes'],
+                    compression['encoding'],
+                    compression['time'])
+        result['compression'] = compression
+
+    return result
+
+
+def run_upload_instance(*, work_dir, keeper_url, ltd_token, ltd_product,
+                        instance_id, aws_id, aws_secret,
+                        content_encodings=None, upload_max_workers=None,
+                        upload_multipart_threshold=None,
+                        edition_index=None, build_index=None,
+                        checkpoint=None, progress=None,
+                        stage_checkpoints=None, timer=None):
+    """Upload a rendered site to LSST the Docs and update the instance's
+    edition.
+
+    See `run_publish_instance` for the parameters, `run_render_instance`
+    for ``content_encodings``, and `upload_html` for ``checkpoint`` and
+    ``stage_checkpoints``.
+
+    Returns
+    -------
+    upload_result : `dict`
+        Summary of the upload (see
+        `uservice_nbreport.publish.upload.upload_site`), and the
+        ``published_url`` of the edition.
     """
-    # Export report notebook to HTML
-    create_html(nb, work_dir)
+    return upload_html(
+        work_dir=work_dir, keeper_url=keeper_url, ltd_token=ltd_token,
+        ltd_product=ltd_product, instance_id=instance_id, aws_id=aws_id,
+        aws_secret=aws_secret, content_encodings=content_encodings,
+        max_workers=upload_max_workers,
+        multipart_threshold=upload_multipart_threshold,
+        edition_index=edition_index, build_index=build_index,
+        checkpoint=checkpoint, progress=progress,
+        stage_checkpoints=stage_checkpoints, timer=timer)
+
 
-    # Upload to LTD
-    upload_html(work_dir=work_dir, keeper_url=keeper_url,
-                ltd_token=ltd_token, ltd_product=ltd_product,
-                instance_id=instance_id, aws_id=aws_id, aws_secret=aws_secret)
+def _ignore_progress(stage, **info):
+    pass
+
+
+class _NoCheckpoints:
+    """Stand-in for `uservice_nbreport.checkpoints.StageCheckpoints` that
+    doesn't record anything.
+    """
 
+    def get(self, stage):
+        return None
 
-def create_html(nb, work_dir):
+    def set(self, stage, value):
+        pass
+
+    def get_uploaded(self):
+        return set()
+
+    def clear(self):
+        pass
+
+    # Uploaded objects aren't recorded
+    add_uploaded = None
+
+
+def log_timings(ltd_product, instance_id, timings):
+    """Log the timings of a publication, with the process's HTTP connection
+    metrics.
+    """
+    structlog.get_logger(__name__).info(
+        'publish_instance timings',
+        ltd_product=ltd_product,
+        instance_id=instance_id,
+        timings=timings,
+        http=get_http_metrics())
+
+
+def create_html(nb, work_dir, cell_cache=None, timer=None):
     """Convert the notebook into an HTML LSST report.
 
     Parameters
@@ -93,35 +904,47 @@ def create_html(nb, work_dir):
     work_dir : `pathlib.Path`
         Directory where the HTML and other website assets are staged for
         upload.
-    keeper_url : `str`
-        Base URL of the LTD Keeper API.
-    ltd_token : `str`
-        Token for the LTD Keeper API.
-    ltd_product : `str`
-        Slug of the LTD Product resource corresponding to the report.
-    instance_id : `str`
-        Identifier of the instance, usually an integer as a string. This is
-        the slug of the LTD Edition corresponding to the report instance.
-    aws_id : `str`
-        AWS key identifier. Used for uploading files to LSST the Docs's
-        S3 bucket.
-    aws_secret : `str`
-        AWS secret key. Used for uploading files to LSST the Docs's S3 bucket.
+    cell_cache : `~uservice_nbreport.publish.cellcache.CellRenderCache`
+        Cache of the report's rendered cells (optional).
+    timer : `uservice_nbreport.timing.StageTimer`, optional
+        Timer that records the ``preprocess``, ``template``, and
+        ``write_site`` stages.
+
+    Returns
+    -------
+    cell_cache_stats : `dict`
+        Hits, misses, and hit rate of the cell cache for this notebook, or
+        `None` if ``cell_cache`` isn't set.
     """
-    exporter = LsstHtmlReportExporter()
-    exporter.register_preprocessor(LsstOutlinePreprocessor, enabled=True)
-    body, resources = exporter.from_notebook_node(nb)
+    if timer is None:
+        timer = StageTimer()
 
-    # Write the HTML to the integration directory
-    (work_dir / 'index.html').write_text(body)
+    exporter = get_exporter()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    body, resources = exporter.from_notebook_node(nb, cell_cache=cell_cache)
+    preprocess_time = resources['lsst_preprocess_time']
+    timer.add('preprocess', **preprocess_time)
+    timer.add('template',
+              wall=time.perf_counter() - wall_start - preprocess_time['wall'],
+              cpu=time.process_time() - cpu_start - preprocess_time['cpu'],
+              nbytes=len(body))
 
-    for asset_path in exporter.asset_paths:
-        dest = work_dir / asset_path.name
-        shutil.copy(asset_path, dest)
+    # Write the HTML, extracted outputs, and assets to the integration
+    # directory
+    with timer.stage('write_site') as stage:
+        exporter.write_site(body, resources, work_dir)
+        stage['bytes'] = sum(p.stat().st_size for p in work_dir.glob('**/*')
+                             if p.is_file())
+
+    return resources.get('lsst_cell_cache_stats')
 
 
 def upload_html(*, work_dir, keeper_url, ltd_token, ltd_product, instance_id,
-                aws_id, aws_secret):
+                aws_id, aws_secret, content_encodings=None,
+                max_workers=None, multipart_threshold=None,
+                edition_index=None, build_index=None, checkpoint=None,
+                progress=None, stage_checkpoints=None, timer=None):
     """Upload the build HTML site for the notebook report instance.
 
     Parameters
@@ -143,42 +966,141 @@ def upload_html(*, work_dir, keeper_url, ltd_token, ltd_product, instance_id,
         S3 bucket.
     aws_secret : `str`
         AWS secret key. Used for uploading files to LSST the Docs's S3 bucket.
+    content_encodings : `dict`, optional
+        Mapping of the paths of pre-compressed files, relative to
+        ``work_dir``, to their content encoding.
+    max_workers : `int`, optional
+        Maximum number of concurrent S3 uploads. The default is
+        `uservice_nbreport.publish.upload.DEFAULT_MAX_WORKERS`.
+    multipart_threshold : `int`, optional
+        Size, in bytes, from which files are uploaded in parts. The default
+        is `uservice_nbreport.publish.upload.DEFAULT_MULTIPART_THRESHOLD`.
+    edition_index : `uservice_nbreport.editionindex.EditionIndex`, optional
+        Index of edition URLs (see `get_edition_url`).
+    build_index : `uservice_nbreport.buildindex.BuildIndex`, optional
+        Index of the latest builds, for copying unchanged files from the
+        previous build. The new build is added to it.
+    checkpoint : callable, optional
+        Function called, without arguments, before the edition is updated.
+        It can raise an exception to leave the edition unchanged, for
+        example because a newer build is being published.
+    progress : callable, optional
+        Progress callback (see `run_publish_instance`), called with the
+        ``'register_build'``, ``'upload'``, ``'confirm_build'``, and
+        ``'update_edition'`` stages.
+    stage_checkpoints : `uservice_nbreport.checkpoints.StageCheckpoints`
+        Checkpoints of the publication (optional). The registered build, the
+        uploaded objects, and the confirmation of the build are recorded, so
+        that a retried task uploads the rest of the site to the same build
+        and doesn't register or confirm it again. Updating the edition is
+        idempotent.
+    timer : `uservice_nbreport.timing.StageTimer`, optional
+        Timer that records the time of each LSST the Docs request and of the
+        upload.
+
+    Returns
+    -------
+    upload_result : `dict`
+        Summary of the upload (see
+        `uservice_nbreport.publish.upload.upload_site`), and the
+        ``published_url`` of the edition.
     """
-    build_resource = register_build(keeper_url, ltd_token, ltd_product,
-                                    [instance_id])
+    if timer is None:
+        timer = StageTimer()
+    if progress is None:
+        progress = _ignore_progress
+
+    if stage_checkpoints is None:
+        stage_checkpoints = _NoCheckpoints()
+
+    # Resume the upload to the build that an earlier attempt registered,
+    # rather than registering a new one.
+    build_resource = stage_checkpoints.get('register_build')
+    if build_resource is None:
+        progress('register_build')
+        with timer.stage('register_build'):
+            build_resource = register_build(keeper_url, ltd_token,
+                                            ltd_product, [instance_id])
+        stage_checkpoints.set('register_build', build_resource)
+    else:
+        logger.info('Resuming the upload to build %s',
+                    build_resource['self_url'])
 
     # This cache_control is appropriate for builds since they're immutable.
     # The LTD Keeper server changes the cache settings when copying the build
     # over to be a mutable edition.
-    upload_dir(
-        build_resource['bucket_name'],
-        build_resource['bucket_root_dir'],
-        str(work_dir),
-        aws_access_key_id=aws_id,
-        aws_secret_access_key=aws_secret,
-        surrogate_key=build_resource['surrogate_key'],
-        cache_control='max-age=31536000',
-        surrogate_control=None,
-        upload_dir_redirect_objects=True)
-
-    confirm_build(build_resource['self_url'], ltd_token)
-
-    edition_url = get_edition_url(keeper_url=keeper_url,
-                                  ltd_token=ltd_token,
-                                  ltd_product=ltd_product,
-                                  instance_id=instance_id)
+    upload_options = {}
+    if max_workers is not None:
+        upload_options['max_workers'] = max_workers
+    if multipart_threshold is not None:
+        upload_options['multipart_threshold'] = multipart_threshold
+    if build_index is not None:
+        upload_options['previous_root'] = build_index.get_previous_root(
+            ltd_product, instance_id, build_resource['bucket_name'])
+    upload_result = stage_checkpoints.get('upload')
+    if upload_result is None:
+        with timer.stage('upload') as stage:
+            upload_result = upload_site(
+                work_dir,
+                bucket_name=build_resource['bucket_name'],
+                bucket_root=build_resource['bucket_root_dir'],
+                aws_id=aws_id,
+                aws_secret=aws_secret,
+                surrogate_key=build_resource['surrogate_key'],
+                cache_control='max-age=31536000',
+                surrogate_control=None,
+                content_encodings=content_encodings,
+                upload_dir_redirect_objects=True,
+                progress_callback=lambda done, total: progress(
+                    'upload', done=done, total=total),
+                completed=stage_checkpoints.get_uploaded(),
+                object_callback=stage_checkpoints.add_uploaded,
+                **upload_options)
+            stage['bytes'] = upload_result['bytes']
+        stage_checkpoints.set('upload', upload_result)
+        logger.info('Uploaded %d bytes, copied %d objects (%d bytes)',
+                    upload_result['bytes'], upload_result['copied'],
+                    upload_result['copied_bytes'])
+
+    if not stage_checkpoints.get('confirm_build'):
+        progress('confirm_build')
+        with timer.stage('confirm_build'):
+            confirm_build(build_resource['self_url'], ltd_token)
+        stage_checkpoints.set('confirm_build', True)
+
+    if build_index is not None:
+        build_index.set(ltd_product, instance_id,
+                        build_resource['bucket_name'],
+                        build_resource['bucket_root_dir'])
+
+    with timer.stage('get_edition_url'):
+        edition_url = get_edition_url(keeper_url=keeper_url,
+                                      ltd_token=ltd_token,
+                                      ltd_product=ltd_product,
+                                      instance_id=instance_id,
+                                      edition_index=edition_index)
 
     # Update the edition to use this build.
-    update_edition(ltd_token=ltd_token,
-                   edition_url=edition_url,
-                   build_url=build_resource['self_url'])
+    if checkpoint is not None:
+        checkpoint()
+    progress('update_edition')
+    with timer.stage('update_edition'):
+        edition = update_edition(ltd_token=ltd_token,
+                                 edition_url=edition_url,
+                                 build_url=build_resource['self_url'])
 
+    upload_result['published_url'] = edition.get('published_url')
+    return upload_result
 
-def get_edition_url(*, keeper_url, ltd_token, ltd_product, instance_id):
+
+def get_edition_url(*, keeper_url, ltd_token, ltd_product, instance_id,
+                    edition_index=None):
     """Find the API URL of the edition corresponding to the instance_id.
 
-    This is currently a bit of a hack since LTD Keeper doesn't have a way of
-    directly obtaining an edition based on its slug (instance_id).
+    LTD Keeper doesn't have a way of directly obtaining an edition based on
+    its slug (instance_id), so the edition is looked up in the edition
+    index, and otherwise found by scanning the product's editions (see
+    `uservice_nbreport.editionindex.find_edition_url`).
 
     Parameters
     ----------
@@ -191,6 +1113,8 @@ def get_edition_url(*, keeper_url, ltd_token, ltd_product, instance_id):
     instance_id : `str`
         Identifier of the instance, usually an integer as a string. This is
         the slug of the LTD Edition corresponding to the report instance.
+    edition_index : `uservice_nbreport.editionindex.EditionIndex`, optional
+        Index of edition URLs. Editions found by scanning are added to it.
 
     Returns
     -------
@@ -198,22 +1122,11 @@ def get_edition_url(*, keeper_url, ltd_token, ltd_product, instance_id):
         URL of the edition in the LTD Keeper API (not the front-end website
         URL).
     """
-    root_url = urljoin(
-        keeper_url, '/products/{0}/editions/'.format(ltd_product))
-    response = requests.get(
-        root_url, auth=(ltd_token, ''))
-    response.raise_for_status()
-    edition_urls = response.json()['editions']
-
-    for edition_url in reversed(edition_urls):
-        response = requests.get(edition_url, auth=(ltd_token, ''))
-        response.raise_for_status()
-        if response.json()['slug'] == instance_id:
-            return edition_url
-
-    raise RuntimeError(
-        'Could not identify the URL for an edition with slug={0}'.format(
-            instance_id))
+    return find_edition_url(keeper_url=keeper_url,
+                            ltd_token=ltd_token,
+                            ltd_product=ltd_product,
+                            instance_id=instance_id,
+                            edition_index=edition_index)
 
 
 def update_edition(*, ltd_token, edition_url, build_url):
@@ -228,13 +1141,23 @@ def update_edition(*, ltd_token, edition_url, build_url):
         URL).
     build_url : `str`
         URL of the build in the LTD Keeper API.
+
+    Returns
+    -------
+    edition : `dict`
+        The updated Edition resource, or an empty `dict` if the response
+        has no JSON body.
     """
     data = {
         'build_url': build_url
     }
-    response = requests.patch(
+    response = get_session('keeper').patch(
         edition_url,
         auth=(ltd_token, ''),
         json=data
     )
     response.raise_for_status()
+    try:
+        return response.json()
+    except ValueError:
+        return {}
@@ -0,0 +1,87 @@
+"""Per-stage timing instrumentation for publish tasks.
+"""
+
+__all__ = ('StageTimer',)
+
+from contextlib import contextmanager
+import time
+
+
+class StageTimer:
+    """Recorder of the wall-clock time, CPU time, and byte count of each
+    stage of a task.
+
+    Wrap each stage in a ``with timer.stage(name):`` block, and get the
+    timings with `as_dict`.
+
+    Notes
+    -----
+    CPU time is the CPU time of the whole process (`time.process_time`), so
+    it includes work done by other threads during the stage, but not work
+    done by child processes.
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        """Time a stage (context manager).
+
+        Parameters
+        ----------
+        name : `str`
+            Name of the stage.
+
+        Yields
+        ------
+        stage : `dict`
+            The stage's record. Set its ``bytes`` field to record the number
+            of bytes the stage processed. The ``wall`` and ``cpu`` times, in
+            seconds, are set when the stage ends, even if it raises.
+        """
+        record = {'name': name, 'wall': None, 'cpu': None, 'bytes': None}
+        self.stages.append(record)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall'] = time.perf_counter() - wall_start
+            record['cpu'] = time.process_time() - cpu_start
+
+    def add(self, name, *, wall, cpu, nbytes=None):
+        """Record a stage that was timed elsewhere.
+
+        Parameters
+        ----------
+        name : `str`
+            Name of the stage.
+        wall : `float`
+            Wall-clock time, in seconds.
+        cpu : `float`
+            CPU time, in seconds.
+        nbytes : `int`, optional
+            Number of bytes the stage processed.
+        """
+        self.stages.append(
+            {'name': name, 'wall': wall, 'cpu': cpu, 'bytes': nbytes})
+
+    def as_dict(self):
+        """Get the timings as a JSON-serializable `dict`.
+
+        Returns
+        -------
+        timings : `dict`
+            Timings, with fields:
+
+            - ``stages``: `list` of stage records in the order they started,
+              each with ``name``, ``wall``, ``cpu``, and ``bytes`` fields.
+            - ``wall``: total wall-clock time of the stages (`float`).
+            - ``cpu``: total CPU time of the stages (`float`).
+        """
+        return {
+            'stages': [dict(record) for record in self.stages],
+            'wall': sum(record['wall'] or 0. for record in self.stages),
+            'cpu': sum(record['cpu'] or 0. for record in self.stages),
+        }